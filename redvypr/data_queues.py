@@ -0,0 +1,611 @@
+"""
+Queues used to exchange datapackets between the devices and the distribution thread (redvypr.distribute_data).
+
+The queues notify the distribution thread when new data has been put into them, such that distribute_data does not
+need to poll all device queues in a fixed time interval but can sleep until new data is available.
+
+Devices running as a process can optionally use a BatchQueue (base_config.queue_transport='batch'), which packs many
+packets into one frame to reduce the pickle and pipe overhead per packet, or a SharedMemoryQueue
+(base_config.queue_transport='shared_memory'), which exchanges the packets through a ring buffer in shared memory.
+"""
+
+import os
+import sys
+import time
+import queue
+import struct
+import pickle
+import weakref
+import logging
+import threading
+import collections
+import multiprocessing
+import multiprocessing.queues
+import multiprocessing.connection
+import multiprocessing.util
+from multiprocessing import shared_memory
+
+logging.basicConfig(stream=sys.stderr)
+logger = logging.getLogger('redvypr.base.data_queues')
+logger.setLevel(logging.INFO)
+
+shm_queue_size = 16 * 1024 * 1024  # The default size of the ring buffer of a SharedMemoryQueue [bytes]
+
+
+class DataNotifier:
+    """
+    A shared wake-up channel for the distribution thread. Every queue that shall wake up distribute_data calls
+    notify() after data has been put into it. Only the first notification after a clear() writes into the
+    internal pipe, all subsequent ones are a simple flag check until the distribution thread has woken up again.
+    """
+    def __init__(self):
+        self.reader, self.writer = multiprocessing.Pipe(duplex=False)
+        self._pending = False
+        self._lock = threading.Lock()
+        self.t_notify = None  # The time of the first notification after the last clear()
+
+    def notify(self):
+        if self._pending:
+            return
+        with self._lock:
+            if not self._pending:
+                self._pending = True
+                self.t_notify = time.time()
+                self.writer.send_bytes(b'\0')
+
+    def clear(self):
+        """
+        Resets the notifier, needs to be called before the queues are read.
+
+        Returns:
+            The time of the first notification since the last clear() or None
+        """
+        with self._lock:
+            while self.reader.poll():
+                self.reader.recv_bytes()
+            self._pending = False
+            t_notify = self.t_notify
+            self.t_notify = None
+
+        return t_notify
+
+    def wait(self, queues=None, timeout=None):
+        """
+        Waits until the notifier was notified or one of the multiprocessing queues has data available.
+
+        Args:
+            queues: List of queues, multiprocessing.Queues are added to the waiting list, all other queues are ignored
+            timeout: The maximum time to wait [s], None waits forever
+
+        Returns:
+            True if woken up by data, False if the timeout was reached
+        """
+        waitlist = [self.reader]
+        if queues is not None:
+            for q in queues:
+                if isinstance(q, (BatchQueue, SharedMemoryQueue)):
+                    if q.pending():  # Packets already received but not read yet
+                        return True
+                    waitlist.append(q.waitable())
+                elif isinstance(q, multiprocessing.queues.Queue):
+                    waitlist.append(q._reader)
+
+        ready = multiprocessing.connection.wait(waitlist, timeout)
+        return len(ready) > 0
+
+
+class NotifyQueue(queue.Queue):
+    """
+    A queue.Queue that notifies a DataNotifier after each put.
+    """
+    def __init__(self, maxsize=0, notifier=None):
+        super().__init__(maxsize=maxsize)
+        self.notifier = notifier
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block=block, timeout=timeout)
+        if self.notifier is not None:
+            self.notifier.notify()
+
+    def put_many(self, items, block=True, timeout=None):
+        """
+        Puts a list of packets into the queue, the notifier is notified once.
+        """
+        for item in items:
+            super().put(item, block=block, timeout=timeout)
+        if self.notifier is not None:
+            self.notifier.notify()
+
+    def get_many(self, maxitems=None):
+        """
+        Returns a list of all available packets without blocking.
+        """
+        with self.mutex:
+            n = len(self.queue) if maxitems is None else min(maxitems, len(self.queue))
+            items = [self.queue.popleft() for i in range(n)]
+            if n > 0:
+                self.not_full.notify_all()
+
+        return items
+
+
+class PacketBatch(list):
+    """
+    A list of packets sent as one frame through a BatchQueue.
+    """
+    pass
+
+
+_local_queues = weakref.WeakSet()
+
+
+def _reset_local_queues_after_fork():
+    for q in list(_local_queues):
+        q._reset_local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_local_queues_after_fork)
+
+
+class BatchQueue:
+    """
+    A queue between processes that transports packets in batches. Packets put into the queue are collected in a
+    local buffer, which is sent as one PacketBatch frame through a multiprocessing.Queue when batchsize packets
+    were collected or the oldest packet is older than deadline seconds. The deadline is checked by a background
+    thread of the putting process, flush() sends the buffer immediately.
+
+    The queue has the get/put interface of a multiprocessing.Queue plus put_many() and get_many(). Note that maxsize
+    refers to the number of frames, not the number of packets.
+    """
+    def __init__(self, maxsize=0, batchsize=1000, deadline=0.01):
+        self.maxsize = maxsize
+        self.batchsize = batchsize
+        self.deadline = deadline
+        self.queue = multiprocessing.Queue(maxsize=maxsize)
+        self._reset_local()
+
+    def __getstate__(self):
+        return {'maxsize': self.maxsize, 'batchsize': self.batchsize, 'deadline': self.deadline,
+                'queue': self.queue}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_local()
+
+    def _reset_local(self):
+        """
+        (Re)initializes the process local state, the buffers are not shared between processes.
+        """
+        self._lock = threading.Lock()
+        self._putbuffer = PacketBatch()
+        self._t_first = None  # Time of the oldest packet in the putbuffer
+        self._getbuffer = collections.deque()
+        self._flusher = None
+        _local_queues.add(self)
+
+    def _start_flusher(self):
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+        # Send the remaining packets when the process exits
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=20)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.deadline)
+            t_first = self._t_first
+            if t_first is not None and (time.time() - t_first) >= self.deadline:
+                try:
+                    self.flush(block=True, timeout=self.deadline)
+                except queue.Full:
+                    pass
+
+    def flush(self, block=True, timeout=None):
+        """
+        Sends all buffered packets as one frame.
+
+        Raises:
+            queue.Full if the frame could not be sent, the packets remain in the buffer
+        """
+        with self._lock:
+            self._flush_locked(block, timeout)
+
+    def _flush_locked(self, block, timeout):
+        if len(self._putbuffer) == 0:
+            return
+        self.queue.put(self._putbuffer, block=block, timeout=timeout)
+        self._putbuffer = PacketBatch()
+        self._t_first = None
+
+    def put_many(self, items, block=True, timeout=None):
+        """
+        Puts a list of packets into the queue.
+
+        Raises:
+            queue.Full if the queue is full and the local buffer holds already two batches, no packet is added
+        """
+        with self._lock:
+            if self._flusher is None:
+                self._start_flusher()
+            if len(self._putbuffer) >= 2 * self.batchsize:
+                self._flush_locked(block, timeout)
+
+            if self._t_first is None:
+                self._t_first = time.time()
+            self._putbuffer.extend(items)
+            if len(self._putbuffer) >= self.batchsize:
+                try:
+                    self._flush_locked(block, timeout)
+                except queue.Full:  # The packets remain in the buffer
+                    pass
+
+    def put(self, item, block=True, timeout=None):
+        self.put_many((item,), block=block, timeout=timeout)
+
+    def put_nowait(self, item):
+        self.put_many((item,), block=False)
+
+    def pending(self):
+        """
+        Returns the number of packets received but not read yet
+        """
+        return len(self._getbuffer)
+
+    def waitable(self):
+        """
+        Returns the connection that becomes ready when data is available, see DataNotifier.wait()
+        """
+        return self.queue._reader
+
+    def _add_frame(self, frame):
+        if isinstance(frame, PacketBatch):
+            self._getbuffer.extend(frame)
+        else:
+            self._getbuffer.append(frame)
+
+    def get(self, block=True, timeout=None):
+        if len(self._getbuffer) == 0:
+            self._add_frame(self.queue.get(block=block, timeout=timeout))
+            if len(self._getbuffer) == 0:  # An empty frame
+                raise queue.Empty
+
+        return self._getbuffer.popleft()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get_many(self, maxitems=None):
+        """
+        Returns a list of all available packets without blocking.
+
+        Args:
+            maxitems: Maximum number of packets returned, None for all
+        """
+        while maxitems is None or len(self._getbuffer) < maxitems:
+            try:
+                self._add_frame(self.queue.get(block=False))
+            except queue.Empty:
+                break
+
+        if maxitems is None or maxitems >= len(self._getbuffer):
+            items = list(self._getbuffer)
+            self._getbuffer.clear()
+        else:
+            items = [self._getbuffer.popleft() for i in range(maxitems)]
+
+        return items
+
+    def empty(self):
+        return len(self._getbuffer) == 0 and self.queue.empty()
+
+    def qsize(self):
+        """
+        Returns the number of packets read from the queue but not yet consumed plus the number of
+        frames in the queue.
+        """
+        return len(self._getbuffer) + self.queue.qsize()
+
+    def close(self):
+        self.queue.close()
+
+
+class SharedMemoryQueue:
+    """
+    A queue between processes based on a ring buffer in shared memory (multiprocessing.shared_memory). Packets are
+    pickled with protocol 5, the buffers of numpy arrays are not pickled but copied directly into the ring buffer
+    and out of it by the reader. A pipe wakes up the reader, it is only written if the ring buffer was empty before.
+
+    The queue has the get/put interface of a multiprocessing.Queue plus put_many() and get_many(). Several processes
+    may put packets into the queue, but only one process shall read from it. A single packet must not be larger
+    than half of the ring buffer. The shared memory is released when the queue of the creating process is deleted.
+    """
+    _header = struct.Struct('<QQQQQ')  # write_pos, read_pos, packets written, packets read, reader signaled
+    _record = struct.Struct('<II')  # Length of the record, number of out-of-band buffers
+    _buflen = struct.Struct('<Q')  # Length of the pickled packet and of each out-of-band buffer
+    _wrap = 0xFFFFFFFF  # Record length marking that the next record starts at the beginning of the ring buffer
+
+    def __init__(self, maxsize=0, size=shm_queue_size):
+        self.maxsize = maxsize  # Maximum number of packets, 0 for no limit
+        self.size = size + (-size) % 8  # Records are aligned to 8 bytes
+        self._shm = shared_memory.SharedMemory(create=True, size=self._header.size + self.size)
+        self.name = self._shm.name
+        # Initialize the header and touch all pages to avoid page faults while writing packets
+        self._shm.buf[:self._header.size + self.size] = bytes(self._header.size + self.size)
+        self._lock = multiprocessing.Lock()
+        self._signal_reader, self._signal_writer = multiprocessing.Pipe(duplex=False)
+        # Release the shared memory when the queue is deleted or redvypr exits
+        multiprocessing.util.Finalize(self, SharedMemoryQueue._unlink, args=(self._shm,), exitpriority=0)
+        self._reset_local()
+
+    @staticmethod
+    def _unlink(shm):
+        try:
+            shm.close()
+        except BufferError:
+            pass
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def __getstate__(self):
+        return {'maxsize': self.maxsize, 'size': self.size, 'name': self.name, '_lock': self._lock,
+                '_signal_reader': self._signal_reader, '_signal_writer': self._signal_writer}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        try:
+            self._shm = shared_memory.SharedMemory(name=self.name, track=False)
+        except TypeError:  # track was added with python 3.13
+            self._shm = shared_memory.SharedMemory(name=self.name)
+        self._reset_local()
+
+    def _reset_local(self):
+        self._getbuffer = collections.deque()
+        _local_queues.add(self)
+
+    def _serialize(self, item):
+        buffers = []
+        data = pickle.dumps(item, protocol=5, buffer_callback=buffers.append)
+        raws = [b.raw() for b in buffers]
+        length = self._record.size + self._buflen.size * (len(raws) + 1) + len(data) + sum(r.nbytes for r in raws)
+        length += (-length) % 8
+        if length > self.size // 2:
+            raise ValueError('Packet of {} bytes is too large for the ring buffer of {} bytes'.format(length, self.size))
+
+        return length, data, raws
+
+    def _write_locked(self, record):
+        """
+        Writes a serialized packet into the ring buffer, the lock has to be acquired.
+
+        Returns:
+            False if there is not enough space
+        """
+        length, data, raws = record
+        buf = self._shm.buf
+        write_pos, read_pos, n_written, n_read, signaled = self._header.unpack_from(buf, 0)
+        if self.maxsize > 0 and (n_written - n_read) >= self.maxsize:
+            return False
+
+        off = write_pos % self.size
+        tail = self.size - off
+        needed = length if length <= tail else tail + length
+        if needed > self.size - (write_pos - read_pos):
+            return False
+
+        base = self._header.size
+        if length > tail:  # The record does not fit at the end, start again at the beginning
+            self._record.pack_into(buf, base + off, self._wrap, 0)
+            write_pos += tail
+            off = 0
+
+        pos = base + off
+        self._record.pack_into(buf, pos, length, len(raws))
+        pos += self._record.size
+        for n in [len(data)] + [r.nbytes for r in raws]:
+            self._buflen.pack_into(buf, pos, n)
+            pos += self._buflen.size
+
+        buf[pos:pos + len(data)] = data
+        pos += len(data)
+        for r in raws:
+            buf[pos:pos + r.nbytes] = r
+            pos += r.nbytes
+
+        self._header.pack_into(buf, 0, write_pos + length, read_pos, n_written + 1, n_read, 1)
+        if not signaled:
+            self._signal_writer.send_bytes(b'\0')
+
+        return True
+
+    def put_many(self, items, block=True, timeout=None):
+        """
+        Puts a list of packets into the queue.
+
+        Raises:
+            queue.Full if there is no space in the ring buffer, packets before the failing one have been put
+            ValueError if a packet is larger than half of the ring buffer
+        """
+        t_end = None if timeout is None else time.time() + timeout
+        for item in items:
+            record = self._serialize(item)
+            while True:
+                with self._lock:
+                    written = self._write_locked(record)
+                if written:
+                    break
+                elif not block or (t_end is not None and time.time() >= t_end):
+                    raise queue.Full
+                time.sleep(0.001)
+
+    def put(self, item, block=True, timeout=None):
+        self.put_many((item,), block=block, timeout=timeout)
+
+    def put_nowait(self, item):
+        self.put_many((item,), block=False)
+
+    def _read_available(self, maxitems=None):
+        """
+        Reads packets from the ring buffer.
+        """
+        buf = self._shm.buf
+        with self._lock:
+            write_pos, read_pos, n_written, n_read, signaled = self._header.unpack_from(buf, 0)
+
+        base = self._header.size
+        items = []
+        while read_pos < write_pos and (maxitems is None or len(items) < maxitems):
+            off = read_pos % self.size
+            length, nbuffers = self._record.unpack_from(buf, base + off)
+            if length == self._wrap:
+                read_pos += self.size - off
+                continue
+
+            pos = base + off + self._record.size
+            lengths = []
+            for i in range(nbuffers + 1):
+                lengths.append(self._buflen.unpack_from(buf, pos)[0])
+                pos += self._buflen.size
+
+            data = bytes(buf[pos:pos + lengths[0]])
+            pos += lengths[0]
+            buffers = []
+            for n in lengths[1:]:
+                buffers.append(bytearray(buf[pos:pos + n]))
+                pos += n
+
+            items.append(pickle.loads(data, buffers=buffers))
+            read_pos += length
+
+        with self._lock:
+            write_pos, read_pos_old, n_written, n_read, signaled = self._header.unpack_from(buf, 0)
+            if read_pos == write_pos:  # Empty, the next put wakes up the reader again
+                while self._signal_reader.poll():
+                    self._signal_reader.recv_bytes()
+                signaled = 0
+            self._header.pack_into(buf, 0, write_pos, read_pos, n_written, n_read + len(items), signaled)
+
+        return items
+
+    def pending(self):
+        """
+        Returns the number of packets received but not read yet
+        """
+        return len(self._getbuffer)
+
+    def waitable(self):
+        """
+        Returns the connection that becomes ready when data is available, see DataNotifier.wait()
+        """
+        return self._signal_reader
+
+    def get(self, block=True, timeout=None):
+        t_end = None if timeout is None else time.time() + timeout
+        while len(self._getbuffer) == 0:
+            self._getbuffer.extend(self._read_available())
+            if len(self._getbuffer) > 0:
+                break
+            elif not block:
+                raise queue.Empty
+
+            timeout_poll = None if t_end is None else t_end - time.time()
+            if timeout_poll is not None and timeout_poll <= 0:
+                raise queue.Empty
+            self._signal_reader.poll(timeout_poll)
+
+        return self._getbuffer.popleft()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get_many(self, maxitems=None):
+        """
+        Returns a list of all available packets without blocking.
+
+        Args:
+            maxitems: Maximum number of packets returned, None for all
+        """
+        if maxitems is None:
+            self._getbuffer.extend(self._read_available())
+            items = list(self._getbuffer)
+            self._getbuffer.clear()
+        else:
+            if len(self._getbuffer) < maxitems:
+                self._getbuffer.extend(self._read_available(maxitems - len(self._getbuffer)))
+            items = [self._getbuffer.popleft() for i in range(min(maxitems, len(self._getbuffer)))]
+
+        return items
+
+    def empty(self):
+        write_pos, read_pos = self._header.unpack_from(self._shm.buf, 0)[:2]
+        return len(self._getbuffer) == 0 and write_pos == read_pos
+
+    def qsize(self):
+        n_written, n_read = self._header.unpack_from(self._shm.buf, 0)[2:4]
+        return len(self._getbuffer) + n_written - n_read
+
+
+def get_many(q, maxitems=None):
+    """
+    Returns a list of all packets available in the queue q without blocking, works for BatchQueue, NotifyQueue
+    and the standard queues.
+    """
+    try:
+        return q.get_many(maxitems)
+    except AttributeError:
+        pass
+
+    items = []
+    while maxitems is None or len(items) < maxitems:
+        try:
+            items.append(q.get(block=False))
+        except queue.Empty:
+            break
+
+    return items
+
+
+def flush(q):
+    """
+    Sends the buffered packets of a BatchQueue, does nothing for other queues.
+    """
+    if isinstance(q, BatchQueue):
+        try:
+            q.flush(block=False)
+        except queue.Full:
+            pass
+
+
+class LatencyStatistic:
+    """
+    Collects latency samples and calculates percentiles, used by distribute_data to report the time between
+    the arrival of data and its distribution.
+    """
+    def __init__(self, maxlen=10000):
+        self.maxlen = maxlen
+        self.samples = []
+
+    def add(self, dt):
+        if len(self.samples) < self.maxlen:
+            self.samples.append(dt)
+
+    def percentiles(self, percentiles=(50, 99)):
+        """
+        Returns the percentiles of the collected samples and clears them afterwards.
+
+        Returns:
+            List of percentiles (same order as percentiles argument), None if no samples were collected
+        """
+        samples = sorted(self.samples)
+        self.samples = []
+        nsamples = len(samples)
+        if nsamples == 0:
+            return [None for p in percentiles]
+
+        pvalues = []
+        for p in percentiles:
+            ind = min(nsamples - 1, int(round(p / 100 * (nsamples - 1))))
+            pvalues.append(samples[ind])
+
+        return pvalues
@@ -31,6 +31,7 @@ import re
 from redvypr.data_packets import commandpacket, create_datadict
 from redvypr.packet_statistic import do_data_statistics
 from redvypr.redvypr_address import RedvyprAddress, metadata_address
+import redvypr.data_queues as data_queues
 
 logging.basicConfig(stream=sys.stderr)
 
@@ -59,6 +60,7 @@ class RedvyprDeviceBaseConfig(pydantic.BaseModel):
     loglevel: str = pydantic.Field(default='')
     autostart: bool = False
     clear_datainqueue_before_thread_starts: bool = pydantic.Field(default=False, description='Clears the datainqueue before the thread is started.')
+    queue_transport: typing.Literal['queue','batch','shared_memory'] = pydantic.Field(default='queue', description='Multiprocess only: The transport of the packets between the process and redvypr. "batch" sends packets in batches, useful for high packet rates, "shared_memory" uses a ring buffer in shared memory, useful for large numpy arrays.')
     devicemodulename: str = pydantic.Field(default='')
     description: str = ''
     gui_tablabel_init: str = 'Init'
@@ -799,6 +801,7 @@ class RedvyprDevice(QtCore.QObject):
         """
 
         self.thread_communication.put(command)
+        data_queues.flush(self.thread_communication)  # Commands are not delayed by batched queues
 
 
     def kill_process(self):
@@ -1210,6 +1213,7 @@ class RedvyprDevice(QtCore.QObject):
         funcname = self.__class__.__name__ + '.unsubscribe_all()'
         self.logger.debug(funcname)
         self.subscribed_addresses = []
+        self.subscription_changed_signal.emit()
 
     def get_metadata_datakey(self, address, all_entries=True):
         """
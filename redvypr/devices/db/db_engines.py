@@ -13,7 +13,7 @@ from typing import Any, Dict, List, Optional, Iterator
 import psycopg
 from abc import ABC, abstractmethod
 from typing import Iterator, Optional, Any, Dict
-from redvypr.redvypr_address import RedvyprAddress
+from redvypr.redvypr_address import RedvyprAddress, packet_address
 
 import numpy as np
 
@@ -21,6 +21,27 @@ logging.basicConfig(stream=sys.stderr)
 logger = logging.getLogger('redvypr.device.db_engines')
 logger.setLevel(logging.DEBUG)
 
+# The columns of the packet table, in the order of AbstractDatabase.packet_to_row()
+packet_columns = "timestamp, data, redvypr_address, host, publisher, device, packetid, numpacket, timestamp_packet, uuid"
+# The columns that can be used in packet filters (see AbstractDatabase.build_packet_where)
+packet_filter_keys = ("host", "device", "packetid", "publisher", "uuid", "redvypr_address")
+# Errors of the database connection (and not of the data), the data can be written later again
+connection_errors = (psycopg.OperationalError, psycopg.InterfaceError)
+# sqlite3.OperationalError is raised for permanent errors (i.e. a missing table) as well, only these are temporary
+sqlite_connection_messages = ("database is locked", "unable to open database file")
+
+
+def is_connection_error(e: BaseException) -> bool:
+    """
+    Returns True if the exception is caused by the database connection (and not by the data), such that
+    the data can be written again later.
+    """
+    if isinstance(e, connection_errors):
+        return True
+    if isinstance(e, sqlite3.OperationalError):
+        return str(e).lower().startswith(sqlite_connection_messages)
+    return False
+
 def json_safe_dumps(obj):
     """
     Convert complex Redvypr packets into JSON-safe text.
@@ -109,6 +130,10 @@ class TimescaleConfig(pydantic.BaseModel):
     password: str = "password"
     host: str = "pi5server1"
     port: int = 5433
+    synchronous_commit: typing.Literal["on", "off", "local", "remote_write", "remote_apply"] = pydantic.Field(
+        default="on",
+        description="Durability of the commits (postgres synchronous_commit). With 'off' a server crash can lose the last transactions, but the database stays consistent."
+    )
 
 
 class SqliteConfig(pydantic.BaseModel):
@@ -132,6 +157,14 @@ class SqliteConfig(pydantic.BaseModel):
         default="{name}_{filecount}_{filedate}.db",
         description="Naming template for rotated files. Placeholders: {name}, {filecount}, {filedate}."
     )
+    journal_mode: typing.Literal["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"] = pydantic.Field(
+        default="WAL",
+        description="SQLite journal mode. WAL allows readers while writing and needs less disk syncs per commit."
+    )
+    synchronous: typing.Literal["OFF", "NORMAL", "FULL", "EXTRA"] = pydantic.Field(
+        default="NORMAL",
+        description="SQLite synchronous setting. NORMAL is safe against corruption in WAL mode, a power loss can lose the last commits."
+    )
 
 
 
@@ -191,18 +224,114 @@ class AbstractDatabase(ABC):
         """Inserts a single data packet into the database."""
         pass
 
+    def insert_packets(self, data_dicts: List[Dict[str, Any]],
+                       table_name: str = 'redvypr_packets') -> int:
+        """
+        Inserts a list of data packets in a single transaction and returns the number of
+        inserted packets. Raises an exception (after a rollback) if the insert fails.
+        """
+        rows = [self.packet_to_row(data_dict) for data_dict in data_dicts]
+        return self.insert_rows(rows, table_name=table_name)
+
+    @abstractmethod
+    def insert_rows(self, rows: List[tuple],
+                    table_name: str = 'redvypr_packets') -> int:
+        """
+        Inserts packets that were already converted with packet_to_row() in a single transaction,
+        this allows to serialize the packets in a different thread than the insert.
+        """
+        pass
+
     @abstractmethod
     def add_metadata(self, address: str, uuid: str, metadata_dict: dict,
-                     mode: str = "merge"):
+                     mode: str = "merge", commit: bool = True):
         """Upserts metadata for a specific device/session."""
         pass
 
+    def commit(self):
+        """Commits the current transaction, i.e. after add_metadata(commit=False)."""
+        if self._connection:
+            self._connection.commit()
+
+    @staticmethod
+    def packet_to_row(data_dict: Dict[str, Any]) -> tuple:
+        """Returns the values of a packet for the columns in packet_columns."""
+        raddr = packet_address(data_dict)
+        rv_meta = data_dict.get('_redvypr', {})
+        ts_utc = datetime.fromtimestamp(
+            data_dict.get('t', datetime.now().timestamp()), tz=timezone.utc)
+        ts_pkt_utc = datetime.fromtimestamp(rv_meta.get('t', 0), tz=timezone.utc)
+        return (ts_utc, json_safe_dumps(data_dict), raddr.to_address_string(),
+                raddr.host, raddr.publisher, raddr.device, raddr.packetid,
+                rv_meta.get('numpacket', '0'), ts_pkt_utc, raddr.uuid)
+
     @abstractmethod
     def get_latest_packet(self, table_name: str = 'redvypr_packets') -> Optional[
         Dict[str, Any]]:
         """Returns the most recent packet."""
         pass
 
+    @staticmethod
+    def build_packet_where(filters: List[Dict[str, str]] = None,
+                           time_range: Dict[str, Any] = None,
+                           placeholder: str = "%s",
+                           after: Optional[tuple] = None) -> tuple:
+        """
+        Builds the WHERE statement for the packet queries, such that the filtering is done by the database.
+
+        Args:
+            filters: A list of dictionaries, the keys of a dictionary are combined with AND, the
+                dictionaries with OR. Allowed keys are given by packet_filter_keys.
+            time_range: Dictionary with the optional datetimes 'tstart' and 'tend', None values are ignored.
+            placeholder: The parameter placeholder of the engine.
+            after: Optional (timestamp, id) of the last packet read, only packets after it are returned
+                (keyset pagination).
+
+        Returns:
+            Tuple (where statement, list of parameters)
+        """
+        where_clauses = []
+        params = []
+        if time_range:
+            if time_range.get("tstart") is not None:
+                where_clauses.append(f"timestamp >= {placeholder}")
+                params.append(time_range["tstart"])
+            if time_range.get("tend") is not None:
+                where_clauses.append(f"timestamp <= {placeholder}")
+                params.append(time_range["tend"])
+
+        if filters:
+            sub_clauses = []
+            for group in filters:
+                group_conditions = []
+                for key, value in group.items():
+                    if key not in packet_filter_keys:
+                        raise ValueError(f"Unknown filter key: {key}")
+                    group_conditions.append(f"{key} = {placeholder}")
+                    params.append(value)
+                if group_conditions:
+                    sub_clauses.append(f"({' AND '.join(group_conditions)})")
+            if sub_clauses:
+                where_clauses.append(f"({' OR '.join(sub_clauses)})")
+
+        if after is not None:
+            where_clauses.append(f"(timestamp, id) > ({placeholder}, {placeholder})")
+            params.extend(after)
+
+        where_stmt = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+        return where_stmt, params
+
+    @abstractmethod
+    def get_packets_after(self, after: Optional[tuple] = None, count: int = 1000,
+                          filters: List[Dict[str, str]] = None,
+                          time_range: Dict[str, Any] = None) -> List[Dict]:
+        """
+        Returns up to count packets ordered by (timestamp, id), starting after the packet with the
+        (timestamp, id) given by after (keyset pagination). In contrast to get_packets_range the cost of a
+        query does not grow with the position in the table.
+        """
+        pass
+
     @abstractmethod
     def get_packets_range(self, start_index: int, count: int,
                           filters: List[Dict[str, str]] = None,
@@ -522,12 +651,14 @@ class RedvyprTimescaleDb(AbstractDatabase):
     """
 
     def __init__(self, dbname: str, user: str, password: str,
-                 host: str = 'localhost', port: str = '5432'):
+                 host: str = 'localhost', port: str = '5432',
+                 synchronous_commit: str = 'on'):
         super().__init__()
         self.conn_params = {
             'dbname': dbname, 'user': user, 'password': password,
             'host': host, 'port': port
         }
+        self.synchronous_commit = synchronous_commit
 
     def connect(self):
         """Implementation of the abstract connect method."""
@@ -536,6 +667,11 @@ class RedvyprTimescaleDb(AbstractDatabase):
             try:
                 self._connection = psycopg.connect(**self.conn_params)
                 #print("Could connect to database")
+                if self.synchronous_commit != 'on':
+                    with self._connection.cursor() as cur:
+                        # The value is validated by TimescaleConfig
+                        cur.execute(f"SET synchronous_commit TO '{self.synchronous_commit}';")
+                    self._connection.commit()
             except psycopg.Error as e:
                 logger.error(f"❌ Connection failed: {e}")
                 raise
@@ -562,6 +698,10 @@ class RedvyprTimescaleDb(AbstractDatabase):
             );
             """,
             f"SELECT create_hypertable('{table_name}', 'timestamp', if_not_exists => TRUE);",
+            # Keyset pagination and filtered reads
+            f"CREATE INDEX IF NOT EXISTS idx_ts_id_{table_name} ON {table_name} (timestamp, id);",
+            f"CREATE INDEX IF NOT EXISTS idx_device_ts_{table_name} ON {table_name} (device, timestamp);",
+            f"CREATE INDEX IF NOT EXISTS idx_host_ts_{table_name} ON {table_name} (host, timestamp);",
             """
             CREATE TABLE IF NOT EXISTS redvypr_metadata (
                 id SERIAL PRIMARY KEY,
@@ -588,46 +728,37 @@ class RedvyprTimescaleDb(AbstractDatabase):
     def insert_packet(self, data_dict: Dict[str, Any],
                       table_name: str = 'redvypr_packets'):
         """Inserts a single packet using internal data extraction logic."""
-        sql = f"""
-            INSERT INTO {table_name} (timestamp, data, redvypr_address, host, publisher, device, packetid, numpacket, timestamp_packet, uuid)
-            VALUES ({self.placeholder}, {self.placeholder}, {self.placeholder}, {self.placeholder}, {self.placeholder}, 
-                    {self.placeholder}, {self.placeholder}, {self.placeholder}, {self.placeholder}, {self.placeholder});
-        """
         try:
-            # Assuming data_dict structure: 't' for timestamp, '_redvypr' for metadata
-            ts_utc = datetime.fromtimestamp(data_dict['t'], tz=timezone.utc)
-            ts_pkt_utc = datetime.fromtimestamp(data_dict['_redvypr']['t'],
-                                                tz=timezone.utc)
-
-            # Here you would normally use your RedvyprAddress helper class
-            # For this example, we assume it's pre-parsed or manual:
-            raddr_data = RedvyprAddress(data_dict)
-            numpacket = data_dict['_redvypr']['numpacket']
-            raddr = RedvyprAddress(data_dict)
-            raddrstr = raddr.to_address_string()
-            host = raddr.host
-            uuid = raddr.uuid
-            device = raddr.device
-            packetid = raddr.packetid
-            publisher = raddr.publisher
-
-            values = (
-                ts_utc, json_safe_dumps(data_dict), raddrstr,
-                host, publisher, device, packetid,
-                numpacket, ts_pkt_utc, uuid)
-
-            with self._connection.cursor() as cur:
-                cur.execute(sql, values)
-            self._connection.commit()
+            self.insert_packets([data_dict], table_name=table_name)
         except:
             logger.warning(f"❌ Insert failed",exc_info=True)
             #print("data dict",data_dict)
             #json.dumps(data_dict)
 
+    def insert_rows(self, rows: List[tuple],
+                    table_name: str = 'redvypr_packets') -> int:
+        """Inserts rows of packet_to_row() with COPY in a single transaction."""
+        if len(rows) == 0:
+            return 0
+
+        try:
+            with self._connection.cursor() as cur:
+                with cur.copy(f"COPY {table_name} ({packet_columns}) FROM STDIN") as copy:
+                    for row in rows:
+                        copy.write_row(row)
+            self._connection.commit()
+        except Exception:
+            if self._connection and not self._connection.closed:
+                self._connection.rollback()
+            raise
+
+        return len(rows)
+
     def add_metadata(self, address: str, uuid: str, metadata_dict: dict,
-                     mode: str = "merge"):
+                     mode: str = "merge", commit: bool = True):
         """
         Upsert metadata with explicit columns and merge/overwrite logic for JSON content.
+        With commit=False several entries can be added in one transaction (see commit()).
         """
         # 1. Extrahiere die Identitäts-Informationen aus der Adresse
         # Wir nutzen hier dein RedvyprAddress-Tool, um konsistent zu bleiben
@@ -677,7 +808,8 @@ class RedvyprTimescaleDb(AbstractDatabase):
                 cur.execute(sql, (
                     address, uuid, packetid, device, host, json_safe_dumps(metadata_dict)
                 ))
-            self._connection.commit()
+            if commit:
+                self._connection.commit()
             logger.info(f"✅ Metadata for {address} stored.")
         except Exception as e:
             logger.error(f"❌ Metadata storage failed: {e}")
@@ -688,35 +820,7 @@ class RedvyprTimescaleDb(AbstractDatabase):
                           filters: List[Dict[str, str]] = None,
                           time_range: Dict[str, Any] = None) -> List[Dict]:
 
-        where_clauses = []
-        params = []
-
-        # 1. Zeitfenster (tstart, tend)
-        if time_range:
-            if "tstart" in time_range:
-                where_clauses.append(f"timestamp >= {self.placeholder}")
-                params.append(time_range["tstart"])
-            if "tend" in time_range:
-                where_clauses.append(f"timestamp <= {self.placeholder}")
-                params.append(time_range["tend"])
-
-        # 2. Kombinations-Filter (Liste von Dicts)
-        if filters:
-            sub_clauses = []
-            for group in filters:
-                # Erstellt für jedes Dict eine AND-Kette: (host='A' AND device='B')
-                group_conditions = []
-                for key, value in group.items():
-                    group_conditions.append(f"{key} = {self.placeholder}")
-                    params.append(value)
-                sub_clauses.append(f"({' AND '.join(group_conditions)})")
-
-            # Verbindet die Gruppen mit OR
-            where_clauses.append(f"({' OR '.join(sub_clauses)})")
-
-        where_stmt = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
-
-        # Das eigentliche SQL
+        where_stmt, params = self.build_packet_where(filters, time_range, self.placeholder)
         sql = f"""
             SELECT id, timestamp, data 
             FROM redvypr_packets 
@@ -736,6 +840,29 @@ class RedvyprTimescaleDb(AbstractDatabase):
             logger.error(f"❌ Filtered range retrieval failed: {e}")
             return []
 
+    def get_packets_after(self, after: Optional[tuple] = None, count: int = 1000,
+                          filters: List[Dict[str, str]] = None,
+                          time_range: Dict[str, Any] = None) -> List[Dict]:
+        """Keyset paginated read of the packets, see AbstractDatabase.get_packets_after."""
+        where_stmt, params = self.build_packet_where(filters, time_range, "%s", after=after)
+        sql = f"""
+            SELECT id, timestamp, data 
+            FROM redvypr_packets 
+            {where_stmt} 
+            ORDER BY timestamp ASC, id ASC 
+            LIMIT %s
+        """
+        params.append(count)
+        try:
+            with self._connection.cursor() as cur:
+                cur.execute(sql, params)
+                return [{"id": r[0], "timestamp": r[1], "data": restore_datetimes(r[2])} for r in
+                        cur.fetchall()]
+        except Exception:
+            if self._connection and not self._connection.closed:
+                self._connection.rollback()
+            raise
+
     def get_latest_packet(self, table_name: str = 'redvypr_packets') -> Optional[
         Dict[str, Any]]:
         """
@@ -914,28 +1041,7 @@ class RedvyprTimescaleDb(AbstractDatabase):
         """
         Returns the number of packets matching specific filters and time ranges.
         """
-        where_clauses = []
-        params = []
-
-        # 1. Time Range
-        if time_range:
-            if "tstart" in time_range:
-                where_clauses.append(f"timestamp >= {self.placeholder}")
-                params.append(time_range["tstart"])
-            if "tend" in time_range:
-                where_clauses.append(f"timestamp <= {self.placeholder}")
-                params.append(time_range["tend"])
-
-        # 2. Key Combination Filters
-        if filters:
-            sub_clauses = []
-            for group in filters:
-                group_conditions = [f"{k} = {self.placeholder}" for k in group.keys()]
-                params.extend(group.values())
-                sub_clauses.append(f"({' AND '.join(group_conditions)})")
-            where_clauses.append(f"({' OR '.join(sub_clauses)})")
-
-        where_stmt = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+        where_stmt, params = self.build_packet_where(filters, time_range, self.placeholder)
         sql = f"SELECT COUNT(*) FROM {table_name} {where_stmt}"
 
         try:
@@ -1059,7 +1165,8 @@ class RedvyprDBFactory:
                 user=db_config.user,
                 password=db_config.password,
                 host=db_config.host,
-                port=db_config.port
+                port=db_config.port,
+                synchronous_commit=db_config.synchronous_commit
             )
 
         # Handling SQLite
@@ -1069,7 +1176,9 @@ class RedvyprDBFactory:
                 base_name=db_config.filepath,
                 max_file_size_mb=db_config.max_file_size_mb,
                 size_check_interval=db_config.size_check_interval,
-                file_format=db_config.file_format
+                file_format=db_config.file_format,
+                journal_mode=db_config.journal_mode,
+                synchronous=db_config.synchronous
             )
 
         # Fallback for dict-based configs (e.g. if loaded from JSON without Pydantic parsing)
@@ -1095,12 +1204,16 @@ class RedvyprSqliteDb(AbstractDatabase):
                  base_name: str = "redvypr",
                  max_file_size_mb: Optional[float] = None,
                  size_check_interval: int = 100,
-                 file_format: str = "{name}_{filecount}_{filedate}.db"):
+                 file_format: str = "{name}_{filecount}_{filedate}.db",
+                 journal_mode: str = "WAL",
+                 synchronous: str = "NORMAL"):
         super().__init__()
         self.base_name = base_name
         self.max_file_size_mb = max_file_size_mb
         self.size_check_interval = size_check_interval
         self.file_format = file_format
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
         print(f"self.max_file_size_mb:{self.max_file_size_mb}")
         print(f"self.size_check_interval:{self.size_check_interval}")
         # Initialisierung der Zähler
@@ -1152,13 +1265,13 @@ class RedvyprSqliteDb(AbstractDatabase):
 
         return os.path.join(directory, f"{new_filename_base}{extension}")
 
-    def _check_rotation(self):
+    def _check_rotation(self, npackets: int = 1):
         """Prüft Intervall und Dateigröße."""
         #print("Checking")
         if self.max_file_size_mb is None:
             return
 
-        self._packet_counter += 1
+        self._packet_counter += npackets
         if self._packet_counter >= self.size_check_interval:
             self._packet_counter = 0
 
@@ -1193,6 +1306,9 @@ class RedvyprSqliteDb(AbstractDatabase):
                     check_same_thread=False
                 )
                 self._connection.row_factory = sqlite3.Row
+                # Durability settings, the values are validated by SqliteConfig
+                self._connection.execute(f"PRAGMA journal_mode={self.journal_mode};")
+                self._connection.execute(f"PRAGMA synchronous={self.synchronous};")
                 # WICHTIG: Immer Schema sicherstellen
                 self.setup_schema()
                 logger.info(f"✅ Connected to: {self.filepath}")
@@ -1221,8 +1337,13 @@ class RedvyprSqliteDb(AbstractDatabase):
                     data TEXT NOT NULL
                 );
             """)
+            # The rowid (id) is part of every index, idx_ts is also used for the keyset pagination
             cur.execute(
                 f"CREATE INDEX IF NOT EXISTS idx_ts_{table_name} ON {table_name} (timestamp);")
+            cur.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_device_ts_{table_name} ON {table_name} (device, timestamp);")
+            cur.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_host_ts_{table_name} ON {table_name} (host, timestamp);")
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS redvypr_metadata (
                     id INTEGER PRIMARY KEY AUTOINCREMENT, -- Eindeutiger Integer-Index
@@ -1247,59 +1368,45 @@ class RedvyprSqliteDb(AbstractDatabase):
         Inserts a data packet into the SQLite database.
         Triggers a file rotation check before insertion if configured.
         """
+        self.insert_packets([data_dict], table_name=table_name)
+
+    def insert_rows(self, rows: List[tuple],
+                    table_name: str = 'redvypr_packets') -> int:
+        """
+        Inserts rows of packet_to_row() with executemany and a single commit.
+        Triggers a file rotation check before insertion if configured.
+        """
+        if len(rows) == 0:
+            return 0
+
         # 1. Check if the database needs to rotate based on file size and packet interval
-        self._check_rotation()
+        self._check_rotation(len(rows))
 
         # 2. Ensure we have an active connection (especially after rotation)
         conn = self.connect()
         cur = conn.cursor()
 
         try:
-            # 3. Extract addressing and timing information
-            raddr = RedvyprAddress(data_dict)
-
-            # Use 't' from the main dict for the entry timestamp
-            ts_utc = datetime.fromtimestamp(
-                data_dict.get('t', datetime.now().timestamp()), tz=timezone.utc)
-
-            # Extract internal redvypr metadata
-            rv_meta = data_dict.get('_redvypr', {})
-            ts_pkt_utc = datetime.fromtimestamp(rv_meta.get('t', 0), tz=timezone.utc)
-
-            # 4. Prepare data for SQL
-            data_dict_json = json_safe_dumps(data_dict)
-
             sql = f"""
-                INSERT INTO {table_name} 
-                (timestamp, data, redvypr_address, host, publisher, device, packetid, numpacket, timestamp_packet, uuid) 
+                INSERT INTO {table_name} ({packet_columns})
                 VALUES (?,?,?,?,?,?,?,?,?,?)
             """
+            cur.executemany(sql, rows)
 
-            cur.execute(sql, (
-                ts_utc,
-                data_dict_json,
-                raddr.to_address_string(),
-                raddr.host,
-                raddr.publisher,
-                raddr.device,
-                raddr.packetid,
-                rv_meta.get('numpacket', '0'),
-                ts_pkt_utc,
-                raddr.uuid
-            ))
-
-            # 5. Commit to save changes and update file size on disk
+            # 3. Commit to save changes and update file size on disk
             conn.commit()
 
         except Exception as e:
-            logger.error(f"❌ Failed to insert packet into SQLite: {e}")
+            logger.error(f"❌ Failed to insert packets into SQLite: {e}")
             conn.rollback()
             raise
         finally:
             cur.close()
 
+        return len(rows)
+
     def add_metadata(self, address: str, uuid: str,
-                     metadata_dict: dict, mode: str = "merge"):
+                     metadata_dict: dict, mode: str = "merge", commit: bool = True):
 
         try:
             raddr = RedvyprAddress(address, uuid=uuid)
@@ -1323,7 +1430,8 @@ class RedvyprSqliteDb(AbstractDatabase):
                     created_at = CURRENT_TIMESTAMP;
             """
             cur.execute(sql, (address, uuid, json_safe_dumps(metadata_dict), packetid, device, host))
-            self._connection.commit()
+            if commit:
+                self._connection.commit()
         finally:
             cur.close()
 
@@ -1407,19 +1515,20 @@ class RedvyprSqliteDb(AbstractDatabase):
 
     def get_packets_range(self, start_index: int, count: int, filters=None,
                           time_range=None) -> List[Dict]:
-        where_clauses, params = [], []
-        if time_range:
-            if "tstart" in time_range:
-                where_clauses.append("timestamp >= ?");
-                params.append(time_range["tstart"])
-            if "tend" in time_range:
-                where_clauses.append("timestamp <= ?");
-                params.append(time_range["tend"])
-
-        where_stmt = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+        where_stmt, params = self.build_packet_where(filters, time_range, "?")
         sql = f"SELECT id, timestamp, data FROM redvypr_packets {where_stmt} ORDER BY timestamp ASC LIMIT ? OFFSET ?"
         params.extend([count, start_index])
+        return self._fetch_packets(sql, params)
 
+    def get_packets_after(self, after: Optional[tuple] = None, count: int = 1000,
+                          filters=None, time_range=None) -> List[Dict]:
+        """Keyset paginated read of the packets, see AbstractDatabase.get_packets_after."""
+        where_stmt, params = self.build_packet_where(filters, time_range, "?", after=after)
+        sql = f"SELECT id, timestamp, data FROM redvypr_packets {where_stmt} ORDER BY timestamp ASC, id ASC LIMIT ?"
+        params.append(count)
+        return self._fetch_packets(sql, params)
+
+    def _fetch_packets(self, sql, params) -> List[Dict]:
         cur = self._connection.cursor()
         try:
             cur.execute(sql, params)
@@ -1441,14 +1550,7 @@ class RedvyprSqliteDb(AbstractDatabase):
 
     def get_packet_count(self, filters=None, time_range=None,
                          table_name='redvypr_packets') -> int:
-        where_clauses, params = [], []
-        if time_range:
-            if "tstart" in time_range: where_clauses.append(
-                "timestamp >= ?"); params.append(time_range["tstart"])
-            if "tend" in time_range: where_clauses.append(
-                "timestamp <= ?"); params.append(time_range["tend"])
-
-        where_stmt = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+        where_stmt, params = self.build_packet_where(filters, time_range, "?")
         cur = self._connection.cursor()
         try:
             cur.execute(f"SELECT COUNT(*) FROM {table_name} {where_stmt}", params)
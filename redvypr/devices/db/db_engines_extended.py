@@ -15,8 +15,9 @@ import hashlib
 import re
 from abc import ABC, abstractmethod
 from typing import Iterator, Optional, Any, Dict
-from redvypr.redvypr_address import RedvyprAddress
-from .db_engines import SqliteConfig, TimescaleConfig, RedvyprDBFactory, AbstractDatabase, RedvyprSqliteDb, RedvyprTimescaleDb
+from redvypr.redvypr_address import RedvyprAddress, packet_address
+from redvypr.data_packets import redvypr_data_keys
+from .db_engines import SqliteConfig, TimescaleConfig, RedvyprDBFactory, AbstractDatabase, RedvyprSqliteDb, RedvyprTimescaleDb, json_safe_dumps
 
 import numpy as np
 
@@ -121,6 +122,8 @@ class SqliteConfigExtended(SqliteConfig):
                                               description="Flag if the whole data packets shall be saved (the subscribed ones!)")
     save_metadata: bool = pydantic.Field(default=True,
                                               description="Flag if the metadata shall be saved")
+    columnar: bool = pydantic.Field(default=False,
+                                    description="Store the packets additionally in typed tables, one table per packet address with one column per datakey, arrays are stored as binary blobs")
     tables: Dict[str, List[str]] = pydantic.Field(
         default_factory=dict,
         description="""
@@ -159,7 +162,10 @@ class RedvyprDBFactoryExtended:
                 max_file_size_mb=db_config.max_file_size_mb,
                 size_check_interval=db_config.size_check_interval,
                 file_format=db_config.file_format,
-                tables=db_config.tables
+                journal_mode=db_config.journal_mode,
+                synchronous=db_config.synchronous,
+                tables=db_config.tables,
+                columnar=db_config.columnar
             )
 
         # Handling TimescaleDB
@@ -169,7 +175,8 @@ class RedvyprDBFactoryExtended:
                 user=db_config.user,
                 password=db_config.password,
                 host=db_config.host,
-                port=db_config.port
+                port=db_config.port,
+                synchronous_commit=db_config.synchronous_commit
             )
 
         # Handling SQLite
@@ -179,7 +186,9 @@ class RedvyprDBFactoryExtended:
                 base_name=db_config.filepath,
                 max_file_size_mb=db_config.max_file_size_mb,
                 size_check_interval=db_config.size_check_interval,
-                file_format=db_config.file_format
+                file_format=db_config.file_format,
+                journal_mode=db_config.journal_mode,
+                synchronous=db_config.synchronous
             )
 
         # Fallback for dict-based configs (e.g. if loaded from JSON without Pydantic parsing)
@@ -204,7 +213,7 @@ class RedvyprSqliteDbExtended(RedvyprSqliteDb):
     Supports reversible mapping between sanitized column names and original Redvypr addresses.
     """
 
-    def __init__(self, *args, tables=None, **kwargs):
+    def __init__(self, *args, tables=None, columnar=False, **kwargs):
         """
         Initializes the database and creates flat tables based on the provided `tables` dictionary.
 
@@ -212,8 +221,12 @@ class RedvyprSqliteDbExtended(RedvyprSqliteDb):
             *args: Positional arguments for the parent class.
             tables: A dictionary where keys are table names and values are lists of Redvypr addresses.
                    Example: {"sensor_data": ["temp@d:thermo", "humidity@d:hygro"]}
+            columnar: Store the packets additionally in typed columnar tables (see insert_packets_columnar).
             **kwargs: Keyword arguments for the parent class.
         """
+        self.columnar = columnar
+        # Cache of the columnar tables: packet address string -> {'table': name, 'columns': {datakey: column}}
+        self._columnar_tables = {}
         super().__init__(*args, **kwargs)
         if tables is None:
             self.tables = {}
@@ -233,6 +246,10 @@ class RedvyprSqliteDbExtended(RedvyprSqliteDb):
     def setup_schema(self, table_name: str = 'redvypr_packets'):
         print("Setup schema extended ...")
         super().setup_schema(table_name=table_name)
+        # The cache is reloaded from the mapping table (i.e. after a rotation into a new file)
+        self._columnar_tables = {}
+        if self.columnar:
+            self._ensure_columnar_mapping_table()
         if len(self.tables) > 0:
             print("Creating table/column mappings")
             self._ensure_table_mapping_table()
@@ -518,10 +535,279 @@ class RedvyprSqliteDbExtended(RedvyprSqliteDb):
         finally:
             cur.close()
 
-    def insert_packet(self, data_dict: Dict[str, Any],
-                      table_name: str = 'redvypr_packets'):
-        # Standard packet writing
-        super().insert_packet(data_dict=data_dict, table_name=table_name)
+    def insert_packets(self, data_dicts: List[Dict[str, Any]],
+                       table_name: str = 'redvypr_packets') -> int:
+        # Standard packet writing in one transaction, the flat tables packet by packet.
+        # insert_packet() of the base class calls this method as well.
+        n = super().insert_packets(data_dicts=data_dicts, table_name=table_name)
+        if self.columnar:
+            self.insert_packets_columnar(data_dicts)
+        for data_dict in data_dicts:
+            self.insert_packet_tables(data_dict)
+        return n
+
+    # Columnar storage
+    def _ensure_columnar_mapping_table(self) -> None:
+        """Ensures the mapping table of the columnar tables exists."""
+        cur = self._connection.cursor()
+        try:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS redvypr_columnar_mapping (
+                    address TEXT NOT NULL,
+                    sanitized_table_name TEXT NOT NULL,
+                    datakey TEXT NOT NULL,
+                    sanitized_name TEXT NOT NULL,
+                    column_type TEXT NOT NULL,  -- INTEGER, REAL, TEXT (json for non scalar values) or BLOB (arrays)
+                    dtype TEXT,                 -- numpy dtype of BLOB columns
+                    shape TEXT,                 -- json list of the trailing dimensions of BLOB columns
+                    PRIMARY KEY (sanitized_table_name, sanitized_name),
+                    UNIQUE (address, datakey)
+                );
+            """)
+            self._connection.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error creating columnar mapping table: {e}")
+        finally:
+            cur.close()
+
+    def columnar_type(self, value: Any):
+        """
+        Returns the column type, numpy dtype and trailing shape of a value for the columnar tables, or None if the
+        type cannot be determined (None values).
+        """
+        if value is None:
+            return None
+        elif isinstance(value, (bool, int, np.integer, np.bool_)):
+            return "INTEGER", None, None
+        elif isinstance(value, (float, np.floating)):
+            return "REAL", None, None
+        elif isinstance(value, str):
+            return "TEXT", None, None
+        elif isinstance(value, (np.ndarray, list, tuple)):
+            try:
+                data = np.asarray(value)
+            except ValueError:  # Ragged lists
+                return "TEXT", None, None
+            if data.dtype.kind in 'biuf' and data.ndim > 0:
+                return "BLOB", data.dtype.str, list(data.shape[1:])
+
+        return "TEXT", None, None
+
+    def _get_columnar_table(self, address: str) -> Dict[str, Any]:
+        """
+        Returns the cached description of the columnar table of a packet address, the table is created if needed.
+        """
+        try:
+            return self._columnar_tables[address]
+        except KeyError:
+            pass
+
+        sanitized_table_name = f"rc_{self.sanitize_name(address)}"  # add redvypr columnar (rc_)
+        conn = self.connect()
+        cur = conn.cursor()
+        try:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {sanitized_table_name} (
+                    timestamp REAL NOT NULL,
+                    numpacket INTEGER
+                );
+            """)
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {sanitized_table_name}_timestamp_idx "
+                        f"ON {sanitized_table_name} (timestamp);")
+            cur.execute("""
+                SELECT datakey, sanitized_name, column_type, dtype, shape
+                FROM redvypr_columnar_mapping WHERE address = ?;
+            """, (address,))
+            columns = {}
+            for row in cur.fetchall():
+                shape = json.loads(row[4]) if row[4] is not None else None
+                columns[row[0]] = (row[1], row[2], row[3], shape)
+            conn.commit()
+        finally:
+            cur.close()
+
+        table = {'table': sanitized_table_name, 'columns': columns}
+        self._columnar_tables[address] = table
+        return table
+
+    def _add_columnar_column(self, address: str, table: Dict[str, Any], datakey: str, value: Any):
+        """
+        Adds a column for datakey to a columnar table, the type is given by value. Returns None if the type cannot be
+        determined yet.
+        """
+        coltype = self.columnar_type(value)
+        if coltype is None:
+            return None
+
+        column_type, dtype, shape = coltype
+        sanitized_names = {c[0] for c in table['columns'].values()}
+        sanitized_name_base = f"c_{self.sanitize_name(datakey)}"
+        sanitized_name = sanitized_name_base
+        i = 1
+        while sanitized_name in sanitized_names:  # Different datakeys with the same sanitized name
+            sanitized_name = f"{sanitized_name_base}_{i}"
+            i += 1
+
+        cur = self._connection.cursor()
+        try:
+            # The column may exist without mapping if a previous transaction was rolled back
+            cur.execute(f"PRAGMA table_info({table['table']});")
+            if sanitized_name not in {row[1] for row in cur.fetchall()}:
+                cur.execute(f"ALTER TABLE {table['table']} ADD COLUMN {sanitized_name} {column_type};")
+            cur.execute("""
+                INSERT INTO redvypr_columnar_mapping
+                (address, sanitized_table_name, datakey, sanitized_name, column_type, dtype, shape)
+                VALUES (?, ?, ?, ?, ?, ?, ?);
+            """, (address, table['table'], datakey, sanitized_name, column_type, dtype,
+                  json.dumps(shape) if shape is not None else None))
+        finally:
+            cur.close()
+
+        logger.info(f"Added column {sanitized_name} ({column_type}) for {datakey} to table {table['table']}.")
+        column = (sanitized_name, column_type, dtype, shape)
+        table['columns'][datakey] = column
+        return column
+
+    def columnar_value(self, value: Any, column):
+        """Converts a value into the storage format of a columnar column."""
+        if value is None:
+            return None
+        column_type = column[1]
+        if column_type == "BLOB":
+            try:
+                return np.asarray(value, dtype=column[2]).tobytes()
+            except (ValueError, TypeError):
+                return None
+        elif column_type == "TEXT" and not isinstance(value, str):
+            return json_safe_dumps(value)
+        elif isinstance(value, np.generic):
+            return value.item()
+        else:
+            return value
+
+    def insert_packets_columnar(self, data_dicts: List[Dict[str, Any]]) -> int:
+        """
+        Inserts the packets into the columnar tables in one transaction. Every packet address has its own table with
+        the columns timestamp, numpacket and one typed column per datakey. Numerical arrays are stored as binary
+        blobs, other non scalar values as json. Columns are added when new datakeys appear, the table descriptions
+        are cached, such that an insert does not need to query the schema.
+        """
+        if len(data_dicts) == 0:
+            return 0
+
+        conn = self.connect()
+        # Rows grouped by table and columns, each group is inserted with executemany
+        groups = {}
+        try:
+            for data_dict in data_dicts:
+                address = packet_address(data_dict).to_address_string()
+                table = self._get_columnar_table(address)
+                columns = table['columns']
+                colnames = []
+                values = []
+                for datakey, value in data_dict.items():
+                    if datakey == 't' or datakey in redvypr_data_keys:
+                        continue
+                    try:
+                        column = columns[datakey]
+                    except KeyError:
+                        column = self._add_columnar_column(address, table, datakey, value)
+                        if column is None:
+                            continue
+                    colnames.append(column[0])
+                    values.append(self.columnar_value(value, column))
+
+                redvypr = data_dict['_redvypr']
+                t = data_dict.get('t', redvypr['t'])
+                row = (t, redvypr.get('numpacket')) + tuple(values)
+                groups.setdefault((table['table'], tuple(colnames)), []).append(row)
+
+            for (table_name, colnames), rows in groups.items():
+                allcolnames = ('timestamp', 'numpacket') + colnames
+                placeholders = ','.join(['?'] * len(allcolnames))
+                sql = f"INSERT INTO {table_name} ({', '.join(allcolnames)}) VALUES ({placeholders})"
+                conn.executemany(sql, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # The cache may contain columns of the rolled back transaction
+            self._columnar_tables = {}
+            raise
+
+        return len(data_dicts)
+
+    def get_columnar_addresses(self) -> List[str]:
+        """Returns the packet addresses that have a columnar table."""
+        conn = self.connect()
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT DISTINCT address FROM redvypr_columnar_mapping;")
+            return [row[0] for row in cur.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching columnar addresses: {e}")
+            return []
+        finally:
+            cur.close()
+
+    def get_columnar_data(self, address: str, datakey: str,
+                          t_start: Optional[float] = None,
+                          t_end: Optional[float] = None):
+        """
+        Reads a single datakey of a packet address from the columnar tables.
+
+        Args:
+            address: The packet address string (as given by packet_address(packet).to_address_string()).
+            datakey: The datakey.
+            t_start: Optional start time (unix time), inclusive.
+            t_end: Optional end time (unix time), inclusive.
+
+        Returns:
+            Tuple (t, data) sorted by time. t is a numpy array, data a numpy array for INTEGER and REAL columns,
+            a list of numpy arrays for BLOB columns and a list of strings for TEXT columns. None if the datakey
+            is not stored.
+        """
+        if address not in self._columnar_tables and address not in self.get_columnar_addresses():
+            return None
+        table = self._get_columnar_table(address)
+        try:
+            sanitized_name, column_type, dtype, shape = table['columns'][datakey]
+        except KeyError:
+            return None
+
+        sql = f"SELECT timestamp, {sanitized_name} FROM {table['table']} WHERE {sanitized_name} IS NOT NULL"
+        params = []
+        if t_start is not None:
+            sql += " AND timestamp >= ?"
+            params.append(t_start)
+        if t_end is not None:
+            sql += " AND timestamp <= ?"
+            params.append(t_end)
+        sql += " ORDER BY timestamp"
+
+        conn = self.connect()
+        cur = conn.cursor()
+        try:
+            # Plain tuples, the sqlite3.Row factory is not needed here
+            cur.row_factory = None
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+
+        t = np.fromiter((row[0] for row in rows), dtype=float, count=len(rows))
+        if column_type == "REAL":
+            data = np.fromiter((row[1] for row in rows), dtype=float, count=len(rows))
+        elif column_type == "INTEGER":
+            data = np.asarray([row[1] for row in rows])
+        elif column_type == "BLOB":
+            dtype = np.dtype(dtype)
+            data = [np.frombuffer(row[1], dtype=dtype).reshape([-1] + shape) for row in rows]
+        else:
+            data = [row[1] for row in rows]
+
+        return t, data
+
+    def insert_packet_tables(self, data_dict: Dict[str, Any]):
         # Check if we can save something into flat tables
         for tablename in self.tables.keys():
             print(f"Inserting packet into table:{tablename}")
@@ -578,7 +864,7 @@ class RedvyprSqliteDbExtended(RedvyprSqliteDb):
         # Get or create the mapping for the column
         existing_sanitized = self.get_sanitized_name(address, table_name)
         if not existing_sanitized:
-            self._add_column_mapping(table_name, address, sanitized_column_name)
+            self._add_column_mapping(table_name, sanitized_table_name, address, sanitized_column_name)
 
         # Convert timestamp to datetime if necessary
         if isinstance(timestamp, (int, float)):
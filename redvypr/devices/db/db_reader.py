@@ -4,6 +4,9 @@ import logging
 from PyQt6 import QtWidgets, QtCore, QtGui
 import qtawesome
 import time
+import queue
+import threading
+import collections
 import logging
 import sys
 import pydantic
@@ -12,7 +15,7 @@ import redvypr
 from redvypr.data_packets import check_for_command
 from redvypr.widgets.standard_device_widgets import RedvyprdevicewidgetSimple
 from redvypr.device import RedvyprDevice, RedvyprDeviceParameter
-from redvypr.redvypr_address import RedvyprAddress
+from redvypr.redvypr_address import RedvyprAddress, packet_address
 from redvypr.data_packets import Datapacket
 from .db_util_widgets import DBStatusDialog, TimescaleDbConfigWidget, DBConfigWidget, DBQueryDialog
 from .db_engines import RedvyprTimescaleDb, DatabaseConfig, DatabaseSettings, TimescaleConfig, SqliteConfig, RedvyprDBFactory
@@ -42,6 +45,80 @@ class DeviceCustomConfig(pydantic.BaseModel):
     replay_mode: typing.Literal["realtime","constant"] = pydantic.Field(default="realtime")
     database: DatabaseConfig = pydantic.Field(default_factory=SqliteConfig, discriminator='dbtype')
 
+class PacketPrefetcher():
+    """
+    Reads the packets chunk by chunk with keyset pagination (db.get_packets_after) in a background thread. The
+    next chunks are read and decoded while the current chunk is replayed (double buffering). A chunk that cannot
+    be read is tried again nretry times, then the exception is handed to the consumer instead of the chunk.
+    """
+    def __init__(self, db, chunksize=100, filters=None, time_range=None, nbuffer=2, nretry=3, dt_retry=1.0):
+        self.db = db
+        self.chunksize = chunksize
+        self.filters = filters
+        self.time_range = time_range
+        self.nretry = nretry
+        self.dt_retry = dt_retry
+        self.chunks = queue.Queue(maxsize=nbuffer)
+        self.stop_event = threading.Event()
+        self.packets_read = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def run(self):
+        funcname = __name__ + '.run()'
+        after = None
+        chunk = []
+        nfailed = 0
+        while not self.stop_event.is_set():
+            try:
+                chunk = self.db.get_packets_after(after=after, count=self.chunksize,
+                                                  filters=self.filters,
+                                                  time_range=self.time_range)
+                nfailed = 0
+            except Exception as e:
+                nfailed += 1
+                if nfailed > self.nretry:
+                    logger.exception(funcname + ' Could not read packets, giving up')
+                    self._put(e)
+                    return
+                logger.warning(funcname + ' Could not read packets, trying again ({}/{}): {}'.format(nfailed, self.nretry, e))
+                self.stop_event.wait(self.dt_retry)
+                continue
+
+            if len(chunk) > 0:
+                after = (chunk[-1]["timestamp"], chunk[-1]["id"])
+                self.packets_read += len(chunk)
+                self._put(chunk)
+            if len(chunk) < self.chunksize:
+                break
+
+        self._put(None)  # All packets read
+
+    def _put(self, chunk):
+        while not self.stop_event.is_set():
+            try:
+                self.chunks.put(chunk, timeout=0.2)
+                return
+            except queue.Full:
+                pass
+
+    def get(self, timeout=None):
+        """
+        Returns the next chunk of packets, an empty list if no chunk is available within timeout, None if all
+        packets were read and the exception if the packets could not be read.
+        """
+        try:
+            return self.chunks.get(timeout=timeout)
+        except queue.Empty:
+            return []
+
+
 def start(device_info, config={}, dataqueue=None, datainqueue=None, statusqueue=None):
     """
 
@@ -51,7 +128,6 @@ def start(device_info, config={}, dataqueue=None, datainqueue=None, statusqueue=
     logger_thread.setLevel(logging.DEBUG)
     logger_thread.debug(funcname)
     dt_update = 1  # Update interval in seconds
-    packets_read = 0
     packets_published = 0
     t_update = time.time() - dt_update
     print("Config",config)
@@ -60,9 +136,12 @@ def start(device_info, config={}, dataqueue=None, datainqueue=None, statusqueue=
     device_config = DeviceCustomConfig(**config)
     dbconfig = device_config.database
     logger_thread.info("Opening database")
-    # Get the filters from the redvypr addresses
+    # Get the filters from the redvypr addresses, they are evaluated by the database
     packet_filters = None
-    packet_time_range = None
+    packet_time_range = {
+        "tstart": device_config.tstart,
+        "tend": device_config.tend
+    }
     if len(device_config.packet_filter):
         packet_filters = []
         filter_keys = ["host","device","packetid","uuid"]
@@ -76,13 +155,9 @@ def start(device_info, config={}, dataqueue=None, datainqueue=None, statusqueue=
             if len(filter_dict.keys()):
                 packet_filters.append(filter_dict)
 
-        packet_time_range = {
-            "tstart": device_config.tstart,
-            "tend": device_config.tend
-        }
-
     print(f"Packet filters:{packet_filters}")
     print(f"Packet time range:{packet_time_range}")
+    prefetcher = None
     try:
         db = RedvyprDBFactory.create(dbconfig)
         #db = RedvyprTimescaleDb(dbname = dbconfig.dbname,
@@ -134,30 +209,71 @@ def start(device_info, config={}, dataqueue=None, datainqueue=None, statusqueue=
                 logger.info("No valid data information returned from database, exiting")
                 return
             statistics = {}
-            packets_read_buffer = []
             print(f"Number of total measurements in db:{db_info["measurement_count"]}")
-            if packet_filters is None:
+            if packet_filters is None and packet_time_range["tstart"] is None and packet_time_range["tend"] is None:
                 ntotal = db_info["measurement_count"]
             else:
                 ntotal = db.get_packet_count(filters=packet_filters,
                                                      time_range=packet_time_range)
 
             print(f"Number of measurements (with filter):{ntotal}")
-            nchunk = device_config.size_packetbuffer
-            ind_read = 0
-            t_packet_old = 0  # Time of the last sent packet
-            t_packet = 0  # Time of the last sent packet
+            prefetcher = PacketPrefetcher(db, chunksize=device_config.size_packetbuffer,
+                                          filters=packet_filters,
+                                          time_range=packet_time_range)
+            prefetcher.start()
+            packets_read_buffer = collections.deque()
+            read_finished = False
+            t_packet_old = None  # Time of the last sent packet
             t_thread_sent = 0  # Time of the last sent packet
-            t_thread_now = 0  # Time of the last sent packet
             data_send = None
 
             while True:
+                # Get the next packet to send
+                if data_send is None:
+                    if len(packets_read_buffer) == 0 and not read_finished:
+                        chunk = prefetcher.get(timeout=dt_update)
+                        if chunk is None:
+                            read_finished = True
+                        elif isinstance(chunk, Exception):
+                            logger_thread.error(funcname + ' Could not read packets from database, stopping: {}'.format(chunk))
+                            data = {}
+                            data['t'] = time.time()
+                            data['packets_read'] = prefetcher.packets_read
+                            data['packets_published'] = packets_published
+                            data['packets_total'] = ntotal
+                            data['statistics'] = statistics
+                            data['error'] = 'Could not read packets: {}'.format(chunk)
+                            statusqueue.put(data)
+                            return
+                        else:
+                            packets_read_buffer.extend(chunk)
+                    if len(packets_read_buffer) > 0:
+                        data_send = packets_read_buffer.popleft()
+                        t_packet_unix = data_send["timestamp"].timestamp()
+                        packet_send = data_send["data"]
+                        # Time between the last sent and this packet
+                        if t_packet_old is None:
+                            dt_packet = 0
+                        elif device_config.replay_mode == "constant":
+                            dt_packet = device_config.constant_dt
+                        else:
+                            dt_packet = (t_packet_unix - t_packet_old) / device_config.speedup
+                    elif read_finished:
+                        print("All read")
+                        return
+
+                # Wait for commands until the next packet is due
+                timeout = 0
+                if data_send is not None:
+                    timeout = min(dt_update, max(0, dt_packet - (time.time() - t_thread_sent)))
                 try:
-                    datapacket = datainqueue.get(block=False)
-                except:
+                    if timeout > 0:
+                        datapacket = datainqueue.get(timeout=timeout)
+                    else:
+                        datapacket = datainqueue.get(block=False)
+                except queue.Empty:
                     datapacket = None
-                    time.sleep(0.5)
-                # print("Got data",datapacket)
+
                 if datapacket is not None:
                     [command, comdata] = check_for_command(datapacket,
                                                            thread_uuid=device_info[
@@ -178,82 +294,42 @@ def start(device_info, config={}, dataqueue=None, datainqueue=None, statusqueue=
                             return
                         elif command == 'info' and packetid == 'metadata':
                             print("Info command", datapacket.keys())
-                else:
-                    # Check if we have to fill the packetbuffer again
-                    if len(packets_read_buffer) < int(nchunk / 10):
-                        print("Reading packets")
-                        if (ind_read + nchunk) < ntotal:
-                            nread = nchunk
-                        elif ind_read < (ntotal - 1):
-                            nread = ntotal - ind_read
-                        else:
-                            print("All read")
-                            return
-
-                        print("Reading #{} packets from {}".format(nread, ind_read))
-                        if packet_filters is None:
-                            data = db.get_packets_range(ind_read, nread)
-                        else:
-                            data = db.get_packets_range(
-                                start_index=ind_read,
-                                count=nread,
-                                filters=packet_filters,
-                                time_range=packet_time_range
-                            )
-                        packets_read += len(data)
-                        ind_read += nread
-                        packets_read_buffer.extend(data)
-
-                    if len(packets_read_buffer) > 1:
-                        # t_packet_old = 0  # Time of the last sent packet
-                        # t_packet = 0  # Time of the last sent packet
-                        # t_thread_sent = 0  # Time of the last sent packet
-                        # t_thread_now = 0  # Time of the last sent packet
-                        if data_send is None:
-                            data_send = packets_read_buffer.pop(0)
-                            # print("Data send",data_send)
-                            id_send = data_send["id"]
-                            t_packet = data_send["timestamp"]
-                            t_packet_unix = t_packet.timestamp()
-                            packet_send = data_send["data"]
-
-                        t_thread_now = time.time()
-                        dt_packet = t_packet_unix - t_packet_old
-                        dt_thread = t_thread_now - t_thread_sent
-                        # print("dt", dt_packet, dt_thread)
-                        if dt_thread >= dt_packet:
-                            #print("Sending", id_send, t_packet)
-                            packets_published += 1
-                            t_thread_sent = t_thread_now
-                            t_packet_old = t_packet_unix
-                            dataqueue.put(packet_send)
-                            data_send = None
-                            # Update statistics
-                            raddr_packet = RedvyprAddress(packet_send).to_address_string()
-                            try:
-                                statistics[raddr_packet]
-                            except:
-                                statistics[raddr_packet] = {'packets_read':0, 'packets_published':0}
-
-                            statistics[raddr_packet]['packets_read'] += 1
-                            statistics[raddr_packet]['packets_published'] += 1
-                            #print(f"statistics:{statistics}")
+                elif data_send is not None:
+                    t_thread_now = time.time()
+                    if (t_thread_now - t_thread_sent) >= dt_packet:
+                        packets_published += 1
+                        t_thread_sent = t_thread_now
+                        t_packet_old = t_packet_unix
+                        dataqueue.put(packet_send)
+                        data_send = None
+                        # Update statistics
+                        raddr_packet = packet_address(packet_send).to_address_string()
+                        try:
+                            statistics[raddr_packet]
+                        except:
+                            statistics[raddr_packet] = {'packets_read':0, 'packets_published':0}
+
+                        statistics[raddr_packet]['packets_read'] += 1
+                        statistics[raddr_packet]['packets_published'] += 1
 
                 if ((time.time() - t_update) > dt_update):
                     t_update = time.time()
-                    print("Updating", packets_read, packets_published)
                     data = {}
                     data['t'] = time.time()
-                    data['packets_read'] = packets_read
+                    data['packets_read'] = prefetcher.packets_read
                     data['packets_published'] = packets_published
+                    data['packets_total'] = ntotal
                     data['statistics'] = statistics
                     statusqueue.put(data)
     except:
         logger_thread.exception("Could not connect to database")
         return
     finally:
+        if prefetcher is not None:
+            prefetcher.stop()
         logger_thread.info("Thread shutting down, connection cleaned up.")
 
+
 class Device(RedvyprDevice):
     """
     db_reader device
@@ -585,6 +661,10 @@ class RedvyprDeviceWidget(RedvyprdevicewidgetSimple):
                 #print("Statistics",self.statistics)
                 self.statustable.setItem(0,1,item_read)
                 self.statustable.setItem(0, 2, item_published)
+                if 'error' in data:
+                    item_error = QtWidgets.QTableWidgetItem("All (stopped, read error)")
+                    item_error.setToolTip(data['error'])
+                    self.statustable.setItem(0, 0, item_error)
                 for row,(k, i) in enumerate(self.statistics.items()):
                     #print("k",k)
                     #print("i", i)
@@ -617,6 +697,7 @@ class RedvyprDeviceWidget(RedvyprdevicewidgetSimple):
 
     def thread_start_signal(self):
         print("Thread started, starting statustimer")
+        self.statustable.setItem(0, 0, QtWidgets.QTableWidgetItem("All"))
         self.statustimer_db.start(500)
 
 
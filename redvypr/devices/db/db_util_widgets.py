@@ -147,6 +147,20 @@ class SqliteConfigWidget(QtWidgets.QWidget):
         self.preview_label.setWordWrap(True)
         layout.addRow("Filename Preview:", self.preview_label)
 
+        # 7. Durability
+        self.journal_mode_combo = QtWidgets.QComboBox()
+        self.journal_mode_combo.addItems(typing.get_args(SqliteConfig.model_fields['journal_mode'].annotation))
+        self.journal_mode_combo.setCurrentText(self.config.journal_mode)
+        self.journal_mode_combo.setToolTip(SqliteConfig.model_fields['journal_mode'].description)
+        self.journal_mode_combo.currentTextChanged.connect(self.config_changed)
+        layout.addRow("Journal Mode:", self.journal_mode_combo)
+        self.synchronous_combo = QtWidgets.QComboBox()
+        self.synchronous_combo.addItems(typing.get_args(SqliteConfig.model_fields['synchronous'].annotation))
+        self.synchronous_combo.setCurrentText(self.config.synchronous)
+        self.synchronous_combo.setToolTip(SqliteConfig.model_fields['synchronous'].description)
+        self.synchronous_combo.currentTextChanged.connect(self.config_changed)
+        layout.addRow("Synchronous:", self.synchronous_combo)
+
         # --- Test/Query Buttons ---
         self.test_button = QtWidgets.QPushButton("Test DB Connection")
         self.test_button.setIcon(qtawesome.icon('mdi6.database-outline'))
@@ -200,7 +214,9 @@ class SqliteConfigWidget(QtWidgets.QWidget):
             filepath=self.path_edit.text(),
             max_file_size_mb=max_size,
             size_check_interval=self.interval_spin.value(),
-            file_format=self.format_edit.text()
+            file_format=self.format_edit.text(),
+            journal_mode=self.journal_mode_combo.currentText(),
+            synchronous=self.synchronous_combo.currentText()
         )
 
     def config_changed(self):
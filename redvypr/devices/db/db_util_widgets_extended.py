@@ -389,6 +389,13 @@ class SqliteConfigWidgetExtended(QtWidgets.QWidget):
         self.save_metadata_cb.stateChanged.connect(self.config_changed)
         layout.addRow(self.save_metadata_cb)
 
+        # Typed columnar tables
+        self.columnar_cb = QtWidgets.QCheckBox("Save Packets in Typed Columnar Tables")
+        self.columnar_cb.setChecked(getattr(self.config, "columnar", False))
+        self.columnar_cb.setToolTip(SqliteConfigExtended.model_fields['columnar'].description)
+        self.columnar_cb.stateChanged.connect(self.config_changed)
+        layout.addRow(self.columnar_cb)
+
         # Save Single Datastreams in Tables (mit Config-Button)
         datastream_layout = QtWidgets.QHBoxLayout()
         self.save_datastreams_cb = QtWidgets.QCheckBox("Save Single Datastreams in Tables")
@@ -474,9 +481,12 @@ class SqliteConfigWidgetExtended(QtWidgets.QWidget):
             max_file_size_mb=max_size,
             size_check_interval=self.extended_config_widget.interval_spin.value(),
             file_format=self.extended_config_widget.format_edit.text(),
+            journal_mode=self.config.journal_mode,
+            synchronous=self.config.synchronous,
             tables=self.config.tables,
             save_whole_packets=self.save_whole_packets_cb.isChecked(),
             save_metadata=self.save_metadata_cb.isChecked(),
+            columnar=self.columnar_cb.isChecked(),
             save_datastreams=self.save_datastreams_cb.isChecked(),
         )
 
@@ -1,5 +1,10 @@
 from PyQt6 import QtWidgets, QtCore
+import os
+import re
+import tempfile
 import time
+import queue
+import threading
 import logging
 import sys
 import pydantic
@@ -7,9 +12,11 @@ import typing
 import qtawesome
 from redvypr.data_packets import check_for_command
 from redvypr.widgets.standard_device_widgets import RedvyprdevicewidgetSimple
-from redvypr.redvypr_address import RedvyprAddress
+from redvypr.redvypr_address import RedvyprAddress, packet_address
+from redvypr.packet_statistic import DeviceinfoMirror
 from .db_util_widgets import DBStatusDialog, TimescaleDbConfigWidget, DBConfigWidget
-from .db_engines import RedvyprTimescaleDb, DatabaseConfig, DatabaseSettings, TimescaleConfig, SqliteConfig, RedvyprDBFactory
+from redvypr import packet_codec
+from .db_engines import RedvyprTimescaleDb, DatabaseConfig, DatabaseSettings, TimescaleConfig, SqliteConfig, RedvyprDBFactory, is_connection_error
 
 logging.basicConfig(stream=sys.stderr)
 logger = logging.getLogger('redvypr.device.db.db_writer')
@@ -26,22 +33,358 @@ class DeviceBaseConfig(pydantic.BaseModel):
 class DeviceCustomConfig(pydantic.BaseModel):
     auto_create_table: bool = pydantic.Field(default=True, description="Create redvypr tables automatically at start, if not existing")
     database: DatabaseConfig = pydantic.Field(default_factory=SqliteConfig, discriminator='dbtype')
+    batch_size: int = pydantic.Field(default=500, description="Maximum number of packets inserted in one transaction")
+    batch_dt: float = pydantic.Field(default=1.0, description="Maximum time [s] a packet is buffered before the packets are inserted")
+    write_queue_size: int = pydantic.Field(default=100, description="Maximum number of serialized batches waiting for the database")
+    spill_file: str = pydantic.Field(default="", description="File buffering the packets while the database is not reachable, if empty a file named after the host and device in the temporary folder is used")
+    spill_maxsize_mb: float = pydantic.Field(default=100.0, description="Maximum size of the spill file [MB], 0 disables the spill buffer")
 
-def start(device_info, config={}, dataqueue=None, datainqueue=None, statusqueue=None):
+
+def get_spill_filename(device_info):
     """
+    Returns the default spill file of the device, it is named after the host and the device and located in the
+    folder redvypr of the temporary folder, such that every db_writer uses its own file that is found again after
+    a restart.
+    """
+    try:
+        hostname = device_info['hostinfo']['host']
+    except (KeyError, TypeError):
+        hostname = 'redvypr'
+    name = '{}_{}'.format(hostname, device_info['device'])
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+    folder = os.path.join(tempfile.gettempdir(), 'redvypr')
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, 'db_writer_{}.spill'.format(name))
 
+
+def update_statistics(statistics, rows, results):
     """
-    funcname = __name__ + '.start()'
-    logger_thread = logging.getLogger('redvypr.device.db_writer.start')
-    logger_thread.setLevel(logging.DEBUG)
-    logger_thread.debug(funcname)
+    Counts the inserted and failed packets per address, the address is the third column of a row.
+    """
+    for row, result in zip(rows, results):
+        addrstr = row[2]
+        try:
+            statistics_addr = statistics[addrstr]
+        except KeyError:
+            statistics_addr = {'packet_inserted': 0, 'packet_inserted_failure': 0}
+            statistics[addrstr] = statistics_addr
+        if result:
+            statistics_addr['packet_inserted'] += 1
+        else:
+            statistics_addr['packet_inserted_failure'] += 1
+
+
+def insert_batch(db, rows, statistics):
+    """
+    Inserts a batch of rows (see AbstractDatabase.packet_to_row) in one transaction. If the batch fails, the rows are
+    inserted one by one, such that a single bad packet does not discard the whole batch.
+
+    Returns
+    -------
+    tuple
+        (number of inserted packets, number of failed packets, rows that were not inserted because of a connection
+        error)
+    """
+    try:
+        db.insert_rows(rows)
+        results = [True] * len(rows)
+    except Exception as e:
+        if is_connection_error(e):
+            logger.warning("Database connection error", exc_info=True)
+            return 0, 0, rows
+
+        logger.info("Could not insert batch, inserting packets one by one", exc_info=True)
+        results = []
+        for row in rows:
+            try:
+                db.insert_rows([row])
+                results.append(True)
+            except Exception as e:
+                if is_connection_error(e):
+                    logger.warning("Database connection error", exc_info=True)
+                    break
+                logger.info("Could not add data", exc_info=True)
+                results.append(False)
+
+    update_statistics(statistics, rows, results)
+    ninserted = sum(results)
+    return ninserted, len(results) - ninserted, rows[len(results):]
+
+
+class SpillBuffer():
+    """
+    A bounded file buffer for batches of rows that could not be written into the database. The batches are stored
+    as frames of redvypr.packet_codec and are replayed in the order they were added. The buffer survives a restart of
+    the device, remaining batches are replayed at the next start.
+    """
+    def __init__(self, filename, maxsize=100 * 1024 * 1024):
+        self.filename = filename
+        self.maxsize = maxsize
+        self.ndropped = 0  # Rows that did not fit into the buffer anymore
+        self.read_position = 0  # The position of the first batch not replayed yet
+        self.rows_pending = []  # Rows of a partially replayed batch
+        self.nrows = 0
+        try:
+            self.f = open(filename, 'r+b')
+            self.nrows = sum(len(rows) for rows, position in self.iter_batches())
+            if self.nrows > 0:
+                logger.info('Spill buffer {} contains {} packets from a previous run'.format(filename, self.nrows))
+        except FileNotFoundError:
+            self.f = open(filename, 'w+b')
+
+    @property
+    def nbytes(self):
+        self.f.seek(0, os.SEEK_END)
+        return self.f.tell() - self.read_position
+
+    def put(self, rows):
+        """
+        Appends a batch of rows.
+
+        Returns
+        -------
+        bool
+            False if the buffer is full and the rows were dropped
+        """
+        datab = packet_codec.encode_frame(list(rows))
+        if self.nbytes + len(datab) > self.maxsize:
+            self.ndropped += len(rows)
+            logger.warning('Spill buffer is full, dropping {} packets'.format(len(rows)))
+            return False
+
+        self.f.seek(0, os.SEEK_END)
+        self.f.write(datab)
+        self.f.flush()
+        self.nrows += len(rows)
+        return True
+
+    def iter_batches(self):
+        """
+        Yields the batches not replayed yet together with the file position after the batch.
+        """
+        position = self.read_position
+        while True:
+            self.f.seek(position)
+            header = self.f.read(packet_codec.frame_header.size)
+            if len(header) < packet_codec.frame_header.size:
+                return
+            magic, n = packet_codec.frame_header.unpack(header)
+            payload = self.f.read(n)
+            if magic != packet_codec.frame_magic or len(payload) < n:
+                logger.warning('Spill buffer {} is corrupted at position {}'.format(self.filename, position))
+                return
+            position += packet_codec.frame_header.size + n
+            yield [tuple(row) for row in packet_codec.decode(payload)], position
+
+    def replay(self, insert_function):
+        """
+        Inserts the batches with insert_function, which returns the rows that could not be inserted because of
+        a connection error. The replay stops at the first batch that was not inserted completely.
+
+        Returns
+        -------
+        bool
+            True if all batches were replayed
+        """
+        if len(self.rows_pending) > 0:
+            rows_remaining = insert_function(self.rows_pending)
+            self.nrows -= len(self.rows_pending) - len(rows_remaining)
+            self.rows_pending = rows_remaining
+            if len(rows_remaining) > 0:
+                return False
+
+        for rows, position in self.iter_batches():
+            rows_remaining = insert_function(rows)
+            self.read_position = position
+            self.nrows -= len(rows) - len(rows_remaining)
+            if len(rows_remaining) > 0:
+                # The inserted rows of the batch are not replayed again
+                self.rows_pending = rows_remaining
+                return False
+
+        self.clear()
+        return True
+
+    def clear(self):
+        self.f.seek(0)
+        self.f.truncate()
+        self.read_position = 0
+        self.rows_pending = []
+        self.nrows = 0
+
+    def close(self):
+        if self.nrows == 0:
+            self.f.close()
+            os.remove(self.filename)
+            return
+
+        # Rewrite the file with the pending and not replayed batches only
+        batches = [rows for rows, position in self.iter_batches()]
+        if len(self.rows_pending) > 0:
+            batches.insert(0, self.rows_pending)
+        self.f.seek(0)
+        self.f.truncate()
+        for rows in batches:
+            self.f.write(packet_codec.encode_frame(rows))
+        self.f.close()
+
+
+def write_thread(db, writequeue, statusqueue, spill, pipeline_state, dt_retry=5.0):
+    """
+    The writing stage of the db_writer. It takes batches of serialized packets and metadata from the writequeue
+    and writes them into the database. If the database is not reachable, the batches are stored in the spill buffer
+    and replayed when the connection is back. The status (number of packets, queue depths, write latency and
+    spill buffer) is sent regularly to the statusqueue.
+    """
+    funcname = __name__ + '.write_thread()'
     dt_update = 1  # Update interval in seconds
     dt_update_db = 10  # Update interval in seconds
+    t_update = time.time()
+    t_update_db = time.time() - dt_update_db
+    t_retry = 0
     packet_inserted = 0
     packet_inserted_failure = 0
     metadata_address_inserted = 0
-    t_update = time.time() - dt_update
-    t_update_db = time.time() - dt_update_db
+    statistics = {}
+    latency = None
+    connected = True
+    metadata_pending = []  # Metadata entries not written because of a connection error, written after reconnecting
+
+    def insert_rows(rows):
+        nonlocal packet_inserted, packet_inserted_failure, latency
+        t0 = time.time()
+        ninserted, nfailed, rows_remaining = insert_batch(db, rows, statistics)
+        if len(rows_remaining) == 0:
+            latency = time.time() - t0
+        packet_inserted += ninserted
+        packet_inserted_failure += nfailed
+        return rows_remaining
+
+    def insert_metadata(entries):
+        """
+        Writes the metadata entries in one transaction, returns the entries that could not be written because
+        of a connection error.
+        """
+        nonlocal metadata_address_inserted
+        ninserted = 0
+        for i, (address, uuid, metadata_content) in enumerate(entries):
+            try:
+                db.add_metadata(address=address, uuid=uuid, metadata_dict=metadata_content, commit=False)
+                ninserted += 1
+            except Exception as e:
+                if is_connection_error(e):
+                    logger.warning(funcname + ' Database connection error, keeping metadata', exc_info=True)
+                    return entries[i:]
+                logger.info(funcname + ' Could not add metadata', exc_info=True)
+        try:
+            db.commit()
+        except Exception as e:
+            if is_connection_error(e):
+                logger.warning(funcname + ' Database connection error, keeping metadata', exc_info=True)
+                return entries
+            logger.info(funcname + ' Could not commit metadata', exc_info=True)
+            return []
+
+        metadata_address_inserted += ninserted
+        return []
+
+    def spill_rows(rows):
+        nonlocal packet_inserted_failure
+        if spill is None or not spill.put(rows):
+            packet_inserted_failure += len(rows)
+            update_statistics(statistics, rows, [False] * len(rows))
+
+    while True:
+        try:
+            item = writequeue.get(timeout=dt_update)
+        except queue.Empty:
+            item = False
+
+        if item is None:
+            break
+        elif item:
+            if item[0] == 'rows':
+                rows = item[1]
+                if connected and (spill is None or spill.nrows == 0):
+                    rows_remaining = insert_rows(rows)
+                    if len(rows_remaining) > 0:
+                        logger.warning(funcname + ' Lost database connection, spilling packets')
+                        connected = False
+                        t_retry = time.time()
+                        spill_rows(rows_remaining)
+                else:  # Keep the order of the packets
+                    spill_rows(rows)
+            elif item[0] == 'metadata':
+                # Metadata is only sent once (DeviceinfoMirror yields changes), it is kept until it is written
+                metadata_pending.extend(item[1])
+
+        # Reconnect
+        if not connected and (time.time() - t_retry) > dt_retry:
+            t_retry = time.time()
+            try:
+                db.disconnect()
+                db.connect()
+                connected = True
+                logger.info(funcname + ' Reconnected to database')
+            except Exception as e:
+                logger.info(funcname + ' Could not reconnect to database: {}'.format(e))
+
+        # Write the pending metadata and replay the spilled packets
+        if connected and len(metadata_pending) > 0:
+            metadata_pending = insert_metadata(metadata_pending)
+            if len(metadata_pending) > 0:
+                connected = False
+                t_retry = time.time()
+        if connected and spill is not None and spill.nrows > 0:
+            connected = spill.replay(insert_rows)
+            if not connected:
+                t_retry = time.time()
+
+        if (time.time() - t_update) > dt_update:
+            t_update = time.time()
+            data = {}
+            data['t'] = time.time()
+            data['packet_inserted'] = packet_inserted
+            data['packet_inserted_failure'] = packet_inserted_failure
+            data['metadata_address_inserted'] = metadata_address_inserted
+            data['metadata_pending'] = len(metadata_pending)
+            data['statistics'] = statistics
+            data['db_connected'] = connected
+            data['write_queue'] = writequeue.qsize()
+            data['datainqueue'] = pipeline_state.get('datainqueue')
+            data['write_latency'] = latency
+            data['spill_packets'] = spill.nrows if spill is not None else 0
+            data['spill_dropped'] = spill.ndropped if spill is not None else 0
+            data['spill_bytes'] = spill.nbytes if spill is not None else 0
+            statusqueue.put(data)
+        if connected and (time.time() - t_update_db) > dt_update_db:
+            t_update_db = time.time()
+            try:
+                statusqueue.put(db.get_status())
+            except:
+                logger.info(funcname + ' Could not get database status', exc_info=True)
+
+    if connected and len(metadata_pending) > 0:
+        metadata_pending = insert_metadata(metadata_pending)
+    if len(metadata_pending) > 0:
+        logger.warning(funcname + ' Could not write metadata of {} addresses'.format(len(metadata_pending)))
+    if spill is not None:
+        if connected and spill.nrows > 0:
+            spill.replay(insert_rows)
+        spill.close()
+    logger.debug(funcname + ' Stopped')
+
+
+def start(device_info, config={}, dataqueue=None, datainqueue=None, statusqueue=None):
+    """
+    Receives the packets, serializes them in batches and hands the batches to the write_thread.
+    """
+    funcname = __name__ + '.start()'
+    logger_thread = logging.getLogger('redvypr.device.db_writer.start')
+    logger_thread.setLevel(logging.DEBUG)
+    logger_thread.debug(funcname)
+    dt_update = 1  # Update interval in seconds
+    deviceinfo_mirror = DeviceinfoMirror()  # Local copy of deviceinfo_all, updated with patches
     print("Config",config)
     print("device_info", device_info)
 
@@ -77,17 +420,39 @@ def start(device_info, config={}, dataqueue=None, datainqueue=None, statusqueue=
                     status = db.check_health()
 
             if status['tables_exist'] and status['can_write']:
-                statistics = {}
+                if device_config.spill_maxsize_mb > 0:
+                    spill_file = device_config.spill_file if device_config.spill_file else get_spill_filename(device_info)
+                    logger_thread.info('Spill file: {}'.format(spill_file))
+                    spill = SpillBuffer(spill_file, maxsize=device_config.spill_maxsize_mb * 1024 * 1024)
+                else:
+                    spill = None
+                writequeue = queue.Queue(maxsize=device_config.write_queue_size)
+                pipeline_state = {}
+                writer = threading.Thread(target=write_thread,
+                                          args=(db, writequeue, statusqueue, spill, pipeline_state),
+                                          daemon=True)
+                writer.start()
+                packets_batch = []
+                t_batch = time.time()  # The time the first packet of the batch was received
                 while True:
-                    datapacket = datainqueue.get()
-                    #print("Got data",datapacket)
-                    addrstr = RedvyprAddress(datapacket).to_address_string()
-                    #print("Addstr",addrstr)
-                    [command, comdata] = check_for_command(datapacket,
-                                                           thread_uuid=device_info[
-                                                               'thread_uuid'],
-                                                           add_data=True)
-                    if command is not None:
+                    # Wait at most until the batch is due
+                    if len(packets_batch) > 0:
+                        timeout = max(0.0, t_batch + device_config.batch_dt - time.time())
+                    else:
+                        timeout = dt_update
+                    try:
+                        datapacket = datainqueue.get(timeout=timeout)
+                        [command, comdata] = check_for_command(datapacket,
+                                                               thread_uuid=device_info[
+                                                                   'thread_uuid'],
+                                                               add_data=True)
+                    except queue.Empty:
+                        datapacket = None
+                        command = None
+
+                    if datapacket is None:
+                        pass
+                    elif command is not None:
                         paddr = RedvyprAddress(datapacket)
                         packetid = paddr.packetid
                         publisher = paddr.publisher
@@ -99,12 +464,22 @@ def start(device_info, config={}, dataqueue=None, datainqueue=None, statusqueue=
                             logger.info(funcname + 'received command:' + str(
                                 datapacket) + ' stopping now')
                             logger.debug('Stop command')
+                            if len(packets_batch) > 0:
+                                writequeue.put(('rows', [db.packet_to_row(p) for p in packets_batch]))
+                            writequeue.put(None)
+                            writer.join()
                             return
                         elif command == 'info' and packetid == 'metadata':
                             print("Info command", datapacket.keys())
-                            metadata = datapacket["deviceinfo_all"]["metadata"]
+                            # Only the changed metadata entries are added
+                            metadata = deviceinfo_mirror.update(datapacket)
+                            if metadata is None:
+                                metadata = {}
+                                if deviceinfo_mirror.resync_needed:
+                                    dataqueue.put(deviceinfo_mirror.resync_packet())
                             print("Metadata", metadata)
                             # add_metadata(self, address: str, uuid: str, metadata_dict: dict,mode: str = "merge"):
+                            metadata_entries = []
                             for metadata_address_str, metadata_content in metadata.items():
                                 print("Adding metadata", metadata_address_str)
                                 metadata_address = RedvyprAddress(metadata_address_str)
@@ -117,45 +492,29 @@ def start(device_info, config={}, dataqueue=None, datainqueue=None, statusqueue=
                                     print("Could not get uuid from metadata, get from host")
                                     uuid = device_info["hostinfo"]["uuid"]
 
-                                try:
-                                    db.add_metadata(address=metadata_address_str, uuid=uuid,
-                                                    metadata_dict=metadata_content)
-                                    metadata_address_inserted += 1
-                                except:
-                                    logger_thread.info("Could not add metadata",exc_info=True)
+                                metadata_entries.append((metadata_address_str, uuid, metadata_content))
+
+                            if len(metadata_entries) > 0:
+                                writequeue.put(('metadata', metadata_entries))
 
                     else:  # Only save real data
-                        #print('Inserting datapacket',datapacket)
-                        try:
-                            statistics[addrstr]
-                        except:
-                            statistics[addrstr] = {'packet_inserted': 0,
-                                                   'packet_inserted_failure': 0}
+                        if len(packets_batch) == 0:
+                            t_batch = time.time()
+                        packets_batch.append(datapacket)
+
+                    # Serialize the packets if the batch is full or the oldest packet waited long enough
+                    if len(packets_batch) >= device_config.batch_size or (
+                            len(packets_batch) > 0 and (time.time() - t_batch) >= device_config.batch_dt):
                         try:
-                            db.insert_packet(datapacket)
-                            packet_inserted += 1
-                            statistics[addrstr]['packet_inserted'] += 1
-                        except:
-                            logger_thread.info("Could not add data",exc_info=True)
-                            packet_inserted_failure += 1
-                            statistics[addrstr]['packet_inserted_failure'] += 1
-
-                    if ((time.time() - t_update) > dt_update):
-                        t_update = time.time()
-                        # print("Updating")
-                        data = {}
-                        data['t'] = time.time()
-                        data['packet_inserted'] = packet_inserted
-                        data['packet_inserted_failure'] = packet_inserted_failure
-                        data['metadata_address_inserted'] = metadata_address_inserted
-                        data['statistics'] = statistics
-                        statusqueue.put(data)
-                    if ((time.time() - t_update_db) > dt_update_db):
-                        t_update_db = time.time()
-                        print("Status")
-                        db_status = db.get_status()
-                        statusqueue.put(db_status)
-                        #print("Db Status",db_status)
+                            pipeline_state['datainqueue'] = datainqueue.qsize()
+                        except NotImplementedError:
+                            pass
+                        writequeue.put(('rows', [db.packet_to_row(p) for p in packets_batch]))
+                        packets_batch = []
+
+                    if not writer.is_alive():
+                        logger_thread.error(funcname + ' Write thread stopped')
+                        return
 
     except:
         logger_thread.exception("Could not connect to database")
@@ -296,7 +655,9 @@ class RedvyprDeviceWidget(RedvyprdevicewidgetSimple):
         # 3. Add the DBConfigWidget to the main content area (self.layout)
         # We add it at the top of the 'self.widget' (main content area)
 
+        self.pipelinelabel = QtWidgets.QLabel()
         self.layout.addWidget(self.db_config_widget)
+        self.layout.addWidget(self.pipelinelabel)
         self.layout.addWidget(self.statussplitter, 1)
 
         self.statustimer_db = QtCore.QTimer()
@@ -340,6 +701,13 @@ class RedvyprDeviceWidget(RedvyprdevicewidgetSimple):
                 self.statustable.setItem(0,1,item_inserted)
                 self.statustable.setItem(0, 2, item_inserted_failure)
                 self.statustable.setItem(1, 1, item_meta_inserted)
+                latency = data['write_latency']
+                latency_str = '{:.1f} ms'.format(latency * 1000) if latency is not None else '-'
+                self.pipelinelabel.setText(
+                    'Database connected: {}, input queue: {}, write queue: {}, write latency: {}, '
+                    'spilled packets: {} (dropped: {})'.format(data['db_connected'], data['datainqueue'],
+                                                               data['write_queue'], latency_str,
+                                                               data['spill_packets'], data['spill_dropped']))
                 for row,(k, i) in enumerate(self.statistics.items()):
                     #print("k",k)
                     #print("i", i)
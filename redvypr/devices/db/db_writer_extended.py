@@ -8,6 +8,7 @@ import qtawesome
 from redvypr.data_packets import check_for_command
 from redvypr.widgets.standard_device_widgets import RedvyprdevicewidgetSimple
 from redvypr.redvypr_address import RedvyprAddress
+from redvypr.packet_statistic import DeviceinfoMirror
 from .db_util_widgets_extended import DBConfigWidgetExtended
 from .db_engines_extended import DatabaseConfigExtended, DatabaseSettingsExtended, TimescaleConfig, SqliteConfigExtended, RedvyprDBFactoryExtended
 
@@ -40,6 +41,7 @@ def start(device_info, config={}, dataqueue=None, datainqueue=None, statusqueue=
     packet_inserted = 0
     packet_inserted_failure = 0
     metadata_address_inserted = 0
+    deviceinfo_mirror = DeviceinfoMirror()  # Local copy of deviceinfo_all, updated with patches
     t_update = time.time() - dt_update
     t_update_db = time.time() - dt_update_db
     print("Config",config)
@@ -99,7 +101,12 @@ def start(device_info, config={}, dataqueue=None, datainqueue=None, statusqueue=
                         # Check if there is metadata to save
                         elif command == 'info' and packetid == 'metadata':
                             print("Info command", datapacket.keys())
-                            metadata = datapacket["deviceinfo_all"]["metadata"]
+                            # Only the changed metadata entries are added
+                            metadata = deviceinfo_mirror.update(datapacket)
+                            if metadata is None:
+                                metadata = {}
+                                if deviceinfo_mirror.resync_needed:
+                                    dataqueue.put(deviceinfo_mirror.resync_packet())
                             print("Metadata", metadata)
                             # add_metadata(self, address: str, uuid: str, metadata_dict: dict,mode: str = "merge"):
                             for metadata_address_str, metadata_content in metadata.items():
@@ -128,6 +128,132 @@ def create_logfile(config,count=0):
        
     return [f,filename]
 
+class DatastreamExtractor():
+    """
+    The datastream addresses of the csv columns, compiled once. For every packet address the columns that can
+    match (publisher, device, packetid, host ...) are determined once and cached, such that a packet is only
+    evaluated by the addresses of its columns. Datakeys that are plain names are read directly from the packet.
+    """
+    route_fields = frozenset(redvypr_address.RedvyprAddress.PREFIX_MAP.values())
+
+    def __init__(self, addresses):
+        self.ncolumns = len(addresses)
+        self.columns = []  # (index, address, datakey or None, flag if the filter depends on the _redvypr fields only)
+        for i, address in enumerate(addresses):
+            try:
+                raddr = redvypr_address.RedvyprAddress(address)
+            except Exception:
+                logger.warning('Invalid address {} of column {}'.format(address, i), exc_info=True)
+                continue
+
+            left = raddr.left_expr
+            datakey = left if (left is not None and left.isidentifier()) else None
+            # Only equality filters of the _redvypr fields are constant for all packets of a packet address
+            eq_filter = raddr.get_equality_filter()
+            header_filter = (eq_filter is not None) and set(eq_filter.keys()).issubset(self.route_fields)
+            self.columns.append((i, raddr, datakey, header_filter))
+
+        self.routes = {}  # Packet address -> columns that can match
+
+    def get_route(self, paddress):
+        try:
+            return self.routes[paddress]
+        except KeyError:
+            pass
+
+        route = []
+        for column in self.columns:
+            i, raddr, datakey, header_filter = column
+            # Columns with filters on other fields than _redvypr are evaluated for every packet
+            if not header_filter or raddr.matches_filter(paddress):
+                route.append(column)
+
+        self.routes[paddress] = route
+        return route
+
+    def extract(self, packet):
+        """
+        Returns the list of the values of all columns (None if not found) or None if no column was found.
+        """
+        route = self.get_route(redvypr_address.packet_address(packet))
+        if len(route) == 0:
+            return None
+
+        values = None
+        for i, raddr, datakey, header_filter in route:
+            if datakey is not None and header_filter:
+                try:
+                    value = packet[datakey]
+                except KeyError:
+                    continue
+            else:
+                try:
+                    value = raddr(packet)
+                except Exception:
+                    continue
+
+            if values is None:
+                values = [None] * self.ncolumns
+            values[i] = value
+
+        return values
+
+
+class RowFormatter():
+    """
+    Formats the rows of the csv file, the format strings of the columns are looked up once per datatype.
+    """
+    def __init__(self, datastreams, separator=','):
+        self.separator = separator
+        self.strformats = [d['strformat'] for d in datastreams]
+        self.formats = [{} for d in datastreams]  # Cache of the format function per column and type
+
+    def get_format(self, index, datatype):
+        try:
+            strformat = self.strformats[index][datatype.__name__ + '_type']
+        except:
+            strformat = '{}'
+
+        if ":s" in strformat:  # Convert to str if str format is choosen, this is useful for datatypes different of str (i.e. bytes)
+            return lambda v: strformat.format(str(v))
+        else:
+            return strformat.format
+
+    def format_rows(self, rows, numline=0):
+        """
+        Formats the rows (data_time_unix, data_line, data_numpacket) and returns the text to be written.
+        """
+        separator = self.separator
+        formats = self.formats
+        lines = []
+        for data_time_unix, data_line, data_numpacket in rows:
+            numline += 1
+            data_time_str = datetime.datetime.fromtimestamp(data_time_unix, tz=datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+            fields = [str(numline), str(data_numpacket), str(data_time_unix), data_time_str]
+            for index, streamdata in enumerate(data_line):
+                if streamdata is None:
+                    streamdata = ''
+
+                datatype = type(streamdata)
+                try:
+                    fformat = formats[index][datatype]
+                except KeyError:
+                    fformat = self.get_format(index, datatype)
+                    formats[index][datatype] = fformat
+
+                # Here errors in conversion could be treated more carefully
+                dtxt = fformat(streamdata)
+                # Check if the separator or a newline is within the data string
+                if (separator in dtxt) or ('\n' in dtxt):
+                    dtxt = '"' + dtxt + '"'
+                fields.append(dtxt)
+
+            lines.append(separator.join(fields))
+
+        lines.append('')
+        return '\n'.join(lines)
+
+
 def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=None):
     funcname = __name__ + '.start()'
     logger.debug(funcname + ':Opening writing:')
@@ -215,6 +341,9 @@ def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=Non
     if(f == None):
        return None
     
+    extractor = DatastreamExtractor([d['address'] for d in config['datastreams']])
+    formatter = RowFormatter(config['datastreams'], separator=config['separator'])
+    nmax_read = 1000  # Maximum number of packets read before the rows are written
     tfile = time.time() # Save the time the file was created
     tflush = time.time() # Save the time the file was created
     tupdate = time.time() # Save the time for the update timing
@@ -227,10 +356,16 @@ def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=Non
             os.fsync(f.fileno())
             tflush = time.time()
 
-        time.sleep(0.05)
-        while(datainqueue.empty() == False):
+        # Wait for the first packet and read all available packets afterwards
+        nread = 0
+        while nread < nmax_read:
+            try:
+                data = datainqueue.get(block=(nread == 0), timeout=0.05)
+            except queue.Empty:
+                break
+
+            nread += 1
             try:
-                data = datainqueue.get(block=False)
                 if (data is not None):
                     [command,comdata] = data_packets.check_for_command(data, thread_uuid=device_info['thread_uuid'], add_data=True)
                     #logger.debug('Got a command: {:s}'.format(str(data)))
@@ -244,26 +379,12 @@ def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=Non
                             continue
 
 
-                FLAG_WRITE_PACKET = False
-                if True:
+                data_fill = extractor.extract(data)
+                # If data to write was found
+                if data_fill is not None:
                     data_time = data['_redvypr']['t']
                     data_numpacket = data['_redvypr']['numpacket']
-                    # Check if the datastreams are in the list already
-                    data_fill = []
-                    for ind_dstream, dstream in enumerate(config['datastreams']):
-                        data_fill.append(None)
-                    for ind_dstream, dstream in enumerate(config['datastreams']):
-                        dstream_raddr = redvypr_address.RedvyprAddress(dstream['address'])
-                        try:
-                            streamdata = dstream_raddr(data)
-                            data_fill[ind_dstream] = streamdata
-                            FLAG_WRITE_PACKET = True
-                        except:
-                            continue
-
-                    # If data to write was found
-                    if FLAG_WRITE_PACKET:
-                        data_write_to_file.append([data_time, data_fill, data_numpacket])
+                    data_write_to_file.append([data_time, data_fill, data_numpacket])
 
                 # Send statistics
                 if ((time.time() - tupdate) > config['dt_update']):
@@ -313,49 +434,13 @@ def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=Non
 
             if len(data_write_to_file) > 0:
                 #logger.debug('Writing {:d} lines to file now'.format(len(data_write_to_file)))
-                for l in data_write_to_file:
-                    numline += 1
-                    data_time_unix = l[0]  # Time
-                    data_time_str = datetime.datetime.fromtimestamp(data_time_unix, tz=datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                    data_line = l[1]  # Data
-                    data_numpacket = l[2]  # Numpacket
-                    # Convert data to str
-                    datastr_all = str(numline) + config['separator']
-                    datastr_all += str(data_numpacket) + config['separator']
-                    datastr_all += str(data_time_unix) + config['separator']
-                    datastr_all += str(data_time_str) + config['separator']
-                    for index, streamdata in enumerate(data_line):
-                        if streamdata is None:
-                            streamdata = ''
-
-                        typestr = type(streamdata).__name__ + '_type'
-                        #print('Index', typestr, index, streamdata)
-                        try:
-                            strformat = config['datastreams'][index]['strformat'][typestr]
-                        except:
-                            #logger.debug('Could not get strformat for {}'.format(index), exc_info=False)
-                            strformat = '{}'
-
-                        if ":s" in strformat:  # Convert to str if str format is choosen, this is useful for datatypes different of str (i.e. bytes)
-                            streamdata = str(streamdata)
-
-                        # Here errors in conversion could be treated more carefully
-                        dtxt = strformat.format(streamdata)
-                        # Check if the separator or a newline is within the data string
-                        if (config['separator'] in dtxt) or ('\n' in dtxt):
-                            dtxt = '"' + dtxt + '"'
-                        datastr_all += dtxt + config['separator']
-
-                    datastr_all = datastr_all[:-len(config['separator'])]
-                    datastr_all += '\n'
-
-                    f.write(datastr_all)
-                    bytes_written += len(datastr_all)
-                    packets_written += 1
-                    bytes_written_total += len(datastr_all)
-                    packets_written_total += 1
-                    #print('Written', datastr_all)
-
+                datastr_all = formatter.format_rows(data_write_to_file, numline)
+                f.write(datastr_all)
+                numline += len(data_write_to_file)
+                bytes_written += len(datastr_all)
+                packets_written += len(data_write_to_file)
+                bytes_written_total += len(datastr_all)
+                packets_written_total += len(data_write_to_file)
                 data_write_to_file = []
 
         if True: # Check if a new file should be created, close the old one and write the header
@@ -9,6 +9,8 @@ import logging
 import numpy
 from PyQt6 import QtWidgets, QtCore, QtGui
 import time
+import queue
+import threading
 import logging
 import sys
 import yaml
@@ -35,6 +37,11 @@ class DeviceBaseConfig(pydantic.BaseModel):
     description: str = "Saves subscribed devices in a netCDF4 file"
     gui_tablabel_display: str = 'netCDF logging status'
 
+class VariableConfig(pydantic.BaseModel):
+    zlib: typing.Optional[bool] = pydantic.Field(default=None, description='Flag if zlib compression shall be used, None for the device setting')
+    complevel: typing.Optional[int] = pydantic.Field(default=None, ge=1, le=9, description='zlib compression level, None for the device setting')
+    chunksize: typing.Optional[int] = pydantic.Field(default=None, description='Chunksize of the time dimension, None for the device setting')
+
 class DeviceCustomConfig(pydantic.BaseModel):
     dt_sync: int = pydantic.Field(default=5,description='Time after which an open file is synced on disk')
     dt_newfile: int = pydantic.Field(default=3600,description='Time after which a new file is created')
@@ -42,6 +49,11 @@ class DeviceCustomConfig(pydantic.BaseModel):
     dt_update:int = pydantic.Field(default=2,description='Time after which an upate is sent to the gui')
     clearqueue: bool = pydantic.Field(default=True, description='Flag if the buffer of the subscribed queue should be emptied before start')
     zlib: bool = pydantic.Field(default=True, description='Flag if zlib compression shall be used for the netCDF data')
+    complevel: int = pydantic.Field(default=4, ge=1, le=9, description='zlib compression level')
+    chunksize: int = pydantic.Field(default=0, description='Chunksize of the time dimension, 0 for the netCDF default')
+    variables: typing.Dict[str, VariableConfig] = pydantic.Field(default={}, description='zlib, complevel and chunksize of single variables, the key is the datakey')
+    nbuffer: int = pydantic.Field(default=100, description='Number of packets of a device that are buffered and written as one block')
+    write_queue_size: int = pydantic.Field(default=100, description='Maximum number of blocks waiting to be written')
     size_newfile:int = pydantic.Field(default=500,description='Size of object in RAM after which a new file is created')
     size_newfile_unit: typing.Literal['none','bytes','kB','MB'] = pydantic.Field(default='MB')
     datafolder:str = pydantic.Field(default='.',description='Folder the data is saved to')
@@ -121,6 +133,387 @@ def create_logfile(config,count=0):
     print("Done ...")
     return [nc,filename]
 
+def get_file_limits(config):
+    """
+    Returns the time [s] and size [bytes] after which a new file is created, 0 if not used.
+    """
+    funcname = __name__ + '.get_file_limits()'
+    try:
+        dtneworig = config['dt_newfile']
+        dtunit = config['dt_newfile_unit']
+        if(dtunit.lower() == 'seconds'):
+            dtfac = 1.0
+        elif(dtunit.lower() == 'hours'):
+            dtfac = 3600.0
+        elif(dtunit.lower() == 'days'):
+            dtfac = 86400.0
+        else:
+            dtfac = 0
+
+        dtnews = dtneworig * dtfac
+        logger.info(funcname + ' Will create new file every {:d} {:s}.'.format(config['dt_newfile'],config['dt_newfile_unit']))
+    except:
+        logger.debug("Configuration incomplete",exc_info=True)
+        dtnews = 0
+
+    try:
+        sizeneworig = config['size_newfile']
+        sizeunit = config['size_newfile_unit']
+        if(sizeunit.lower() == 'kb'):
+            sizefac = 1000.0
+        elif(sizeunit.lower() == 'mb'):
+            sizefac = 1e6
+        elif(sizeunit.lower() == 'bytes'):
+            sizefac = 1
+        else:
+            sizefac = 0
+
+        sizenewb = sizeneworig * sizefac # Size in bytes
+        logger.info(funcname + ' Will create new file every {:d} {:s}.'.format(config['size_newfile'],config['size_newfile_unit']))
+    except:
+        logger.debug("Configuration incomplete", exc_info=True)
+        sizenewb = 0  # Size in bytes
+
+    return dtnews, sizenewb
+
+
+class RecordBuffer():
+    """
+    Column buffer of the packets of one device group. Every datakey has a list with one entry per record, records
+    without the datakey have None.
+    """
+    def __init__(self, address):
+        self.address = address  # The packet address, used for the metadata
+        self.t = []
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.t)
+
+    def append(self, data, datakeys):
+        n = len(self.t)
+        self.t.append(data['t'])
+        columns = self.columns
+        for k in datakeys:
+            try:
+                column = columns[k]
+            except KeyError:
+                column = [None] * n
+                columns[k] = column
+            column.append(data[k])
+        # Fill the columns missing in this record
+        if len(datakeys) < len(columns):
+            for column in columns.values():
+                if len(column) == n:
+                    column.append(None)
+
+    def take(self):
+        """
+        Returns the buffered block (t, columns) and clears the buffer.
+        """
+        block = (self.t, self.columns)
+        self.t = []
+        self.columns = {}
+        return block
+
+
+class NetcdfFileWriter():
+    """
+    Writes the blocks of the RecordBuffers into the netCDF file. The writer runs in its own thread and owns the
+    netCDF file, such that the HDF5 writes and the compression do not block the thread receiving the packets.
+    The writer also syncs the file, creates new files and sends the status of the file to the dataqueue.
+    """
+    def __init__(self, config, device_info, dataqueue, count=0):
+        self.config = config
+        self.device_info = device_info
+        self.dataqueue = dataqueue
+        self.count = count
+        self.queue = queue.Queue(maxsize=config['write_queue_size'])
+        self.dtnews, self.sizenewb = get_file_limits(config)
+        self.flag_zlib = config['zlib']
+        self.variables_config = config.get('variables', {})
+        self.deviceinfo_all = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def get_variable_config(self, datakey):
+        """
+        Returns the zlib flag, the compression level and the time chunksize of a variable.
+        """
+        varconfig = self.variables_config.get(datakey, {})
+        zlib = varconfig.get('zlib')
+        if zlib is None:
+            zlib = self.flag_zlib
+        complevel = varconfig.get('complevel')
+        if complevel is None:
+            complevel = self.config['complevel']
+        chunksize = varconfig.get('chunksize')
+        if chunksize is None:
+            chunksize = self.config['chunksize']
+        return zlib, complevel, chunksize
+
+    def open_file(self):
+        [self.nc, self.filename] = create_logfile(self.config, self.count)
+        self.count += 1
+        self.nc.redvypr_version = 'redvypr {}'.format(redvypr.version)
+        self.groups = {}  # Cache of the device groups: key -> {'group', 'n', 'variables'}
+        self.vars_updated = set()  # Groups and variables with metadata
+        self.file_status = {}
+        self.bytes_written = 0
+        self.packets_written = 0
+        self.tfile = time.time()
+        self.t_created = time.time()
+        self.dataqueue.put(self.get_status())
+
+    def close_file(self):
+        status = self.get_status()
+        status['_deviceinfo']['closed'] = time.time()
+        self.set_file_attributes(status)
+        self.nc.close()
+        self.dataqueue.put(status)
+
+    def get_status(self):
+        data_stat = {'_deviceinfo': {}}
+        data_stat['_deviceinfo']['filename'] = self.filename
+        data_stat['_deviceinfo']['filename_full'] = os.path.realpath(self.filename)
+        data_stat['_deviceinfo']['created'] = self.t_created
+        data_stat['_deviceinfo']['bytes_written'] = self.bytes_written
+        data_stat['_deviceinfo']['packets_written'] = self.packets_written
+        data_stat['_deviceinfo']['write_queue'] = self.queue.qsize()
+        return data_stat
+
+    def set_file_attributes(self, data_stat):
+        self.nc.filename = data_stat['_deviceinfo']['filename']
+        self.nc.filename_full = data_stat['_deviceinfo']['filename_full']
+        self.nc.closed = data_stat['_deviceinfo'].get('closed', -1)
+        self.nc.bytes_written = data_stat['_deviceinfo']['bytes_written']
+        self.nc.packets_written = data_stat['_deviceinfo']['packets_written']
+
+    def send_status(self):
+        data_stat = self.get_status()
+        data_stat['_deviceinfo']['file_status'] = self.file_status
+        data_stat['_deviceinfo']['closed'] = -1
+        data_stat['_deviceinfo']['file_status_reduced'] = self.file_status
+        self.set_file_attributes(data_stat)
+        data_stat['_deviceinfo']['nc_structure'] = get_nc_structure(self.nc)
+        self.dataqueue.put(data_stat)
+
+    def sync(self):
+        self.nc.sync()
+        self.bytes_written = os.path.getsize(self.filename)
+        logger.info(f"Syncing netCDF file {self.filename} ({self.bytes_written}bytes)")
+
+    def run(self):
+        funcname = __name__ + '.run()'
+        self.open_file()
+        tupdate = time.time()
+        while True:
+            try:
+                item = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                item = False
+
+            try:
+                if item is None:
+                    break
+                elif item:
+                    if item[0] == 'block':
+                        self.write_block(*item[1:])
+                    elif item[0] == 'sync':
+                        self.sync()
+                    elif item[0] == 'metadata':
+                        self.deviceinfo_all = item[1]
+                        self.vars_updated = set()
+
+                if (time.time() - tupdate) > self.config['dt_update']:
+                    tupdate = time.time()
+                    self.send_status()
+
+                # Check if a new file should be created
+                file_age = time.time() - self.tfile
+                FLAG_TIME = (self.dtnews > 0) and (file_age >= self.dtnews)
+                FLAG_SIZE = (self.sizenewb > 0) and (self.bytes_written >= self.sizenewb)
+                if FLAG_TIME or FLAG_SIZE:
+                    self.close_file()
+                    self.open_file()
+            except Exception as e:
+                logger.exception(e)
+                logger.debug(funcname + ':Exception:' + str(e))
+
+        self.close_file()
+
+    def get_group(self, key, address):
+        """
+        Returns the cached device group nc[hostname][publisher][devicename], it is created if needed.
+        """
+        try:
+            return self.groups[key]
+        except KeyError:
+            pass
+
+        nc_group = self.nc
+        for name in key:
+            try:
+                nc_group = nc_group.groups[name]
+            except KeyError:
+                logger.debug('Creating group {}'.format(name))
+                nc_group = nc_group.createGroup(name)
+
+        if 'time' not in nc_group.variables:
+            nc_group.redvypr_address = address.to_address_string()
+            logger.debug('Creating time dimension')
+            nc_group.createDimension('time', None)
+            nc_group.createVariable('time', float, ('time'))
+
+        group = {'group': nc_group, 'n': len(nc_group.variables['time']), 'variables': dict(nc_group.variables),
+                 'address': address}
+        self.groups[key] = group
+        return group
+
+    def create_variable(self, nc_device, k, value, address):
+        """
+        Creates the variable for datakey k, the type is given by value. Returns None for types that are not saved.
+        """
+        typedata = type(value)
+        zlib, complevel, chunksize = self.get_variable_config(k)
+        if (typedata is list) or (typedata is numpy.ndarray):
+            try:
+                logger.info('Creating variable for list/ndarray type {}'.format(typedata))
+                dwrite = numpy.asarray(value)
+                datatype_array = dwrite.dtype
+                dimnames = ['time']
+                for id,nd in enumerate(numpy.shape(dwrite)):
+                    dimname = k + '_n_{}'.format(id)
+                    dimnames.append(dimname)
+                    nc_device.createDimension(dimname, None)
+
+                chunksizes = None
+                if chunksize > 0:
+                    chunksizes = [chunksize] + [max(nd, 1) for nd in numpy.shape(dwrite)]
+                logger.debug('Creating variable {}. Dimnames {}. Datatype {}.'.format(k,dimnames,datatype_array))
+                var = nc_device.createVariable(k, datatype_array, dimnames, zlib=zlib, complevel=complevel,
+                                               chunksizes=chunksizes)
+            except:
+                logger.warning('Could not create variable for {}'.format(k),exc_info=True)
+                return None
+        elif (typedata is str):
+            logger.info('Creating string variable')
+            # For some reason zlib does not work with str
+            var = nc_device.createVariable(k, str, ('time'), zlib=False)
+        elif (typedata is bytes) or (typedata is dict): # Ignore bytes and dicts
+            return None
+        else:
+            try:
+                logger.info('Creating variable with type {}'.format(typedata))
+                chunksizes = [chunksize] if chunksize > 0 else None
+                var = nc_device.createVariable(k, typedata, ('time'), zlib=zlib, complevel=complevel,
+                                               chunksizes=chunksizes)
+            except:
+                return None
+
+        setattr(var, 'redvypr_address', address.to_address_string())
+        return var
+
+    def write_block(self, key, address, t, columns):
+        """
+        Writes a block of records into the device group with slice assignments.
+        """
+        group = self.get_group(key, address)
+        nc_device = group['group']
+        variables = group['variables']
+        n0 = group['n']
+        n = len(t)
+        nc_device.variables['time'][n0:n0 + n] = numpy.asarray(t, dtype=float)
+        group['n'] = n0 + n
+        self.packets_written += n
+        for k, column in columns.items():
+            try:
+                var = variables[k]
+            except KeyError:
+                value = next((v for v in column if v is not None), None)
+                if value is None:
+                    continue  # Type not known yet
+                var = self.create_variable(nc_device, k, value, address)
+                variables[k] = var
+
+            if var is None:
+                continue
+
+            try:
+                nvalid = self.write_column(var, n0, column)
+                try:
+                    self.file_status[k] += nvalid
+                except KeyError:
+                    self.file_status[k] = nvalid
+            except:
+                logger.warning('Could not write data',exc_info=True)
+
+        # Write metadata of the group and the variables
+        if self.deviceinfo_all is not None:
+            for k, var in [(None, nc_device)] + list(variables.items()):
+                if var is None or (key, k) in self.vars_updated or k == 'time':
+                    continue
+                try:
+                    if k is None:
+                        raddress_tmp = redvypr_address.RedvyprAddress(address)
+                    else:
+                        raddress_tmp = redvypr_address.RedvyprAddress(address, datakey=k)
+                    metadata_tmp = packet_statistics.get_metadata(self.deviceinfo_all, raddress_tmp, mode="merge")
+                    for metakey in metadata_tmp.keys():
+                        logger.debug(f"Setting attribute {metakey} to {metadata_tmp[metakey]}")
+                        setattr(var, metakey, metadata_tmp[metakey])
+                except:
+                    logger.info('Could not set metadata', exc_info=True)
+                self.vars_updated.add((key, k))
+
+    def write_column(self, var, n0, column):
+        """
+        Writes the values of a column starting at record n0, None values are left empty (fill value).
+        Returns the number of written values.
+        """
+        n = len(column)
+        valid = [v is not None for v in column]
+        nvalid = sum(valid)
+        if var.ndim == 1:
+            if var.dtype is str:
+                data = numpy.array(['' if v is None else v for v in column], dtype=object)
+                var[n0:n0 + n] = data
+            elif nvalid == n:
+                var[n0:n0 + n] = numpy.asarray(column, dtype=var.dtype)
+            else:
+                data = numpy.ma.masked_all(n, dtype=var.dtype)
+                data[valid] = [v for v in column if v is not None]
+                var[n0:n0 + n] = data
+            return nvalid
+
+        # Arrays, written as one block if all records have the same shape
+        if nvalid == n:
+            try:
+                data = numpy.asarray(column, dtype=var.dtype)
+            except ValueError:  # Different shapes
+                data = None
+            if data is not None and data.ndim == var.ndim:
+                index = (slice(n0, n0 + n),) + tuple(slice(0, nd) for nd in data.shape[1:])
+                var[index] = data
+                return nvalid
+
+        for i, v in enumerate(column):
+            if v is not None:
+                v = numpy.asarray(v)
+                index = (n0 + i,) + tuple(slice(0, nd) for nd in v.shape)
+                var[index] = v
+        return nvalid
+
+
 def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=None):
     logger_start = logging.getLogger('netcdfwriter/thread')
     logger_start.setLevel(logging.DEBUG)
@@ -133,318 +526,97 @@ def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=Non
             except:
                 break
 
-    count = 0
-    if True:
-        try:
-            dtneworig = config['dt_newfile']
-            dtunit = config['dt_newfile_unit']
-            if(dtunit.lower() == 'seconds'):
-                dtfac = 1.0
-            elif(dtunit.lower() == 'hours'):
-                dtfac = 3600.0
-            elif(dtunit.lower() == 'days'):
-                dtfac = 86400.0
-            else:
-                dtfac = 0
-                
-            dtnews = dtneworig * dtfac
-            logger_start.info(funcname + ' Will create new file every {:d} {:s}.'.format(config['dt_newfile'],config['dt_newfile_unit']))
-        except:
-            logger.debug("Configuration incomplete",exc_info=True)
-            dtnews = 0
-            
-        try:
-            sizeneworig = config['size_newfile']
-            sizeunit = config['size_newfile_unit']
-            if(sizeunit.lower() == 'kb'):
-                sizefac = 1000.0
-            elif(sizeunit.lower() == 'mb'):            
-                sizefac = 1e6
-            elif(sizeunit.lower() == 'bytes'):            
-                sizefac = 1 
-            else:
-                sizefac = 0
-                
-            sizenewb = sizeneworig * sizefac # Size in bytes
-            logger_start.info(funcname + ' Will create new file every {:d} {:s}.'.format(config['size_newfile'],config['size_newfile_unit']))
-        except:
-            logger.debug("Configuration incomplete", exc_info=True)
-            sizenewb = 0  # Size in bytes
-            
     try:
         config['dt_sync']
     except:
         config['dt_sync'] = 5
 
-    flag_zlib = config['zlib']
-    bytes_written = 0
-    packets_written = 0
-    bytes_written_total = 0
-    packets_written_total = 0
-    [nc,filename] = create_logfile(config,count)
     logger_start.debug('Adding main group {}'.format(device_info))
-    hostname = device_info['hostinfo']['host']
-    redvypr_version_str = 'redvypr {}'.format(redvypr.version)
-    nc.redvypr_version = redvypr_version_str
-    data_stat = {'_deviceinfo': {}}
-    data_stat['_deviceinfo']['filename'] = filename
-    data_stat['_deviceinfo']['filename_full'] = os.path.realpath(filename)
-    data_stat['_deviceinfo']['created'] = time.time()
-    data_stat['_deviceinfo']['bytes_written'] = bytes_written
-    data_stat['_deviceinfo']['packets_written'] = packets_written
-    dataqueue.put(data_stat)
-    count += 1
-
-    tfile = time.time() # Save the time the file was created
-    tflush = time.time() # Save the time the file was flushed to disk
-    tupdate = time.time() # Save the time for the update timing
-    FLAG_RUN = True
-    file_status = {}
-    file_status_reduced = file_status
-    deviceinfo_all = None
-    while FLAG_RUN:
-        tcheck = time.time()
-        time.sleep(0.05)
-        while(datainqueue.empty() == False):
-            # Flush file on regular basis
-            if ((time.time() - tflush) > config['dt_sync']):
-                nc.sync()
-                bytes_written = os.path.getsize(filename)
-                logger_start.info(
-                    f"{funcname}:Syncing netCDF file {filename} ({bytes_written}bytes)")
-                tflush = time.time()
+    hostname_local = device_info['hostinfo']['host']
+    uuid_local = device_info['hostinfo']['uuid']
+    nbuffer = max(1, config['nbuffer'])
+    address_metadata = redvypr_address.RedvyprAddress(redvypr.redvypr_address.metadata_address)
+    ignore_keys = set(data_packets.redvypr_data_keys)
+    ignore_keys.add('t')
+    writer = NetcdfFileWriter(config, device_info, dataqueue)
+    writer.start()
+    buffers = {}  # The RecordBuffers of the device groups
+    deviceinfo_mirror = packet_statistics.DeviceinfoMirror()  # Local copy of deviceinfo_all, updated with patches
+    tflush = time.time() # Save the time the buffers were flushed to the file
+
+    def flush(key, buffer):
+        t, columns = buffer.take()
+        writer.put(('block', key, buffer.address, t, columns))
+
+    while True:
+        try:
+            data = datainqueue.get(timeout=0.5)
+        except queue.Empty:
+            data = None
 
-            try:
-                data = datainqueue.get(block=False)
-                packet_address = redvypr.RedvyprAddress(data)
-                if (data is not None):
-                    [command,comdata] = data_packets.check_for_command(data, thread_uuid=device_info['thread_uuid'], add_data=True)
-                    #logger.debug('Got a command: {:s}'.format(str(data)))
-                    if (command is not None):
-                        if(command == 'stop'):
-                            logger_start.debug('Stop command')
-                            FLAG_RUN = False
-                            break
-
-                        if (command == 'info'):
-                            logger_start.debug('Metadata command')
-                            if packet_address.packetid == 'metadata':
-                                deviceinfo_all = data['deviceinfo_all']
-                                metadata_update = True
-                                vars_updated = []
-
-                    # Ignore some packages
-                    if redvypr_address.RedvyprAddress(redvypr.redvypr_address.metadata_address)(data,strict=False):
-                        logger_start.debug('Ignoring metadata packet')
-                        continue
-
-                # Check if host uuid is the same as local uuid
-                if packet_address.uuid == device_info['hostinfo']['uuid']:
-                    pass
-                else:
-                    hostname = packet_address.host + '__UUID__' + packet_address.uuid
-                address_format = 'h,p,d'
-                packet_address_str = packet_address.to_address_string(address_format)
-                publisher = packet_address.publisher
-                devicename = packet_address.device
+        try:
+            if (data is not None):
+                [command,comdata] = data_packets.check_for_command(data, thread_uuid=device_info['thread_uuid'], add_data=True)
+                if (command is not None):
+                    if(command == 'stop'):
+                        logger_start.debug('Stop command')
+                        break
+
+                    if (command == 'info'):
+                        logger_start.debug('Metadata command')
+                        if deviceinfo_mirror.update(data) is not None:
+                            writer.put(('metadata', copy.deepcopy(deviceinfo_mirror.deviceinfo_all)))
+                        elif deviceinfo_mirror.resync_needed:
+                            dataqueue.put(deviceinfo_mirror.resync_packet())
+
+                # Ignore some packages
+                if address_metadata(data,strict=False):
+                    logger_start.debug('Ignoring metadata packet')
+                    data = None
+
+            if data is not None and command is None:
+                paddress = redvypr_address.packet_address(data)
                 # This is the group structure
                 # Data is written to the group found in
                 # ncgroup = groups[hostname][publisher][devicename]
+                if paddress.uuid == uuid_local:
+                    hostname = hostname_local
+                else:
+                    hostname = paddress.host + '__UUID__' + paddress.uuid
+                key = (hostname, paddress.publisher, paddress.device)
                 try:
-                    nc[hostname]
-                except:
-                    logger_start.debug('Creating base group {}'.format(hostname))
-                    nchost = nc.createGroup(hostname)
+                    buffer = buffers[key]
+                except KeyError:
+                    buffer = RecordBuffer(paddress)
+                    buffers[key] = buffer
 
                 try:
-                    nc[hostname][publisher]
+                    data['t']
                 except:
-                    logger_start.debug('Creating publishing device {}'.format(publisher))
-                    ncgroup_pub = nc[hostname].createGroup(publisher)
+                    data['t'] = data['_redvypr']['t']
 
-                # The device
-                try:
-                    nc_device = nc[hostname][publisher][devicename]
-                except:
-                    logger_start.debug('Creating device {}'.format(devicename))
-                    nc_device = nc[hostname][publisher].createGroup(devicename)
-                    nc_device.redvypr_address = redvypr_address.RedvyprAddress(data).to_address_string()
-                    # Add time variable
-                    logger.debug('Creating time dimension')
-                    nc_device.createDimension('time',None)
-                    nc_device.createVariable('time', float,('time'))
-
-                # Write metadata of roogroup and devices
-                if deviceinfo_all is not None and not(nc in vars_updated):
-                    # Write metadata
-                    try:
-                        if deviceinfo_all is not None and not (var in vars_updated):
-                            raddress_tmp = redvypr_address.RedvyprAddress(data)
-                            #raddress_tmp_str = raddress_tmp.get_str('/h/d/i')
-                            metadata_tmp = packet_statistics.get_metadata(deviceinfo_all, raddress_tmp, mode="merge")
-                            #print('Metadata tmp', raddress_tmp, metadata_tmp)
-                            # device_worksheets[packet_address_str].write(lineindex, colindex, datawrite)
-                            if len(metadata_tmp.keys()) > 0:  # Check if something was found
-                                for metakey in metadata_tmp.keys():
-                                    setattr(nc_device, metakey, metadata_tmp[metakey])
-
-                            vars_updated.append(var)
-                    except:
-                        logger_start.debug('Could not set metadata', exc_info=True)
-
-                # Write data
-                if True:
-                    #print(funcname + ' got data',data)
-                    try:
-                        data['t']
-                    except:
-                        data['t'] = data['_redvypr']['t']
-
-                    lent = len(nc_device.variables['time'])
-                    nc_device.variables['time'][lent] = data['t']
-                    datakeys = data_packets.Datapacket(data).datakeys()
-                    datakeys.remove('t')
-                    #datakeys.insert(0,'t')
-                    # Write data in datakeys or create variable
-                    # Write time
-                    packets_written += 1
-                    for k in datakeys:
-                        #print('-----')
-                        #print('Datakeys', datakeys)
-                        #print('Datakey',k)
-                        try:
-                            var = nc_device.variables[k]
-                        except: # Create variable
-                            typedata = type(data[k])
-                            #print('typedata',typedata)
-                            if (typedata is list) or (typedata is numpy.ndarray):
-                                try:
-                                    logger_start.info('Creating variable for list/ndarray type {}'.format(typedata))
-                                    dwrite = numpy.asarray(data[k])
-                                    datatype_array = dwrite.dtype
-                                    dwrite_shape = numpy.shape(dwrite)
-                                    dimnames = ['time']
-                                    for id,nd in enumerate(numpy.shape(dwrite)):
-                                        dimname = k + '_n_{}'.format(id)
-                                        dimnames.append(dimname)
-                                        nc_device.createDimension(dimname, None)
-
-                                    logger_start.debug('Creating variable {}. Dimnames {}. Datatype {}.'.format(k,dimnames,datatype_array))
-                                    var = nc_device.createVariable(k, datatype_array, dimnames, zlib=flag_zlib)
-                                    setattr(var, 'redvypr_address', packet_address.to_address_string())
-                                except:
-                                    logger_start.warning('Could not create variable for {}'.format(k),exc_info=True)
-                            elif (typedata is str):
-                                logger_start.info('Creating string variable')
-                                # For some reason zlib does not work with str
-                                var = nc_device.createVariable(k, str, ('time'), zlib=False)
-                                setattr(var, 'redvypr_address', packet_address.to_address_string())
-                            elif (typedata is bytes): # Ignore bytes
-                                var = None
-                            elif (typedata is dict): # Ignore dict
-                                var = None
-                            elif (typedata is None or typedata is type(None)): # Ignore None
-                                var = None
-                            else:
-                                try:
-                                    logger_start.info('Creating variable with type {}'.format(typedata))
-                                    var = nc_device.createVariable(k, typedata, ('time'), zlib=flag_zlib)
-                                    setattr(var, 'redvypr_address', packet_address.to_address_string())
-                                except:
-                                    var = None
-
-                        if var is not None:
-                            try:
-                                var[lent] = data[k]
-                                try:
-                                    file_status[k] += 1
-                                except:
-                                    file_status[k] = 1
-                            except:
-                                logger_start.warning('Could not write data',exc_info=True)
-                        else:
-                            pass
-
-
-                        # Write metadata
-                        try:
-                            if deviceinfo_all is not None and not(var in vars_updated):
-                                raddress_tmp = redvypr_address.RedvyprAddress(data, datakey=k)
-                                metadata_tmp = packet_statistics.get_metadata(deviceinfo_all, raddress_tmp, mode="merge")
-                                # print('Metadata tmp', raddress_tmp, metadata_tmp)
-                                # device_worksheets[packet_address_str].write(lineindex, colindex, datawrite)
-                                if len(metadata_tmp.keys()) > 0:  # Check if something was found
-                                    for metakey in metadata_tmp.keys():
-                                        logger_start.debug(f"Setting attribute {metakey} to {metadata_tmp[metakey]}")
-                                        setattr(var,metakey,metadata_tmp[metakey])
-
-                                vars_updated.append(var)
-                        except:
-                            logger_start.info('Could not set metadata',exc_info=True)
-
-
-                # Send statistics
-                if ((time.time() - tupdate) > config['dt_update']):
-                    tupdate = time.time()
-                    data_stat = {'_deviceinfo': {}}
-                    data_stat['_deviceinfo']['filename'] = filename
-                    data_stat['_deviceinfo']['filename_full'] = os.path.realpath(filename)
-                    data_stat['_deviceinfo']['bytes_written'] = bytes_written
-                    data_stat['_deviceinfo']['packets_written'] = packets_written
-                    data_stat['_deviceinfo']['file_status'] = file_status
-                    data_stat['_deviceinfo']['closed'] = -1
-                    data_stat['_deviceinfo']['file_status_reduced'] = file_status_reduced
-                    nc.filename = data_stat['_deviceinfo']['filename']
-                    nc.filename_full = data_stat['_deviceinfo']['filename_full']
-                    nc.closed = data_stat['_deviceinfo']['closed']
-                    nc.bytes_written = data_stat['_deviceinfo']['bytes_written']
-                    nc.packets_written = data_stat['_deviceinfo']['packets_written']
-                    nc_structure = get_nc_structure(nc)
-                    #print("nc structure",nc_structure)
-                    data_stat['_deviceinfo']['nc_structure'] = nc_structure
-                    dataqueue.put(data_stat)
+                datakeys = [k for k in data.keys() if k not in ignore_keys]
+                buffer.append(data, datakeys)
+                if len(buffer) >= nbuffer:
+                    flush(key, buffer)
 
-            except Exception as e:
-                logger.exception(e)
-                logger.debug(funcname + ':Exception:' + str(e))
+            # Write the buffers and sync the file on regular basis
+            if ((time.time() - tflush) > config['dt_sync']):
+                tflush = time.time()
+                for key, buffer in buffers.items():
+                    if len(buffer) > 0:
+                        flush(key, buffer)
+                writer.put(('sync',))
+
+        except Exception as e:
+            logger.exception(e)
+            logger.debug(funcname + ':Exception:' + str(e))
+
+    for key, buffer in buffers.items():
+        if len(buffer) > 0:
+            flush(key, buffer)
+    writer.stop()
 
-        if True: # Check if a new file should be created, close the old one and write the header
-            file_age = tcheck - tfile
-            FLAG_TIME = (dtnews > 0) and (file_age >= dtnews)
-            FLAG_SIZE = (sizenewb > 0) and (bytes_written >= sizenewb)
-            if FLAG_TIME or FLAG_SIZE or (FLAG_RUN == False):
-                # Update file information
-                data_stat = {'_deviceinfo': {}}
-                data_stat['_deviceinfo']['filename'] = filename
-                data_stat['_deviceinfo']['filename_full'] = os.path.realpath(filename)
-                data_stat['_deviceinfo']['closed'] = time.time()
-                data_stat['_deviceinfo']['bytes_written'] = bytes_written
-                data_stat['_deviceinfo']['packets_written'] = packets_written
-                nc.filename = data_stat['_deviceinfo']['filename']
-                nc.filename_full = data_stat['_deviceinfo']['filename_full']
-                nc.closed = data_stat['_deviceinfo']['closed']
-                nc.bytes_written = data_stat['_deviceinfo']['bytes_written']
-                nc.packets_written = data_stat['_deviceinfo']['packets_written']
-                # Autofit
-                nc.close()
-                count += 1
-
-                dataqueue.put(data_stat)
-                if FLAG_RUN:
-                    tfile = tcheck
-                    bytes_written = 0
-                    packets_written = 0
-                    bytes_written_total = 0
-                    packets_written_total = 0
-                    [nc, filename] = create_logfile(config, count)
-                    redvypr_version_str = 'redvypr {}'.format(redvypr.version)
-                    data_stat = {'_deviceinfo': {}}
-                    data_stat['_deviceinfo']['filename'] = filename
-                    data_stat['_deviceinfo']['filename_full'] = os.path.realpath(filename)
-                    data_stat['_deviceinfo']['created'] = time.time()
-                    data_stat['_deviceinfo']['bytes_written'] = bytes_written
-                    data_stat['_deviceinfo']['packets_written'] = packets_written
-                    dataqueue.put(data_stat)
 
 class Device(RedvyprDevice):
     """
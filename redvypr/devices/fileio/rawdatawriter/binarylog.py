@@ -0,0 +1,369 @@
+"""
+Binary log format for raw redvypr packets.
+
+The packets are encoded with redvypr.packet_codec (MessagePack) and stored as length prefixed records. The records are
+collected in chunks, each chunk is compressed on its own and has an uncompressed index with the time, the address and
+the position of its records. When the file is closed, a footer with the index of all records is appended, such that a
+reader can find the packets of a time range or an address without decoding (or even decompressing) the other
+packets. If the footer is missing (i.e. the writer did not close the file), the index is rebuilt from the chunk
+headers.
+
+File layout::
+
+    file header  : b'RVBLOG01' | uint32 length | header (MessagePack)
+    chunk        : chunk header | chunk index (MessagePack) | compressed records
+    ...
+    footer       : b'RVIX' | uint32 length | index (MessagePack)
+    trailer      : uint64 position of the footer | b'RVBLEND1'
+
+A record is a uint32 length followed by the MessagePack encoded packet.
+"""
+
+import os
+import sys
+import zlib
+import time
+import struct
+import logging
+import numpy as np
+from redvypr import packet_codec
+from redvypr.redvypr_address import RedvyprAddress, packet_address
+
+logging.basicConfig(stream=sys.stderr)
+logger = logging.getLogger('redvypr.device.rawdatawriter.binarylog')
+logger.setLevel(logging.INFO)
+
+file_magic = b'RVBLOG01'
+file_header = struct.Struct('<8sI')
+chunk_magic = b'RVCK'
+chunk_header = struct.Struct('<4sIIIIB')  # magic, index length, data length, raw length, number of records, compression
+footer_magic = b'RVIX'
+footer_header = struct.Struct('<4sI')
+trailer = struct.Struct('<Q8s')
+trailer_magic = b'RVBLEND1'
+record_header = struct.Struct('<I')
+
+compressions = {'none': 0, 'zlib': 1}
+
+
+def is_binary_log(filename):
+    """
+    Returns True if the file is a binary redvypr log.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(file_magic)) == file_magic
+    except OSError:
+        return False
+
+
+class BinaryLogWriter():
+    """
+    Writes packets into a binary log file. The records are buffered until the chunk has chunksize bytes (or flush()
+    is called) and are then written as one compressed chunk.
+    """
+    def __init__(self, f, chunksize=1000000, compression='zlib', compresslevel=1):
+        """
+        Parameters
+        ----------
+        f: file
+            A file opened in binary write mode
+        chunksize: int
+            The size of the uncompressed records after which a chunk is written [bytes]
+        compression: str
+            'zlib' or 'none'
+        """
+        self.f = f
+        self.chunksize = chunksize
+        self.compression = compression
+        self.compresslevel = compresslevel
+        self.records = []
+        self.nbytes_chunk = 0
+        # The index of the current chunk
+        self.chunk_addresses = {}
+        self.chunk_t = []
+        self.chunk_address = []
+        self.chunk_offset = []
+        self.chunk_numpacket = []
+        # The index of the file
+        self.addresses = {}
+        self.index_chunks = []
+        self.index_t = []
+        self.index_address = []
+        self.index_chunk = []
+        self.index_offset = []
+        self.index_numpacket = []
+        header = packet_codec.encode({'version': 1, 'created': time.time(), 'compression': compression})
+        self.f.write(file_header.pack(file_magic, len(header)))
+        self.f.write(header)
+
+    def write(self, packet):
+        """
+        Adds a packet to the log.
+
+        Returns
+        -------
+        int
+            The size of the encoded record [bytes]
+        """
+        datab = packet_codec.encode(packet)
+        address = packet_address(packet).to_address_string()
+        redvypr = packet.get('_redvypr', {})
+        try:
+            address_id = self.chunk_addresses[address]
+        except KeyError:
+            address_id = len(self.chunk_addresses)
+            self.chunk_addresses[address] = address_id
+
+        numpacket = redvypr.get('numpacket')
+        self.chunk_t.append(redvypr.get('t', packet.get('t', np.nan)))
+        self.chunk_address.append(address_id)
+        self.chunk_offset.append(self.nbytes_chunk)
+        self.chunk_numpacket.append(numpacket if type(numpacket) is int else -1)
+        self.records.append(record_header.pack(len(datab)))
+        self.records.append(datab)
+        nrecord = record_header.size + len(datab)
+        self.nbytes_chunk += nrecord
+        if self.nbytes_chunk >= self.chunksize:
+            self.write_chunk()
+
+        return nrecord
+
+    def write_chunk(self):
+        """
+        Writes the buffered records as a chunk.
+        """
+        nrecords = len(self.chunk_t)
+        if nrecords == 0:
+            return
+
+        raw = b''.join(self.records)
+        if self.compression == 'zlib':
+            data = zlib.compress(raw, self.compresslevel)
+        else:
+            data = raw
+
+        chunk_addresses = list(self.chunk_addresses)
+        index = {'addresses': chunk_addresses,
+                 't': np.asarray(self.chunk_t, dtype=float),
+                 'address': np.asarray(self.chunk_address, dtype=np.uint32),
+                 'offset': np.asarray(self.chunk_offset, dtype=np.uint32),
+                 'numpacket': np.asarray(self.chunk_numpacket, dtype=np.int64)}
+        indexb = packet_codec.encode(index)
+        position = self.f.tell()
+        self.f.write(chunk_header.pack(chunk_magic, len(indexb), len(data), len(raw), nrecords,
+                                       compressions[self.compression]))
+        self.f.write(indexb)
+        self.f.write(data)
+
+        # Update the file index
+        ichunk = len(self.index_chunks)
+        self.index_chunks.append(position)
+        address_ids = []
+        for address in chunk_addresses:
+            address_ids.append(self.addresses.setdefault(address, len(self.addresses)))
+        self.index_t.append(index['t'])
+        self.index_address.append(np.asarray(address_ids, dtype=np.uint32)[index['address']])
+        self.index_chunk.append(np.full(nrecords, ichunk, dtype=np.uint32))
+        self.index_offset.append(index['offset'])
+        self.index_numpacket.append(index['numpacket'])
+
+        self.records = []
+        self.nbytes_chunk = 0
+        self.chunk_addresses = {}
+        self.chunk_t = []
+        self.chunk_address = []
+        self.chunk_offset = []
+        self.chunk_numpacket = []
+
+    def flush(self):
+        """
+        Writes the buffered records and flushes the file.
+        """
+        self.write_chunk()
+        self.f.flush()
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        """
+        Writes the remaining records and the footer and closes the file.
+        """
+        self.write_chunk()
+        index = {'addresses': list(self.addresses), 'chunks': np.asarray(self.index_chunks, dtype=np.int64)}
+        for key, data, dtype in [('t', self.index_t, float), ('address', self.index_address, np.uint32),
+                                 ('chunk', self.index_chunk, np.uint32), ('offset', self.index_offset, np.uint32),
+                                 ('numpacket', self.index_numpacket, np.int64)]:
+            index[key] = np.concatenate(data) if len(data) > 0 else np.zeros(0, dtype=dtype)
+
+        indexb = packet_codec.encode(index)
+        position = self.f.tell()
+        self.f.write(footer_header.pack(footer_magic, len(indexb)))
+        self.f.write(indexb)
+        self.f.write(trailer.pack(position, trailer_magic))
+        self.f.close()
+
+
+class BinaryLogReader():
+    """
+    Reads a binary log file. The index of all records is available as numpy arrays (t, address, chunk, offset,
+    numpacket), the address strings are in addresses.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = open(filename, 'rb')
+        magic, n = file_header.unpack(self.f.read(file_header.size))
+        if magic != file_magic:
+            raise ValueError('{} is not a binary redvypr log file'.format(filename))
+        self.header = packet_codec.decode(self.f.read(n))
+        self.datastart = self.f.tell()
+        self._chunk_cache = (None, None)
+        if not self.read_footer():
+            logger.info('No footer found in {}, scanning the chunks'.format(filename))
+            self.scan_chunks()
+
+    def __len__(self):
+        return len(self.t)
+
+    def close(self):
+        self.f.close()
+
+    def read_footer(self):
+        """
+        Reads the index from the footer.
+
+        Returns
+        -------
+        bool
+            False if the file has no (valid) footer
+        """
+        try:
+            self.f.seek(-trailer.size, os.SEEK_END)
+            position, magic = trailer.unpack(self.f.read(trailer.size))
+            if magic != trailer_magic:
+                return False
+            self.f.seek(position)
+            magic, n = footer_header.unpack(self.f.read(footer_header.size))
+            if magic != footer_magic:
+                return False
+            index = packet_codec.decode(self.f.read(n))
+        except (OSError, struct.error, packet_codec.DecodeError):
+            return False
+
+        self.addresses = index['addresses']
+        self.chunks = index['chunks']
+        self.t = index['t']
+        self.address = index['address']
+        self.chunk = index['chunk']
+        self.offset = index['offset']
+        self.numpacket = index['numpacket']
+        return True
+
+    def scan_chunks(self):
+        """
+        Rebuilds the index from the chunk headers. A truncated last chunk is ignored.
+        """
+        addresses = {}
+        chunks = []
+        index = {'t': [], 'address': [], 'chunk': [], 'offset': [], 'numpacket': []}
+        position = self.datastart
+        self.f.seek(0, os.SEEK_END)
+        filesize = self.f.tell()
+        while position + chunk_header.size <= filesize:
+            self.f.seek(position)
+            magic, nindex, ndata, nraw, nrecords, compression = chunk_header.unpack(self.f.read(chunk_header.size))
+            if magic != chunk_magic or position + chunk_header.size + nindex + ndata > filesize:
+                break
+            try:
+                chunk_index = packet_codec.decode(self.f.read(nindex))
+            except packet_codec.DecodeError:
+                break
+            address_ids = np.asarray([addresses.setdefault(a, len(addresses)) for a in chunk_index['addresses']],
+                                     dtype=np.uint32)
+            index['t'].append(chunk_index['t'])
+            index['address'].append(address_ids[chunk_index['address']])
+            index['chunk'].append(np.full(nrecords, len(chunks), dtype=np.uint32))
+            index['offset'].append(chunk_index['offset'])
+            index['numpacket'].append(chunk_index['numpacket'])
+            chunks.append(position)
+            position += chunk_header.size + nindex + ndata
+
+        self.addresses = list(addresses)
+        self.chunks = np.asarray(chunks, dtype=np.int64)
+        for key, dtype in [('t', float), ('address', np.uint32), ('chunk', np.uint32), ('offset', np.uint32),
+                           ('numpacket', np.int64)]:
+            data = np.concatenate(index[key]) if len(index[key]) > 0 else np.zeros(0, dtype=dtype)
+            setattr(self, key, data)
+
+    def read_chunk(self, ichunk):
+        """
+        Returns the uncompressed records of a chunk, the last chunk is cached.
+        """
+        if self._chunk_cache[0] == ichunk:
+            return self._chunk_cache[1]
+
+        self.f.seek(self.chunks[ichunk])
+        magic, nindex, ndata, nraw, nrecords, compression = chunk_header.unpack(self.f.read(chunk_header.size))
+        self.f.seek(nindex, os.SEEK_CUR)
+        data = self.f.read(ndata)
+        if compression == compressions['zlib']:
+            data = zlib.decompress(data)
+        self._chunk_cache = (ichunk, data)
+        return data
+
+    def select(self, t_start=None, t_end=None, address=None):
+        """
+        Returns the indices of the records within a time range and matching an address, without decoding them.
+
+        Parameters
+        ----------
+        t_start: float
+        t_end: float
+        address: RedvyprAddress or str
+            The records with an address matched by address are returned
+        """
+        mask = np.ones(len(self.t), dtype=bool)
+        if t_start is not None:
+            mask &= self.t >= t_start
+        if t_end is not None:
+            mask &= self.t <= t_end
+        if address is not None:
+            if not isinstance(address, RedvyprAddress):
+                address = RedvyprAddress(address)
+            address_match = np.asarray([address.matches(RedvyprAddress(a)) for a in self.addresses], dtype=bool)
+            if len(address_match) > 0:
+                mask &= address_match[self.address]
+
+        return np.flatnonzero(mask)
+
+    def get_packet(self, index):
+        data = self.read_chunk(self.chunk[index])
+        offset = int(self.offset[index])
+        n = record_header.unpack_from(data, offset)[0]
+        offset += record_header.size
+        return packet_codec.decode(data[offset:offset + n])
+
+    def get_packets(self, indices):
+        return [self.get_packet(i) for i in indices]
+
+    def iter_packets(self, t_start=None, t_end=None, address=None):
+        """
+        Yields the packets in the order they were written, optionally only packets of a time range or address.
+        Chunks without a selected packet are not read.
+        """
+        for i in self.select(t_start=t_start, t_end=t_end, address=address):
+            yield self.get_packet(i)
+
+    def get_filestat(self):
+        """
+        Returns the file statistics in the format of rawdatareplay.index_file.
+        """
+        stat = {}
+        stat['npackets'] = len(self.t)
+        stat['packets_t'] = self.t.tolist()
+        stat['packets_num'] = self.numpacket.tolist()
+        stat['packets_chunk'] = self.chunk.tolist()
+        stat['packets_offset'] = self.offset.tolist()
+        stat['addresses'] = list(self.addresses)
+        return stat
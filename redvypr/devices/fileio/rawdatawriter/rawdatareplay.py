@@ -11,12 +11,14 @@ import copy
 import os
 import gzip
 import threading
-import hashlib
+import concurrent.futures
 import re
 import pydantic
 import typing
 from redvypr.device import RedvyprDevice
 from redvypr.data_packets import check_for_command
+from redvypr.redvypr_address import RedvyprAddress, packet_address
+from redvypr.devices.fileio.rawdatawriter.binarylog import BinaryLogReader, is_binary_log
 #from redvypr.redvypr_packet_statistic import do_data_statistics, create_data_statistic_dict
 
 logging.basicConfig(stream=sys.stderr)
@@ -36,6 +38,9 @@ class DeviceCustomConfig(pydantic.BaseModel):
     loop: bool = pydantic.Field(default=False, description='Loop over all files if set')
     speedup: float = pydantic.Field(default=1.0, description='Speedup factor of the data')
     replace_time: bool = pydantic.Field(default=False, description='Replaces the original time in the packet with the time the packet was read')
+    replay_t_start: typing.Optional[float] = pydantic.Field(default=None, description='Replay only packets with a time larger or equal (unix time)')
+    replay_t_end: typing.Optional[float] = pydantic.Field(default=None, description='Replay only packets with a time smaller or equal (unix time)')
+    replay_address: typing.Optional[str] = pydantic.Field(default=None, description='Replay only packets matching the address. Binary files are filtered with their index without decoding the packets.')
 
 
 redvypr_devicemodule = True
@@ -60,10 +65,92 @@ def get_packets(filestream=None):
         return None
 
 
+# Only the _redvypr block of a packet is decoded for the index, it is the first not indented block in a yaml.dump
+# with sorted keys
+regex_header = re.compile(rb'^_redvypr:\n(?:[ \t].*\n?)*', re.MULTILINE)
+# The fields that change from packet to packet, the rest of the header is the same for all packets of a datastream
+regex_header_varying = re.compile(rb'^  (t|numpacket): (.*)\n', re.MULTILINE)
+yaml_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+index_version = 1
+
+
+def get_packet_header(datab):
+    """
+    Returns the _redvypr header of a YAML encoded packet without decoding the data of the packet. Falls back to
+    decoding the whole packet if the header block cannot be found.
+    """
+    match = regex_header.search(datab)
+    if match is not None:
+        header = yaml.load(match.group(0), Loader=yaml_loader)
+    else:
+        header = yaml.load(datab, Loader=yaml_loader)
+
+    if header is None:
+        return None
+
+    return header['_redvypr']
+
+
+class PacketHeaderParser():
+    """
+    Returns the time, numpacket and address of YAML encoded packets. The header is decoded with YAML only once per
+    datastream, for the following packets the time and numpacket are parsed from their lines.
+    """
+    def __init__(self, maxcache=10000):
+        self.maxcache = maxcache
+        self.cache = {}
+
+    def parse(self, datab):
+        """
+        Returns
+        -------
+        tuple or None
+            (t, numpacket, address string)
+        """
+        match = regex_header.search(datab)
+        if match is None:
+            header = get_packet_header(datab)
+            if header is None:
+                return None
+            return header.get('t', np.nan), header.get('numpacket'), packet_address({'_redvypr': header}).to_address_string()
+
+        block = match.group(0)
+        varying = regex_header_varying.findall(block)
+        static = regex_header_varying.sub(b'', block)
+        try:
+            address = self.cache[static]
+            values = dict(varying)
+            return float(values[b't']), int(values[b'numpacket']), address
+        except (KeyError, ValueError):  # Unknown datastream or a value that needs YAML to be decoded
+            header = yaml.load(block, Loader=yaml_loader)['_redvypr']
+            address = packet_address({'_redvypr': header}).to_address_string()
+            if len(self.cache) >= self.maxcache:
+                self.cache.clear()
+            self.cache[static] = address
+            return header.get('t', np.nan), header.get('numpacket'), address
+
+
 def index_file(filestream, chunksize, statusqueue=None):
+    """
+    Indexes a raw data file by searching the packets and decoding their _redvypr headers.
+
+    Parameters
+    ----------
+    filestream: file
+        The opened (binary) file
+    chunksize: int
+        The number of bytes read at once
+    statusqueue: queue.Queue
+        Optional queue for status updates, used by the thread based indexing
+
+    Returns
+    -------
+    dict
+        The file statistic with the numpy arrays packets_seek, packets_size, packets_num, packets_t, packets_address
+        (index of the addresses list), the addresses and npackets
+    """
     funcname = __name__ + '.index_file()'
     npackets_read = 0
-    packets = []
     status_thread = {}
     tstatus = time.time()
     stat = {}
@@ -71,119 +158,230 @@ def index_file(filestream, chunksize, statusqueue=None):
     stat['packets_size'] = []
     stat['packets_num'] = []
     stat['packets_t'] = []
+    stat['packets_address'] = []
+    stat['addresses'] = []
     stat['npackets'] = 0
-    packets_ = []
-    seek_start = 0
-    seek_now = 0
-    nread = 0
-    data = ''
+    address_ids = {}
+    header_parser = PacketHeaderParser()
+    seek_buffer = 0 # The position of the data_buffer in the file
     data_buffer = b''
     flag_eof = False
     filestream.seek(0)
-    if (filestream is not None):
-        while True:
-            seek_start = filestream.tell()
-            data_read = filestream.read(chunksize)
-            seek_now = filestream.tell()
-            #print('data read', seek_start,seek_now, seek_now - seek_start,len(data_read))
-            lendata = len(data_read)
-            nread += lendata
-            # print('len', len(data_read))
-            if len(data_read) < chunksize:
-                flag_eof = True
-
-            # Add potentially old data and the newly read data
-            data_buffer += data_read
-            seek_data_buffer_end = seek_now
-            seek_data_buffer_start = seek_data_buffer_end - len(data_buffer)
-            while True:
-                # Look for the start of a packet
-                try:
-                    index_start = data_buffer.index(b'---')
-                except Exception as e:
-                    index_start = None
+    while not flag_eof:
+        data_read = filestream.read(chunksize)
+        if len(data_read) < chunksize:
+            flag_eof = True
 
-                # Look for the end of a packet
-                try:
-                    pattern_end = b'\0'
-                    index_end = data_buffer.index(pattern_end)
-                    #index_end += len(pattern_end)
-                except Exception as e:
-                    index_end = None
+        data_buffer += data_read
+        i = 0
+        while True:
+            index_start = data_buffer.find(b'---', i)
+            if index_start < 0:
+                break
+            index_end = data_buffer.find(b'\0', index_start)
+            if index_end < 0:
+                break
 
-                #print('data',data_buffer)
-                #print('index start',index_start,index_end)
+            try:
+                header = header_parser.parse(data_buffer[index_start:index_end])
+            except Exception as e:
+                logger.debug(funcname + ': Could not decode packet at {:d}: {:s}'.format(seek_buffer + index_start, str(e)))
+                header = None
 
-                if (index_end is not None) and (index_start is not None) and ((index_end - index_start) > 0):
-                    datab = data_buffer[index_start:index_end]
-                    databs = datab.decode('utf-8')
-                    #print('databs',databs,index_start,index_end)
-                else:
-                    break
+            if header is not None:
+                tpacket, numpacket, address = header
                 try:
-                    data_packet = yaml.safe_load(databs)
-                    if (data_packet is not None):
-                        numpacket = data_packet['_redvypr']['numpacket']
-                        tpacket = data_packet['_redvypr']['t']
-                        #print('Found datapacket',seek_data_buffer_start)
-                        loc_packet_start = seek_data_buffer_start + index_start
-                        loc_packet_length = index_end - index_start
-                        packets.append(data_packet)
-                        stat['packets_seek'].append(loc_packet_start)
-                        stat['packets_size'].append(loc_packet_length)
-                        stat['packets_num'].append(numpacket)
-                        stat['packets_t'].append(tpacket)
-
-                        npackets_read += 1
-                        #print('fdsfd',npackets_read)
-                        stat['npackets'] = npackets_read
-
-                        if True:
-                            dt = time.time() - tstatus
-                            if dt > 0.5:
-                                tstatus = time.time()
-                                tmin = stat['packets_t'][0]
-                                tmax = stat['packets_t'][-1]
-                                status_thread['t'] = time.time()
-                                status_thread['t_min'] = tmin
-                                status_thread['t_max'] = tmax
-                                status_thread['seek'] = seek_now
-                                status_thread['packets_num'] = npackets_read
-                                status_thread['flag_eof'] = flag_eof
-                                status_thread['stat'] = None
-                                logger.debug(funcname + ' Status:' + str(status_thread))
-                                if statusqueue is not None:
-                                    statusqueue.put(status_thread)
-                        # Remove the packet from the dta_buffer
-                        data_buffer = data_buffer[index_end+len(pattern_end):]
-                        seek_data_buffer_start = seek_data_buffer_end - len(data_buffer)
-                except Exception as e:
-                    logger.debug(funcname + ': Could not decode message {:s}'.format(str(databs)))
-                    logger.exception(e)
-                    #return [packets, packet_ind]
+                    address_id = address_ids[address]
+                except KeyError:
+                    address_id = len(address_ids)
+                    address_ids[address] = address_id
+
+                stat['packets_seek'].append(seek_buffer + index_start)
+                stat['packets_size'].append(index_end - index_start)
+                stat['packets_num'].append(numpacket if type(numpacket) is int else -1)
+                stat['packets_t'].append(tpacket)
+                stat['packets_address'].append(address_id)
+                npackets_read += 1
+
+            i = index_end + 1
+
+        data_buffer = data_buffer[i:]
+        seek_buffer += i
+        if statusqueue is not None and npackets_read > 0 and (time.time() - tstatus) > 0.5:
+            tstatus = time.time()
+            status_thread['t'] = tstatus
+            status_thread['t_min'] = stat['packets_t'][0]
+            status_thread['t_max'] = stat['packets_t'][-1]
+            status_thread['seek'] = seek_buffer
+            status_thread['packets_num'] = npackets_read
+            status_thread['flag_eof'] = flag_eof
+            status_thread['stat'] = None
+            logger.debug(funcname + ' Status:' + str(status_thread))
+            statusqueue.put(dict(status_thread))
 
-                #break
+    logger.debug(funcname + ': EOF. Rewinding file')
+    filestream.seek(0)
+    stat['packets_seek'] = np.asarray(stat['packets_seek'], dtype=np.int64)
+    stat['packets_size'] = np.asarray(stat['packets_size'], dtype=np.int64)
+    stat['packets_num'] = np.asarray(stat['packets_num'], dtype=np.int64)
+    stat['packets_t'] = np.asarray(stat['packets_t'], dtype=float)
+    stat['packets_address'] = np.asarray(stat['packets_address'], dtype=np.uint32)
+    stat['addresses'] = list(address_ids)
+    stat['npackets'] = npackets_read
+
+    # In thread mode, add stat to status dictionary
+    if statusqueue is not None:
+        status_thread['t'] = time.time()
+        if npackets_read > 0:
+            status_thread['t_min'] = stat['packets_t'][0]
+            status_thread['t_max'] = stat['packets_t'][-1]
+        status_thread['seek'] = seek_buffer
+        status_thread['packets_num'] = npackets_read
+        status_thread['flag_eof'] = flag_eof
+        status_thread['stat'] = stat
+        statusqueue.put(status_thread)
+
+    return stat
+
+
+def get_index_filename(filename):
+    """
+    Returns the filename of the index sidecar of a raw data file.
+    """
+    return filename + '.index.npz'
+
+
+def save_index(filename, stat):
+    """
+    Saves the index of a raw data file as a numpy sidecar. The size and modification time of the file are stored
+    with the index to detect an outdated index.
+    """
+    fstat = os.stat(filename)
+    filename_index = get_index_filename(filename)
+    filename_tmp = filename_index + '.{:d}.tmp'.format(os.getpid())
+    with open(filename_tmp, 'wb') as f:
+        np.savez(f, version=index_version, filesize=fstat.st_size, mtime=fstat.st_mtime_ns,
+                 packets_seek=stat['packets_seek'], packets_size=stat['packets_size'],
+                 packets_num=stat['packets_num'], packets_t=stat['packets_t'],
+                 packets_address=stat['packets_address'], addresses=np.asarray(stat['addresses'], dtype=str))
+    # Atomic, several processes might index the same file
+    os.replace(filename_tmp, filename_index)
+
+
+def load_index(filename):
+    """
+    Loads the index sidecar of a raw data file.
+
+    Returns
+    -------
+    dict or None
+        The file statistic (see index_file) or None if there is no up to date index
+    """
+    funcname = __name__ + '.load_index()'
+    filename_index = get_index_filename(filename)
+    try:
+        fstat = os.stat(filename)
+        with np.load(filename_index) as index:
+            if (int(index['version']) != index_version or int(index['filesize']) != fstat.st_size
+                    or int(index['mtime']) != fstat.st_mtime_ns):
+                logger.debug(funcname + ': Index {:s} is outdated'.format(filename_index))
+                return None
 
+            stat = {}
+            for key in ['packets_seek', 'packets_size', 'packets_num', 'packets_t', 'packets_address']:
+                stat[key] = index[key]
+            stat['addresses'] = index['addresses'].tolist()
+    except (OSError, KeyError, ValueError):
+        return None
 
-            if flag_eof:  # EOF, cleanup
-                logger.debug(funcname + ': EOF. Rewinding file')
-                filestream.seek(0)
-                t = time.time()
-                td = datetime.datetime.fromtimestamp(t)
-                tdstr = td.strftime("%Y-%m-%d %H:%M:%S.%f")
-                break
+    stat['npackets'] = len(stat['packets_t'])
+    return stat
 
-        # In thread mode, add stat to status dictionary
-        if statusqueue is not None:
-            status_thread['t'] = time.time()
-            status_thread['seek'] = seek_now
-            status_thread['packets_num'] = npackets_read
-            status_thread['flag_eof'] = flag_eof
-            status_thread['stat'] = stat
-            statusqueue.put(status_thread)
 
+def create_index(filename, chunksize=1048576):
+    """
+    Indexes a raw data file and saves the index sidecar next to the file.
+
+    Returns
+    -------
+    dict
+        The file statistic (see index_file)
+    """
+    funcname = __name__ + '.create_index()'
+    if is_binary_log(filename):  # The binary log has its own index
+        binarylog = BinaryLogReader(filename)
+        stat = binarylog.get_filestat()
+        binarylog.close()
         return stat
 
+    if filename.lower().endswith('.gz'):
+        filestream = gzip.open(filename, 'rb')
+    else:
+        filestream = open(filename, 'rb')
+
+    with filestream:
+        stat = index_file(filestream, chunksize)
+
+    try:
+        save_index(filename, stat)
+    except OSError as e:
+        logger.warning(funcname + ': Could not save index of {:s}: {:s}'.format(filename, str(e)))
+
+    return stat
+
+
+def build_indices(filenames, max_workers=None):
+    """
+    Returns the file statistics of several raw data files. Files without an up to date index sidecar are indexed
+    concurrently in a process pool.
+
+    Parameters
+    ----------
+    filenames: list
+    max_workers: int
+        The number of processes, defaults to the number of CPUs
+
+    Returns
+    -------
+    dict
+        The file statistics with the filenames as keys, None if a file could not be indexed
+    """
+    funcname = __name__ + '.build_indices()'
+    stats = {}
+    filenames_index = []
+    for filename in filenames:
+        stat = None if is_binary_log(filename) else load_index(filename)
+        if stat is None:
+            filenames_index.append(filename)
+        else:
+            stats[filename] = stat
+
+    if len(filenames_index) == 1:
+        filenames_index_single = filenames_index
+        filenames_index = []
+    else:
+        filenames_index_single = []
+
+    for filename in filenames_index_single:
+        try:
+            stats[filename] = create_index(filename)
+        except Exception as e:
+            logger.warning(funcname + ': Could not index {:s}: {:s}'.format(filename, str(e)))
+            stats[filename] = None
+
+    if len(filenames_index) > 0:
+        logger.info(funcname + ': Indexing {:d} files'.format(len(filenames_index)))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {filename: executor.submit(create_index, filename) for filename in filenames_index}
+            for filename, future in futures.items():
+                try:
+                    stats[filename] = future.result()
+                except Exception as e:
+                    logger.warning(funcname + ': Could not index {:s}: {:s}'.format(filename, str(e)))
+                    stats[filename] = None
+
+    return stats
+
 
 class packetreader():
     def __init__(self, filename=None, replay_index = '0,-1,1', npackets = 10, chunksize=1024,statusqueue=None,filestat = None):
@@ -205,6 +403,26 @@ class packetreader():
         except:
             pass
         logger.info(sstr)
+        self.binarylog = None
+        self.chunksize = chunksize
+        if is_binary_log(filename):
+            # The binary log has its own index, no need for a checksum and an index file
+            try:
+                self.binarylog = BinaryLogReader(filename)
+            except Exception as e:
+                logger.warning(funcname + ' Error opening file:' + filename + ':' + str(e))
+                return None
+
+            self.filestream = self.binarylog.f
+            self.fsize = os.path.getsize(filename)
+            if filestat == 'thread':
+                self.index_file_thread()
+            elif filestat is None:
+                self.filestat = self.binarylog.get_filestat()
+            else:
+                self.filestat = filestat
+            return
+
         if filename.lower().endswith('.gz'):
             FLAG_GZIP = True
         else:
@@ -226,45 +444,20 @@ class packetreader():
                 return None
 
         self.filestream = filestream
-        # Get the size of the data (within the file, this is different to the filesize, which can be gzipped
         self.fsize = os.path.getsize(filename)
-        f = self.filestream
-        f.seek(0, os.SEEK_END)
-        size = f.tell() # The size of the internal data
-        self.datasize = size
-        self.filestream.seek(0)
         self.chunksize = chunksize
 
-        # Calculate hash
-        #hasher = hashlib.sha256()
-        hasher = hashlib.md5()
-        while True:
-            data = f.read(65536)
-            if not data:
-                break
-            hasher.update(data)
-        self.checksum = hasher.hexdigest()
-        self.filestream.seek(0)
-        #print("MD5 checksum of {}".format(self.checksum))
-
         if filestat is None:
             # Check for an index file
-            filename_index = filename + '.index{}.yaml.gz'.format(self.checksum)
-            try:
-                logger.debug(funcname + ' loading index file')
-                filestream_index = gzip.open(filename_index, 'rb')
-                filestat_raw = filestream_index.read()
-                filestat = yaml.safe_load(filestat_raw)
-                filestat['checksum'] = self.checksum
-                logger.debug(funcname + ' loading index file done')
-            except:
-                logger.debug(funcname, exc_info=True)
+            logger.debug(funcname + ' loading index file')
+            filestat = load_index(filename)
+            if filestat is None:
                 logger.info("Did not find index file, creating one")
                 filestat = self.index_file()
-                findex = gzip.open(filename_index, 'wb')
-                yamlstr = yaml.dump(filestat)
-                findex.write(yamlstr.encode('utf-8'))
-                findex.close()
+                try:
+                    save_index(filename, filestat)
+                except OSError as e:
+                    logger.warning(funcname + ' Could not save index file: {:s}'.format(str(e)))
 
             # Inspect file, if not done already
             logger.debug(funcname + ' Indexing file {:s}'.format(filename))
@@ -311,10 +504,13 @@ class packetreader():
         """
         Get the packets
         """
+        if self.binarylog is not None:
+            return self.binarylog.get_packets(packetindex)
+
         packets = []
         for pindex in packetindex:
-            iseek = self.filestat['packets_seek'][pindex]
-            plen  = self.filestat['packets_size'][pindex]
+            iseek = int(self.filestat['packets_seek'][pindex])
+            plen  = int(self.filestat['packets_size'][pindex])
             self.filestream.seek(iseek)
             packetdata_raw = self.filestream.read(plen)
             packetdata = yaml.safe_load(packetdata_raw)
@@ -329,21 +525,133 @@ class packetreader():
         self.filestream.close()
 
     def index_file(self):
+        if self.binarylog is not None:
+            return self.binarylog.get_filestat()
+
         stat = index_file(self.filestream,self.chunksize)
         return stat
 
     def index_file_thread(self):
         self.stat_thread = {}
         self.statusqueue = queue.Queue()
-        self.index_thread = threading.Thread(target = index_file, args = (self.filestream,self.chunksize,self.statusqueue), daemon = True)
+        if self.binarylog is not None:
+            target = index_binary_file
+            args = (self.binarylog, self.statusqueue)
+        else:
+            target = index_file
+            args = (self.filestream, self.chunksize, self.statusqueue)
+        self.index_thread = threading.Thread(target = target, args = args, daemon = True)
         self.index_thread.start()
 
 
+def index_binary_file(binarylog, statusqueue=None):
+    """
+    Returns the file statistic of a binary log, the index is read from the file and not created by decoding the packets.
+    """
+    stat = binarylog.get_filestat()
+    if statusqueue is not None:
+        status_thread = {}
+        status_thread['t'] = time.time()
+        status_thread['t_min'] = float(np.nanmin(binarylog.t)) if len(binarylog.t) > 0 else np.nan
+        status_thread['t_max'] = float(np.nanmax(binarylog.t)) if len(binarylog.t) > 0 else np.nan
+        status_thread['seek'] = binarylog.datastart
+        status_thread['packets_num'] = stat['npackets']
+        status_thread['flag_eof'] = True
+        status_thread['stat'] = stat
+        statusqueue.put(status_thread)
+
+    return stat
+
+
+def packet_filter_matches(packet, packetfilter):
+    """
+    Checks if a packet is within the time range and matches the address (a RedvyprAddress) of packetfilter.
+    """
+    t = packet['_redvypr']['t']
+    if packetfilter.get('t_start') is not None and t < packetfilter['t_start']:
+        return False
+    if packetfilter.get('t_end') is not None and t > packetfilter['t_end']:
+        return False
+    if packetfilter.get('address') is not None:
+        return packetfilter['address'].matches_filter(packet)
+
+    return True
+
+
+def packet_read_thread_binary(filename, npacket_buf=10, dataqueue=None, commandqueue=None, statusqueue=None,
+                              packetfilter=None):
+    """
+    Reads the packets of a binary log. Packets outside of the time range or not matching the address of packetfilter
+    are skipped with the index, i.e. without decompressing or decoding them.
+    """
+    funcname = __name__ + '.packet_read_thread_binary()'
+    try:
+        binarylog = BinaryLogReader(filename)
+        logger.debug(funcname + ' Opened file: {:s}'.format(filename))
+    except Exception as e:
+        logger.warning(funcname + ' Error opening file:' + filename + ':' + str(e))
+        return None
+
+    if packetfilter is None:
+        packetfilter = {}
+
+    indices = binarylog.select(t_start=packetfilter.get('t_start'), t_end=packetfilter.get('t_end'),
+                               address=packetfilter.get('address'))
+    fsize = os.path.getsize(filename)
+    filename_base = os.path.basename(filename)
+    filename_path = os.path.dirname(filename)
+    status_thread = {}
+    npackets_read = 0
+    nnewread = 0
+    try:
+        while True:
+            com = commandqueue.get()
+            if type(com) == int: # Read n new packets
+                nnewread = com
+            elif com == 'stop':
+                logger.debug(funcname + ' Stopping ...')
+                return
 
+            iend = min(npackets_read + nnewread, len(indices))
+            for i in indices[npackets_read:iend]:
+                dataqueue.put(binarylog.get_packet(i))
 
-def packet_read_thread(filename, chunksize, npacket_buf=10, dataqueue=None, commandqueue=None, statusqueue=None):
+            npackets_read = iend
+            flag_eof = npackets_read >= len(indices)
+            if statusqueue is not None:
+                status_thread['t'] = time.time()
+                td = datetime.datetime.fromtimestamp(status_thread['t'])
+                status_thread['time'] = td.strftime('%d %b %Y %H:%M:%S')
+                status_thread['filename'] = filename_base
+                status_thread['filepath'] = filename_path
+                status_thread['seek'] = npackets_read
+                status_thread['datasize'] = len(indices)
+                status_thread['filesize'] = fsize
+                try:
+                    pc = npackets_read / len(indices) * 100
+                except:
+                    pc = 'NaN'
+                status_thread['pc'] = "{:.2f}".format(pc)
+                status_thread['packets_num'] = npackets_read
+                status_thread['flag_eof'] = flag_eof
+                statusqueue.put(status_thread)
+
+            if flag_eof:
+                logger.debug(funcname + ': EOF')
+                return
+    finally:
+        binarylog.close()
+
+
+
+
+def packet_read_thread(filename, chunksize, npacket_buf=10, dataqueue=None, commandqueue=None, statusqueue=None,
+                       packetfilter=None):
     funcname = __name__ + '.packet_read_thread()'
 
+    if is_binary_log(filename):
+        return packet_read_thread_binary(filename, npacket_buf, dataqueue, commandqueue, statusqueue, packetfilter)
+
     if filename.lower().endswith('.gz'):
         FLAG_GZIP = True
     else:
@@ -452,8 +760,9 @@ def packet_read_thread(filename, chunksize, npacket_buf=10, dataqueue=None, comm
                             loc_packet_start = seek_data_buffer_start + index_start
                             loc_packet_length = index_end - index_start
                             #packets.append(data_packet)
-                            dataqueue.put(data_packet)
-                            nread += 1
+                            if packetfilter is None or packet_filter_matches(data_packet, packetfilter):
+                                dataqueue.put(data_packet)
+                                nread += 1
                             #stat['packets_seek'].append(loc_packet_start)
                             #stat['packets_size'].append(loc_packet_length)
                             #stat['packets_num'].append(numpacket)
@@ -538,7 +847,9 @@ def start(device_info, config={'filename': ''}, dataqueue=None, datainqueue=None
         config['loop'] = False
         
     loop = config['loop']
-    
+    packetfilter = {'t_start': config.get('replay_t_start'), 't_end': config.get('replay_t_end'), 'address': None}
+    if config.get('replay_address'):
+        packetfilter['address'] = RedvyprAddress(config['replay_address'])
     
     #statistics = create_data_statistic_dict()
     
@@ -606,28 +917,46 @@ def start(device_info, config={'filename': ''}, dataqueue=None, datainqueue=None
             npacket_buf = 10
             nfile += 1
             print('Starting reading thread')
-            args = (filename, chunksize, npacket_buf, read_dataqueue, read_commandqueue, statusqueue)
+            args = (filename, chunksize, npacket_buf, read_dataqueue, read_commandqueue, statusqueue, packetfilter)
             read_thread = threading.Thread(target=packet_read_thread, args=args, daemon=True)
             read_thread.start()
             read_commandqueue.put(npacket_buf)
-            for i in range(npacket_buf):
-                packets.append(read_dataqueue.get())
+            while len(packets) < npacket_buf:
+                try:
+                    packets.append(read_dataqueue.get(timeout=0.1))
+                except queue.Empty:
+                    # The file has less packets than npacket_buf (i.e. because of the filter)
+                    if not read_thread.is_alive() and read_dataqueue.empty():
+                        break
+
+            if len(packets) < 2:
+                for p in packets:
+                    dataqueue.put(p)
+                packets = []
+                continue
 
             pnow = packets.pop(0)
             pnext = packets.pop(0)
             FLAG_NEW_FILE = False
 
         # Check if the read thread is still alive
-        if not(read_thread.is_alive()):
+        if not(read_thread.is_alive()) and read_dataqueue.empty() and len(packets) == 0:
             logger.debug(funcname + ' Reading thread finished')
+            # Publish the last two packets of the file
+            for p in (pnow, pnext):
+                if config['replace_time']:
+                    p['t'] = time.time()
+                    p['_redvypr']['t'] = p['t']
+                dataqueue.put(p)
+                packets_published += 1
             FLAG_NEW_FILE = True
         else:
-            if len(packets) > 1:
-                while True:
-                    try:
-                        packets.append(read_dataqueue.get_nowait())
-                    except:
-                        break
+            while True:
+                try:
+                    packets.append(read_dataqueue.get_nowait())
+                except:
+                    break
+            if len(packets) > 0:
                 if True:
                     t_pnow = pnow['_redvypr']['t']
                     t_pnext = pnext['_redvypr']['t']
@@ -895,7 +1224,7 @@ class initDeviceWidget(QtWidgets.QWidget):
         logger.debug(funcname)
 
         stat = self.inspect_data(filename,rescan=False)
-        if True:
+        if len(stat['packets_num']) > 0:
             npackets = len(stat['packets_num'])
             t_min = stat['packets_t'][0]
             t_max = stat['packets_t'][-1]
@@ -943,18 +1272,43 @@ class initDeviceWidget(QtWidgets.QWidget):
         funcname = self.__class__.__name__ + '.scan_files()'
         logger.debug(funcname)
 
-        for i in rows:
+        self.index_rows = {}
+        for i in set(rows):
             filename = self.inlist.item(i,self.col_fname).text()
+            self.index_rows[filename] = i
             #stat = self.inspect_data_thread(filename, i, rescan=False)
 
-        # Start a timer to update
-        #if len(rows) > 0:
-        #    self.threadtimer = QtCore.QTimer()
-        #    self.threadtimer.timeout.connect(self.update_table_from_thread)  # Add to the timer another update
-        #    self.threadtimer.start(250)
+        # Index the files in the background (with a process pool) and update the table when done
+        if len(self.index_rows) > 0:
+            self.index_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            self.index_future = self.index_executor.submit(build_indices, list(self.index_rows))
+            self.scanfilesbtn.setEnabled(False)
+            self.threadtimer = QtCore.QTimer()
+            self.threadtimer.timeout.connect(self.update_table_from_index)  # Add to the timer another update
+            self.threadtimer.start(250)
             
         self.inlist.resizeColumnsToContents()
 
+    def update_table_from_index(self):
+        funcname = self.__class__.__name__ + '.update_table_from_index()'
+        if not self.index_future.done():
+            return
+
+        self.threadtimer.stop()
+        self.index_executor.shutdown()
+        self.scanfilesbtn.setEnabled(True)
+        try:
+            stats = self.index_future.result()
+        except Exception as e:
+            logger.warning(funcname + ': Could not index files: {:s}'.format(str(e)))
+            return
+
+        for filename, row in self.index_rows.items():
+            stat = stats.get(filename)
+            if stat is not None:
+                self.file_statistics[filename] = stat
+                self.scan_file(filename, row)
+
     def inspect_data_thread(self, filename, row, rescan=False):
         """ Inspects the files for possible datastreams in the file with the filename located in config['files'][fileindex].
         """
@@ -1035,9 +1389,9 @@ class initDeviceWidget(QtWidgets.QWidget):
         """ Opens a dialog to choose file to add
         """
         funcname = self.__class__.__name__ + '.add_files()'
-        regex_indexfile = re.compile('.*[.index][0-9a-f]{32}.yaml.gz')
+        regex_indexfile = re.compile(r'.*(\.index[0-9a-f]{32}\.yaml\.gz|\.index\.npz)$')
         logger.debug(funcname)
-        filenames, _ = QtWidgets.QFileDialog.getOpenFileNames(self,"Rawdatafiles","","redvypr raw gzip (*.redvypr_yaml.gz);;redvypr raw (*.redvypr_yaml);;All Files (*)")
+        filenames, _ = QtWidgets.QFileDialog.getOpenFileNames(self,"Rawdatafiles","","redvypr raw gzip (*.redvypr_yaml.gz);;redvypr raw (*.redvypr_yaml);;redvypr binary (*.redvypr_bin);;All Files (*)")
         for f in filenames:
             if regex_indexfile.match(f) is None:
                 self.device.custom_config.files.append(f)
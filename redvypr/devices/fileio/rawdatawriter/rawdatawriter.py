@@ -15,6 +15,7 @@ import typing
 from redvypr.device import RedvyprDevice
 from redvypr.data_packets import check_for_command
 from redvypr.packet_statistic import do_data_statistics, create_data_statistic_dict
+from redvypr.devices.fileio.rawdatawriter.binarylog import BinaryLogWriter
 
 logging.basicConfig(stream=sys.stderr)
 logger = logging.getLogger('redvypr.device.rawdatawriter')
@@ -45,6 +46,8 @@ class DeviceCustomConfig(pydantic.BaseModel):
     filedateformat: str = pydantic.Field(default='%Y-%m-%d_%H%M%S', description='Dateformat used in the filename, must be understood by datetime.strftime')
     filecountformat: str = pydantic.Field(default='04', description='Format of the counter. Add zero if trailing zeros are wished, followed by number of digits. 04 becomes {:04d}')
     filegzipformat: str = pydantic.Field(default='gz', description='If empty, no compression done')
+    fileformat: typing.Literal['yaml', 'binary'] = pydantic.Field(default='yaml', description='Format of the file, "binary" writes compressed chunks of binary packets with an index of time and address (filegzipformat is not used, the default extension is redvypr_bin)')
+    binary_chunksize: int = pydantic.Field(default=1000000, description='Size of the uncompressed packets of a chunk in the binary format [bytes]')
 
 
 def create_logfile(config,count=0):
@@ -68,10 +71,16 @@ def create_logfile(config,count=0):
     if (len(config['filepostfix']) > 0):
         filename += '_' + config['filepostfix']
 
+    FLAG_BINARY = config.get('fileformat', 'yaml') == 'binary'
     if (len(config['fileextension']) > 0):
-        filename += '.' + config['fileextension']
+        if FLAG_BINARY and config['fileextension'] == 'redvypr_yaml':
+            filename += '.redvypr_bin'
+        else:
+            filename += '.' + config['fileextension']
 
-    if (len(config['filegzipformat']) > 0):
+    if FLAG_BINARY: # The chunks of the binary format are compressed already
+        FLAG_GZIP = False
+    elif (len(config['filegzipformat']) > 0):
         filename += '.' + config['filegzipformat']
         FLAG_GZIP = True
     else:
@@ -97,6 +106,8 @@ def create_logfile(config,count=0):
         try:
             f = open(filename,'wb+')
             logger.debug(funcname + ' Opened file: {:s}'.format(filename))
+            if FLAG_BINARY:
+                f = BinaryLogWriter(f, chunksize=config.get('binary_chunksize', 1000000))
         except Exception as e:
             logger.warning(funcname + ' Error opening file:' + filename + ':' + str(e))
             return None
@@ -233,14 +244,18 @@ def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=Non
                             dataqueue.put(data_stat)
                             return
 
-                statistics, status = do_data_statistics(data,statistics)
-                yamlstr = yaml.dump(data,explicit_end=True,explicit_start=True)
-                bytes_written         += len(yamlstr)
+                do_data_statistics(data,statistics)
+                if isinstance(f, BinaryLogWriter):
+                    nbytes = f.write(data)
+                else:
+                    yamlstr = yaml.dump(data,explicit_end=True,explicit_start=True)
+                    nbytes = len(yamlstr)
+                    f.write(yamlstr.encode('utf-8'))
+                    f.write(b'\0')
+                bytes_written         += nbytes
                 packets_written       += 1
-                bytes_written_total   += len(yamlstr)
+                bytes_written_total   += nbytes
                 packets_written_total += 1
-                f.write(yamlstr.encode('utf-8'))
-                f.write(b'\0')
                 if((time.time() - tflush) > config['dt_sync']):
                     f.flush()
                     os.fsync(f.fileno())
@@ -11,11 +11,21 @@ logging.basicConfig(stream=sys.stderr)
 logger = logging.getLogger('redvypr.device.sqlite3db')
 logger.setLevel(logging.DEBUG)
 
+# Estimate of the bytes of a row in the table and the index in addition to the timestamp and data
+row_overhead = 24
+
+# Columns extracted from the _redvypr part of the packets, used for indexed queries without json_extract
+packet_columns = ('t', 'host', 'device', 'packetid', 'publisher')
 
 
 class RedvyprDbSqlite3:
-    def __init__(self, db_file: str = "redvypr_data.db"):
-        """Open a persistent connection to the SQLite database."""
+    def __init__(self, db_file: str = "redvypr_data.db", wal: bool = False):
+        """
+        Open a persistent connection to the SQLite database.
+
+        If wal is True the database is switched into the write-ahead log mode, which allows fast commits of the
+        writer while readers access the file. The mode is stored in the file.
+        """
         self.db_file = db_file
         self.file_status = 'open'
 
@@ -24,24 +34,51 @@ class RedvyprDbSqlite3:
 
         self.conn = sqlite3.connect(db_file, check_same_thread=False)
         self.cursor = self.conn.cursor()
+        if wal:
+            self.cursor.execute("PRAGMA journal_mode=WAL")
+            # In WAL mode the database is consistent after a crash also without syncing every commit
+            self.cursor.execute("PRAGMA synchronous=NORMAL")
 
         # If it's a new file, initialize the tables
         if not db_exists:
             self.init_db()
 
+        # Files of older versions do not have the extracted packet columns
+        columns = [row[1] for row in self.cursor.execute("PRAGMA table_info(redvypr_packets)")]
+        self.has_packet_columns = all(c in columns for c in packet_columns)
+        if self.has_packet_columns:
+            self.insert_sql = """
+                INSERT INTO redvypr_packets (timestamp, data, t, host, device, packetid, publisher)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """
+        else:
+            self.insert_sql = """
+                INSERT INTO redvypr_packets (timestamp, data)
+                VALUES (?, ?)
+            """
+
     def init_db(self):
         """Create the table if it doesn’t exist."""
         self.cursor.execute("""
             CREATE TABLE IF NOT EXISTS redvypr_packets (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 timestamp TEXT NOT NULL,
-                data JSON NOT NULL
+                data JSON NOT NULL,
+                t REAL,
+                host TEXT,
+                device TEXT,
+                packetid TEXT,
+                publisher TEXT
             )
         """)
         self.cursor.execute("""
             CREATE INDEX IF NOT EXISTS idx_redvypr_timestamp
             ON redvypr_packets (timestamp)
         """)
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_redvypr_device_t ON redvypr_packets (device, t)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_redvypr_host_device_t ON redvypr_packets (host, device, t)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_redvypr_packetid_t ON redvypr_packets (packetid, t)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_redvypr_publisher_t ON redvypr_packets (publisher, t)")
         self.conn.commit()
 
     def insert_packet(self, packet: dict, timestamp: str | None = None):
@@ -50,17 +87,69 @@ class RedvyprDbSqlite3:
             timestamp = datetime.now(timezone.utc).isoformat()
 
         try:
-            jsonstr = json_safe_dumps(packet)
+            row = self.packet_to_row(packet, timestamp)
             #print("Jsonstr",jsonstr)
         except:
             logger.info("Could not serialize data",exc_info=True)
             #print(packet)
             raise ValueError("Bad")
 
-        self.cursor.execute("""
-            INSERT INTO redvypr_packets (timestamp, data)
-            VALUES (?, json(?))
-        """, (timestamp, jsonstr))
+        self.cursor.execute(self.insert_sql, row)
+
+    def packet_to_row(self, packet: dict, timestamp: str | None = None):
+        """
+        Serializes a packet into a row (timestamp, data, t, host, device, packetid, publisher) for insert_rows().
+        If no timestamp is given the packet time is used.
+        """
+        rinfo = packet['_redvypr']
+        if timestamp is None:
+            timestamp = datetime.fromtimestamp(rinfo['t'], tz=timezone.utc).isoformat()
+
+        jsonstr = json_safe_dumps(packet)
+        if not self.has_packet_columns:
+            return (timestamp, jsonstr)
+
+        try:
+            host = rinfo['host']['host']
+        except (KeyError, TypeError):
+            host = None
+
+        return (timestamp, jsonstr, rinfo.get('t'), host, rinfo.get('device'), rinfo.get('packetid'),
+                rinfo.get('publisher'))
+
+    def insert_rows(self, rows):
+        """
+        Inserts rows created with packet_to_row() within one transaction.
+
+        Returns
+        -------
+        int
+            Estimate of the number of bytes added to the database file
+        """
+        with self.conn:
+            self.cursor.executemany(self.insert_sql, rows)
+
+        nbytes = row_overhead * len(rows)
+        for row in rows:
+            nbytes += 2 * len(row[0]) + len(row[1])
+            for value in row[3:]:  # The extracted strings are stored in the table and the indices
+                if value is not None:
+                    nbytes += 3 * len(value)
+
+        return nbytes
+
+    def get_file_size(self):
+        """
+        Returns the size of the database file including the write-ahead log.
+        """
+        size = 0
+        for filename in (self.db_file, self.db_file + '-wal'):
+            try:
+                size += os.path.getsize(filename)
+            except OSError:
+                pass
+
+        return size
 
     def commit(self):
         """Manually commit — e.g. after multiple inserts."""
@@ -75,31 +164,118 @@ class RedvyprDbSqlite3:
         ]
 
     def get_stats(self):
-        """Return the number of packets, earliest timestamp, and latest timestamp."""
+        """
+        Return the number of packets, earliest timestamp, and latest timestamp.
+
+        The values are read from the primary key and the timestamp index, the number of packets is derived from the
+        ids (packets are not deleted), such that large files do not need to be scanned.
+        """
+        # Separate subqueries, such that each MIN/MAX is a single index lookup
         self.cursor.execute("""
-            SELECT COUNT(*), MIN(timestamp), MAX(timestamp)
-            FROM redvypr_packets
+            SELECT (SELECT MIN(id) FROM redvypr_packets), (SELECT MAX(id) FROM redvypr_packets),
+                   (SELECT MIN(timestamp) FROM redvypr_packets), (SELECT MAX(timestamp) FROM redvypr_packets)
         """)
-        count, min_ts, max_ts = self.cursor.fetchone()
+        min_id, max_id, min_ts, max_ts = self.cursor.fetchone()
+        if min_id is None:
+            count = 0
+        else:
+            count = max_id - min_id + 1
         return {
-            "count": count or 0,
+            "count": count,
+            "min_id": min_id,
+            "max_id": max_id,
             "min_timestamp": min_ts,
             "max_timestamp": max_ts
         }
 
+    def get_devices(self):
+        """
+        Returns the devices in the file. With the extracted device column the index is traversed from device to
+        device, otherwise all packets are read.
+        """
+        if self.has_packet_columns:
+            self.cursor.execute("""
+                WITH RECURSIVE devices(device) AS (
+                    SELECT MIN(device) FROM redvypr_packets
+                    UNION ALL
+                    SELECT (SELECT MIN(device) FROM redvypr_packets WHERE device > devices.device)
+                    FROM devices WHERE devices.device IS NOT NULL
+                )
+                SELECT device FROM devices WHERE device IS NOT NULL
+            """)
+        else:
+            self.cursor.execute("""
+                SELECT DISTINCT json_extract(data, '$._redvypr.device') FROM redvypr_packets
+            """)
+
+        return [row[0] for row in self.cursor.fetchall() if row[0] is not None]
+
     def query_by_device(self, device_id: str):
-        """Example query: filter packets by device_id inside the JSON."""
+        """Filter packets by the device, using the device index if available."""
+        if self.has_packet_columns:
+            where = "device = ?"
+        else:
+            where = "json_extract(data, '$._redvypr.device') = ?"
+
         self.cursor.execute("""
             SELECT id, timestamp, data
             FROM redvypr_packets
-            WHERE json_extract(data, '$.device_id') = ?
+            WHERE {}
             ORDER BY timestamp DESC
-        """, (device_id,))
+        """.format(where), (device_id,))
         return [
             {"id": row[0], "timestamp": row[1], "data": json.loads(row[2])}
             for row in self.cursor.fetchall()
         ]
 
+    def get_id_by_index(self, index: int):
+        """
+        Returns the id of the packet at the given index (0-based, negative values count from the end) ordered by
+        insertion, None if the index is out of range.
+        """
+        if index < 0:
+            order = "DESC"
+            index = -index - 1
+        else:
+            order = "ASC"
+
+        self.cursor.execute("""
+            SELECT id FROM redvypr_packets ORDER BY id {} LIMIT 1 OFFSET ?
+        """.format(order), (index,))
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+        return row[0]
+
+    def iter_packet_chunks(self, id_start: int, id_end: int, nth: int = 1, chunksize: int = 500):
+        """
+        Iterates over the packets with id_start <= id <= id_end (every nth packet) ordered by insertion. The packets
+        are read with one range-bounded cursor on the primary key and returned in lists of up to chunksize packets.
+        """
+        cursor = self.conn.cursor()
+        if nth > 1:
+            cursor.execute("""
+                SELECT data FROM redvypr_packets
+                WHERE id BETWEEN ? AND ? AND (id - ?) % ? = 0
+                ORDER BY id ASC
+            """, (id_start, id_end, id_start, nth))
+        else:
+            cursor.execute("""
+                SELECT data FROM redvypr_packets
+                WHERE id BETWEEN ? AND ?
+                ORDER BY id ASC
+            """, (id_start, id_end))
+
+        loads = json.loads
+        try:
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if len(rows) == 0:
+                    break
+                yield [loads(row[0]) for row in rows]
+        finally:
+            cursor.close()
+
     def get_packet_by_index(self, index: int):
         """
         Return the packet at the given index (0-based) ordered by insertion (id ASC).
@@ -126,21 +302,27 @@ class RedvyprDbSqlite3:
         self.conn.close()
 
 
+def _json_default(o):
+    # numpy arrays → convert to Python lists
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    # numpy scalar values (e.g. np.int64, np.float64)
+    if isinstance(o, (np.generic,)):
+        return o.item()
+    # Handle Python 'type' objects (e.g., <class 'float'>)
+    if isinstance(o, type):
+        return str(o)
+    # Handle datetime
+    if isinstance(o, datetime):
+        return o.isoformat()
+    # Handle other unknown types
+    return str(o)
+
+
+# The encoder is created once, json.dumps with arguments creates a new one for every call
+_json_encoder = json.JSONEncoder(default=_json_default, ensure_ascii=False, separators=(',', ':'))
+
+
 def json_safe_dumps(obj):
     """Convert complex Redvypr packets into JSON-safe text."""
-    def default(o):
-        # numpy arrays → convert to Python lists
-        if isinstance(o, np.ndarray):
-            return o.tolist()
-        # numpy scalar values (e.g. np.int64, np.float64)
-        if isinstance(o, (np.generic,)):
-            return o.item()
-        # Handle Python 'type' objects (e.g., <class 'float'>)
-        if isinstance(o, type):
-            return str(o)
-        # Handle datetime
-        if isinstance(o, datetime):
-            return o.isoformat()
-        # Handle other unknown types
-        return str(o)
-    return json.dumps(obj, default=default, ensure_ascii=False)
+    return _json_encoder.encode(obj)
@@ -43,6 +43,78 @@ redvypr_devicemodule = True
 
 
 
+class PacketReadAhead():
+    """
+    Reads the packets of a file in chunks with a range-bounded cursor (RedvyprDbSqlite3.iter_packet_chunks) in a
+    background thread, such that the next chunks are read and decoded while the current one is replayed.
+    """
+    def __init__(self, filename, id_start, id_end, nth=1, chunksize=500, nbuffer=4):
+        self.filename = filename
+        self.id_start = id_start
+        self.id_end = id_end
+        self.nth = nth
+        self.chunksize = chunksize
+        self.chunks = queue.Queue(maxsize=nbuffer)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        # Make room for the end of the thread
+        try:
+            while True:
+                self.chunks.get_nowait()
+        except queue.Empty:
+            pass
+        self.thread.join()
+
+    def run(self):
+        funcname = __name__ + '.run()'
+        db = RedvyprDbSqlite3(self.filename)
+        try:
+            for chunk in db.iter_packet_chunks(self.id_start, self.id_end, nth=self.nth, chunksize=self.chunksize):
+                if not self._put(chunk):
+                    break
+        except Exception:
+            logger.exception(funcname + ' Could not read packets')
+        finally:
+            db.close()
+
+        self._put(None)  # End of the file
+
+    def _put(self, chunk):
+        while not self.stop_event.is_set():
+            try:
+                self.chunks.put(chunk, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                return
+            yield from chunk
+
+
+def get_replay_range(db, replay_index):
+    """
+    Returns the id range and the step (id_start, id_end, nth) of the replay index string 'start,end,nth' of a file.
+    """
+    try:
+        istart, iend, nth = [int(i) for i in str(replay_index).split(',')]
+    except Exception:
+        logger.warning('Invalid replay index {}, replaying all packets'.format(replay_index))
+        istart, iend, nth = 0, -1, 1
+
+    return db.get_id_by_index(istart), db.get_id_by_index(iend), max(nth, 1)
+
+
 def start(device_info, config={'filename': ''}, dataqueue=None, datainqueue=None, statusqueue=None):
     funcname = __name__ + '.start()'
     logger_start = logging.getLogger('redvypr.device.sqlite3replay.thread')
@@ -53,8 +125,6 @@ def start(device_info, config={'filename': ''}, dataqueue=None, datainqueue=None
     t_status = time.time()
     #dt_status = 2 # Status update
     dt_status = 1.0  # Status update
-    t_sent = 0 # The time the last packets was sent
-    t_packet_old = 1e12 # The time the last packet had (internally)
     try:
         config['speedup']
     except:
@@ -76,15 +146,24 @@ def start(device_info, config={'filename': ''}, dataqueue=None, datainqueue=None
     dt_packet_sum = 0
     FLAG_NEW_FILE = True
     nfile = 0
-    dt_packet_wait = 1000
-    dt_sleep = 0.2
-    while True:
-        tcheck = time.time()
-        try:
-            data = datainqueue.get(block=False)
-        except:
-            data = None
-        if (data is not None):
+    filename = ''
+    reader = None
+    packets = None
+    t_pold = None  # The packet time of the previous packet
+    t_sent = 0  # The time the previous packet was sent
+    t_command = 0  # The time the command queue was checked
+
+    def wait_for_command(timeout):
+        """
+        Waits up to timeout seconds for commands, returns True if the device shall stop.
+        """
+        t_end = time.time() + timeout
+        while True:
+            try:
+                data = datainqueue.get(timeout=max(t_end - time.time(), 0))
+            except queue.Empty:
+                return False
+
             command = check_for_command(data, thread_uuid=device_info['thread_uuid'])
             logger_start.debug('Got a command: {:s}'.format(str(data)))
             if (command is not None):
@@ -96,12 +175,16 @@ def start(device_info, config={'filename': ''}, dataqueue=None, datainqueue=None
                         statusqueue.put_nowait(sstr)
                     except:
                         pass
+                    return True
 
-                    break
-
+    while True:
         if (FLAG_NEW_FILE):
+            if reader is not None:
+                reader.stop()
+                reader = None
+
             if (nfile >= len(files)):
-                if (loop == False):
+                if (loop == False) or (packets_published_total == 0):
                     sstr = funcname + ': All files read, stopping now.'
                     try:
                         statusqueue.put_nowait(sstr)
@@ -120,67 +203,67 @@ def start(device_info, config={'filename': ''}, dataqueue=None, datainqueue=None
                     nfile = 0
 
             filename = files[nfile]
+            try:
+                replay_index_file = replay_index[nfile]
+            except IndexError:
+                replay_index_file = replay_index[-1] if len(replay_index) > 0 else '0,-1,1'
+
+            nfile += 1
             #print('Opening file')
             db = RedvyprDbSqlite3(filename)
             stat = db.get_stats()
             npackets = stat['count']
+            id_start, id_end, nth = get_replay_range(db, replay_index_file)
+            db.close()
             ipacket = 0
-            if npackets > 2:
+            if (id_start is not None) and (id_end is not None) and (id_start <= id_end):
                 packets_published_file = 0
                 logger_start.debug('Starting reading data of file with {} packets'.format(npackets))
-                nfile += 1
-                pnow_all = db.get_packet_by_index(ipacket)
-                pnow = pnow_all['data']
-                ipacket += 1
-                pnext_all = db.get_packet_by_index(ipacket)
-                pnext = pnext_all['data']
+                reader = PacketReadAhead(filename, id_start, id_end, nth)
+                reader.start()
+                packets = iter(reader)
+                t_pold = None
                 FLAG_NEW_FILE = False
-                dt_packet_wait = 0
             else:
-                FLAG_NEW_FILE = True
-                db.close()
+                logger_start.info('No packets to replay in {}'.format(filename))
+                continue
+
+        try:
+            pnow = next(packets)
+        except StopIteration:
+            FLAG_NEW_FILE = True
+            continue
+
+        ipacket += 1
+        # Wait according to the time difference to the previous packet
+        t_pnow = pnow['_redvypr']['t']
+        if t_pold is not None:
+            dt_packet = (t_pnow - t_pold) / speedup
+            if dt_packet < 0:
+                dt_packet = 0
+            elif dt_packet > 0.2:
+                logger_start.debug(funcname + ' Long dt_packet of {:f} seconds'.format(dt_packet))
+            dt_packet_sum += dt_packet
+            dt_wait = t_sent + dt_packet - time.time()
+        else:
+            dt_wait = 0
+
+        if (dt_wait > 0) or ((time.time() - t_command) > 0.1):
+            t_command = time.time()
+            if wait_for_command(max(dt_wait, 0)):
+                break
+
+        t_pold = t_pnow
+        t_sent = time.time()
+        if config['replace_time']:
+            pnow['t'] = t_sent
+            pnow['_redvypr']['t'] = t_sent
+
+        #print('sending',pnow)
+        dataqueue.put(pnow)
+        packets_published_file += 1
+        packets_published_total += 1
 
-        if ipacket <= npackets:
-            if dt_packet_wait<=0:
-                t_pnow = pnow['_redvypr']['t']
-                t_pnext = pnext['_redvypr']['t']
-                dt = t_pnext - t_pnow
-                t_now = time.time()
-                if config['replace_time']:
-                    pnow['t'] = t_now
-                    pnow['_redvypr']['t'] = t_now
-
-                #print('sending',pnow)
-                dataqueue.put(pnow)
-                packets_published_file += 1
-                packets_published_total += 1
-                #print("ipacket",ipacket,npackets,filename)
-                if ipacket == npackets:
-                    FLAG_NEW_FILE = True
-                    dt_sleep = 0.2
-                    #print("Last packet published")
-                    db.close()
-                else:
-                    pnow = pnext
-                    pnext_all = db.get_packet_by_index(ipacket)
-                    pnext = pnext_all['data']
-                    ipacket += 1
-                    dt_packet = dt / speedup
-                    dt_packet_sum += dt_packet
-                    #print("dt_packet",dt_packet,speedup)
-                    if (dt_packet < 0):
-                        dt_packet = 0
-                        dt_sleep = 0.0
-                    elif (dt_packet <= 0.2):
-                        dt_sleep = dt_packet
-                    else:
-                        dt_sleep = 0.2
-                        logger_start.debug(funcname + ' Long dt_packet of {:f} seconds'.format(dt_packet))
-
-                    dt_packet_wait = dt_packet
-
-        time.sleep(dt_sleep)
-        dt_packet_wait -= dt_sleep
         # Status update
         if (time.time() - t_status) > dt_status:
             #print('status')
@@ -215,6 +298,9 @@ def start(device_info, config={'filename': ''}, dataqueue=None, datainqueue=None
             status_thread['packets_num'] = npackets
             statusqueue.put(status_thread)
 
+    if reader is not None:
+        reader.stop()
+
 
 #
 #
@@ -451,16 +537,12 @@ class initDeviceWidget(QtWidgets.QWidget):
 
         stat = self.inspect_data(filename,rescan=False)
         if True:
-            npackets = len(stat['packets_num'])
-            t_min = stat['packets_t'][0]
-            t_max = stat['packets_t'][-1]
+            npackets = stat['count']
             packetitem = QtWidgets.QTableWidgetItem(str(npackets))
             packetitem.setFlags(packetitem.flags() & ~QtCore.Qt.ItemIsEditable)
             self.inlist.setItem(row, self.col_npackets, packetitem)
-            tdmin = datetime.datetime.fromtimestamp(t_min)
-            tminstr = str(tdmin)
-            tdmax = datetime.datetime.fromtimestamp(t_max)
-            tmaxstr = str(tdmax)
+            tminstr = str(stat['min_timestamp'])
+            tmaxstr = str(stat['max_timestamp'])
             t_min_item = QtWidgets.QTableWidgetItem(tminstr)
             t_min_item.setFlags(t_min_item.flags() & ~QtCore.Qt.ItemIsEditable)
             t_max_item = QtWidgets.QTableWidgetItem(tmaxstr)
@@ -484,9 +566,12 @@ class initDeviceWidget(QtWidgets.QWidget):
 
         if (rescan or (FLAG_HASSTAT == False)):
             logger.debug(funcname + ': Scanning file {:s}'.format(filename))
-            p = packetreader(filename)
-            # stat = p.ipacketreadernspect_file()
-            self.file_statistics[filename] = p.filestat
+            # The statistics are read from the indices, the file is not scanned
+            db = RedvyprDbSqlite3(filename)
+            stat = db.get_stats()
+            stat['devices'] = db.get_devices()
+            db.close()
+            self.file_statistics[filename] = stat
         else:
             logger.debug(funcname + ': No rescan of {:s}'.format(filename))
 
@@ -501,6 +586,7 @@ class initDeviceWidget(QtWidgets.QWidget):
         for i in rows:
             filename = self.inlist.item(i,self.col_fname).text()
             #stat = self.inspect_data_thread(filename, i, rescan=False)
+            self.scan_file(filename, i)
 
         # Start a timer to update
         #if len(rows) > 0:
@@ -1,6 +1,7 @@
 from datetime import datetime, timezone
 from PyQt6 import QtWidgets, QtCore, QtGui
 import time
+import queue
 import logging
 import sys
 import pydantic
@@ -38,7 +39,7 @@ class DeviceCustomConfig(pydantic.BaseModel):
     zlib: bool = pydantic.Field(default=True,
                                 description='Flag if zlib compression shall be used for the netCDF data')
     size_newfile: int = pydantic.Field(default=500,
-                                       description='Size of object in RAM after which a new file is created')
+                                       description='Size of the file after which a new file is created')
     size_newfile_unit: typing.Literal['none', 'bytes', 'kB', 'MB'] = pydantic.Field(
         default='MB')
     datafolder: str = pydantic.Field(default='.',
@@ -52,6 +53,8 @@ class DeviceCustomConfig(pydantic.BaseModel):
                                          description='Dateformat used in the filename, must be understood by datetime.strftime')
     filecountformat: str = pydantic.Field(default='04',
                                           description='Format of the counter. Add zero if trailing zeros are wished, followed by number of digits. 04 becomes {:04d}')
+    batchsize: int = pydantic.Field(default=1000,
+                                    description='Maximum number of packets inserted within one transaction')
 
 redvypr_devicemodule = True
 
@@ -143,14 +146,33 @@ def start(device_info, config={'filename': ''}, dataqueue=None, datainqueue=None
     except:
         config['dt_sync'] = 5
 
+    batchsize = max(config.get('batchsize', 1000), 1)
     t_last = time.time()
     count = 0
     packets_written = 0
     statistics = create_data_statistic_dict()
     flag_new_file = True
+    flag_stop = False
     tfile = time.time()  # Save the time the file was created
     tupdate = time.time()
     numpackets_tmp = 0
+
+    nretry_insert = 3  # Number of attempts to insert a batch
+    dt_retry_insert = 0.5  # Seconds between attempts (e.g. a locked database)
+
+    def send_status(closed=False, error=None):
+        data_stat = {'_deviceinfo': {}}
+        data_stat['_deviceinfo']['filename'] = filename
+        data_stat['_deviceinfo']['filename_full'] = os.path.realpath(filename)
+        if closed:
+            data_stat['_deviceinfo']['closed'] = time.time()
+        if error is not None:
+            data_stat['_deviceinfo']['error'] = str(error)
+        data_stat['_deviceinfo']['created'] = tfile
+        data_stat['_deviceinfo']['bytes_written'] = bytes_written
+        data_stat['_deviceinfo']['packets_written'] = packets_written
+        statusqueue.put(data_stat)
+
     while True:
         tcheck = time.time()
 
@@ -159,24 +181,21 @@ def start(device_info, config={'filename': ''}, dataqueue=None, datainqueue=None
             logger_start.debug("Opening new file:{}".format(filename))
             count += 1
             # Create the database file
-            db = RedvyprDbSqlite3(filename)
+            db = RedvyprDbSqlite3(filename, wal=True)
             tfile = time.time()
             flag_new_file = False
-            bytes_written = 0
+            bytes_written = db.get_file_size()
             packets_written = 0
-            data_stat = {'_deviceinfo': {}}
-            data_stat['_deviceinfo']['filename'] = filename
-            data_stat['_deviceinfo']['filename_full'] = os.path.realpath(filename)
-            data_stat['_deviceinfo']['created'] = tfile
-            data_stat['_deviceinfo']['bytes_written'] = bytes_written
-            data_stat['_deviceinfo']['packets_written'] = packets_written
-            statusqueue.put(data_stat)
+            send_status()
+
+        # Wait for the first packet and read all available packets afterwards
+        rows = []
+        while len(rows) < batchsize:
+            try:
+                data = datainqueue.get(block=(len(rows) == 0), timeout=0.1)
+            except queue.Empty:
+                break
 
-        try:
-            data = datainqueue.get(block=False)
-        except:
-            data = None
-        if (data is not None):
             command = check_for_command(data, thread_uuid=device_info['thread_uuid'])
             # logger.debug('Got a command: {:s}'.format(str(data)))
             if (command is not None):
@@ -184,66 +203,67 @@ def start(device_info, config={'filename': ''}, dataqueue=None, datainqueue=None
                 logger.debug(sstr)
                 if command == 'stop':
                     logger.debug('Stopping')
-                    db.close()
-                    data_stat = {'_deviceinfo': {}}
-                    data_stat['_deviceinfo']['filename'] = filename
-                    data_stat['_deviceinfo']['filename_full'] = os.path.realpath(
-                        filename)
-                    data_stat['_deviceinfo']['closed'] = time.time()
-                    data_stat['_deviceinfo']['created'] = tfile
-                    data_stat['_deviceinfo']['bytes_written'] = bytes_written
-                    data_stat['_deviceinfo']['packets_written'] = packets_written
-                    statusqueue.put(data_stat)
-                    #dataqueue.put(data_stat)
+                    flag_stop = True
                     break
             else:
                 numpackets_tmp += 1
 
-            unix_time = data['_redvypr']['t']
-            timestamp = datetime.fromtimestamp(unix_time, tz=timezone.utc).isoformat()
-
-
-
+            try:
+                rows.append(db.packet_to_row(data))
+            except:
+                logger_start.info("Could not serialize data", exc_info=True)
 
-            # print("Inserting packet")
-            db.insert_packet(data,timestamp)
-            packets_written += 1
-            bytes_written = os.path.getsize(filename)
-            print("Packets written",packets_written,"bytes written",bytes_written)
+        if len(rows) > 0:
+            for iretry in range(nretry_insert):
+                try:
+                    bytes_written += db.insert_rows(rows)
+                    packets_written += len(rows)
+                    insert_error = None
+                    break
+                except Exception as e:
+                    insert_error = e
+                    logger_start.warning('Could not insert {} packets into {} (attempt {}/{}): {}'.format(
+                        len(rows), filename, iretry + 1, nretry_insert, e))
+                    time.sleep(dt_retry_insert)
+
+            if insert_error is not None:
+                logger_start.error('Stopping, {} packets could not be written to {}'.format(len(rows), filename),
+                                   exc_info=insert_error)
+                try:
+                    db.close()
+                except Exception:
+                    logger_start.warning('Could not close {}'.format(filename), exc_info=True)
+                bytes_written = db.get_file_size()
+                send_status(closed=True, error=insert_error)
+                return
+
+        if flag_stop:
+            db.close()
+            bytes_written = db.get_file_size()
+            send_status(closed=True)
+            #dataqueue.put(data_stat)
+            break
 
         if (time.time() - tupdate) > config['dt_sync']:
             packets_per_second = numpackets_tmp / (time.time() - t_last)
             t_last = time.time()
-            print("packets per second", packets_per_second)
+            logger_start.debug("Packets per second: {:.1f}".format(packets_per_second))
             numpackets_tmp = 0
             tupdate = time.time()
             if db.file_status == 'open':
-                db.commit()
-                data_stat = {'_deviceinfo': {}}
-                data_stat['_deviceinfo']['filename'] = filename
-                data_stat['_deviceinfo']['filename_full'] = os.path.realpath(filename)
-                data_stat['_deviceinfo']['created'] = tfile
-                data_stat['_deviceinfo']['bytes_written'] = bytes_written
-                data_stat['_deviceinfo']['packets_written'] = packets_written
-                statusqueue.put(data_stat)
+                # Correct the estimate of the file size
+                bytes_written = db.get_file_size()
+                send_status()
 
         if True:  # Check if a new file should be created, close the old one and write the header
             file_age = tcheck - tfile
             FLAG_TIME = (dtnews > 0) and (file_age >= dtnews)
             FLAG_SIZE = (sizenewb > 0) and (bytes_written >= sizenewb)
-            if FLAG_TIME or FLAG_SIZE and (db.file_status == 'open'):
+            if (FLAG_TIME or FLAG_SIZE) and (db.file_status == 'open'):
                 db.close()
+                bytes_written = db.get_file_size()
                 flag_new_file = True
-                data_stat = {'_deviceinfo': {}}
-                data_stat['_deviceinfo']['filename'] = filename
-                data_stat['_deviceinfo']['filename_full'] = os.path.realpath(filename)
-                data_stat['_deviceinfo']['closed'] = time.time()
-                data_stat['_deviceinfo']['created'] = tfile
-                data_stat['_deviceinfo']['bytes_written'] = bytes_written
-                data_stat['_deviceinfo']['packets_written'] = packets_written
-                statusqueue.put(data_stat)
-
-        time.sleep(0.1)
+                send_status(closed=True)
 
 
 #
@@ -315,7 +335,7 @@ class DeviceConfigWidget(QtWidgets.QWidget):
         edit.setValidator(onlyInt)
         self.size_newfile = edit
         self.size_newfile.setToolTip(
-            'Create a new file if N bytes of RAM are used.\nFilename is "filenamebase"_yyyymmdd_HHMMSS_count."ext".\nUse 0 to disable feature.')
+            'Create a new file if the file has N bytes.\nFilename is "filenamebase"_yyyymmdd_HHMMSS_count."ext".\nUse 0 to disable feature.')
         try:
             self.size_newfile.setText(str(self.device.custom_config.size_newfile))
         except Exception as e:
@@ -669,7 +689,12 @@ class RedvyprDeviceWidget(RedvyprdevicewidgetSimple):
                 except:
                     timestamp_closed = 'open'
 
+                if 'error' in statusdata:
+                    timestamp_closed += ', write error'
+
                 item = QtWidgets.QTableWidgetItem(timestamp_closed)
+                if 'error' in statusdata:
+                    item.setToolTip(statusdata['error'])
                 self.inlist.setItem(irow, 4, item)
 
             except:
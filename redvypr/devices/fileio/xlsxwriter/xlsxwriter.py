@@ -40,6 +40,11 @@ row_packetid = 5
 row_datakey = 6
 row_dataunit = 7
 row_firstdata = row_dataunit + 1
+header_labels = ['hostname', 'uuid', 'device', 'publisher', 'packetid', 'datakey']  # Labels of row_host to row_datakey
+colindex_numpacket = 0
+colindex_time = 1
+coloffset = colindex_time + 1
+nrows_max = 1048576 - row_firstdata  # Maximum number of data rows of a worksheet
 
 redvypr_devicemodule = True
 class DeviceBaseConfig(pydantic.BaseModel):
@@ -56,8 +61,11 @@ class DeviceCustomConfig(pydantic.BaseModel):
     dt_newfile_unit: typing.Literal['none','seconds','hours','days'] = pydantic.Field(default='seconds')
     dt_update: int = pydantic.Field(default=2,description='Time after which an upate is sent to the gui')
     datakey_expansionlevel: int = pydantic.Field(default=3, description='Level of the datakey expansionlevel')
-    size_newfile:int = pydantic.Field(default=500,description='Size of object in RAM after which a new file is created')
+    size_newfile:int = pydantic.Field(default=500,description='Size of object in RAM (size of the temporary files in constant_memory mode) after which a new file is created')
     size_newfile_unit: typing.Literal['none','bytes','kB','MB'] = pydantic.Field(default='MB')
+    nrows_newfile: int = pydantic.Field(default=0, description='Number of rows of a worksheet after which a new file is created, 0 for the maximum number of rows of a xlsx worksheet')
+    constant_memory: bool = pydantic.Field(default=False, description='Write the rows in order into temporary files (xlsxwriter constant_memory mode) instead of keeping the workbook in memory. Datakeys that appear after the header was written are continued in a new worksheet')
+    nbuffer: int = pydantic.Field(default=100, description='Number of rows buffered per worksheet before they are written')
     datafolder:str = pydantic.Field(default='./',description='Folder the data is saved to')
     fileextension:str= pydantic.Field(default='xlsx',description='File extension, if empty not used')
     fileprefix:str= pydantic.Field(default='redvypr',description='If empty not used')
@@ -97,7 +105,11 @@ def create_logfile(config,count=0,all_worksheets={}):
     logger.info(funcname + ' Will create a new file: {:s}'.format(filename))
 
     # Create a workbook and add a worksheet.
-    workbook = xlsxwriter.Workbook(filename,{'in_memory': True})
+    if config.get('constant_memory', False):
+        # The rows are written to temporary files and not kept in memory
+        workbook = xlsxwriter.Workbook(filename,{'constant_memory': True})
+    else:
+        workbook = xlsxwriter.Workbook(filename,{'in_memory': True})
     date_format = workbook.add_format({'num_format': time_format})
     header_format = workbook.add_format({'bold': True,'bg_color':'#F0F0F0'})
     text_wrap_format = workbook.add_format({'text_wrap': True})
@@ -105,6 +117,7 @@ def create_logfile(config,count=0,all_worksheets={}):
     all_worksheets['text_wrap_format'] = text_wrap_format
     formats = {}
     formats['date'] = date_format
+    formats['header'] = header_format
 
     worksheet_summary = workbook.add_worksheet('summary')
     # Write some information
@@ -113,80 +126,240 @@ def create_logfile(config,count=0,all_worksheets={}):
     redvypr_version_str = 'redvypr {}'.format(redvypr.version)
     worksheet_summary.write(1, 0, 'version')
     worksheet_summary.write(1, 1, redvypr_version_str)
+    worksheet_summary.write(2, 0, 'device')
+    worksheet_summary.write(2, 1, 'worksheet')
     all_worksheets['summary'] = worksheet_summary
     all_worksheets['metadata'] = workbook.add_worksheet('metadata')
     all_worksheets['metadata_indices'] = {'rows': [], 'columns': []}
     return [workbook,filename,formats]
 
-def write_metadata(workbook, all_worksheets, datakey, data, deviceinfo_all, device_info, config):
-    funcname = 'write_metadata():'
-    logger.debug(funcname)
-    raddress_tmp = redvypr_address.RedvyprAddress(data, datakey=datakey)
-    raddress_tmp_str = raddress_tmp.to_address_string('h,d,i,k')
-    metadata_tmp = packet_statistics.get_metadata_deviceinfo_all(deviceinfo_all, raddress_tmp)
-    header_rows = [(row_host, raddress_tmp.hostname, 'hostname')]
-    header_rows.append((row_uuid, raddress_tmp.uuid, 'uuid'))
-    header_rows.append((row_device, raddress_tmp.device, 'device'))
-    header_rows.append((row_publisher, raddress_tmp.publisher, 'publisher'))
-    header_rows.append((row_packetid, raddress_tmp.packetid, 'packetid'))
-    header_rows.append((row_datakey, datakey, 'datakey'))
-    for header_row in header_rows:
-        colindex = 0
-        all_worksheets['metadata'].write(header_row[0], colindex, header_row[1],
-                                                    all_worksheets['header_format'])
-        all_worksheets['metadata'].write(header_row[0], 0, header_row[2], all_worksheets['header_format'])
-    #device_worksheets[packet_address_str].write(lineindex, colindex, datawrite)
-    if len(metadata_tmp.keys())>0: # Check if something was found
-        mkeys = list(metadata_tmp.keys())
-        #print('-----')
-        #print('Got metadata keys',metadata_tmp)
+def get_header_values(paddress):
+    """
+    Returns the header values (hostname, uuid, device, publisher, packetid) of a packet address.
+    """
+    return (paddress.host, paddress.uuid, paddress.device, paddress.publisher, paddress.packetid)
+
+
+def get_worksheet_bytes(worksheet):
+    """
+    Returns the number of bytes of the row data of a worksheet in constant_memory mode, which are written to a
+    temporary file by xlsxwriter.
+    """
+    try:
+        return worksheet.row_data_fh.tell()
+    except Exception:
+        return 0
+
+
+class MetadataTable():
+    """
+    The content of the metadata worksheet, one column per address with the metadata keys as rows. The worksheet
+    is written when the file is closed, such that the rows are written in order (constant_memory mode).
+    """
+    def __init__(self):
+        self.metakeys = []
+        self.columns = {}  # Address string -> (header values, metadata)
+
+    def add(self, address_str, header_values, metadata):
+        if len(metadata) == 0:
+            return
+
+        self.columns[address_str] = (header_values, metadata)
+
+        for metakey in metadata.keys():
+            if metakey not in self.metakeys:
+                if metakey == 'unit':
+                    self.metakeys.insert(0, metakey)
+                else:
+                    self.metakeys.append(metakey)
+
+    def write(self, worksheet, header_format):
+        columns = list(self.columns.values())
+        for irow, header_label in enumerate(header_labels):
+            row = irow + row_host
+            worksheet.write(row, 0, header_label, header_format)
+            for icol, (header_values, metadata) in enumerate(columns):
+                worksheet.write(row, icol + 1, header_values[irow], header_format)
+
+        for irow, metakey in enumerate(self.metakeys):
+            row = irow + row_firstdata
+            worksheet.write(row, 0, metakey, header_format)
+            for icol, (header_values, metadata) in enumerate(columns):
+                try:
+                    datawrite = metadata[metakey]
+                except KeyError:
+                    continue
+                if not (isinstance(datawrite, (str, int, float))):
+                    datawrite = str(datawrite)
+                worksheet.write(row, icol + 1, datawrite)
+
+
+class WorksheetWriter():
+    """
+    The worksheet of one packet address. The column layout (datakeys, header and units) is cached and the rows are
+    buffered and written in order with flush(). In the constant_memory mode of xlsxwriter rows cannot be changed
+    after a following row was written, the header is therefore written with the first flush and get_columns()
+    returns None if a packet has datakeys that are not in the layout anymore, the packets need a new worksheet
+    then.
+    """
+    def __init__(self, worksheet, name, paddress, address_str, formats, constant_memory=False):
+        self.worksheet = worksheet
+        self.name = name
+        self.paddress = paddress
+        self.address_str = address_str
+        self.formats = formats
+        self.constant_memory = constant_memory
+        self.datakeys = []
+        self.colindex = {}
+        self.header = {}  # Datakey -> header values (hostname, uuid, device, publisher, packetid, datakey)
+        self.units = {}
+        self.layouts = {}  # Tuple of datakeys -> column indices
+        self.rows = []
+        self.numline = 0  # Number of rows written
+        self.header_written = False
+
+    @property
+    def nrows(self):
+        """
+        Number of data rows, written and buffered.
+        """
+        return self.numline + len(self.rows)
+
+    def get_columns(self, datakeys, header_values, get_unit):
+        """
+        Returns the column indices of the datakeys, new datakeys are appended to the layout. Returns None if the
+        layout cannot be changed anymore.
+        """
         try:
-            datakey_unit = metadata_tmp['unit']
-            mkeys.remove('unit')
-            mkeys.insert(0,'unit')
-        except:
-            datakey_unit = None
+            return self.layouts[datakeys]
+        except KeyError:
+            pass
 
-        for metakey in mkeys:
-            # Get the rows and columns
-            try:
-                rowind = all_worksheets['metadata_indices']['rows'].index(metakey)
-                rowind_write = rowind + row_firstdata
-            except:
-                all_worksheets['metadata_indices']['rows'].append(metakey)
-                rowind = all_worksheets['metadata_indices']['rows'].index(metakey)
-                rowind_write = rowind + row_firstdata
-                colind_datakey = 0
-                # Write the metakey in the correct row
-                #all_worksheets['metadata'].write(row_firstdata, 0, 'Metadata key')
-                all_worksheets['metadata'].write(rowind_write, colind_datakey, metakey, all_worksheets['header_format'])
-
-            # And finally write the metadata
+        datakeys_new = [datakey for datakey in datakeys if datakey not in self.colindex]
+        if len(datakeys_new) > 0 and self.constant_memory and self.header_written:
+            return None
+
+        for datakey in datakeys_new:
+            self.colindex[datakey] = len(self.datakeys) + coloffset
+            self.datakeys.append(datakey)
+            self.header[datakey] = header_values + (datakey,)
+            self.units[datakey] = get_unit(datakey)
+            if self.header_written:
+                self.write_column_header(datakey)
+
+        columns = [self.colindex[datakey] for datakey in datakeys]
+        self.layouts[datakeys] = columns
+        return columns
+
+    def copy_layout(self, worksheet_writer):
+        """
+        Copies the column layout of another worksheet, used if the packets are continued in a new worksheet.
+        """
+        for datakey in worksheet_writer.datakeys:
+            self.colindex[datakey] = worksheet_writer.colindex[datakey]
+            self.datakeys.append(datakey)
+            self.header[datakey] = worksheet_writer.header[datakey]
+            self.units[datakey] = worksheet_writer.units[datakey]
+
+    def update_units(self, get_unit):
+        """
+        Updates the units after new metadata was received, in constant_memory mode only before the header was written.
+        """
+        for datakey in self.datakeys:
+            unit = get_unit(datakey)
+            if unit != self.units[datakey]:
+                self.units[datakey] = unit
+                if self.header_written and not self.constant_memory:
+                    self.write_unit(datakey)
+
+    def add_row(self, numpacket, datatime, columns, values):
+        self.rows.append((numpacket, datatime, columns, values))
+
+    def write_unit(self, datakey):
+        unit = self.units[datakey]
+        if unit is None:
+            unit = ''
+        self.worksheet.write(row_dataunit, self.colindex[datakey], unit, self.formats['header'])
+
+    def write_column_header(self, datakey):
+        colindex = self.colindex[datakey]
+        for irow, header_value in enumerate(self.header[datakey]):
+            self.worksheet.write(irow + row_host, colindex, header_value, self.formats['header'])
+        self.write_unit(datakey)
+
+    def write_header(self):
+        worksheet = self.worksheet
+        header_format = self.formats['header']
+        worksheet.write(row_address, 0, 'Address', header_format)
+        worksheet.write(row_address, 1, self.address_str, header_format)
+        # Write the header row by row
+        for irow, header_label in enumerate(header_labels):
+            row = irow + row_host
+            worksheet.write(row, 0, header_label, header_format)
+            if row == row_datakey:
+                worksheet.write(row, colindex_time, 'Excel time', header_format)
+            else:
+                worksheet.write(row, colindex_time, '', header_format)
+            for datakey in self.datakeys:
+                worksheet.write(row, self.colindex[datakey], self.header[datakey][irow], header_format)
+
+        worksheet.write(row_dataunit, colindex_numpacket, '#', header_format)
+        worksheet.write(row_dataunit, colindex_time, time_format, header_format)
+        for datakey in self.datakeys:
+            self.write_unit(datakey)
+
+        if self.constant_memory:  # Autofit is not available, set the widths from the header
+            worksheet.set_column(colindex_time, colindex_time, len(time_format) + 2)
+            for datakey in self.datakeys:
+                width = max(len(str(v)) for v in self.header[datakey])
+                worksheet.set_column(self.colindex[datakey], self.colindex[datakey], min(width + 2, 50))
+
+        self.header_written = True
+
+    def flush(self):
+        """
+        Writes the header (if not done yet) and the buffered rows.
+        """
+        if not self.header_written:
+            self.write_header()
+
+        worksheet = self.worksheet
+        write = worksheet.write
+        date_format = self.formats['date']
+        lineindex = row_firstdata + self.numline
+        for numpacket, datatime, columns, values in self.rows:
+            write(lineindex, colindex_numpacket, numpacket)
+            worksheet.write_datetime(lineindex, colindex_time, datatime, date_format)
+            for colindex, datawrite in zip(columns, values):
+                write(lineindex, colindex, datawrite)
+            lineindex += 1
+
+        self.numline += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if not self.constant_memory:
             try:
-                colind = all_worksheets['metadata_indices']['columns'].index(raddress_tmp_str)
-                colind_write = colind + 1
+                self.worksheet.autofit()
             except:
-                try:
-                    all_worksheets['metadata_indices']['columns'].append(raddress_tmp_str)
-                    colind = all_worksheets['metadata_indices']['columns'].index(raddress_tmp_str)
-                    colind_write = colind + 1
-                    rowind_write_col = 0
-                    #all_worksheets['metadata'].write(rowind_write_col, colind_write, raddress_tmp_str,all_worksheets['header_format'])
-                    #all_worksheets['metadata'].write(rowind_write_col+1, colind_write, raddress_tmp_str_full,all_worksheets['header_format'])
-                    for header_row in header_rows:
-                        all_worksheets['metadata'].write(header_row[0], colind_write, header_row[1],
-                                                         all_worksheets['header_format'])
-
-                except:
-                    logger.info('Error',exc_info=True)
+                logger.info('Could not autofit {}'.format(self.name), exc_info=True)
 
 
-            #print('Writing metadata for address')
-            datawrite = metadata_tmp[metakey]
-            all_worksheets['metadata'].write(rowind_write, colind_write, datawrite)
+def get_datakeys(data, expansionlevel):
+    """
+    Returns the (expanded) datakeys of a packet, the time 't' is always the first datakey. The second item is a list of
+    flags if the datakey is a key of the packet itself, otherwise the data has to be accessed via Datapacket.
+    """
+    datapacket = data_packets.Datapacket(data)
+    datakeys = datapacket.datakeys(expand=expansionlevel, return_type='list')
+    if 't' in datakeys:
+        datakeys.remove('t')
+    datakeys.insert(0, 't')
+    datakeys = tuple(datakeys)
+    datakeys_plain = [(datakey in data) for datakey in datakeys]
+    return datakeys, datakeys_plain
 
-        all_worksheets['metadata'].autofit()
-        return datakey_unit
 
 def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=None):
     funcname = __name__ + '.start()'
@@ -195,10 +368,11 @@ def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=Non
     funcname = __name__ + '.start()'
     logger_start.debug(funcname + ':Opening writing:')
     #print('Config',config)
-    data_write_to_file = [] # List of columns to be written to file
     count = 0
     all_worksheets = {}
     deviceinfo_all = None
+    deviceinfo_mirror = packet_statistics.DeviceinfoMirror()  # Local copy of deviceinfo_all, updated with patches
+    constant_memory = config.get('constant_memory', False)
     if True:
         try:
             dtneworig = config['dt_newfile']
@@ -235,20 +409,31 @@ def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=Non
         except:
             logger_start.debug("Could not open new file",exc_info=True)
             sizenewb = 0  # Size in bytes
-            
+
+        # The number of rows of a worksheet is limited in xlsx files
+        nrows_newfile = config.get('nrows_newfile', 0)
+        if (nrows_newfile <= 0) or (nrows_newfile > nrows_max):
+            nrows_newfile = nrows_max
+        else:
+            logger_start.info(funcname + ' Will create new file every {:d} rows.'.format(nrows_newfile))
+
     try:
         config['dt_sync']
     except:
         config['dt_sync'] = 5
 
+    nbuffer = max(config.get('nbuffer', 100), 1)
     bytes_written = 0
     packets_written = 0
     bytes_written_total = 0
     packets_written_total = 0
-    device_worksheets = {} # The extended info of the worksheets for the devices
+    device_worksheets = {} # The worksheet writers for the packet addresses
     device_worksheets_reduced = {} # The worksheets for the devices
     device_worksheets_indices = {}
     numworksheet = 0
+    metadata_table = MetadataTable()
+    datakeys_cache = {}  # (packet address, schema fingerprint) -> (datakeys, datakeys_plain)
+    metadata_cache = {}  # (packet address, datakey) -> metadata
     [workbook,filename,formats] = create_logfile(config,count,all_worksheets)
     worksheet_summary = all_worksheets['summary']
 
@@ -261,6 +446,170 @@ def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=Non
     dataqueue.put(data_stat)
     count += 1
 
+    def get_metadata(paddress, datakey):
+        try:
+            return metadata_cache[(paddress, datakey)]
+        except KeyError:
+            pass
+
+        metadata = {}
+        if deviceinfo_all is not None:
+            raddress_datakey = redvypr_address.RedvyprAddress(paddress, datakey=datakey)
+            try:
+                metadata = packet_statistics.get_metadata(deviceinfo_all, raddress_datakey, mode='merge')
+            except:
+                logger_start.debug('Could not get metadata for {}'.format(raddress_datakey), exc_info=True)
+
+            header_values = get_header_values(paddress) + (datakey,)
+            metadata_table.add(raddress_datakey.to_address_string('h,d,i,k'), header_values, metadata)
+
+        metadata_cache[(paddress, datakey)] = metadata
+        return metadata
+
+    def get_unit_function(paddress):
+        def get_unit(datakey):
+            datakey_unit = get_metadata(paddress, datakey).get('unit')
+            if (datakey == 't') and (datakey_unit is None):
+                datakey_unit = 'unix time'
+            return datakey_unit
+
+        return get_unit
+
+    def add_worksheet(paddress, packet_address_str):
+        nonlocal numworksheet
+        numworksheet += 1
+        devicename = paddress.device.replace('/','_').replace('[','_').replace(']','_').replace('\\','_').replace('*','_').replace(':','_')
+        packet_address_str_xlsx = '{:02d}_{}'.format(numworksheet,devicename)
+        if len(packet_address_str_xlsx) > 31:
+            packet_address_str_xlsx = packet_address_str_xlsx[0:31]
+
+        worksheet_summary.write(numworksheet + numworksheet_offset, 0, packet_address_str)
+        worksheet_summary.write(numworksheet + numworksheet_offset, 1, packet_address_str_xlsx)
+        logger_start.debug('Will create workbook for {}'.format(packet_address_str_xlsx))
+        worksheet = workbook.add_worksheet(packet_address_str_xlsx)
+        device_worksheets[packet_address_str] = WorksheetWriter(worksheet, packet_address_str_xlsx, paddress,
+                                                                packet_address_str, formats,
+                                                                constant_memory=constant_memory)
+        device_worksheets_indices[packet_address_str] = {'datakeys':[],'numline':0,'colindex':{}}
+        device_worksheets_indices[packet_address_str]['worksheet'] = packet_address_str_xlsx
+        device_worksheets_reduced[packet_address_str] = "worksheet: {}, #written: {}".format(packet_address_str_xlsx,0)
+        try:
+            file_status[filename]['worksheets']
+        except:
+            file_status[filename] = {'worksheets':{}}
+        try:
+            file_status_reduced[filename]['worksheets']
+        except:
+            file_status_reduced[filename] = {'worksheets': {}}
+
+        data_stat = {'_deviceinfo': {}}
+        file_status[filename]['worksheets'][packet_address_str] = device_worksheets_indices[packet_address_str]
+        file_status_reduced[filename]['worksheets'] = device_worksheets_reduced
+        data_stat['_deviceinfo']['file_status'] = file_status
+        data_stat['_deviceinfo']['file_status_reduced'] = file_status_reduced
+        dataqueue.put(data_stat)
+        return device_worksheets[packet_address_str]
+
+    def update_worksheet_indices(packet_address_str):
+        worksheet_writer = device_worksheets[packet_address_str]
+        indices = device_worksheets_indices[packet_address_str]
+        indices['datakeys'] = list(worksheet_writer.datakeys)
+        indices['colindex'] = dict(worksheet_writer.colindex)
+        indices['numline'] = worksheet_writer.nrows
+        indices['worksheet'] = worksheet_writer.name
+        device_worksheets_reduced[packet_address_str] = "worksheet: {}, numkeys: {}, numlines: {}".format(
+            worksheet_writer.name, len(worksheet_writer.datakeys), worksheet_writer.nrows)
+
+    def close_workbook():
+        for packet_address_str, worksheet_writer in device_worksheets.items():
+            try:
+                worksheet_writer.close()
+            except:
+                logger_start.info(funcname + 'Could not write {}'.format(worksheet_writer.name), exc_info=True)
+
+        metadata_table.write(all_worksheets['metadata'], formats['header'])
+        if not constant_memory:
+            try:
+                worksheet_summary.autofit()
+                all_worksheets['metadata'].autofit()
+            except:
+                logger_start.info(funcname + 'Could not autofit summary',exc_info=True)
+
+        workbook.close()
+
+    def write_packet(data):
+        """
+        Adds the packet to the rows of its worksheet, returns True if the worksheet has nrows_newfile rows.
+        """
+        nonlocal packets_written, packets_written_total
+        paddress = redvypr_address.packet_address(data)
+        packet_address_str = paddress.to_address_string(address_format)
+        try:
+            worksheet_writer = device_worksheets[packet_address_str]
+        except KeyError:
+            worksheet_writer = add_worksheet(paddress, packet_address_str)
+
+        # Get the datakeys, cached for packets with the same schema
+        try:
+            fingerprint = packet_statistics.get_schema_fingerprint(data)
+            datakeys, datakeys_plain = datakeys_cache[(paddress, fingerprint)]
+        except KeyError:
+            datakeys, datakeys_plain = get_datakeys(data, config['datakey_expansionlevel'])
+            datakeys_cache[(paddress, fingerprint)] = (datakeys, datakeys_plain)
+
+        columns = worksheet_writer.get_columns(datakeys, get_header_values(paddress),
+                                               get_unit_function(paddress))
+        if columns is None:
+            # New datakeys after the header was written, continue in a new worksheet
+            logger_start.info('New datakeys for {}, continuing in a new worksheet'.format(packet_address_str))
+            worksheet_writer_old = worksheet_writer
+            worksheet_writer_old.flush()
+            worksheet_writer = add_worksheet(paddress, packet_address_str)
+            worksheet_writer.copy_layout(worksheet_writer_old)
+            columns = worksheet_writer.get_columns(datakeys, get_header_values(paddress),
+                                                   get_unit_function(paddress))
+
+        # Write data
+        try:
+            datatime_unix = data['t']
+        except:
+            datatime_unix = data['_redvypr']['t']
+
+        try:
+            numpacket = data['_redvypr']['numpacket']
+        except:
+            numpacket = -1
+
+        datapacket = None
+        values = []
+        for datakey, plain in zip(datakeys, datakeys_plain):
+            if plain:
+                datawrite = data[datakey]
+            elif datakey == 't':
+                datawrite = datatime_unix
+            else:
+                if datapacket is None:
+                    datapacket = data_packets.Datapacket(data)
+                datawrite = datapacket[datakey]
+
+            if not(isinstance(datawrite,str)) and not(isinstance(datawrite,int)) and not(isinstance(datawrite,float)):
+                #print('Datatype {} not supported, converting data to str'.format(str(type(datawrite))))
+                datawrite = str(datawrite)
+
+            values.append(datawrite)
+
+        datatime = datetime.datetime.fromtimestamp(datatime_unix)
+        worksheet_writer.add_row(numpacket, datatime, columns, values)
+        if len(worksheet_writer.rows) >= nbuffer:
+            worksheet_writer.flush()
+
+        packets_written += 1
+        packets_written_total += 1
+        return worksheet_writer.nrows >= nrows_newfile
+
+    address_metadata = redvypr_address.RedvyprAddress(redvypr.metadata_address)
+    address_format = 'h,p,d'
+    numworksheet_offset = 2
     tfile = time.time() # Save the time the file was created
     tflush = time.time() # Save the time the file was created
     tupdate = time.time() # Save the time for the update timing
@@ -271,174 +620,53 @@ def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=Non
         tcheck = time.time()
         # Flush file on regular basis
         if ((time.time() - tflush) > config['dt_sync']):
-            #print('Flushing, not implemented (yet)')
-            bytes_written = pympler.asizeof.asizeof(workbook)
+            for worksheet_writer in device_worksheets.values():
+                worksheet_writer.flush()
+            if constant_memory:
+                bytes_written = sum(get_worksheet_bytes(w.worksheet) for w in device_worksheets.values())
+            else:
+                bytes_written = pympler.asizeof.asizeof(workbook)
             #print('Bytes written',bytes_written)
             tflush = time.time()
 
-        time.sleep(0.05)
-        while(datainqueue.empty() == False):
+        FLAG_NROWS = False
+        try:
+            data = datainqueue.get(timeout=0.05)
+        except queue.Empty:
+            data = None
+
+        while data is not None:
             try:
-                data = datainqueue.get(block=False)
-                packet_address = redvypr.RedvyprAddress(data)
                 #print('xlsxlogger: Got data',data)
+                [command,comdata] = data_packets.check_for_command(data, thread_uuid=device_info['thread_uuid'], add_data=True)
+                if (command is not None):
+                    logger_start.debug('Command: {:s}'.format(str(command)))
+                    if(command == 'stop'):
+                        logger_start.debug('Stop command')
+                        FLAG_RUN = False
+                        break
+
+                    if (command == 'info'):
+                        logger_start.debug('Metadata command')
+                        if deviceinfo_mirror.update(data) is not None:
+                            deviceinfo_all = deviceinfo_mirror.deviceinfo_all
+                            metadata_cache.clear()
+                            for packet_address_str, worksheet_writer in device_worksheets.items():
+                                worksheet_writer.update_units(get_unit_function(worksheet_writer.paddress))
+                        elif deviceinfo_mirror.resync_needed:
+                            dataqueue.put(deviceinfo_mirror.resync_packet())
 
-                if (data is not None):
-                    [command,comdata] = data_packets.check_for_command(data, thread_uuid=device_info['thread_uuid'], add_data=True)
-                    if (command is not None):
-                        logger_start.debug('Command: {:s}'.format(str(command)))
-                        if(command == 'stop'):
-                            logger_start.debug('Stop command')
-                            FLAG_RUN = False
-                            break
-
-                        if (command == 'info'):
-                            logger_start.debug('Metadata command')
-                            if packet_address.packetid == 'metadata':
-                                deviceinfo_all = data['deviceinfo_all']
-
-                #statistics = data_packets.do_data_statistics(data,statistics)
-                address_format = 'h,p,d'
-                packet_address_str = packet_address.to_address_string(address_format)
-                colindex_time = 1
-                colindex_numpacket = 0
-                coloffset = colindex_time + 1
                 # Ignore some packages
-                if redvypr_address.RedvyprAddress(redvypr.metadata_address)(data,strict=False):
+                if address_metadata(data,strict=False):
                     logger_start.debug('Ignoring metadata packet')
-                    continue
-
-                try:
-                    device_worksheets[packet_address_str]
-                except:
-                    numworksheet += 1
-                    numworksheet_offset = 2
-                    devicename = packet_address.device.replace('/','_').replace('[','_').replace(']','_').replace('\\','_').replace('*','_').replace(':','_')
-                    packet_address_str_xlsx = '{:02d}_{}'.format(numworksheet,devicename)
-                    if len(packet_address_str_xlsx) > 31:
-                        packet_address_str_xlsx = packet_address_str_xlsx[0:31]
-
-                    worksheet_summary.write(numworksheet_offset, 0, 'device')
-                    worksheet_summary.write(numworksheet_offset, 1, 'worksheet')
-                    worksheet_summary.write(numworksheet + numworksheet_offset, 0, packet_address_str)
-                    worksheet_summary.write(numworksheet + numworksheet_offset, 1, packet_address_str_xlsx)
-                    logger_start.debug('Will create workbook for {}'.format(packet_address_str_xlsx))
-                    device_worksheets[packet_address_str] = workbook.add_worksheet(packet_address_str_xlsx)
-                    device_worksheets_indices[packet_address_str] = {'datakeys':[],'numline':0,'colindex':{}}
-                    device_worksheets_indices[packet_address_str]['worksheet'] = packet_address_str_xlsx
-                    device_worksheets_reduced[packet_address_str] = "worksheet: {}, #written: {}".format(packet_address_str_xlsx,0)
-                    #
-                    device_worksheets[packet_address_str].write(row_address,0,'Address',all_worksheets['header_format'])
-                    device_worksheets[packet_address_str].write(row_address,1,packet_address_str,all_worksheets['header_format'])
-                    #
-                    device_worksheets[packet_address_str].write(row_datakey, colindex_time, 'Excel time',all_worksheets['header_format'])
-                    for row in range(row_host,row_datakey):
-                        device_worksheets[packet_address_str].write(row, colindex_time, '',
-                                                                    all_worksheets['header_format'])
-                    device_worksheets[packet_address_str].write(row_dataunit, colindex_time, time_format,all_worksheets['header_format'])
-                    device_worksheets[packet_address_str].write(row_datakey, colindex_numpacket, 'Numpacket',all_worksheets['header_format'])
-                    device_worksheets[packet_address_str].write(row_dataunit, colindex_numpacket, '#',all_worksheets['header_format'])
-                    try:
-                        file_status[filename]['worksheets']
-                    except:
-                        file_status[filename] = {'worksheets':{}}
-                    try:
-                        file_status_reduced[filename]['worksheets']
-                    except:
-                        file_status_reduced[filename] = {'worksheets': {}}
-
-                    data_stat = {'_deviceinfo': {}}
-                    file_status[filename]['worksheets'][packet_address_str] = device_worksheets_indices[packet_address_str]
-                    file_status_reduced[filename]['worksheets'] = device_worksheets_reduced
-                    data_stat['_deviceinfo']['file_status'] = file_status
-                    data_stat['_deviceinfo']['file_status_reduced'] = file_status_reduced
-                    dataqueue.put(data_stat)
-
-                # Write data
-                if True:
-                    try:
-                        data['t']
-                    except:
-                        data['t'] = data['_redvypr']['t']
-
-                    try:
-                        numpacket = data['_redvypr']['numpacket']
-                    except:
-                        numpacket = -1
-
-                    datapacket = data_packets.Datapacket(data)
-                    datakeys = datapacket.datakeys(expand=config['datakey_expansionlevel'],return_type='list')
-                    #print('datakeys',datakeys)
-                    lineindex = row_firstdata + device_worksheets_indices[packet_address_str]['numline']
-                    # Write numpacket
-                    device_worksheets[packet_address_str].write(lineindex, colindex_numpacket, numpacket)
-                    # Write time
-                    datakeys.remove('t')
-                    datakeys.insert(0,'t')
-                    datatime = datetime.datetime.fromtimestamp(data['t'])
-                    device_worksheets[packet_address_str].write_datetime(lineindex, colindex_time, datatime,formats['date'])
-                    # Write data in datakeys
-                    for datakey in datakeys:
-                        raddress_datakey = redvypr_address.RedvyprAddress(data, datakey=datakey)
-                        # Get metadata
-                        if deviceinfo_all is not None:
-                            datakey_unit = write_metadata(workbook, all_worksheets, datakey, data, deviceinfo_all, device_info, config)
-                        else:
-                            #print('No metadata to check for')
-                            datakey_unit = None
-
-                        if (datakey == 't') and (datakey_unit is None):
-                            datakey_unit = 'unix time'
-
-                        try:
-                            colindex = device_worksheets_indices[packet_address_str]['colindex'][datakey]
-                        except:
-                            device_worksheets_indices[packet_address_str]['datakeys'].append(datakey)
-                            colindex = len(device_worksheets_indices[packet_address_str]['datakeys']) - 1 + coloffset
-                            device_worksheets_indices[packet_address_str]['colindex'][datakey] = colindex
-                            header_rows = [(row_host,raddress_datakey.hostname,'hostname')]
-                            header_rows.append((row_uuid, raddress_datakey.uuid,'uuid'))
-                            header_rows.append((row_device, raddress_datakey.device,'device'))
-                            header_rows.append((row_publisher, raddress_datakey.publisher,'publisher'))
-                            header_rows.append((row_packetid, raddress_datakey.packetid,'packetid'))
-                            header_rows.append((row_datakey, datakey,'datakey'))
-                            for header_row in header_rows:
-                                device_worksheets[packet_address_str].write(header_row[0],colindex,header_row[1],
-                                                                            all_worksheets['header_format'])
-                                device_worksheets[packet_address_str].write(header_row[0], 0, header_row[2],
-                                                                            all_worksheets['header_format'])
-
-
-                            #device_worksheets[packet_address_str].write(row_datakey,colindex,datakey,all_worksheets['header_format'])
-
-
-                        if datakey_unit is not None:
-                            device_worksheets[packet_address_str].write(row_dataunit, colindex, datakey_unit,all_worksheets['header_format'])
-                        else:
-                            datakey_unit_tmp = ''
-                            device_worksheets[packet_address_str].write(row_dataunit, colindex, datakey_unit_tmp,
-                                                                        all_worksheets['header_format'])
-                        #print('Will write data from {} to column {} and line {}'.format(packet_address_str, colindex,lineindex))
-                        datawrite = datapacket[datakey]
-                        if not(isinstance(datawrite,str)) and not(isinstance(datawrite,int)) and not(isinstance(datawrite,float)):
-                            #print('Datatype {} not supported, converting data to str'.format(str(type(datawrite))))
-                            datawrite = str(datawrite)
-
-                        device_worksheets[packet_address_str].write(lineindex, colindex, datawrite)
-
-                    device_worksheets_indices[packet_address_str]['numline'] += 1
-                    numline = device_worksheets_indices[packet_address_str]['numline']
-                    numkeys = len(device_worksheets_indices[packet_address_str]['datakeys'])
-                    worksheet_tmp = device_worksheets_indices[packet_address_str]['worksheet']
-                    device_worksheets_reduced[packet_address_str] = "worksheet: {}, numkeys: {}, numlines: {}".format(
-                        worksheet_tmp, numkeys, numline)
-                    #size = sys.getsizeof(workbook)
-                    packets_written += 1
-                    #print('Size:',size)
+                elif write_packet(data):
+                    FLAG_NROWS = True
 
                 # Send statistics
                 if ((time.time() - tupdate) > config['dt_update']):
                     tupdate = time.time()
+                    for packet_address_str in device_worksheets:
+                        update_worksheet_indices(packet_address_str)
                     data_stat = {'_deviceinfo': {}}
                     data_stat['_deviceinfo']['filename'] = filename
                     data_stat['_deviceinfo']['filename_full'] = os.path.realpath(filename)
@@ -451,30 +679,20 @@ def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=Non
 
             except:
                 logger_start.debug('Could not write data',exc_info=True)
-                #logger.exception(e)
-                #logger.debug(funcname + ':Exception:' + str(e))
-                # print(data)
+
+            if FLAG_NROWS:
+                break
+            try:
+                data = datainqueue.get(block=False)
+            except queue.Empty:
+                data = None
 
         if True: # Check if a new file should be created, close the old one and write the header
             file_age = tcheck - tfile
             FLAG_TIME = (dtnews > 0) and (file_age >= dtnews)
             FLAG_SIZE = (sizenewb > 0) and (bytes_written >= sizenewb)
-            if FLAG_TIME or FLAG_SIZE or (FLAG_RUN == False):
-                # Autofit
-                #print('Autofit')
-                if True:
-                    try:
-                        worksheet_summary.autofit()
-                    except:
-                        logger_start.info(funcname + 'Could not autofit summary',exc_info=True)
-                    for w in device_worksheets:
-                        try:
-                            device_worksheets[w].autofit()
-                        except:
-                            logger_start.info(funcname + 'Could not autofit {}'.format(w), exc_info=True)
-                # Make the Excel time column wider, autofit does not work properly here
-                #device_worksheets[w].set_column(colindex_time, colindex_time, 25)
-                workbook.close()
+            if FLAG_TIME or FLAG_SIZE or FLAG_NROWS or (FLAG_RUN == False):
+                close_workbook()
                 data_stat = {'_deviceinfo': {}}
                 data_stat['_deviceinfo']['filename'] = filename
                 data_stat['_deviceinfo']['filename_full'] = os.path.realpath(filename)
@@ -492,8 +710,11 @@ def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=Non
                     device_worksheets_reduced = {}  # The worksheets for the devices
                     device_worksheets_indices = {}
                     numworksheet = 0
+                    metadata_table = MetadataTable()
+                    metadata_cache.clear()
                     [workbook, filename, formats] = create_logfile(config, count, all_worksheets)
                     worksheet_summary = all_worksheets['summary']
+                    count += 1
                     data_stat = {'_deviceinfo': {}}
                     data_stat['_deviceinfo']['filename'] = filename
                     data_stat['_deviceinfo']['filename_full'] = os.path.realpath(filename)
@@ -503,8 +724,6 @@ def start(device_info, config, dataqueue=None, datainqueue=None, statusqueue=Non
                     dataqueue.put(data_stat)
 
 
-
-
 class Device(RedvyprDevice):
     """
     xlsxwriter device
@@ -613,6 +832,17 @@ class initDeviceWidget(QtWidgets.QWidget):
         except Exception as e:
             self.size_newfile.setText('0')
             
+        # Number of rows for new file
+        edit = QtWidgets.QLineEdit(self)
+        onlyInt = QtGui.QIntValidator()
+        edit.setValidator(onlyInt)
+        self.nrows_newfile = edit
+        self.nrows_newfile.setToolTip('Create a new file if a worksheet has N rows.\nUse 0 to disable feature.')
+        self.nrows_newfile.setText(str(self.device.custom_config.nrows_newfile))
+        self.constant_memory_check = QtWidgets.QCheckBox('Constant memory')
+        self.constant_memory_check.setToolTip('Write the rows into temporary files instead of keeping the workbook in memory')
+        self.constant_memory_check.setChecked(self.device.custom_config.constant_memory)
+
         self.newfiletimecombo = QtWidgets.QComboBox()
         times = typing.get_args(self.device.custom_config.model_fields['dt_newfile_unit'].annotation)
         timeunit = self.device.custom_config.dt_newfile_unit
@@ -641,6 +871,8 @@ class initDeviceWidget(QtWidgets.QWidget):
         self.newfilelayout.addRow(sizelabel)
         self.newfilelayout.addRow(self.dt_newfile,self.newfiletimecombo)
         self.newfilelayout.addRow(self.size_newfile,self.newfilesizecombo)
+        self.newfilelayout.addRow(self.nrows_newfile,QtWidgets.QLabel('rows'))
+        self.newfilelayout.addRow(self.constant_memory_check)
         
         # Filenamelayout
         self.folder_text = QtWidgets.QLineEdit('')
@@ -723,6 +955,8 @@ class initDeviceWidget(QtWidgets.QWidget):
             self.extension_text.editingFinished.connect(self.update_device_config)
             self.newfilesizecombo.currentIndexChanged.connect(self.update_device_config)
             self.newfiletimecombo.currentIndexChanged.connect(self.update_device_config)
+            self.nrows_newfile.editingFinished.connect(self.update_device_config)
+            self.constant_memory_check.stateChanged.connect(self.update_device_config)
         else:
             self.prefix_check.stateChanged.disconnect()
             self.postfix_check.stateChanged.disconnect()
@@ -736,6 +970,8 @@ class initDeviceWidget(QtWidgets.QWidget):
             self.extension_text.editingFinished.disconnect()
             self.newfilesizecombo.currentIndexChanged.disconnect()
             self.newfiletimecombo.currentIndexChanged.disconnect()
+            self.nrows_newfile.editingFinished.disconnect()
+            self.constant_memory_check.stateChanged.disconnect()
 
 
     def get_datafolder(self):
@@ -808,6 +1044,8 @@ class initDeviceWidget(QtWidgets.QWidget):
                 break
 
         self.size_newfile.setText(str(config.size_newfile))
+        self.nrows_newfile.setText(str(config.nrows_newfile))
+        self.constant_memory_check.setChecked(config.constant_memory)
 
         if len(config.datafolder)>0:
             self.folder_text.setText(config.datafolder)
@@ -839,6 +1077,8 @@ class initDeviceWidget(QtWidgets.QWidget):
         config.dt_newfile_unit = self.newfiletimecombo.currentText()
         config.size_newfile = int(self.size_newfile.text())
         config.size_newfile_unit = self.newfilesizecombo.currentText()
+        config.nrows_newfile = int(self.nrows_newfile.text())
+        config.constant_memory = self.constant_memory_check.isChecked()
 
         config.datafolder = self.folder_text.text()
 
@@ -22,6 +22,7 @@ from redvypr.device import RedvyprDevice
 from redvypr.data_packets import check_for_command
 import redvypr.redvypr_address as redvypr_address
 import redvypr.packet_statistic as packet_statistic
+import redvypr.packet_codec as packet_codec
 from redvypr.widgets.pydanticConfigWidget import dictQTreeWidget
 from redvypr.widgets.standard_device_widgets import displayDeviceWidget_standard
 
@@ -51,7 +52,7 @@ class DeviceCustomConfig(pydantic.BaseModel):
     protocol: typing.Literal['tcp', 'udp'] = pydantic.Field(default='tcp', description= 'The network protocol used.')
     direction: typing.Literal['publish', 'receive'] = pydantic.Field(default='tcp', description='Publishing or receiving data.')
     datakey: str = pydantic.Field(default='all', description='Datakey to store data, this is used if serialize is raw or str')
-    serialize: typing.Literal['yaml','str','raw'] = pydantic.Field(default='raw',description='Method to serialize (convert) original data into binary data.')
+    serialize: typing.Literal['yaml','binary','str','raw'] = pydantic.Field(default='raw',description='Method to serialize (convert) original data into binary data. "binary" sends length prefixed MessagePack frames (redvypr.packet_codec).')
     queuesize: int = pydantic.Field(default=10000, description= 'Size of the queues for transfer between threads')
     dt_status: float = pydantic.Field(default=4.0,description= 'Send a status message every dt_status seconds')
     tcp_reconnect: bool = pydantic.Field(default=True, description = 'Reconnecting to TCP Port if connection was closed by host')
@@ -76,7 +77,7 @@ def yaml_dump(data):
     #return yaml.dump(data,default_flow_style=False)
     return yaml.dump(data,explicit_end=True,explicit_start=True)
 
-def raw_to_packet(datab, config, safe_load=False):
+def raw_to_packet(datab, config, safe_load=False, decoder=None):
     """
     Packs the received raw data into a packet that can be sent via the dataqueue
 
@@ -84,6 +85,8 @@ def raw_to_packet(datab, config, safe_load=False):
         datab:
         config:
         safe_load:
+        decoder: packet_codec.PacketStreamDecoder used for the "binary" serialization, it keeps incomplete frames
+            between the calls. If None, incomplete frames are returned in 'datab_rest'.
 
     Returns:
         packets: A list of datapackets to be sent via the dataqueue
@@ -123,6 +126,19 @@ def raw_to_packet(datab, config, safe_load=False):
                     datan[config['datakey']] = data[config['datakey']]
                     packets.append(datan)
 
+    elif (config['serialize'] == 'binary'):
+        if decoder is None:
+            data_all, datab_rest = packet_codec.decode_frames(datab)
+        else:
+            data_all = decoder.feed(datab)
+        for data in data_all:
+            if (config['datakey'] == 'all'):  # Forward the whole message
+                packets.append(data)
+            else:
+                datan = {'t': t}
+                datan[config['datakey']] = data[config['datakey']]
+                packets.append(datan)
+
     elif (config['serialize'] == 'utf-8'):  # Put the "str" data into the packet with the key in "data"
         data = datab.decode('utf-8')
         datan = {'t':t}
@@ -142,6 +158,12 @@ def packet_to_raw(data_dict,config):
     #
     if (config['datakey'] == 'all') and (config['serialize'] == 'yaml'):
         datab = yaml_dump(data_dict).encode('utf-8')
+    elif (config['serialize'] == 'binary'):
+        if (config['datakey'] == 'all'):
+            datab = packet_codec.encode_frame(data_dict)
+        else:
+            key = config['datakey']
+            datab = packet_codec.encode_frame({'t': data_dict['t'], key: data_dict[key]})
     elif (config['serialize'] == 'utf-8'):
         key = config['datakey']
         datab = str(data_dict[key]).encode('utf-8')
@@ -211,6 +233,7 @@ def start_tcp_send(dataqueue, datainqueue, statusqueue, config=None, device_info
     bytes_read   = 0
     metadata_packet = None
     metadata_update = False
+    deviceinfo_mirror = packet_statistic.DeviceinfoMirror()  # Local copy of deviceinfo_all, updated with patches
     threadqueues = []
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     logger.debug(funcname + ' Binding to {:s}:{:d}'.format(config['address'],config['port']))
@@ -247,8 +270,9 @@ def start_tcp_send(dataqueue, datainqueue, statusqueue, config=None, device_info
             threadqueues.append(thread_queue_dict)
             if metadata_packet is not None:
                 metadata_send = copy.deepcopy(metadata_packet)
-                devinfo_all = metadata_send.pop('deviceinfo_all')
-                metadata_tmp = devinfo_all['metadata']
+                metadata_send.pop('deviceinfo_all', None)
+                metadata_send.pop('deviceinfo_patch', None)
+                metadata_tmp = copy.deepcopy(deviceinfo_mirror.deviceinfo_all['metadata'])
                 metadata_send['_metadata'] = {}
                 raddr_tmp = redvypr_address.RedvyprAddress(metadata_packet,datakey='REMOTE')
                 raddr_tmp_str = raddr_tmp.to_address_string()
@@ -292,8 +316,11 @@ def start_tcp_send(dataqueue, datainqueue, statusqueue, config=None, device_info
                         logger.debug('Metadata command')
                         #print("\n\n\nMETADATAMETADATA\n\n\n")
                         if packet_address.packetid == 'metadata':
-                            metadata_packet = data_dict
-                            metadata_update = True
+                            if deviceinfo_mirror.update(data_dict) is not None:
+                                metadata_packet = data_dict
+                                metadata_update = True
+                            elif deviceinfo_mirror.resync_needed:
+                                dataqueue.put(deviceinfo_mirror.resync_packet())
                             #continue
 
                 npackets += 1
@@ -374,6 +401,7 @@ def start_tcp_recv(dataqueue, datainqueue, statusqueue, config=None, device_info
     # 
     npackets = 0 # Number packets received via the datainqueue
     datab_all = b''
+    decoder = packet_codec.PacketStreamDecoder()  # Keeps incomplete frames of the "binary" serialization
     while True:
         try:
             com = datainqueue.get(block=False)
@@ -403,6 +431,7 @@ def start_tcp_recv(dataqueue, datainqueue, statusqueue, config=None, device_info
                             client.settimeout(1.0) # timeout for listening
                             client.connect((config['address'],config['port']))
                             reconnections += 1
+                            decoder = packet_codec.PacketStreamDecoder()
                         except:
                             logger.warning(funcname + ': Could not connect to host.')
                             
@@ -416,7 +445,7 @@ def start_tcp_recv(dataqueue, datainqueue, statusqueue, config=None, device_info
             bytes_read += len(datab)
             # Check what data we are expecting and convert it accordingly
             datab_all += datab
-            tmp = raw_to_packet(datab_all, config, safe_load=False)
+            tmp = raw_to_packet(datab_all, config, safe_load=False, decoder=decoder)
             packets = tmp['packets']
             datab_all = tmp['datab_rest'] # Store the rest
             for p in packets:
@@ -570,6 +599,7 @@ def start_udp_recv(dataqueue, datainqueue, statusqueue, config=None, device_info
     logger.debug(funcname + 'Will bind to {:s} on port {:d}'.format(udp_addr,config['port']))
     client.bind((udp_addr,config['port']))
     datab_all = b''
+    decoder = packet_codec.PacketStreamDecoder()  # Keeps incomplete frames of the "binary" serialization
     while True:
         try:
             com = datainqueue.get(block=False)
@@ -600,7 +630,7 @@ def start_udp_recv(dataqueue, datainqueue, statusqueue, config=None, device_info
             t = time.time()
             # Check what data we are expecting and convert it accordingly
             datab_all += datab
-            tmp = raw_to_packet(datab_all, config, safe_load=False)
+            tmp = raw_to_packet(datab_all, config, safe_load=False, decoder=decoder)
             packets = tmp['packets']
             datab_all = tmp['datab_rest']
             for p in packets:
@@ -819,12 +849,16 @@ class initDeviceWidget(QtWidgets.QWidget):
         self._data_pub_all  = QtWidgets.QRadioButton("Redvypr YAML datapacket")
         self._data_pub_all.setStatusTip('Sends/Expects the whole datapacket as a YAML string')
 
+        self._data_pub_binary = QtWidgets.QRadioButton("Redvypr binary datapacket")
+        self._data_pub_binary.setStatusTip('Sends/Expects the whole datapacket as binary (MessagePack) frames, this is faster than YAML')
+
 
         self._data_pub_dict = QtWidgets.QRadioButton("Dictionary entries")
         self._data_pub_dict.setStatusTip('Sends entries and serialize them as choosen by the serialization box')
 
         self._data_pub_group = QtWidgets.QButtonGroup()
         self._data_pub_group.addButton(self._data_pub_all)
+        self._data_pub_group.addButton(self._data_pub_binary)
         self._data_pub_group.addButton(self._data_pub_dict)
 
         self._data_pub_dict.setChecked(False)
@@ -857,6 +891,7 @@ class initDeviceWidget(QtWidgets.QWidget):
         self._serialize_label = QtWidgets.QLabel("Data publishing options")
         layout.addRow(self._serialize_label)
         layout.addRow(self._data_pub_all,self._data_pub_dict)
+        layout.addRow(self._data_pub_binary)
         layout.addRow(QtWidgets.QLabel("Serialize"),self._combo_ser)
         layout.addRow(self.fdataentry,self.dataentry)
         layout.addRow(self.subbtn)
@@ -868,6 +903,7 @@ class initDeviceWidget(QtWidgets.QWidget):
         self.config_widgets.append(self._combo_proto)        
         self.config_widgets.append(self._data_pub_all)
         self.config_widgets.append(self._data_pub_dict)
+        self.config_widgets.append(self._data_pub_binary)
         self.config_widgets.append(self._combo_ser)
         self.config_widgets.append(self.dataentry)
 
@@ -888,12 +924,14 @@ class initDeviceWidget(QtWidgets.QWidget):
                 self._combo_inout.currentIndexChanged.connect(self.process_options)
                 self._combo_proto.currentIndexChanged.connect(self.process_options)
                 self._data_pub_all.toggled.connect(self.process_options)
+                self._data_pub_binary.toggled.connect(self.process_options)
                 self._combo_ser.currentIndexChanged.connect(self.process_options)
             else:
                 try:
                     self._combo_inout.currentIndexChanged.disconnect()
                     self._combo_proto.currentIndexChanged.disconnect()
                     self._data_pub_all.toggled.disconnect()
+                    self._data_pub_binary.toggled.disconnect()
                     self._combo_ser.currentIndexChanged.disconnect()
                 except:
                     pass
@@ -930,7 +968,10 @@ class initDeviceWidget(QtWidgets.QWidget):
                 break
 
         if(self.device.custom_config.datakey.lower() == 'all'):
-            self._data_pub_all.setChecked(True)
+            if (self.device.custom_config.serialize == 'binary'):
+                self._data_pub_binary.setChecked(True)
+            else:
+                self._data_pub_all.setChecked(True)
         else:
             self._data_pub_dict.setChecked(True)
 
@@ -953,6 +994,11 @@ class initDeviceWidget(QtWidgets.QWidget):
             self._combo_ser.setEnabled(False)
             config.serialize = 'yaml'
             config.datakey = 'all'
+        elif(self._data_pub_binary.isChecked()): # sending/receiving binary frames
+            self.dataentry.setEnabled(False)
+            self._combo_ser.setEnabled(False)
+            config.serialize = 'binary'
+            config.datakey = 'all'
         else:
             self.dataentry.setEnabled(True)
             self._combo_ser.setEnabled(True)
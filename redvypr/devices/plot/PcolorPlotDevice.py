@@ -55,9 +55,76 @@ class DeviceCustomConfig(pydantic.BaseModel):
     collevel_max: typing.Optional[float] = pydantic.Field(default=None, description='Maximum color level')
 
 
-
-
-
+class ProfileBuffer():
+    """
+    Buffer of profiles (i.e. ADCP or thermistor chain data) and their time with a maximum number of profiles
+    (buffersize). The data is stored in preallocated numpy arrays of twice the buffersize, new profiles are written
+    at the end and the last profiles are moved into a new array when it is full. The arrays returned by get_mesh()
+    are views and are not changed by later appends.
+    """
+    def __init__(self):
+        self.t = None
+        self.z = None
+        self.nbins = None
+        self.start = 0
+        self.end = 0
+        self.buffersize = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def clear(self):
+        # A new array is allocated with the next append, views given to the plot stay valid
+        self.t = None
+        self.z = None
+        self.nbins = None
+        self.start = 0
+        self.end = 0
+
+    def _reallocate(self, buffersize):
+        nkeep = min(len(self), buffersize - 1)
+        t_new = numpy.empty(2 * buffersize)
+        z_new = numpy.empty((2 * buffersize, self.nbins))
+        if nkeep > 0:
+            t_new[:nkeep] = self.t[self.end - nkeep:self.end]
+            z_new[:nkeep] = self.z[self.end - nkeep:self.end]
+        self.t = t_new
+        self.z = z_new
+        self.buffersize = buffersize
+        self.start = 0
+        self.end = nkeep
+
+    def append(self, t, profile, buffersize):
+        """
+        Appends a profile, the oldest profile exceeding buffersize is removed. If the profile has a different
+        number of bins than the profiles in the buffer, the buffer is cleared.
+        """
+        nbins = len(profile)
+        if nbins != self.nbins:
+            self.clear()
+            self.nbins = nbins
+
+        if self.t is None or self.buffersize != buffersize or self.end >= 2 * buffersize:
+            self._reallocate(buffersize)
+
+        end = self.end
+        self.t[end] = t
+        self.z[end] = profile
+        self.end = end + 1
+        if self.end - self.start > buffersize:
+            self.start = self.end - buffersize
+
+    def get_mesh(self):
+        """
+        Returns the X, Y, Z arrays for PColorMeshItem.setData. The times are used as the edges of the cells, the
+        cell of the last profile is therefore not plotted. X and Y are broadcasted views and are not copied.
+        """
+        t = self.t[self.start:self.end]
+        shape = (len(t), self.nbins + 1)
+        X = numpy.broadcast_to(t[:, numpy.newaxis], shape)
+        Y = numpy.broadcast_to(numpy.arange(self.nbins + 1, dtype=float), shape)
+        Z = self.z[self.start:self.end - 1]
+        return X, Y, Z
 
 
 # Use the standard start function as the start function
@@ -84,12 +151,14 @@ class PcolorPlotWidget(QtWidgets.QWidget):
         self.description = 'Pcolor plot'
         self.layout = QtWidgets.QGridLayout(self)
         self.levels = None
-        self.data_z = []
-        self.data_x = []
-        self.data_y = []
-        self.data_all = []
+        self.databuffer = ProfileBuffer()
+        self.data_changed = False
         self.create_widgets()
         self.applyConfig()
+        # The plot is updated with a timer, independent of the packet rate
+        self.updatetimer = QtCore.QTimer()
+        self.updatetimer.timeout.connect(self.update_plot)
+        self.updatetimer.start(int(self.config.dt_update * 1000))
 
     def thread_startstop(self):
         if 'start' in self.startAction.text().lower():
@@ -117,10 +186,8 @@ class PcolorPlotWidget(QtWidgets.QWidget):
 
     def pyqtgraphClearBufferAction(self):
         self.logger.debug('Clearing buffer')
-        self.data_z = []
-        self.data_x = []
-        self.data_y = []
-        self.data_all = []
+        self.databuffer.clear()
+        self.data_changed = False
         z = numpy.random.rand(10, 10) * 0
         self.mesh.setData(z)
 
@@ -147,6 +214,8 @@ class PcolorPlotWidget(QtWidgets.QWidget):
         funcname = __name__ + '.applyConfig():'
         self.logger.debug(funcname)
         self.setTitle()
+        if hasattr(self, 'updatetimer'):
+            self.updatetimer.setInterval(int(self.config.dt_update * 1000))
         try:
             self.device.subscribe_address(self.config.datastream)
         except:
@@ -215,104 +284,49 @@ class PcolorPlotWidget(QtWidgets.QWidget):
         levels = self.colorbar.levels()
         self.levels = levels
         self.mesh.setLevels(self.levels)
-        print('Scale',self.levels)
 
-    def repair_data(self):
+    def update_data(self, rdata):
+        """
+        Appends the profile of the datastream to the buffer, the plot is updated by update_plot.
         """
-        Repairs data such that it can be plotted in a pcolor-plot like style
-        Parameters
-        ----------
-        data
-        config
+        funcname = __name__ + '.update_data():'
+        try:
+            profile = numpy.asarray(rdata[self.config.datastream], dtype=float).ravel()
+            t = float(rdata['t'])
+        except:
+            self.logger.warning(funcname + 'Could not append update data', exc_info=True)
+            return
+
+        # Profiles with invalid data cannot be plotted
+        if numpy.isnan(profile).any() or numpy.isnan(t):
+            return
+
+        if profile.size != self.databuffer.nbins and len(self.databuffer) > 0:
+            self.logger.debug(funcname + 'Number of bins changed from {} to {}, clearing buffer'.format(
+                self.databuffer.nbins, profile.size))
 
-        Returns
-        -------
+        self.databuffer.append(t, profile, self.config.buffersize)
+        self.data_changed = True
 
+    def update_plot(self):
         """
-        lenmax = -1000
-        for d in self.data_z:
-            lenmax = max(len(d), lenmax)
-
-        data_clean_z = []
-        data_clean_x = []
-        for i, d in enumerate(self.data_z):
-            if len(d) != lenmax:
-                pass
-                # d_new = numpy.zeros(lenmax) * numpy.nan
-                # data[i] = d_new.tolist()
-            elif numpy.isnan(d).any():
-                pass
-            else:
-                data_clean_z.append(d)
-                data_clean_x.append(self.data_x[i])
-
-        self.data_x = data_clean_x
-        self.data_z = data_clean_z
-
-        #print('Repaired',numpy.shape(self.data_z),numpy.shape(self.data_y),numpy.shape(self.data_x))
-
-    def update_data(self,rdata):
-        funcname = __name__ + '.update_data():'
-        self.logger.debug(funcname + 'Got data to plot {}'.format(rdata.address))
-        data_plot = rdata[self.config.datastream]
-        #print('Data to plot', data_plot)
+        Plots the data of the buffer if new data arrived since the last update.
+        """
+        funcname = __name__ + '.update_plot():'
+        if not self.data_changed or len(self.databuffer) <= 2:
+            return
+
+        self.data_changed = False
         try:
-            if len(self.data_x) > self.config.buffersize:
-                self.logger.debug('Bufferoverflow')
-                self.data_z.pop(0)
-                self.data_all.pop(0)
-                self.data_x.pop(0)
-
-            self.data_z.append(data_plot)
-            self.data_all.append(rdata)
-            self.data_x.append(rdata['t'])
+            X, Y, Z = self.databuffer.get_mesh()
+            self.mesh.setData(X, Y, Z)
+            if self.levels is not None:
+                if self.config.collevel_auto:
+                    self.levels = self.mesh.getLevels()
+                else:
+                    self.mesh.setLevels(self.levels)
         except:
-            self.logger.warning('Could not append update data', exc_info=True)
-
-        if len(self.data_x) > 2:
-            try:
-                print('Plotting')
-                print(self.data_z)
-
-                try:
-                    z = numpy.asarray(self.data_z)
-                except:
-                    print('Repairing')
-                    print('Repairing')
-                    print('Repairing')
-                    print('Repairing')
-                    self.repair_data()
-                    z = numpy.asarray(self.data_z)
-
-                if numpy.isnan(self.data_z).any() or numpy.isnan(self.data_x).any():
-                    print('Repairing nan')
-                    self.repair_data()
-                Z = z[:-1, :]
-                ny = numpy.shape(z)[1]
-                nx = numpy.shape(z)[0]
-                y = numpy.arange(0,ny+1)
-                x = numpy.asarray(self.data_x)
-                X = numpy.asarray(numpy.tile(x,(ny+1,1)))
-                X = X.T
-                Y = numpy.asarray(numpy.tile(y, (nx, 1)))
-
-                self.mesh.setData(X, Y, Z)
-                if self.levels is not None:
-                    if self.config.collevel_auto:
-                        self.levels = self.mesh.getLevels()
-                    else:
-                        self.mesh.setLevels(self.levels)
-                    #print('Set levels', self.levels)
-            except:
-                print('Problem')
-                #self.logger.info('Could not update data', exc_info=True)
-                self.logger.warning('Could not update data',exc_info=True)
-                self.logger.warning('Resetting buffer')
-                return
-                self.data_z = []
-                self.data_x = []
-                self.data_y = []
-                self.data_all = []
+            self.logger.warning(funcname + 'Could not update data', exc_info=True)
 
 class RedvyprDeviceWidget(RedvyprdevicewidgetStartonly):
     def __init__(self,*args,**kwargs):
@@ -336,8 +350,6 @@ class RedvyprDeviceWidget(RedvyprdevicewidgetStartonly):
         try:
             #print(funcname)
             #print('Got data', data)
-            print('Datastream', self.device.custom_config.datastream)
-            print('Datastream2', self.device.custom_config.datastream(data))
             rdata = redvypr.data_packets.Datapacket(data)
             if self.device.custom_config.datastream(data, strict=False) is not None:
                 self.pcolorplot.update_data(rdata)
@@ -51,6 +51,8 @@ class RedvyprDeviceWidget(RedvyprdevicewidgetSimple):
         self.tablewidget = TablePlotWidget.TablePlotWidget(config=self.device.custom_config, redvypr_device=self.device)
         self.layout.addWidget(self.tablewidget)
         self.device.config_changed_signal.connect(self.config_changed)
+        # Connect new_data signal, the data arrives in batches
+        self.device.new_data.connect(self.new_data)
 
     def config_changed(self):
         funcname = __name__ + '.config_changed():'
@@ -59,10 +61,10 @@ class RedvyprDeviceWidget(RedvyprdevicewidgetSimple):
         self.tablewidget.config = self.device.custom_config
         self.tablewidget.apply_config()
 
-    def update_data(self, data, force_update = False):
-        funcname = __name__ + '.update_data():'
+    def new_data(self, data_list):
+        funcname = __name__ + '.new_data():'
         logger.debug(funcname)
         try:
-            self.tablewidget.update_plot(data)
+            self.tablewidget.update_plot(data_list)
         except:
-            logger.info('Could not update data',exc_info=True)
\ No newline at end of file
+            logger.info('Could not update data',exc_info=True)
@@ -8,6 +8,7 @@ import logging
 import sys
 import yaml
 import copy
+import collections
 import pydantic
 from pydantic.color import Color as pydColor
 #from pydantic_extra_types import Color as pydColor
@@ -18,8 +19,9 @@ import redvypr.files as files
 from redvypr.widgets.pydanticConfigWidget import pydanticConfigWidget
 from redvypr.widgets.redvyprAddressWidget import RedvyprAddressEditWidget
 from redvypr.device import RedvyprDevice, RedvyprDeviceParameter
-from redvypr.redvypr_address import RedvyprAddress
+from redvypr.redvypr_address import RedvyprAddress, packet_address
 from redvypr.data_packets import Datapacket
+from redvypr.packet_statistic import get_schema_fingerprint
 from redvypr.data_packets import check_for_command
 
 logging.basicConfig(stream=sys.stderr)
@@ -49,8 +51,114 @@ class ConfigTablePlot(pydantic.BaseModel):
                                                   description='Ignore metadata packets')
     show_unit: bool = pydantic.Field(default=True,
                                                   description='Show the unit')
+    dt_update: float = pydantic.Field(default=0.1,
+                                      description='Update time of the table [s]')
+
+
+class TableColumn():
+    """
+    A column of the table, either the datakeys ('keys') or the data of a packet ('data'). The first row is the header.
+    """
+    def __init__(self, kind, header, strings, datastreams, datakeys, data=None, counter=0):
+        self.kind = kind
+        self.header = header
+        self.strings = strings
+        self.datastreams = datastreams
+        self.datakeys = datakeys
+        self.data = data
+        self.counter = counter  # Identifies the datakeys layout of the column
+
+
+class TablePlotModel(QtCore.QAbstractTableModel):
+    """
+    Model of the table, the data is set column wise with set_columns.
+    """
+    header_colors = {'keys': QtGui.QColor("lightblue"), 'data': QtGui.QColor("lightgrey")}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.numrows_header = 1
+        self.columns = []
+        self.numrows = self.numrows_header
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return self.numrows
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(self.columns)
+
+    def data(self, index, role=QtCore.Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+
+        column = self.columns[index.column()]
+        irow = index.row()
+        if role == QtCore.Qt.ItemDataRole.DisplayRole:
+            if irow < self.numrows_header:
+                return column.header
+            irow -= self.numrows_header
+            if irow < len(column.strings):
+                return column.strings[irow]
+            return ''
+        elif role == QtCore.Qt.ItemDataRole.BackgroundRole:
+            if irow < self.numrows_header:
+                return QtGui.QBrush(self.header_colors[column.kind])
+
+        return None
+
+    def get_column_row(self, index):
+        """
+        Returns the column and the data row of the index or (None, None) if the index is not a data cell.
+        """
+        if not index.isValid():
+            return None, None
+        column = self.columns[index.column()]
+        irow = index.row() - self.numrows_header
+        if 0 <= irow < len(column.datastreams):
+            return column, irow
+        return None, None
+
+    def get_datastream(self, index):
+        column, irow = self.get_column_row(index)
+        if column is None:
+            return None
+        return column.datastreams[irow]
+
+    def set_columns(self, columns):
+        """
+        Sets new columns. If the layout (number of columns, kinds and datakeys) is unchanged only the changed
+        range is signalled with dataChanged, otherwise the model is reset.
+
+        Returns
+        -------
+        bool
+            True if the model was reset
+        """
+        numrows = self.numrows_header + max([len(c.strings) for c in columns], default=0)
+        columns_old = self.columns
+        same_layout = (numrows == self.numrows and len(columns) == len(columns_old) and
+                       all(c.kind == c_old.kind and c.datakeys == c_old.datakeys
+                           for c, c_old in zip(columns, columns_old)))
+        if not same_layout:
+            self.beginResetModel()
+            self.columns = columns
+            self.numrows = numrows
+            self.endResetModel()
+            return True
+
+        # Only the columns that changed
+        changed = [i for i, (c, c_old) in enumerate(zip(columns, columns_old)) if c is not c_old]
+        self.columns = columns
+        if len(changed) > 0:
+            topleft = self.index(0, changed[0])
+            bottomright = self.index(numrows - 1, changed[-1])
+            self.dataChanged.emit(topleft, bottomright, [QtCore.Qt.ItemDataRole.DisplayRole])
+        return False
+
 
 class TablePlotWidget(QtWidgets.QWidget):
+    route_fields = frozenset(RedvyprAddress.PREFIX_MAP.values())  # The filter fields of the packet address
+
     def __init__(self, *args, config=None, redvypr_device=None, **kwargs):
         """
         A table widget that displays data of subscribed redvypr data packets
@@ -67,13 +175,13 @@ class TablePlotWidget(QtWidgets.QWidget):
         else:
             self.redvypr = None
         self.counter = 0
-        self.data_table_keys_show = []
-        self.col_last_keys_show = 0
-        self.col_current = 0
-        self.col_packets_showed = 0
-        self.numrows_header = 1
+        self.packets_show = collections.deque(maxlen=self.config.num_packets_show)
+        self.schema_cache = {}  # Datakeys, datastreams and formats per packet address and schema
+        self.data_changed = False
         self.layout = QtWidgets.QVBoxLayout(self)
-        self.table = QtWidgets.QTableWidget()
+        self.model = TablePlotModel()
+        self.table = QtWidgets.QTableView()
+        self.table.setModel(self.model)
         self.table.horizontalHeader().setVisible(False)
         self.table.verticalHeader().setVisible(False)
 
@@ -81,31 +189,32 @@ class TablePlotWidget(QtWidgets.QWidget):
         self.table.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
         self.table.customContextMenuRequested.connect(self.show_context_menu)
         self.layout.addWidget(self.table)
+        # The table is updated with a timer, independent of the packet rate
+        self.updatetimer = QtCore.QTimer()
+        self.updatetimer.timeout.connect(self.refresh_table)
+        self.updatetimer.start(int(self.config.dt_update * 1000))
         self.apply_config()
 
     def show_context_menu(self, position):
-        # Get the item at the clicked position
-        item = self.table.itemAt(position)
-        # Create a menu specific to the item
+        # Get the datastream at the clicked position
+        index = self.table.indexAt(position)
+        datastream = self.model.get_datastream(index)
+        # Create a menu specific to the datastream
         menu = QtWidgets.QMenu(self)
-        try:
-            datastream = item.__datastream__
-        except:
-            datastream = None
 
         resizeTable = QtGui.QAction("Resize Table", self)
         resizeTable.triggered.connect(lambda: self.table.resizeColumnsToContents())
         menu.addAction(resizeTable)
-        if item is not None and datastream is not None:
+        if datastream is not None:
             # Create a xyplot action
             actionXyplot = QtGui.QAction("Plot XY", self)
-            actionXyplot.triggered.connect(lambda: self.create_xyplot(item))
+            actionXyplot.triggered.connect(lambda: self.create_xyplot(datastream))
             menu.addAction(actionXyplot)
             # Create a format menu/action
             formats = []
             menu_formats = menu.addMenu('Formats')
             actionAddformat = QtGui.QAction("Add format", self)
-            actionAddformat.triggered.connect(lambda: self.edit_format(item))
+            actionAddformat.triggered.connect(lambda: self.edit_format(datastream))
             menu_formats.addAction(actionAddformat)
             for fa in self.config.formats:
                 try:
@@ -146,8 +255,8 @@ class TablePlotWidget(QtWidgets.QWidget):
         # Show the menu at the position of the mouse click
         menu.exec_(self.table.viewport().mapToGlobal(position))
 
-    def create_xyplot(self,item):
-        address = RedvyprAddress(item.__datastream__)
+    def create_xyplot(self, datastream):
+        address = RedvyprAddress(datastream)
         try:
             devicemodulename = 'redvypr.devices.plot.XYPlotDevice'
             plotname = 'XYPlot({})'.format(address.datakey)
@@ -163,9 +272,8 @@ class TablePlotWidget(QtWidgets.QWidget):
         except:
             logger.debug('Could not add XY-Plot',exc_info=True)
 
-    def edit_format(self,item):
-        #print('Editing format',item,item.__datastream__)
-        datastream = item.__datastream__
+    def edit_format(self, datastream):
+        #print('Editing format',datastream)
         self.address_edit_tmp = RedvyprAddressEditWidget(redvypr_address_str=datastream)
         applybutton = self.address_edit_tmp.configwidget_apply
         self.address_edit_tmp.layout.removeWidget(applybutton)
@@ -185,18 +293,21 @@ class TablePlotWidget(QtWidgets.QWidget):
         addrstr = addr['address_str']
         new_dict = {addrstr: format_new, **self.config.formats}
         self.config.formats = new_dict
+        self.clear_schema_cache()
         self.address_edit_tmp.close()
 
     def apply_format_clicked(self):
         button = self.sender()
         print('Button apply', button)
         self.config.formats[button.__formatskey__] = button.__format_lineEdit__.text()
+        self.clear_schema_cache()
         button.__menu__.close()
 
     def remove_format_clicked(self):
         button = self.sender()
         print('Button remove',button)
         self.config.formats.pop(button.__formatskey__)
+        self.clear_schema_cache()
         button.__menu__.close()
     def config_clicked(self):
         button = self.sender()
@@ -210,210 +321,175 @@ class TablePlotWidget(QtWidgets.QWidget):
         # self.subscribed.emit(self.device)
 
     def apply_config(self):
+        self.packets_show = collections.deque(maxlen=self.config.num_packets_show)
+        self.schema_cache = {}
+        self.updatetimer.setInterval(int(self.config.dt_update * 1000))
         self.reset_table()
-        self.device.unsubscribe_all()
         if self.device is not None:
+            self.device.unsubscribe_all()
             for d in self.config.datastreams:
                 self.device.subscribe_address(d)
 
-    def reset_table(self):
-        self.col_last_keys_show = 0
-        self.col_current = 0
-        self.col_packets_showed = 0
-        self.data_table_keys_show = []
-        self.data_table_datastreams_show = []
-        self.table.setColumnCount(2)
-        self.table.setRowCount(1)
-        self.table.clear()
-        # Plot the header
-        item = QtWidgets.QTableWidgetItem('Datakeys')
-        item.__counter__ = self.counter
-        item.__numrows__ = 1
-        item.setBackground(QtGui.QBrush(QtGui.QColor("lightblue")))
-        self.table.setItem(0, 0, item)
-        item = QtWidgets.QTableWidgetItem('Data')
-        item.__counter__ = self.counter
-        item.__numrows__ = 1
-        item.setBackground(QtGui.QBrush(QtGui.QColor("lightgrey")))
-        self.table.setItem(0, 1, item)
+    def clear_schema_cache(self):
+        """
+        Clears the cached datakeys and formats and recreates the shown columns, i.e. after the formats changed.
+        """
+        self.schema_cache = {}
+        packets = [p[0] for p in self.packets_show]
+        self.packets_show.clear()
+        self.update_plot(packets)
 
-    def update_plot(self, data):
+    def reset_table(self):
+        self.packets_show.clear()
+        self.data_changed = False
+        # Only the header
+        columns = [TableColumn('keys', 'Datakeys', [], [], [], counter=self.counter),
+                   TableColumn('data', 'Data', [], [], [], counter=self.counter)]
+        self.model.set_columns(columns)
+
+    def get_format(self, datastream):
         """
+        Returns the format string of the first address in config.formats matching the datastream.
         """
-        funcname = __name__ + '.update_data():'
+        for format_addressstr in self.config.formats:
+            format_address = RedvyprAddress(format_addressstr)
+            try:
+                data_tmp = format_address(datastream)
+            except:
+                data_tmp = None
+            if data_tmp is not None:
+                return self.config.formats[format_addressstr]
+
+        return '{}'
+
+    def get_schema_entry(self, data):
+        """
+        Returns the datakeys, datastreams and formats of a data packet or None if not all datastreams are in the
+        packet. The entries are cached per packet address and schema, packets of the same schema are not expanded
+        again. Filters of the datastreams that depend on the data and not only on the _redvypr fields are
+        evaluated for every packet.
+        """
+        key = (packet_address(data), get_schema_fingerprint(data))
+        try:
+            entry = self.schema_cache[key]
+        except KeyError:
+            pass
+        else:
+            if entry is None:
+                return None
+            for d in entry['filters']:
+                if not d.matches_filter(data):
+                    return None
+            return entry
+
         rdata = Datapacket(data)
-        if self.config.ignore_command_packets:
-            command = check_for_command(data)
-            if self.config.ignore_metadata_packets:
-                if rdata.address.packetid == 'metadata':
-                    return
-            if command is not None:
-                return
-
-        # Check if everything is found in the data packet
+        expand_level = self.config.expansion_level
+        datakeys = []
+        datastreams = []
+        filters = []
         for d in self.config.datastreams:
+            eq_filter = d.get_equality_filter()
+            header_filter = (eq_filter is not None) and set(eq_filter.keys()).issubset(self.route_fields)
+            if not header_filter:
+                filters.append(d)
             if not d.matches_filter(data):
-                return
-
-        if self.col_packets_showed >= self.config.num_packets_show:
-            # print('Reset')
-            if self.table.columnCount() == 2:
-                print("Resetting")
-                self.reset_table()
-            counter = self.table.item(0, 0).__counter__
-            counter1 = self.table.item(0, 1).__counter__
-            if counter == counter1:
-                self.table.removeColumn(1)
-                self.col_packets_showed -= 1
-                self.col_current -= 1
-
-            counter = self.table.item(self.numrows_header, 0).__counter__
-            counter1 = self.table.item(self.numrows_header, 1).__counter__
-            if counter != counter1:
-                self.table.removeColumn(0)
-                self.col_current -= 1
-
-            numrows_tmp = 0
-            for icol_tmp in range(self.table.columnCount()):
-                item = self.table.item(0, icol_tmp)
-                numrows_tmp = max(item.__numrows__, numrows_tmp)
-
-            self.table.setRowCount(numrows_tmp + self.numrows_header)
+                if header_filter:  # Does not change for packets of the same address
+                    self.schema_cache[key] = None
+                return None
+            datakeys += rdata.datakeys([d], expand=expand_level, return_type='list')
+            datastreams += rdata.datastreams([d], expand=expand_level)
+        self.counter += 1
+        # The datakeys column
+        keystrings = []
+        for dk, ds in zip(datakeys, datastreams):
+            dkstr = str(dk)  # Here one could do some formatting
+            # Metadata
+            if self.redvypr is not None and self.config.show_unit:
+                metadata = self.redvypr.get_metadata(ds)
+                try:
+                    unit = " / {}".format(metadata['unit'])
+                    dkstr += unit
+                except:
+                    pass
+            keystrings.append(dkstr)
 
-        expand_level = self.config.expansion_level
+        keys_column = TableColumn('keys', 'Datakeys', keystrings, datastreams, datakeys, counter=self.counter)
+        entry = {'datakeys': datakeys, 'datastreams': datastreams, 'filters': filters,
+                 'formats': [self.get_format(ds) for ds in datastreams], 'keys_column': keys_column}
+
+        self.schema_cache[key] = entry
+        return entry
+
+    def create_data_column(self, data, entry):
+        rdata = Datapacket(data)
         data_table = []
-        data_table_keys_new = []
-        data_table_datastreams_new = []
-        for d in self.config.datastreams:
-            if not d.matches_filter(data):
-                return
+        strings = []
+        for dk, format_show in zip(entry['datakeys'], entry['formats']):
+            data_item = rdata[dk]
+            # Convert the data into a string
+            if format_show == 'ISO8601':
+                dt_object = datetime.datetime.fromtimestamp(data_item, pytz.utc)
+                data_str = dt_object.isoformat()
             else:
-                #print('d in data',d)
-                datakeys = rdata.datakeys([d], expand=expand_level,return_type='list')
-                datastreams = rdata.datastreams([d], expand=expand_level)
-                data_table_datastreams_new += datastreams
-                # print('rdata',rdata)
-                #print('expand level',expand_level)
-                #print('datakeys',datakeys)
-                for dk in datakeys:
-                    data_tmp = rdata[dk]
-                    #print('Data tmp',data_tmp)
-                    data_table.append(data_tmp)
-                    data_table_keys_new.append(dk)
-
-
-        if self.data_table_keys_show == data_table_keys_new:
-            flag_new_keys = False
-        else:
-            self.data_table_keys_show = data_table_keys_new
-            flag_new_keys = True
-            self.counter += 1
-
-        #print('Data keys table', data_table_keys_new,flag_new_keys)
-        #print('Data keys table show', self.data_table_keys_show)
-        #print('Data show',data_table)
-        if self.table.rowCount() < len(self.data_table_keys_show):
-            self.table.setRowCount(len(self.data_table_keys_show)+self.numrows_header)
-
-        # Plot datakeys
-        if flag_new_keys:
-            self.data_table_keys_show = data_table_keys_new
-            self.data_table_datastreams_show = data_table_datastreams_new
-            icol = self.col_current
-            ncols = self.table.columnCount()
-            if ncols < (icol + 1):
-                self.table.setColumnCount(ncols+1)
-
-            self.col_last_keys_show = icol
-            self.col_current += 1
-
-            # Plot the header
-            item = QtWidgets.QTableWidgetItem('Datakeys')
-            item.__counter__ = self.counter
-            item.__numrows__ = len(data_table_keys_new)
-            item.setBackground(QtGui.QBrush(QtGui.QColor("lightblue")))
-            self.table.setItem(0, icol, item)
-            # Plot the datakeys
-            ds = None
-            for irow in range(self.table.rowCount()):
-                if irow < len(data_table_keys_new):
-                    dk = data_table_keys_new[irow]
-                    ds = data_table_datastreams_new[irow]
-                else:
-                    dk = ''
-
-                dkstr = str(dk)  # Here one could do some formatting
-                # Metadata
-                if self.redvypr is not None and self.config.show_unit:
-                    metadata = self.redvypr.get_metadata(ds)
-                    try:
-                        unit = " / {}".format(metadata['unit'])
-                        dkstr += unit
-                    except:
-                        pass
-
-                item = QtWidgets.QTableWidgetItem(dkstr)
-                item.__counter__ = self.counter
-                item.__datastream__ = ds
-                item.__datakey__ = dk
-                self.table.setItem(irow+self.numrows_header,icol,item)
-
-        # Plot data
-        if True:
-            icol = self.col_current
-            ncols = self.table.columnCount()
-            if ncols < (icol + 1):
-                self.table.setColumnCount(ncols + 1)
-            self.col_current += 1
-            self.col_packets_showed += 1
-            item = QtWidgets.QTableWidgetItem('Data')
-            item.__counter__ = self.counter
-            item.__numrows__ = len(data_table)
-            item.setBackground(QtGui.QBrush(QtGui.QColor("lightgrey")))
-            self.table.setItem(0, icol, item)
-            datastream_show_tmp = None
-            datakey_show_tmp = None
-            for irow in range(self.table.rowCount()):
-                if irow < len(data_table):
-                    data_item = data_table[irow]
-                    datastream_show_tmp = self.data_table_datastreams_show[irow]
-                    datakey_show_tmp = self.data_table_keys_show[irow]
-                    format_show = '{}'
-                    for format_addressstr in self.config.formats:
-                        format_address = RedvyprAddress(format_addressstr)
-                        #print("format_address",format_address)
-                        #print("datastream_show_tmp",datastream_show_tmp)
-                        try:
-                            data_tmp = format_address(datastream_show_tmp)
-                        except:
-                            data_tmp = None
-                        if data_tmp is not None:
-                            format_show = self.config.formats[format_addressstr]
-                            break
-
-                    # data_str = str(data_item)
-                    # Convert the data into a string
-                    if format_show == 'ISO8601':
-                        dt_object = datetime.datetime.fromtimestamp(data_item, pytz.utc)
-                        data_str = dt_object.isoformat()
-                    else:
-                        try:
-                            data_str = format_show.format(data_item)
-                        except:
-                            logger.warning('Could not apply format str "" for address: {}'.format(format_show,
-                                                                                              format_addressstr),
-                                       exc_info=True)
-                else:
-                    data_str = ''
-
-                item = QtWidgets.QTableWidgetItem(data_str)
-                item.__counter__ = self.counter
-                item.__data__ = data_item
-                item.__datastream__ = datastream_show_tmp
-                item.__datakey__ = datakey_show_tmp
-                self.table.setItem(irow+self.numrows_header, icol, item)
+                try:
+                    data_str = format_show.format(data_item)
+                except:
+                    logger.warning('Could not apply format str "{}" for datakey: {}'.format(format_show, dk),
+                                   exc_info=True)
+                    data_str = str(data_item)
 
-        # TODO, here should be better a user resize be possible
-        self.table.resizeColumnsToContents()
+            data_table.append(data_item)
+            strings.append(data_str)
 
+        keys_column = entry['keys_column']
+        return TableColumn('data', 'Data', strings, keys_column.datastreams, keys_column.datakeys, data=data_table,
+                           counter=keys_column.counter)
 
+    def update_plot(self, data):
+        """
+        Adds a data packet or a list of data packets to the table. Only the last num_packets_show packets are kept,
+        the table is redrawn by refresh_table.
+        """
+        funcname = __name__ + '.update_data():'
+        if isinstance(data, dict):
+            data = [data]
+
+        for packet in data:
+            if self.config.ignore_command_packets:
+                command = check_for_command(packet)
+                if self.config.ignore_metadata_packets:
+                    if packet['_redvypr'].get('packetid') == 'metadata':
+                        continue
+                if command is not None:
+                    continue
+
+            entry = self.get_schema_entry(packet)
+            if entry is not None:
+                self.packets_show.append([packet, entry, None])
+                self.data_changed = True
+
+    def refresh_table(self):
+        """
+        Updates the table with the packets that arrived since the last refresh. The datakeys are shown in a column
+        before the data, if they differ from the datakeys of the column before.
+        """
+        if not self.data_changed:
+            return
+
+        self.data_changed = False
+        columns = []
+        entry_last = None
+        for packet_show in self.packets_show:
+            packet, entry, column = packet_show
+            if entry_last is None or (entry is not entry_last and entry['datakeys'] != entry_last['datakeys']):
+                columns.append(entry['keys_column'])
+            if column is None:
+                column = self.create_data_column(packet, entry)
+                packet_show[2] = column
+            columns.append(column)
+            entry_last = entry
+
+        flag_reset = self.model.set_columns(columns)
+        # TODO, here should be better a user resize be possible
+        if flag_reset:
+            self.table.resizeColumnsToContents()
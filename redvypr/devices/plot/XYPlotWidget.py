@@ -11,7 +11,6 @@ import pydantic
 #from pydantic.color import Color as pydColor
 from pydantic_extra_types import Color as pydColor
 import typing
-from collections.abc import Iterable
 import pyqtgraph
 import redvypr.data_packets
 import redvypr.gui
@@ -32,25 +31,359 @@ logger.setLevel(logging.DEBUG)
 
 colors = ['red','blue','green','gray','yellow','purple']
 
+def _as_floatdata(data):
+    """
+    Converts data to a float or, if data is a list or array, to a 1-D float array.
+    """
+    if isinstance(data, (list, tuple, np.ndarray)):
+        return np.asarray(data, dtype=float).ravel()
+    else:
+        return float(data)
+
+
+def _get_length(rows):
+    """
+    Returns the number of entries of rows of data, floats count as one entry if there are no arrays in rows.
+    """
+    n = None
+    for r in rows:
+        if type(r) is not float and type(r) is not int:
+            nr = np.size(r)
+            n = nr if n is None else max(n, nr)
+
+    return 1 if n is None else n
+
+
+class RingBuffer():
+    """
+    Buffer of rows of float data with a maximum number of entries (buffersize). The data is stored in a preallocated
+    numpy array of twice the buffersize, new data is appended at the end and the entries are moved into a new
+    array when it is full. get_view() returns views of the last buffersize entries, they are not changed by later
+    appends.
+    """
+    def __init__(self, nrows):
+        self.nrows = nrows
+        self.data = None
+        self.start = 0
+        self.end = 0
+        self.buffersize = 0
+        self.count = 0  # Number of entries appended since the last clear
+
+    def __len__(self):
+        return self.end - self.start
+
+    def get_view(self, row):
+        if self.data is None:
+            return np.zeros(0)
+        else:
+            return self.data[row, self.start:self.end]
+
+    def clear(self):
+        # A new array is allocated with the next append, views given to the plot stay valid
+        self.data = None
+        self.start = 0
+        self.end = 0
+        self.count = 0
+
+    def _reallocate(self, buffersize, nnew=0):
+        """
+        Moves the last entries into a new array of size 2 * buffersize with space for nnew new entries.
+        """
+        nkeep = max(min(len(self), buffersize - nnew), 0)
+        data_new = np.empty((self.nrows, 2 * buffersize))
+        if nkeep > 0:
+            data_new[:, :nkeep] = self.data[:, self.end - nkeep:self.end]
+        self.data = data_new
+        self.buffersize = buffersize
+        self.start = 0
+        self.end = nkeep
+
+    def append(self, rows, buffersize, n=None):
+        """
+        Appends data to the buffer and removes the oldest entries exceeding buffersize.
+
+        Parameters
+        ----------
+        rows: list
+            The data of the rows, either floats or array like of the same length, floats are broadcasted.
+            A 2D array with one row per buffer row can be used as well.
+        buffersize: int
+            The maximum number of entries in the buffer
+        n: int
+            The number of entries in rows, if known already
+        """
+        if n is None:
+            n = _get_length(rows)
+        self.count += n
+        if n == 0:
+            return
+        elif n > buffersize:
+            rows = [np.broadcast_to(np.asarray(r, dtype=float).ravel(), (n,))[-buffersize:] for r in rows]
+            n = buffersize
+
+        if self.data is None or self.buffersize != buffersize or self.end + n > 2 * buffersize:
+            self._reallocate(buffersize, nnew=n)
+
+        end = self.end
+        if n == 1:
+            try:
+                self.data[:, end] = rows
+            except (ValueError, TypeError):  # Arrays of length one
+                for irow, r in enumerate(rows):
+                    self.data[irow, end] = np.ravel(r)[0]
+        else:
+            for irow, r in enumerate(rows):
+                self.data[irow, end:end + n] = np.ravel(r)
+
+        self.end = end + n
+        self.start = max(self.start, self.end - buffersize)
+
+
+class DecimationPyramid():
+    """
+    Multi resolution min/max decimation of a line. Level L (L >= 1) has one record per factor**L samples of the line
+    with the time range, the minimum and maximum of y together with their x values, the maximum error and the order
+    of the minimum and maximum. The levels are updated incrementally with the appended data and hold the same
+    span of samples as the line buffer. get_points() returns two points per record, such that peaks are preserved
+    when plotting a decimated line.
+    """
+    T0, T1, XMIN, YMIN, XMAX, YMAX, ERR, MINFIRST = range(8)
+    nrows = 8
+
+    def __init__(self, factor=4, nrecords_min=16):
+        self.factor = factor
+        self.nrecords_min = nrecords_min  # Levels with less records than this are not created
+        self.levels = []  # RingBuffers with the records of level 1, 2, ...
+        self.pending = []  # Records of the level below, not yet filling a complete record of the level
+        self.count = 0  # Number of samples added since the last clear
+
+    def clear(self):
+        self.levels = []
+        self.pending = []
+        self.count = 0
+
+    def append(self, t, x, y, err, buffersize):
+        """
+        Adds the samples of the line to the levels.
+        """
+        x = np.asarray(x, dtype=float).ravel()
+        n = len(x)
+        self.count += n
+        records = np.empty((self.nrows, n))
+        records[self.T0] = np.ravel(t)
+        records[self.T1] = records[self.T0]
+        records[self.XMIN] = x
+        records[self.YMIN] = np.ravel(y)
+        records[self.XMAX] = x
+        records[self.YMAX] = records[self.YMIN]
+        records[self.ERR] = np.ravel(err)
+        records[self.MINFIRST] = 1
+        level = 0
+        size = self.factor
+        while records.shape[1] > 0 and buffersize // size >= self.nrecords_min:
+            if len(self.levels) <= level:
+                self.levels.append(RingBuffer(self.nrows))
+                self.pending.append(records[:, :0])
+
+            if self.pending[level].shape[1] > 0:
+                records = np.concatenate((self.pending[level], records), axis=1)
+
+            ncomplete = records.shape[1] // self.factor * self.factor
+            self.pending[level] = records[:, ncomplete:].copy()
+            records = self._reduce(records[:, :ncomplete])
+            self.levels[level].append(records, buffersize // size + 1)
+            level += 1
+            size *= self.factor
+
+    def _reduce(self, records):
+        """
+        Combines groups of factor records into one record.
+        """
+        nrec = records.shape[1] // self.factor
+        groups = records.reshape(self.nrows, nrec, self.factor)
+        ind = np.arange(nrec)
+        # NaNs are ignored for the search of the extrema
+        imin = np.argmin(np.where(np.isnan(groups[self.YMIN]), np.inf, groups[self.YMIN]), axis=1)
+        imax = np.argmax(np.where(np.isnan(groups[self.YMAX]), -np.inf, groups[self.YMAX]), axis=1)
+        reduced = np.empty((self.nrows, nrec))
+        reduced[self.T0] = groups[self.T0, :, 0]
+        reduced[self.T1] = groups[self.T1, :, -1]
+        reduced[self.XMIN] = groups[self.XMIN, ind, imin]
+        reduced[self.YMIN] = groups[self.YMIN, ind, imin]
+        reduced[self.XMAX] = groups[self.XMAX, ind, imax]
+        reduced[self.YMAX] = groups[self.YMAX, ind, imax]
+        reduced[self.ERR] = np.max(groups[self.ERR], axis=1)
+        reduced[self.MINFIRST] = np.where(imin == imax, groups[self.MINFIRST, ind, imin], imin < imax)
+        return reduced
+
+    def get_records(self, level, g0, g1):
+        """
+        Returns the records of level (>= 1) covering the samples with the indices g0 to g1 (counted since the last
+        clear) and the index of the first sample after the last returned record.
+        """
+        ringbuffer = self.levels[level - 1]
+        size = self.factor ** level
+        j0 = max(g0 // size, ringbuffer.count - len(ringbuffer))
+        j1 = min(-(-g1 // size), ringbuffer.count)
+        if j1 <= j0:
+            return None, g0
+
+        offset = ringbuffer.count - len(ringbuffer)
+        records = ringbuffer.data[:, ringbuffer.start + j0 - offset:ringbuffer.start + j1 - offset]
+        return records, j1 * size
+
+    def get_points(self, records):
+        """
+        Converts records into points, the minimum and the maximum of each record in their original order.
+        """
+        minfirst = records[self.MINFIRST] > 0
+        x = np.empty((records.shape[1], 2))
+        y = np.empty((records.shape[1], 2))
+        x[:, 0] = np.where(minfirst, records[self.XMIN], records[self.XMAX])
+        x[:, 1] = np.where(minfirst, records[self.XMAX], records[self.XMIN])
+        y[:, 0] = np.where(minfirst, records[self.YMIN], records[self.YMAX])
+        y[:, 1] = np.where(minfirst, records[self.YMAX], records[self.YMIN])
+        err = np.repeat(records[self.ERR], 2)
+        return x.ravel(), y.ravel(), err
+
+
 class Databufferline(pydantic.BaseModel):
+    """
+    Buffer of the time, x, y and error data of a line, stored in a RingBuffer. tdata, xdata, ydata and errordata
+    are numpy views of the buffer that can be given directly to the plot.
+    """
     model_config = {'extra': 'allow'}
     skip_bufferdata_when_serialized: bool = pydantic.Field(default=True, description='Do not save the buffer data when serialized')
-    tdata: list = pydantic.Field(default=[])
-    xdata: list = pydantic.Field(default=[])
-    ydata: list = pydantic.Field(default=[])
-    errordata: list = pydantic.Field(default=[])
+    _ringbuffer: RingBuffer = pydantic.PrivateAttr(default_factory=lambda: RingBuffer(4))
+    _pyramid: DecimationPyramid = pydantic.PrivateAttr(default_factory=DecimationPyramid)
+    _x_sorted: bool = pydantic.PrivateAttr(default=True)  # The x data is monotonically increasing since the last clear
+
+    def model_post_init(self, __context):
+        # Data of a serialized buffer
+        extra = self.__pydantic_extra__ if self.__pydantic_extra__ is not None else {}
+        bufferdata = [extra.pop(k, []) for k in ('tdata', 'xdata', 'ydata', 'errordata')]
+        if len(bufferdata[0]) > 0:
+            self.append(*bufferdata, buffersize=len(bufferdata[0]))
+
+    @property
+    def tdata(self):
+        return self._ringbuffer.get_view(0)
+
+    @property
+    def xdata(self):
+        return self._ringbuffer.get_view(1)
+
+    @property
+    def ydata(self):
+        return self._ringbuffer.get_view(2)
+
+    @property
+    def errordata(self):
+        return self._ringbuffer.get_view(3)
+
+    @property
+    def x_sorted(self):
+        """
+        True if the x data is monotonically increasing, i.e. if x is the time, and can be searched with
+        np.searchsorted.
+        """
+        return self._x_sorted
+
+    def __len__(self):
+        return len(self._ringbuffer)
+
     def clear(self):
-        self.tdata = []
-        self.xdata = []
-        self.ydata = []
-        self.errordata = []
+        self._ringbuffer.clear()
+        self._pyramid.clear()
+        self._x_sorted = True
+
+    def append(self, t, x, y, err, buffersize):
+        """
+        Appends the data to the buffer and removes the oldest entries exceeding buffersize.
+
+        Parameters
+        ----------
+        t, x, y, err: float or array like
+            The data, floats are broadcasted to the length of the arrays
+        buffersize: int
+            The maximum number of entries in the buffer
+        """
+        ringbuffer = self._ringbuffer
+        pyramid = self._pyramid
+        rows = [t, x, y, err]
+        n = _get_length(rows)
+        if self._x_sorted and n > 0:
+            xnew = np.asarray(x, dtype=float).ravel()
+            if len(ringbuffer) > 0:
+                xnew = np.concatenate((self.xdata[-1:], xnew))
+            self._x_sorted = bool(np.all(xnew[1:] >= xnew[:-1]))
+        # The decimation pyramid is updated in blocks with the entries of the buffer, before they are removed
+        if ringbuffer.count - pyramid.count + n > buffersize // 2:
+            self.update_pyramid()
+
+        ringbuffer.append(rows, buffersize, n=n)
+        if n > buffersize // 2:  # Not all entries are in the buffer
+            rows = [np.broadcast_to(np.asarray(r, dtype=float).ravel(), (n,)) for r in rows]
+            pyramid.append(*rows, buffersize)
+
+    def update_pyramid(self):
+        """
+        Adds the entries of the buffer, that were appended since the last update, to the decimation pyramid.
+        """
+        ringbuffer = self._ringbuffer
+        pyramid = self._pyramid
+        nnew = min(ringbuffer.count - pyramid.count, len(ringbuffer))
+        if nnew > 0:
+            i0 = len(ringbuffer) - nnew
+            pyramid.append(self.tdata[i0:], self.xdata[i0:], self.ydata[i0:], self.errordata[i0:],
+                           ringbuffer.buffersize)
+        pyramid.count = ringbuffer.count
+
+    def get_plotdata(self, i0, i1, npoints):
+        """
+        Returns x, y and err of the entries i0 to i1 (indices of xdata) for plotting with at most about npoints
+        points. If there are more entries, the finest decimation level with less points is used, the last
+        entries that do not fill a record of this level are taken from the finer levels.
+        """
+        ringbuffer = self._ringbuffer
+        i0 = max(i0, 0)
+        i1 = min(i1, len(ringbuffer))
+        if (i1 - i0) <= npoints:
+            return self.xdata[i0:i1], self.ydata[i0:i1], self.errordata[i0:i1]
+
+        self.update_pyramid()
+        pyramid = self._pyramid
+        offset = ringbuffer.count - len(ringbuffer)  # The index of the first entry since the last clear
+        g0 = offset + i0
+        g1 = offset + i1
+        level = 1
+        while level < len(pyramid.levels) and 2 * (g1 - g0) / pyramid.factor ** level > npoints:
+            level += 1
+
+        level = min(level, len(pyramid.levels))
+        parts = []
+        gstart = g0
+        for l in range(level, 0, -1):
+            records, gstart_new = pyramid.get_records(l, gstart, g1)
+            if records is not None:
+                parts.append(pyramid.get_points(records))
+                gstart = gstart_new
+
+        # The remaining entries
+        istart = max(gstart - offset, i0)
+        parts.append((self.xdata[istart:i1], self.ydata[istart:i1], self.errordata[istart:i1]))
+        x = np.concatenate([p[0] for p in parts])
+        y = np.concatenate([p[1] for p in parts])
+        err = np.concatenate([p[2] for p in parts])
+        return x, y, err
 
     @pydantic.model_serializer
     def ser_model(self) -> typing.Dict[str, typing.Any]:
         if self.skip_bufferdata_when_serialized:
             return {'tdata': [],'xdata': [],'ydata': [],'errordata': [], 'skip_bufferdata_when_serialized':self.skip_bufferdata_when_serialized}
         else:
-            return {'tdata': self.tdata, 'xdata': self.xdata, 'ydata': self.ydata, 'errordata': self.errordata,
+            return {'tdata': self.tdata.tolist(), 'xdata': self.xdata.tolist(), 'ydata': self.ydata.tolist(),
+                    'errordata': self.errordata.tolist(),
                     'skip_bufferdata_when_serialized': self.skip_bufferdata_when_serialized}
 
 class configLine(pydantic.BaseModel,extra='allow'):
@@ -70,14 +403,14 @@ class configLine(pydantic.BaseModel,extra='allow'):
     color: pydColor = pydantic.Field(default=pydColor('red'), description='The color of the line')
     linewidth: float = pydantic.Field(default=2.0, description='The linewidth')
     linestyle: typing.Literal['SolidLine','DashLine','DotLine','DashDotLine','DashDotDotLine'] = pydantic.Field(default='SolidLine', description='The linestyle, see also https://doc.qt.io/qt-6/qt.html#PenStyle-enum')
-    databuffer: Databufferline = pydantic.Field(default=Databufferline(), description='The databuffer', editable=False)
+    databuffer: Databufferline = pydantic.Field(default_factory=Databufferline, description='The databuffer', editable=False)
     databuffer_add_mode: typing.Literal['append', 'clear first'] = pydantic.Field(default='append', description='Behaviour off data handling with add_data()')
     plot_mode_x: typing.Literal['all', 'last_N_s', 'last_N_points'] = pydantic.Field(default='all', description='')
     last_N_s: float = pydantic.Field(default=60,
                                      description='Plots the last seconds, if plot_mode_x is set to last_N_s')
     last_N_points: int = pydantic.Field(default=1000,
                                         description='Plots the last points, if plot_mode_x is set to last_N_points')
-    plot_every_Nth: int = pydantic.Field(default=1, description='Uses every Nth datapoint for plotting')
+    plot_every_Nth: int = pydantic.Field(default=1, description='Uses every Nth datapoint for plotting, if 1 lines with more than numplot_max points are decimated preserving the minima and maxima')
 
     def get_data(self, xlim=None, ylim=None):
         funcname = __name__ + '.get_data():'
@@ -109,57 +442,34 @@ class configLine(pydantic.BaseModel,extra='allow'):
             if self.databuffer_add_mode == "clear first":
                 self.databuffer.clear()
             rdata = redvypr.data_packets.Datapacket(data)
-            # data can be a single float or a list, if its a list add it item by item
             #newt = data['t']  # Add also the time of the packet
             newt = data['_redvypr']['t']  # Add also the time of the packet
             newx = self.x_addr(rdata)
             newy = self.y_addr(rdata)
 
-            if (type(newx) is not list):
-                newx = [newx]
-            if (type(newy) is not list):
-                newy = [newy]
-
+            # data can be a single value, a list or an array
+            newx = _as_floatdata(newx)
+            newy = _as_floatdata(newy)
             if self.error_mode != 'off':
-                error_mode: typing.Literal['off', 'standard', 'factor', 'constant'] = pydantic.Field(
-                    default='standard', description='')
-                error_factor: float = pydantic.Field(default=1.1, description='')
-                error_constant: float = pydantic.Field(default=.01, description='')
                 # print('errordata',error_raddr.datakey)
                 if len(self.error_addr) > 0 and self.error_mode == 'standard':
                     # logger.debug('Error standard')
-                    newerror = self.error_addr(data)
-                    if (type(newerror) is not list):
-                        newerror = [newerror]
+                    newerror = _as_floatdata(self.error_addr(data))
                     # print('newerror',newerror)
                 elif self.error_mode == 'factor':
                     # print('Error factor')
-                    errdata = np.asarray(newy)
-                    errdata_factor = errdata * self.error_factor - errdata.mean()
-                    newerror = errdata_factor.tolist()
+                    newerror = newy * self.error_factor - np.mean(newy)
                 elif self.error_mode == 'constant':
                     # print('Error constant')
-                    newerror = [self.error_constant] * len(newx)
+                    newerror = np.full(np.shape(newx), self.error_constant)
             else:
-                newerror = [0] * len(newx)
-
-            if (len(newx) != len(newy)) or (len(newx) != len(newerror)):
-                raise ValueError('lengths of x, y and error data different (x:{:d}, y:{:d}, err:{:d})'.format(len(newx), len(newy), len(newerror)))
+                newerror = np.zeros(np.shape(newx)) if np.ndim(newx) else 0.0
 
-            for inew in range(len(newx)):  # TODO this can be optimized using indices instead of a loop
-                if isinstance(newt, Iterable):
-                    self.databuffer.tdata.append(float(newt[inew]))
-                else:
-                    self.databuffer.tdata.append(float(newt))
+            if (type(newx) is not float or type(newy) is not float) and (
+                    (np.size(newx) != np.size(newy)) or (np.size(newx) != np.size(newerror))):
+                raise ValueError('lengths of x, y and error data different (x:{:d}, y:{:d}, err:{:d})'.format(np.size(newx), np.size(newy), np.size(newerror)))
 
-                self.databuffer.xdata.append(float(newx[inew]))
-                self.databuffer.ydata.append(float(newy[inew]))
-                self.databuffer.errordata.append(float(newerror[inew]))
-                while len(self.databuffer.tdata) > self.buffersize:
-                    self.databuffer.tdata.pop(0)
-                    self.databuffer.xdata.pop(0)
-                    self.databuffer.ydata.pop(0)
-                    self.databuffer.errordata.pop(0)
+            self.databuffer.append(newt, newx, newy, newerror, buffersize=self.buffersize)
 
         else:
             raise ValueError('Datapacket does not contain data for address xaddr:{}:{}, yadd:{}:{}'.format(self.x_addr,inx,self.y_addr,iny))
@@ -347,6 +657,11 @@ class XYPlotWidget(QtWidgets.QFrame):
         self._interactive_mode = ''
         self.x_min = 0
         self.x_max = 0
+        self._xlim_view = None  # The visible x-range, if zoomed in
+        self._replot_timer = QtCore.QTimer()  # Replots the lines after zooming
+        self._replot_timer.setSingleShot(True)
+        self._replot_timer.setInterval(100)
+        self._replot_timer.timeout.connect(self.replot_lines)
         if (config == None):  # Create a config from the template
             self.config = ConfigXYplot()
         else:
@@ -483,6 +798,7 @@ class XYPlotWidget(QtWidgets.QFrame):
             # Add a legend
             legend = plot.addLegend()
             self.layout.addWidget(plot)
+            plot.getViewBox().sigXRangeChanged.connect(self._view_x_range_changed)
             self.plotWidget = plot
             self.legendWidget = legend
             # plot_dict = {'widget': plot, 'lines': []}
@@ -1367,58 +1683,90 @@ class XYPlotWidget(QtWidgets.QFrame):
 
     def __get_data_for_line(self, line):
         """
-        Provides the data for the line to plot
-        :return:
-
-        plot_mode_x: typing.Literal['all', 'last_N_s', 'last_N_points'] = pydantic.Field(default='all', description='')
-    last_N_s: float = pydantic.Field(default=60,
-                                     description='Plots the last seconds, if plot_mode_x is set to last_N_s')
-    last_N_points: int = pydantic.Field(default=200,
-                                        description='Plots the last points, if plot_mode_x is set to last_N_points')
-    plot_every_Nth: int = pydantic.Field(default=1, description='Uses every Nth datapoint for plotting')
-
+        Provides the data for the line to plot. If plot_every_Nth is 1, the data in the plotted range is
+        decimated to about numplot_max points (or twice the width of the plot) with the min/max levels of the
+        databuffer, otherwise every Nth point of the last numplot_max points is plotted.
+        :return: [x,y,err]
         """
-        if line.plot_mode_x == 'all':
-            ttmp = line.databuffer.tdata[::line.plot_every_Nth]
-            xtmp = line.databuffer.xdata[::line.plot_every_Nth]
-            ytmp = line.databuffer.ydata[::line.plot_every_Nth]
-            errtmp = line.databuffer.errordata[::line.plot_every_Nth]
-        elif line.plot_mode_x == 'last_N_s':
-            ttmp = line.databuffer.tdata[::line.plot_every_Nth]
-            xtmp = line.databuffer.xdata[::line.plot_every_Nth]
-            ytmp = line.databuffer.ydata[::line.plot_every_Nth]
-            errtmp = line.databuffer.errordata[::line.plot_every_Nth]
-            # Find the index
-            tnow = ttmp[-1]
-            tsearch = tnow - line.last_N_s
-            ttmp_ar = np.asarray(ttmp)
-            iplot = np.where(ttmp_ar >= tsearch)[0]
-            if len(iplot)>0:
-                istart = iplot[0]
-                ttmp = ttmp[istart:]
-                xtmp = xtmp[istart:]
-                ytmp = ytmp[istart:]
-                errtmp = errtmp[istart:]
+        databuffer = line.databuffer
+        if line.plot_every_Nth > 1:
+            if line.plot_mode_x == 'last_N_s':
+                ttmp = databuffer.tdata[::line.plot_every_Nth]
+                istart = np.searchsorted(ttmp, ttmp[-1] - line.last_N_s, side='left')
+                sl = slice(istart, None)
+            elif line.plot_mode_x == 'last_N_points':
+                sl = slice(-line.last_N_points, None)
             else:
-                ttmp = []
-                xtmp = []
-                ytmp = []
-                errtmp = []
-
+                sl = slice(None)
+
+            # Reduce the number of points, if they are more than numplot_max
+            x = databuffer.xdata[::line.plot_every_Nth][sl][-line.numplot_max:]
+            y = databuffer.ydata[::line.plot_every_Nth][sl][-line.numplot_max:]
+            err = databuffer.errordata[::line.plot_every_Nth][sl][-line.numplot_max:]
+            return [x, y, err]
+
+        nbuffer = len(databuffer)
+        i0 = 0
+        i1 = nbuffer
+        if line.plot_mode_x == 'last_N_s':
+            tdata = databuffer.tdata
+            if nbuffer > 0:
+                i0 = np.searchsorted(tdata, tdata[-1] - line.last_N_s, side='left')
         elif line.plot_mode_x == 'last_N_points':
-            ttmp = line.databuffer.tdata[::line.plot_every_Nth][-line.last_N_points:]
-            xtmp = line.databuffer.xdata[::line.plot_every_Nth][-line.last_N_points:]
-            ytmp = line.databuffer.ydata[::line.plot_every_Nth][-line.last_N_points:]
-            errtmp = line.databuffer.errordata[::line.plot_every_Nth][-line.last_N_points:]
+            i0 = nbuffer - line.last_N_points
+        elif self._xlim_view is not None and databuffer.x_sorted:
+            # Zoomed in, the visible range and its neighbouring ranges are plotted. The range can only be
+            # searched if x is sorted (i.e. the time), otherwise the whole buffer is plotted.
+            xdata = databuffer.xdata
+            dx = self._xlim_view[1] - self._xlim_view[0]
+            i0 = np.searchsorted(xdata, self._xlim_view[0] - dx, side='left')
+            i1 = np.searchsorted(xdata, self._xlim_view[1] + dx, side='right')
+
+        npoints = line.numplot_max
+        width = self.plotWidget.width()
+        if width > 0:
+            npoints = min(npoints, 2 * width)
+
+        x, y, err = databuffer.get_plotdata(i0, i1, npoints)
+        return [x, y, err]
+
+    def _view_x_range_changed(self, viewbox, xrange):
+        """
+        Replots the lines with the data of the visible x-range, if the x-axis is not autoscaled.
+        """
+        if viewbox.autoRangeEnabled()[0] or self.config.plot_mode_x != 'all':
+            xlim = None
         else:
-            pass
+            xlim = tuple(xrange)
 
-        # Reduce the number of points, if they are more than numplot_max
-        x = xtmp[-line.numplot_max:]
-        y = ytmp[-line.numplot_max:]
-        err = errtmp[-line.numplot_max:]
-        # pw.setXRange(min(x[:ind]),max(x[:ind]))
-        return [x,y,err]
+        if xlim is None and self._xlim_view is None:
+            return
+
+        self._xlim_view = xlim
+        self._replot_timer.start()
+
+    def replot_lines(self):
+        """
+        Plots the buffered data of all lines
+        """
+        for line in self.config.lines:
+            try:
+                line._lineplot
+            except:
+                continue
+
+            self._set_line_data(line)
+
+    def _set_line_data(self, line):
+        [x, y, err] = self.__get_data_for_line(line)
+        line._lineplot.setData(x=x, y=y)
+        if len(x) > 0:
+            self.x_min = min(self.x_min, np.min(x))
+            self.x_max = max(self.x_max, np.max(x))
+        if line._errorplot is not None:
+            beamwidth = None
+            line._errorplot.setData(x=np.asarray(x), y=np.asarray(y), top=np.asarray(err) * 1,
+                                    bottom=np.asarray(err) * 1, beam=beamwidth)
 
     def closeEvent(self, event):
         #print('Close event')
@@ -1481,16 +1829,8 @@ class XYPlotWidget(QtWidgets.QFrame):
                     if update and line.__newdata:  # We could check here if data was changed above the for given line
                         line._tlastupdate = tnow
                         try:
-                            [x,y,err]= self.__get_data_for_line(line)
-                            line._lineplot.setData(x=x, y=y)
-                            self.x_min = min(self.x_min,min(x))
-                            self.x_max = max(self.x_max, max(x))
+                            self._set_line_data(line)
                             something_updated = True
-                            if line._errorplot is not None:
-                                beamwidth = None
-                                line._errorplot.setData(x=np.asarray(x), y=np.asarray(y), top=np.asarray(err) * 1,
-                                                        bottom=np.asarray(err) * 1, beam=beamwidth)
-
                         except:
                             self.logger.info('Could not update line',exc_info=True)
 
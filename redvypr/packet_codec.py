@@ -0,0 +1,376 @@
+"""
+Binary serialization of datapackets.
+
+The packets are encoded in the MessagePack format (https://msgpack.org), numpy arrays and datetime objects are stored
+as extension types. Every packet is sent as a frame with a small header (magic bytes and the length of the encoded
+packet), such that a stream of packets can be decoded incrementally, i.e. from a TCP receive buffer, without searching
+for separators. Compared to YAML the encoding is fast and the decoding does not create arbitrary python objects.
+
+Frame layout::
+
+    b'RVP1' | uint32 (little endian) length of the payload | MessagePack encoded packet
+
+Tuples are encoded as lists, numpy scalars as their python equivalent.
+"""
+
+import sys
+import struct
+import logging
+import datetime
+import numpy as np
+
+logging.basicConfig(stream=sys.stderr)
+logger = logging.getLogger('redvypr.base.packet_codec')
+logger.setLevel(logging.INFO)
+
+frame_magic = b'RVP1'
+frame_header = struct.Struct('<4sI')
+frame_maxsize = 256 * 1024 * 1024  # Frames with a larger payload are treated as corrupted
+
+# Extension type codes
+ext_ndarray = 1
+ext_datetime = 2
+
+_pack_float = struct.Struct('>Bd').pack
+_pack_int64 = struct.Struct('>Bq').pack
+_pack_uint64 = struct.Struct('>BQ').pack
+_pack_type32 = struct.Struct('>BI').pack
+_pack_ext32 = struct.Struct('>BIb').pack
+
+_unpack_uint8 = struct.Struct('>B').unpack_from
+_unpack_uint16 = struct.Struct('>H').unpack_from
+_unpack_uint32 = struct.Struct('>I').unpack_from
+_unpack_uint64 = struct.Struct('>Q').unpack_from
+_unpack_int8 = struct.Struct('>b').unpack_from
+_unpack_int16 = struct.Struct('>h').unpack_from
+_unpack_int32 = struct.Struct('>i').unpack_from
+_unpack_int64 = struct.Struct('>q').unpack_from
+_unpack_float32 = struct.Struct('>f').unpack_from
+_unpack_float64 = struct.Struct('>d').unpack_from
+
+_fixint = [bytes([i]) for i in range(128)]
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def _encode(value, out):
+    """
+    Appends the encoded value to the list out.
+    """
+    vtype = type(value)
+    if vtype is str:
+        b = value.encode('utf-8')
+        n = len(b)
+        if n < 32:
+            out.append(bytes([0xa0 | n]))
+        else:
+            out.append(_pack_type32(0xdb, n))
+        out.append(b)
+    elif vtype is float:
+        out.append(_pack_float(0xcb, value))
+    elif vtype is int:
+        if 0 <= value < 128:
+            out.append(_fixint[value])
+        elif value >= 0x8000000000000000:
+            out.append(_pack_uint64(0xcf, value))
+        else:
+            out.append(_pack_int64(0xd3, value))
+    elif vtype is dict:
+        n = len(value)
+        if n < 16:
+            out.append(bytes([0x80 | n]))
+        else:
+            out.append(_pack_type32(0xdf, n))
+        for k, v in value.items():
+            _encode(k, out)
+            _encode(v, out)
+    elif vtype is list or vtype is tuple:
+        n = len(value)
+        if n < 16:
+            out.append(bytes([0x90 | n]))
+        else:
+            out.append(_pack_type32(0xdd, n))
+        for v in value:
+            _encode(v, out)
+    elif value is None:
+        out.append(b'\xc0')
+    elif vtype is bool:
+        out.append(b'\xc3' if value else b'\xc2')
+    elif vtype is bytes or vtype is bytearray or vtype is memoryview:
+        b = bytes(value)
+        out.append(_pack_type32(0xc6, len(b)))
+        out.append(b)
+    elif vtype is np.ndarray:
+        _encode_ndarray(value, out)
+    elif isinstance(value, np.generic):
+        _encode(value.item(), out)
+    elif isinstance(value, datetime.datetime):
+        b = value.isoformat().encode('utf-8')
+        out.append(_pack_ext32(0xc9, len(b), ext_datetime))
+        out.append(b)
+    # Subclasses of the standard types
+    elif isinstance(value, dict):
+        _encode(dict(value), out)
+    elif isinstance(value, (list, tuple)):
+        _encode(list(value), out)
+    elif isinstance(value, str):
+        _encode(str(value), out)
+    elif isinstance(value, bool):
+        _encode(bool(value), out)
+    elif isinstance(value, int):
+        _encode(int(value), out)
+    elif isinstance(value, float):
+        _encode(float(value), out)
+    else:
+        raise TypeError('Cannot encode object of type {}'.format(vtype))
+
+
+def _encode_ndarray(value, out):
+    if value.dtype.hasobject:
+        # Object arrays cannot be copied as raw data
+        _encode(value.tolist(), out)
+        return
+
+    header = []
+    _encode(value.dtype.str, header)
+    _encode(list(value.shape), header)
+    data = np.ascontiguousarray(value).tobytes()
+    n = sum(len(h) for h in header) + len(data)
+    out.append(_pack_ext32(0xc9, n, ext_ndarray))
+    out.extend(header)
+    out.append(data)
+
+
+def _decode(buf, i):
+    """
+    Decodes the object starting at position i of buf.
+
+    Returns
+    -------
+    tuple
+        (object, position after the object)
+    """
+    b = buf[i]
+    i += 1
+    if b < 0x80:  # positive fixint
+        return b, i
+    elif b < 0x90:  # fixmap
+        return _decode_map(buf, i, b & 0x0f)
+    elif b < 0xa0:  # fixarray
+        return _decode_array(buf, i, b & 0x0f)
+    elif b < 0xc0:  # fixstr
+        n = b & 0x1f
+        return str(buf[i:i + n], 'utf-8'), i + n
+    elif b >= 0xe0:  # negative fixint
+        return b - 0x100, i
+    elif b == 0xc0:
+        return None, i
+    elif b == 0xc2:
+        return False, i
+    elif b == 0xc3:
+        return True, i
+    elif b == 0xcb:
+        return _unpack_float64(buf, i)[0], i + 8
+    elif b == 0xca:
+        return _unpack_float32(buf, i)[0], i + 4
+    elif b == 0xcc:
+        return buf[i], i + 1
+    elif b == 0xcd:
+        return _unpack_uint16(buf, i)[0], i + 2
+    elif b == 0xce:
+        return _unpack_uint32(buf, i)[0], i + 4
+    elif b == 0xcf:
+        return _unpack_uint64(buf, i)[0], i + 8
+    elif b == 0xd0:
+        return _unpack_int8(buf, i)[0], i + 1
+    elif b == 0xd1:
+        return _unpack_int16(buf, i)[0], i + 2
+    elif b == 0xd2:
+        return _unpack_int32(buf, i)[0], i + 4
+    elif b == 0xd3:
+        return _unpack_int64(buf, i)[0], i + 8
+    elif b in (0xd9, 0xda, 0xdb):  # str 8/16/32
+        n, i = _decode_length(buf, i, b - 0xd9)
+        return str(buf[i:i + n], 'utf-8'), i + n
+    elif b in (0xc4, 0xc5, 0xc6):  # bin 8/16/32
+        n, i = _decode_length(buf, i, b - 0xc4)
+        return bytes(buf[i:i + n]), i + n
+    elif b in (0xdc, 0xdd):  # array 16/32
+        n, i = _decode_length(buf, i, b - 0xdb)
+        return _decode_array(buf, i, n)
+    elif b in (0xde, 0xdf):  # map 16/32
+        n, i = _decode_length(buf, i, b - 0xdd)
+        return _decode_map(buf, i, n)
+    elif b in (0xc7, 0xc8, 0xc9):  # ext 8/16/32
+        n, i = _decode_length(buf, i, b - 0xc7)
+        return _decode_ext(buf, i + 1, n, _unpack_int8(buf, i)[0])
+    elif 0xd4 <= b <= 0xd8:  # fixext 1, 2, 4, 8, 16
+        n = 1 << (b - 0xd4)
+        return _decode_ext(buf, i + 1, n, _unpack_int8(buf, i)[0])
+    else:
+        raise DecodeError('Unknown type byte 0x{:02x}'.format(b))
+
+
+def _decode_length(buf, i, size):
+    """
+    Decodes a length of 1 (size=0), 2 (size=1) or 4 (size=2) bytes.
+    """
+    if size == 0:
+        return buf[i], i + 1
+    elif size == 1:
+        return _unpack_uint16(buf, i)[0], i + 2
+    else:
+        return _unpack_uint32(buf, i)[0], i + 4
+
+
+def _decode_array(buf, i, n):
+    data = []
+    for _ in range(n):
+        v, i = _decode(buf, i)
+        data.append(v)
+    return data, i
+
+
+def _decode_map(buf, i, n):
+    data = {}
+    for _ in range(n):
+        k, i = _decode(buf, i)
+        v, i = _decode(buf, i)
+        if type(k) is list:  # Not hashable, tuples are encoded as lists
+            k = tuple(k)
+        data[k] = v
+    return data, i
+
+
+def _decode_ext(buf, i, n, code):
+    iend = i + n
+    if iend > len(buf):
+        raise DecodeError('Extension data exceeds the buffer')
+    if code == ext_ndarray:
+        dtype, i = _decode(buf, i)
+        shape, i = _decode(buf, i)
+        # Copy the data, the array shall not reference the receive buffer
+        data = np.frombuffer(buf[i:iend], dtype=np.dtype(dtype)).reshape(shape).copy()
+        return data, iend
+    elif code == ext_datetime:
+        return datetime.datetime.fromisoformat(str(buf[i:iend], 'utf-8')), iend
+    else:
+        raise DecodeError('Unknown extension type {}'.format(code))
+
+
+def encode(data):
+    """
+    Encodes an object (typically a datapacket) into MessagePack.
+
+    Returns
+    -------
+    bytes
+    """
+    out = []
+    _encode(data, out)
+    return b''.join(out)
+
+
+def decode(datab):
+    """
+    Decodes a MessagePack encoded object.
+    """
+    buf = bytes(datab)
+    try:
+        data, i = _decode(buf, 0)
+    except (IndexError, struct.error, UnicodeDecodeError, TypeError) as e:
+        raise DecodeError('Could not decode data: {}'.format(e)) from e
+    if i != len(buf):
+        raise DecodeError('Decoded {} of {} bytes'.format(i, len(buf)))
+    return data
+
+
+def encode_frame(packet):
+    """
+    Encodes a datapacket into a frame with header.
+
+    Returns
+    -------
+    bytes
+    """
+    out = [b'']
+    _encode(packet, out)
+    n = sum(len(b) for b in out)
+    out[0] = frame_header.pack(frame_magic, n)
+    return b''.join(out)
+
+
+def decode_frames(datab):
+    """
+    Decodes all complete frames in datab.
+
+    Returns
+    -------
+    tuple
+        (list of packets, remaining bytes that do not contain a complete frame)
+    """
+    decoder = PacketStreamDecoder()
+    packets = decoder.feed(datab)
+    return packets, bytes(decoder.buffer)
+
+
+class PacketStreamDecoder():
+    """
+    Incremental decoder of a stream of frames. Received bytes are added with feed(), which returns the packets of all
+    complete frames. Incomplete frames are kept until the rest has been received. If the stream is corrupted the
+    decoder skips to the next frame header.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.nskipped = 0  # Number of bytes skipped because of corrupted data
+        self.nerrors = 0  # Number of frames that could not be decoded
+
+    def feed(self, datab):
+        """
+        Adds received data and decodes the complete frames.
+
+        Returns
+        -------
+        list
+            The decoded packets
+        """
+        buffer = self.buffer
+        buffer += datab
+        packets = []
+        nbuf = len(buffer)
+        i = 0
+        with memoryview(buffer) as buf:
+            while nbuf - i >= frame_header.size:
+                magic, n = frame_header.unpack_from(buf, i)
+                if magic != frame_magic or n > frame_maxsize:
+                    # Resynchronize to the next header
+                    inext = buffer.find(frame_magic, i + 1)
+                    if inext < 0:
+                        inext = max(i + 1, nbuf - len(frame_magic) + 1)
+                    self.nskipped += inext - i
+                    logger.debug('Skipping {} bytes of corrupted data'.format(inext - i))
+                    i = inext
+                    continue
+
+                istart = i + frame_header.size
+                iend = istart + n
+                if iend > nbuf:  # Incomplete frame
+                    break
+
+                try:
+                    packet, ipacket = _decode(bytes(buf[istart:iend]), 0)
+                    if ipacket != n:
+                        raise DecodeError('Decoded {} of {} bytes'.format(ipacket, n))
+                except Exception as e:
+                    self.nerrors += 1
+                    logger.info('Could not decode frame: {}'.format(e))
+                else:
+                    packets.append(packet)
+                i = iend
+
+        if i > 0:
+            del buffer[:i]
+
+        return packets
@@ -1,12 +1,14 @@
 import sys
 import logging
 import copy
-from .redvypr_address import RedvyprAddress, redvypr_standard_address_filter
+from .redvypr_address import RedvyprAddress, redvypr_standard_address_filter, packet_address
 import redvypr.data_packets as data_packets
 import time
 import json
 import deepdiff
 import typing
+import bisect
+import threading
 from datetime import datetime
 
 logging.basicConfig(stream=sys.stderr)
@@ -97,6 +99,7 @@ def create_data_statistic_dict():
     statdict['host_redvypr'] = {}
     statdict['metadata'] = {}
     statdict['packets'] = {}  # Packets from subscribed devices
+    statdict['datakeys_schema'] = {}  # Schema fingerprints of the datapackets of device_redvypr
     return statdict
 
 
@@ -123,7 +126,7 @@ def rem_device_from_statistics(deviceaddress, statdict):
 
 def do_metadata(data, metadatadict, auto_add_packetfilter=True):
     funcname = __name__ + '.do_metadata():'
-    status = {'metadata_changed': False}
+    status = {'metadata_changed': False, 'addresses_changed': set()}
     # Remove entries
     if '_metadata_remove' in data.keys():
         #print("Removing data",data)
@@ -140,12 +143,7 @@ def do_metadata(data, metadatadict, auto_add_packetfilter=True):
             if remove_mode == "exact":
                 address_strings = [address_str]
             else:
-                address_strings = []
-                potential_address_strings = metadatadict['metadata'].keys()
-                for addr_test in potential_address_strings:
-                    raddr_test = RedvyprAddress(addr_test)
-                    if raddress_str.matches(raddr_test):
-                        address_strings.append(addr_test)
+                address_strings = get_metadata_store(metadatadict).find_matching(raddress_str)
 
             print(f"Try to remove entries from addresses:{address_strings}")
             if constraint_entries is not None:
@@ -212,12 +210,15 @@ def do_metadata(data, metadatadict, auto_add_packetfilter=True):
                 except:
                     pass
 
+            if status['metadata_changed']:
+                status['addresses_changed'].update(address_strings)
+
     # Add entry
     if '_metadata' in data.keys():
         try:
             for address_str_work in data['_metadata'].keys():
                 raddress = RedvyprAddress(address_str_work)
-                raddress_data = RedvyprAddress(data)
+                raddress_data = packet_address(data)
 
                 if auto_add_packetfilter:
                     uuid = None
@@ -260,6 +261,7 @@ def do_metadata(data, metadatadict, auto_add_packetfilter=True):
                     if target.get(key) != value:
                         target[key] = value
                         status['metadata_changed'] = True
+                        status['addresses_changed'].add(address_str)
                         logger.debug(f"New metadata for {address_str=}:\n")
                         logger.debug(f"{key=}:{value=}")
 
@@ -282,6 +284,7 @@ def do_metadata(data, metadatadict, auto_add_packetfilter=True):
                         if not is_duplicate:
                             target['_constraints'].append(new_rule)
                             status['metadata_changed'] = True
+                            status['addresses_changed'].add(address_str)
                             #print(f"Added new unique constraint to {address_str}")
                             logger.debug(f"New contrained metadata for {address_str=}:\n")
                             logger.debug(f"{new_rule=}")
@@ -289,55 +292,221 @@ def do_metadata(data, metadatadict, auto_add_packetfilter=True):
         except Exception:
             logger.info(funcname + " Could not update metadata", exc_info=True)
 
+    # The entries were changed in place, the memoized lookups of the store need to be invalidated
+    if status['metadata_changed'] and isinstance(metadatadict['metadata'], MetadataStore):
+        metadatadict['metadata'].invalidate(status['addresses_changed'] or None)
+
     return status
 
 
+class DeviceinfoRevisions():
+    """
+    Tracks the changes of the deviceinfo_all dictionary of distribute_data and creates delta patches instead
+    of copying the whole dictionary for every change. Changes are marked with mark_changed(section, key), where
+    section is 'device_redvypr' or 'metadata'. create_patch() increases the revision and returns the current
+    content of the changed entries:
+
+    {'revision': 5, 'base_revision': 4, 'set': {'metadata': {address_str: metadata}}, 'remove': [['metadata', address_str]]}
+
+    The patches are applied by DeviceinfoMirror.
+    """
+    def __init__(self, deviceinfo_all):
+        self.deviceinfo_all = deviceinfo_all
+        self.revision = 0
+        self._changed = set()
+
+    def mark_changed(self, section, key):
+        self._changed.add((section, key))
+
+    def create_patch(self):
+        """
+        Creates a patch with the entries changed since the last patch.
+
+        Returns:
+            The patch dictionary or None if nothing changed
+        """
+        if len(self._changed) == 0:
+            return None
+
+        self.revision += 1
+        patch_set = {}
+        patch_remove = []
+        for section, key in self._changed:
+            try:
+                value = self.deviceinfo_all[section][key]
+            except KeyError:
+                patch_remove.append([section, key])
+                continue
+            patch_set.setdefault(section, {})[key] = copy.deepcopy(value)
+
+        self._changed = set()
+        return {'revision': self.revision, 'base_revision': self.revision - 1, 'set': patch_set, 'remove': patch_remove}
+
+    def snapshot(self):
+        """
+        Returns the revision and a full copy of deviceinfo_all, pending changes are included in the copy
+        and will be sent again with the next patch. The copy contains only plain dictionaries (the MetadataStore
+        is converted), such that it can be serialized (e.g. yaml.safe_dump) when sent within a packet.
+        """
+        revision = self.revision
+        deviceinfo_copy = copy.deepcopy(self.deviceinfo_all)
+        for section, value in deviceinfo_copy.items():
+            if isinstance(value, MetadataStore):
+                deviceinfo_copy[section] = dict(value)
+        return revision, deviceinfo_copy
+
+
+def apply_deviceinfo_patch(deviceinfo_all, patch):
+    """
+    Applies a patch created by DeviceinfoRevisions.create_patch() to a copy of deviceinfo_all.
+    """
+    for section, entries in patch['set'].items():
+        deviceinfo_all.setdefault(section, {}).update(entries)
+
+    for section, key in patch['remove']:
+        deviceinfo_all.get(section, {}).pop(key, None)
+
+
+class DeviceinfoMirror():
+    """
+    A local copy of the deviceinfo_all dictionary of redvypr for devices. It is updated with the 'info' command
+    packets of distribute_data, containing either the full deviceinfo_all ('deviceinfo_all') or a patch with the
+    changes since the previous revision ('deviceinfo_patch'). If a patch does not fit to the local revision, e.g.
+    because a packet was dropped, resync_needed is set and the device should send resync_packet() to redvypr,
+    which answers with the full deviceinfo_all.
+    """
+    def __init__(self):
+        self.deviceinfo_all = None
+        self.revision = None
+        self.resync_needed = False
+        self._resync_requested = False
+
+    def update(self, datapacket):
+        """
+        Updates the local deviceinfo_all with the content of an info packet.
+
+        Returns:
+            Dictionary of the metadata entries that changed or were added (all entries for a full deviceinfo_all),
+            None if the packet did not change the local copy
+        """
+        if datapacket.get('deviceinfo_all') is not None:
+            # Copy the first two levels, the packet might be shared with other devices
+            self.deviceinfo_all = {k: dict(v) if isinstance(v, dict) else v for k, v in datapacket['deviceinfo_all'].items()}
+            self.deviceinfo_all['metadata'] = MetadataStore(self.deviceinfo_all.get('metadata', {}))
+            self.revision = datapacket.get('deviceinfo_revision')
+            self.resync_needed = False
+            self._resync_requested = False
+            return self.deviceinfo_all.get('metadata', {})
+
+        patch = datapacket.get('deviceinfo_patch')
+        if patch is None:
+            return None
+
+        if self.deviceinfo_all is None or patch['base_revision'] != self.revision:
+            if (self.revision is None or patch['revision'] > self.revision) and not self._resync_requested:
+                logger.debug('Deviceinfo revision {} does not fit to patch {}, resync needed'.format(self.revision, patch['base_revision']))
+                self.resync_needed = True
+            return None
+
+        apply_deviceinfo_patch(self.deviceinfo_all, patch)
+        self.revision = patch['revision']
+        return patch['set'].get('metadata', {})
+
+    def resync_packet(self):
+        """
+        Returns a command packet requesting the full deviceinfo_all from redvypr, to be put into the dataqueue.
+        """
+        self.resync_needed = False
+        self._resync_requested = True
+        return data_packets.commandpacket('deviceinfo_resync')
+
+
+def get_schema_fingerprint(data):
+    """
+    Returns a hash of the datakey names and types of a data packet, the redvypr keys (_redvypr etc.) are ignored.
+    Dictionaries and lists are followed recursively, numpy arrays are treated as one element.
+    Two packets with the same fingerprint have the same expanded datakeys.
+    :param data: redvypr data dictionary
+    :return: int
+    """
+    return hash(tuple((k, _get_value_schema(v)) for k, v in data.items() if k not in _redvypr_data_keys))
+
+
+def _get_value_schema(value):
+    value_type = type(value)
+    if value_type is dict:
+        return tuple((k, _get_value_schema(v)) for k, v in value.items())
+    elif value_type is list:
+        return (list,) + tuple(_get_value_schema(v) for v in value)
+    else:
+        return value_type
+
+
+_redvypr_data_keys = frozenset(data_packets.redvypr_data_keys)
+
+
 def do_data_statistics(data, statdict, address_data = None):
     """
-    Fills in the statistics dictionary with the data packet information
+    Fills in the statistics dictionary with the data packet information. The datakeys are only updated if the schema
+    fingerprint (see get_schema_fingerprint) of the address differs from the last packet, the fingerprints are stored
+    in statdict['datakeys_schema'].
     :param data:
     :param statdict:
     :param address_data:
     :return: statdict
     """
     if address_data is None:
-        raddr = RedvyprAddress(data)
+        raddr = packet_address(data)
     else:
         raddr = address_data
 
     #print("\n\nStatistics for data",data)
     #print("\n\nStatistics for address", raddr)
-    uuid = raddr.uuid
     address_str = raddr.to_address_string(data_statistics_address_format)
 
     # Create a hostinfo information
     try:
-        statdict['host_redvypr'][uuid].update(data['_redvypr']['host'])
+        statdict['host_redvypr'][raddr.uuid].update(data['_redvypr']['host'])
     except:
-        statdict['host_redvypr'][uuid] = data['_redvypr']['host']
+        statdict['host_redvypr'][raddr.uuid] = data['_redvypr']['host']
 
     # Create device_redvypr, dictionary with all devices as keys
     try:
-        statdict['device_redvypr'][address_str]['packets_published'] += 1
+        device_stat = statdict['device_redvypr'][address_str]
+        device_stat['packets_published'] += 1
     except:  # Does not exist yet, create the entry
-        statdict['device_redvypr'][address_str] = copy.deepcopy(device_redvypr_statdict)
+        device_stat = copy.deepcopy(device_redvypr_statdict)
+        statdict['device_redvypr'][address_str] = device_stat
+        statdict.get('datakeys_schema', {}).pop(address_str, None)
+
+    device_stat['_redvypr'].update(data['_redvypr'])
+
+    # Check if the datakeys changed, if not the expensive expansion is not necessary
+    fingerprint = get_schema_fingerprint(data)
+    try:
+        schemas = statdict['datakeys_schema']
+    except KeyError:
+        schemas = statdict['datakeys_schema'] = {}
+
+    if schemas.get(address_str) == fingerprint:
+        return
 
+    schemas[address_str] = fingerprint
     # Get datakeys from datapacket
     datakeys = get_keys_from_data(data)
     try:
-        datakeys_new = list(set(statdict['device_redvypr'][address_str]['datakeys'] + datakeys))
+        datakeys_new = list(set(device_stat['datakeys'] + datakeys))
     except Exception as e:
         logger.exception(e)
         datakeys_new = datakeys
 
-    statdict['device_redvypr'][address_str]['_redvypr'].update(data['_redvypr'])
-    statdict['device_redvypr'][address_str]['datakeys'] = datakeys_new
+    device_stat['datakeys'] = datakeys_new
 
     # Deeper check, data types and expanded data types
     rdata = data_packets.Datapacket(data)
     datakeys_expanded = rdata.datakeys(expand=True)
     #print('Datakeys expanded',datakeys_expanded)
-    statdict['device_redvypr'][address_str]['datakeys_expanded'].update(datakeys_expanded)
+    device_stat['datakeys_expanded'].update(datakeys_expanded)
 
 
     #return statdict
@@ -368,69 +537,235 @@ def get_keys_from_data(data):
     return keys
 
 
+class MetadataStore(dict):
+    """
+    Dictionary of the metadata entries {address_str: metadata} of deviceinfo_all['metadata'] with an index for
+    the hierarchical lookup of get_metadata(). The address strings are parsed once and sorted into buckets by their
+    device and packetid equality filters, such that only entries that can match a query are tested with
+    RedvyprAddress.matches(). The results of get_metadata() are memoized and invalidated by changes of the store,
+    changes of the metadata entries itself (as done in do_metadata) need to be announced with invalidate().
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._entries = None  # {address_str: RedvyprAddress}, None if the index needs to be rebuilt
+        self._buckets = {}  # {(device, packetid): [(number of datakey entries, address_str)]}
+        self._results = {}  # Memoized results of get_metadata()
+        self._intervals = {}  # Time intervals of the constraints of the entries
+
+    def __reduce__(self):
+        # Copies and pickles contain only the metadata, the index is rebuilt if needed
+        return (self.__class__, (dict(self),))
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.invalidate([key])
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.invalidate([key])
+
+    def pop(self, key, *args):
+        value = super().pop(key, *args)
+        self.invalidate([key])
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self.invalidate([item[0]])
+        return item
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.invalidate()
+
+    def clear(self):
+        super().clear()
+        self.invalidate()
+
+    def invalidate(self, address_strs=None):
+        """
+        Invalidates the memoized results after a change of the entries address_strs, or of all entries if None.
+        """
+        with self._lock:
+            self._generation += 1
+            self._results.clear()
+            if address_strs is None:
+                self._entries = None
+                self._intervals.clear()
+                return
+
+            for address_str in address_strs:
+                self._intervals.pop(address_str, None)
+                if self._entries is not None and ((address_str in self._entries) != (address_str in self)):
+                    self._entries = None
+
+    def _build_index(self):
+        entries = {}
+        buckets = {}
+        for address_str in list(self.keys()):
+            raddr = RedvyprAddress(address_str)
+            eq_filter = raddr.get_equality_filter() or {}
+            bucket = (eq_filter.get('__device__'), eq_filter.get('__packetid__'))
+            buckets.setdefault(bucket, []).append((len(raddr.get_datakeyentries()), address_str))
+            entries[address_str] = raddr
+
+        self._entries = entries
+        self._buckets = buckets
+
+    def find_matching(self, address):
+        """
+        Returns the address strings of the entries matched by address (address.matches(entry)). The address strings
+        are sorted by the number of their datakey entries, i.e. the most specific entries are last.
+        """
+        raddress = address if isinstance(address, RedvyprAddress) else RedvyprAddress(address)
+        eq_filter = raddress.get_equality_filter() or {}
+        device = eq_filter.get('__device__')
+        packetid = eq_filter.get('__packetid__')
+        with self._lock:
+            if self._entries is None:
+                self._build_index()
+            entries = self._entries
+            candidates = []
+            for (device_bucket, packetid_bucket), bucket in self._buckets.items():
+                if device is not None and device_bucket is not None and device_bucket != device:
+                    continue
+                if packetid is not None and packetid_bucket is not None and packetid_bucket != packetid:
+                    continue
+                candidates.extend(bucket)
+
+        candidates.sort()
+        return [address_str for nentries, address_str in candidates if raddress.matches(entries[address_str])]
+
+    def get_metadata(self, address: None | str | RedvyprAddress = None,
+                     mode: typing.Literal["merge", "expanded"] = "expanded"):
+        """
+        Gets the metadata of the redvypr address, see get_metadata().
+        """
+        if address is None:
+            raddress = RedvyprAddress("@")  # Everything
+        else:
+            raddress = RedvyprAddress(address)
+
+        key = (raddress.to_address_string(), mode)
+        with self._lock:
+            result = self._results.get(key)
+            generation = self._generation
+
+        if result is None:
+            result = {}
+            for address_str in self.find_matching(raddress):
+                try:
+                    metadata = copy.deepcopy(self[address_str])
+                except KeyError:  # Removed in the meantime
+                    continue
+                if mode == 'merge':  # Put everything into one dictionary
+                    result.update(metadata)
+                else:
+                    result[address_str] = metadata
+
+            with self._lock:
+                if generation == self._generation:
+                    self._results[key] = result
+
+        return copy.deepcopy(result)
+
+    def _get_intervals(self, address_str):
+        """
+        Returns the time intervals of the constraints of an entry as a tuple of the constraints, the sorted start
+        times with the constraint indices, the indices of constraints without a start and the end times.
+        """
+        with self._lock:
+            intervals = self._intervals.get(address_str)
+        if intervals is None:
+            constraints = self.get(address_str, {}).get('_constraints', [])
+            starts = []
+            no_start = []
+            ends = []
+            for i, rule in enumerate(constraints):
+                r_start, r_end = _get_rule_interval(rule)
+                if r_start is None:
+                    no_start.append(i)
+                else:
+                    starts.append((r_start, i))
+                ends.append(r_end)
+
+            starts.sort(key=lambda x: x[0])
+            intervals = (constraints, [x[0] for x in starts], [x[1] for x in starts], no_start, ends)
+            with self._lock:
+                self._intervals[address_str] = intervals
+
+        return intervals
+
+    def get_active_constraints(self, address_str, t1=None, t2=None):
+        """
+        Returns the constraints of the entry address_str that overlap with the time range [t1, t2], in the
+        original order.
+        """
+        constraints, start_times, start_indices, no_start, ends = self._get_intervals(address_str)
+        if not t1 and not t2:  # No range specified, show all
+            return list(constraints)
+
+        # Overlap logic: (RuleStart <= QueryEnd) AND (RuleEnd >= QueryStart)
+        if t2:
+            indices = no_start + start_indices[:bisect.bisect_right(start_times, t2)]
+        else:
+            indices = no_start + start_indices
+        if t1:
+            indices = [i for i in indices if ends[i] is None or not ends[i] < t1]
+
+        indices.sort()
+        return [constraints[i] for i in indices]
+
+
+def _get_rule_interval(rule):
+    """ Returns the start and end time of the 't' conditions of a constraint rule """
+    r_start = None
+    r_end = None
+    for cond in rule.get('conditions', []):
+        if cond['field'] == 't':
+            if cond['op'] in ['>', '>=']:
+                r_start = datetime.fromisoformat(cond['value']) if isinstance(
+                    cond['value'], str) else cond['value']
+            if cond['op'] in ['<', '<=']:
+                r_end = datetime.fromisoformat(cond['value']) if isinstance(
+                    cond['value'], str) else cond['value']
+
+    return r_start, r_end
+
+
+def get_metadata_store(statistics):
+    """
+    Returns statistics['metadata'] as a MetadataStore. If it is an ordinary dictionary a temporary store is created.
+    """
+    metadata = statistics['metadata']
+    if isinstance(metadata, MetadataStore):
+        return metadata
+    else:
+        return MetadataStore(metadata)
+
+
 def get_metadata(statistics,
     address: None | str | RedvyprAddress = None,
     mode: typing.Literal["merge", "expanded"] = "expanded"):
     """
-    Gets the metadata of the redvypr address
-    :param statistics:
+    Gets the metadata of the redvypr address. The metadata entries are sorted by the number of their datakey
+    entries, such that a more specific entry overwrites a less specific one.
+    :param statistics: dictionary with a 'metadata' entry (MetadataStore or dict)
     :param address:
     :param mode: merge or expanded
-    :return:
+    :return: a copy of the metadata
     """
 
     funcname = __name__ + '.get_metadata():'
     logger.debug(funcname)
-    metadata_return = {}
-    if address is None:
-        raddress = RedvyprAddress("@") # Everything
-    else:
-        raddress = RedvyprAddress(address)
-
-    if mode == 'merge':
-        metadata_return[raddress.to_address_string()] = {}
-    # Sort the datakeys by the number of the datakey indices.
-    # This allows to have the longest entries latest such that the most
-    # specific one is overwriting a less specific one
-    #https://docs.python.org/3/howto/sorting.html Decorate-Sort-Undecorate
-    decorated = [(len(RedvyprAddress(astr).get_datakeyentries()),astr) for astr in statistics['metadata'].keys()]
-    decorated.sort()
-    metadata_keys_sorted = [astr for nentries,astr in decorated]
-    #print('Metadaty_keys_sorted',metadata_keys_sorted)
-    #for astr in statistics['metadata'].keys():
-    for astr in metadata_keys_sorted:
-        #print("Astr",astr,mode,raddress)
-        raddr = RedvyprAddress(astr)
-        #print("Test address,",raddr,raddress)
-        #print("Test address result,", raddr(raddress))
-        #print("Test matches", raddress.matches_filter(raddr, soft_missing=False), raddr.matches_filter(raddress, soft_missing=False))
-        #print("Test address result2,", RedvyprAddress(astr))
-        #print("\n")
-        #try:
-        #    retdata = raddr(raddress)
-        #except:
-        #    continue
-
-        if raddress.matches(raddr):
-            #print(f"Match of {raddress} and {raddr}:\n{raddress.matches(raddr)=}")
-            if True:
-                metadata = statistics['metadata'][astr]
-                #print('Found metadata', metadata)
-                if mode == 'merge': # Put everything into the addressstring key
-                    metadata_return[raddress.to_address_string()].update(metadata)
-                else:
-                    #print("Expanded",astr)
-                    try:
-                        metadata_return[astr].update(metadata)
-                    except:
-                        metadata_return[astr] = metadata
-
-                    #print("Expanded", metadata_return)
-
-    if mode == 'merge':
-        return metadata_return[raddress.to_address_string()]
-    else:
-        return metadata_return
+    return get_metadata_store(statistics).get_metadata(address, mode=mode)
 
 
 def get_metadata_in_range(
@@ -443,45 +778,36 @@ def get_metadata_in_range(
 ):
     """
     Retrieves metadata within a time range.
-    :param mode: Controls the spatial hierarchy (Address merging).
+    :param mode: Controls the spatial hierarchy (Address merging), with "merge" the result has the address string
+    of address as the only key.
     :param constraint_mode: Controls the temporal hierarchy (Constraint merging).
     """
-    # 1. Get the base metadata (Spatial Merge/Expanded)
-    # Using your existing hierarchical logic
-    def _is_rule_active_in_range(rule, t1, t2):
-        """ Helper to check time overlap """
-        if not t1 and not t2: return True  # No range specified, show all
-
-        r_start = None
-        r_end = None
-        for cond in rule.get('conditions', []):
-            if cond['field'] == 't':
-                if cond['op'] in ['>', '>=']:
-                    r_start = datetime.fromisoformat(cond['value']) if isinstance(
-                        cond['value'], str) else cond['value']
-                if cond['op'] in ['<', '<=']:
-                    r_end = datetime.fromisoformat(cond['value']) if isinstance(
-                        cond['value'], str) else cond['value']
-
-        # Overlap logic: (RuleStart <= QueryEnd) AND (RuleEnd >= QueryStart)
-        if r_start and t2 and r_start > t2: return False
-        if r_end and t1 and r_end < t1: return False
-        return True
+    store = get_metadata_store(statistics)
+    if address is None:
+        raddress = RedvyprAddress("@")  # Everything
+    else:
+        raddress = RedvyprAddress(address)
 
-    base_data = get_metadata(statistics, address, mode=mode)
+    # 1. Get the base metadata (Spatial Merge/Expanded) together with the constraints active in [t1, t2]
+    base_data = {}
+    for address_str in store.find_matching(raddress):
+        try:
+            content = {k: copy.deepcopy(v) for k, v in store[address_str].items() if k != '_constraints'}
+        except KeyError:  # Removed in the meantime
+            continue
+        active_rules = copy.deepcopy(store.get_active_constraints(address_str, t1, t2))
+        if mode == 'merge':
+            merged = base_data.setdefault(raddress.to_address_string(), {})
+            merged.update(content)
+            if '_constraints' in store.get(address_str, {}):  # A more specific entry overwrites the constraints
+                merged['_constraints'] = active_rules
+        else:
+            content['_constraints'] = active_rules
+            base_data[address_str] = content
 
     results = {}
-
-    for addr_str, content in base_data.items():
-        final_content = content.copy()
-        constraints = final_content.pop('_constraints', [])
-
-        # Filter constraints that overlap with [t1, t2]
-        active_rules = []
-        for rule in constraints:
-            if _is_rule_active_in_range(rule, t1, t2):
-                active_rules.append(rule)
-
+    for addr_str, final_content in base_data.items():
+        active_rules = final_content.pop('_constraints', [])
         if constraint_mode == 'merge':
             # TEMPORAL MERGE: Flatten rules into the main dictionary
             # Note: Later rules in the list overwrite earlier ones (Priority)
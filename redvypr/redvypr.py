@@ -34,6 +34,7 @@ import redvypr.data_packets as data_packets
 import redvypr.redvypr_address as redvypr_address
 from redvypr.redvypr_address import RedvyprAddress
 import redvypr.packet_statistic as redvypr_packet_statistic
+import redvypr.data_queues as data_queues
 from redvypr.version import version
 import redvypr.files as files
 from redvypr.device import RedvyprDeviceConfig, RedvyprDeviceBaseConfig, RedvyprDevice, RedvyprDeviceScan, RedvyprDeviceParameter, queuesize
@@ -52,7 +53,7 @@ else:
     faulthandler.enable(file=logfile)
 
 # Collect all logger
-logger_all = [data_packets.logger, redvypr_address.logger, redvypr_packet_statistic.logger]
+logger_all = [data_packets.logger, redvypr_address.logger, redvypr_packet_statistic.logger, data_queues.logger]
 
 # Platform information str
 __platform__ = "redvypr (REaltime Data Vi(Y)ewer and PRocessor (in Python))\n"
@@ -127,50 +128,199 @@ def create_hostinfo(hostname='redvypr'):
     hostinfo = {'host': hostname, 'tstart': time.time(), 'addr': get_ip(), 'uuid': redvyprid}
     return hostinfo
 
-def send_packets_to_devices(devicedict, devices, data_packets_fan_out, logger_dist, hostinfo):
+class SubscriptionRoutingTable():
+    """
+    Routing table for send_packets_to_devices. Instead of testing every datapacket against all subscribed
+    addresses of all devices, the subscribers are cached for each (host uuid, publisher, device, packetid) key.
+    Subscriptions that consist only of equality filters on these fields are resolved once per key, only the
+    remaining subscriptions (regex, lists, other keys ...) are evaluated for each packet.
+    The table is rebuilt after invalidate() was called, i.e. by Redvypr.process_subscription_changed and when
+    devices are added or removed.
+    """
+    route_fields = ('__host_uuid__', '__publisher__', '__device__', '__packetid__')
+    route_paths = (('host', 'uuid'), ('publisher',), ('device',), ('packetid',))
+
+    def __init__(self, maxroutes=10000):
+        self.maxroutes = maxroutes
+        self.version = 0
+        self._version_built = -1
+        self.subscribers = []
+        self.routes = {}
+
+    def invalidate(self):
+        """
+        Marks the table as outdated, it is rebuilt with the next packet
+        """
+        self.version += 1
+
+    def update(self, devices):
+        """
+        Rebuilds the table if it was invalidated
+        """
+        if self._version_built == self.version:
+            return
+
+        version = self.version
+        subscribers = []
+        for devicedict_sub in devices:
+            static_filters = []
+            dynamic_addresses = []
+            for addr in list(devicedict_sub['device'].subscribed_addresses):
+                eq_filter = addr.get_equality_filter()
+                if (eq_filter is not None) and set(eq_filter.keys()).issubset(self.route_fields):
+                    static_filters.append(tuple((self.route_fields.index(k), v) for k, v in eq_filter.items()))
+                else:
+                    dynamic_addresses.append(addr)
+
+            subscribers.append((devicedict_sub, static_filters, dynamic_addresses))
+
+        self.subscribers = subscribers
+        self.routes = {}
+        self._version_built = version
+
+    def route_key(self, data_packet):
+        """
+        Returns the (host uuid, publisher, device, packetid) tuple of the packet or None if a field is missing
+        """
+        try:
+            _redvypr = data_packet['_redvypr']
+            key = tuple(_redvypr[p[0]][p[1]] if len(p) == 2 else _redvypr[p[0]] for p in self.route_paths)
+            hash(key)
+        except (KeyError, TypeError):
+            return None
+
+        return key
+
+    def get_route(self, data_packet):
+        """
+        Returns a list of [devicedict_sub, dynamic_addresses] of all potential receivers of the packet. If
+        dynamic_addresses is None, the packet matches already, otherwise at least one of the addresses has to match.
+        """
+        key = self.route_key(data_packet)
+        try:
+            return self.routes[key]
+        except KeyError:
+            pass
+
+        route = []
+        for devicedict_sub, static_filters, dynamic_addresses in self.subscribers:
+            if key is None: # Packet without the routing fields, evaluate all subscriptions
+                route.append([devicedict_sub, list(devicedict_sub['device'].subscribed_addresses)])
+                continue
+            FLAG_MATCH = False
+            for static_filter in static_filters:
+                if all(key[ind] == val for ind, val in static_filter):
+                    FLAG_MATCH = True
+                    break
+
+            if FLAG_MATCH:
+                route.append([devicedict_sub, None])
+            elif len(dynamic_addresses) > 0:
+                route.append([devicedict_sub, dynamic_addresses])
+
+        if key is not None:
+            if len(self.routes) >= self.maxroutes:
+                self.routes = {}
+            self.routes[key] = route
+
+        return route
+
+    def get_statname(self, data_packet):
+        """
+        Returns the address string of the packet used as key in the 'packets' statistics of the devices
+        """
+        return str(redvypr_address.packet_address(data_packet))
+
+
+def is_local_deviceinfo_patch(data_packet, hostinfo):
+    """
+    Returns True if the packet is a deviceinfo patch created by distribute_data of the local host
+    (see create_deviceinfo_packet).
+    """
+    if 'deviceinfo_patch' not in data_packet:
+        return False
+    try:
+        _redvypr = data_packet['_redvypr']
+        return _redvypr['device'] == 'distribute_data' and _redvypr['host']['uuid'] == hostinfo['uuid']
+    except (KeyError, TypeError):
+        return False
+
+
+def send_packets_to_devices(devicedict, devices, data_packets_fan_out, logger_dist, hostinfo, routing_table=None):
     funcname = __name__ + '.send_packets_to_devices()'
     device = devicedict['device']
-    for devicedict_sub in devices:
-        devicesub = devicedict_sub['device']
-        if (devicesub == device):  # Not to itself
+    if routing_table is None:
+        routing_table = SubscriptionRoutingTable()
+
+    routing_table.update(devices)
+    for data_packet in data_packets_fan_out:
+        try:
+            numtag_packet = data_packet['_redvypr']['tag'][hostinfo['uuid']]
+        except:
+            numtag_packet = 0
+
+        if numtag_packet >= 2: # Do not recirculate packets
             continue
 
-        for data_packet in data_packets_fan_out:
-            raddr = redvypr_address.RedvyprAddress(data_packet)
-            devicename_stat = str(raddr)
-            for addr in devicesub.subscribed_addresses:  # Loop over all subscribed redvypr_addresses
+        # Deviceinfo patches created by distribute_data of this host are sent to the originating device as well,
+        # otherwise its DeviceinfoMirror misses a revision. Forwarded patches of other hosts are not sent back.
+        device_skip = None if is_local_deviceinfo_patch(data_packet, hostinfo) else device
+        devicename_stat = None
+        for devicedict_sub, dynamic_addresses in routing_table.get_route(data_packet):
+            devicesub = devicedict_sub['device']
+            if (devicesub == device_skip):  # Not to itself
+                continue
+
+            # This is the main functionality for distribution, comparing a datapacket with the subscriptions
+            if dynamic_addresses is not None:
+                FLAG_MATCH = False
+                for addr in dynamic_addresses:
+                    if addr.matches_filter(data_packet):
+                        FLAG_MATCH = True
+                        break
+                if not FLAG_MATCH:
+                    continue
+
+            if devicename_stat is None:
+                devicename_stat = routing_table.get_statname(data_packet)
+            try:
+                devicesub.datainqueue.put_nowait(data_packet)  # These are the datainqueues of the subscribing devices
+                devicedict_sub['statistics']['packets_received'] += 1
                 try:
-                    numtag_packet = data_packet['_redvypr']['tag'][hostinfo['uuid']]
+                    devicedict_sub['statistics']['packets'][devicename_stat]['received'] += 1
                 except:
-                    numtag_packet = 0
-                # This is the main functionality for distribution, comparing a datapacket with a
-                # print('Testing packet',redvypr_address.RedvyprAddress(data_packet),numtag_packet,(data_packet in addr))
-                if addr.matches_filter(data_packet) and (
-                        numtag_packet < 2):  # Check if data packet fits with addr and if its not recirculated again
-                    try:
-                        # print(funcname + 'data to be sent',data)
-                        devicesub.datainqueue.put_nowait(
-                            data_packet)  # These are the datainqueues of the subscribing devices
-                        devicedict_sub['statistics']['packets_received'] += 1
-                        # print(devicedict_sub['statistics']['packets_received'])
-                        try:
-                            devicedict_sub['statistics']['packets'][devicename_stat]
-                        except:
-                            devicedict_sub['statistics']['packets'][devicename_stat] = {
-                                'received': 0, 'published': 0}
-                        devicedict_sub['statistics']['packets'][devicename_stat][
-                            'received'] += 1
-                        # print('Sent data to',devicename_stat,devicedict_sub['packets_received'])
-                        break
-                    except:
-                        thread_status = devicesub.get_thread_status()
-                        if thread_status['thread_running']:
-                            devicedict['statistics']['packets_dropped'] += 1
-                        logger_dist.warning(funcname + ':dataout of :' + devicedict_sub[
-                            'device'].name, exc_info=True)
+                    devicedict_sub['statistics']['packets'][devicename_stat] = {'received': 1, 'published': 0}
+            except:
+                thread_status = devicesub.get_thread_status()
+                if thread_status['thread_running']:
+                    devicedict['statistics']['packets_dropped'] += 1
+                logger_dist.warning(funcname + ':dataout of :' + devicedict_sub[
+                    'device'].name, exc_info=True)
+
+def create_deviceinfo_packet(hostinfo, tread, patch=None, deviceinfo_all=None, revision=None, devicename='distribute_data'):
+    """
+    Creates an info command packet (packetid 'metadata') with either a deviceinfo patch
+    (packet_statistic.DeviceinfoRevisions.create_patch()) or a full deviceinfo_all of the given revision.
+    """
+    compacket = data_packets.commandpacket('info', host=hostinfo, devicename=devicename, packetid='metadata')
+    if patch is not None:
+        compacket['deviceinfo_patch'] = patch
+        compacket['deviceinfo_revision'] = patch['revision']
+    else:
+        compacket['deviceinfo_all'] = deviceinfo_all
+        compacket['deviceinfo_revision'] = revision
 
-def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue, redvyprreplyqueue, dt=0.01):
+    redvypr_packet_statistic.treat_datadict(compacket, '', hostinfo, 0, tread, 'distribute_data')
+    return compacket
+
+
+def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue, redvyprreplyqueue, dt=0.01, notifier=None, routing_table=None, deviceinfo_revisions=None):
     """ The heart of redvypr, this functions distributes the queue data onto the subqueues.
+
+    If a notifier (data_queues.DataNotifier) is given, the function sleeps until data arrives in one of the
+    device dataqueues, otherwise the queues are polled every dt seconds. The routing_table (SubscriptionRoutingTable)
+    caches the subscribers of the datapackets. Changes of deviceinfo_all are tracked by deviceinfo_revisions
+    (packet_statistic.DeviceinfoRevisions) and sent as patches to the devices and the infoqueue.
     """
     funcname = __name__ + '.distribute_data()'
     logger_dist = logging.getLogger('redvypr.base.distribute_data')
@@ -184,6 +334,11 @@ def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue,
     tstop = time.time()
     thread_start = time.time()
     dt_sleep = dt
+    latency_statistic = data_queues.LatencyStatistic()
+    if routing_table is None:
+        routing_table = SubscriptionRoutingTable()
+    if deviceinfo_revisions is None:
+        deviceinfo_revisions = redvypr_packet_statistic.DeviceinfoRevisions(deviceinfo_all)
 
     # Create a bogus main redvypr device
     devicedict_main = {}
@@ -191,25 +346,33 @@ def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue,
     devicedict_main['device'] = None
     while True:
         try:
-            time.sleep(dt_sleep)
-            tstart = time.time()
+            if notifier is None:
+                time.sleep(dt_sleep)
+                tstart = time.time()
+                t_notify = None
+            else:
+                # Wait for new data, but wake up in time to send the info packet
+                timeout = max(0.0, dt_info - (time.time() - tinfo))
+                notifier.wait([d['device'].dataqueue for d in devices], timeout=timeout)
+                tstart = time.time()
+                t_notify = notifier.clear()
+
+            # Reference time for the latency statistic
+            t_latency = tstart if t_notify is None else min(t_notify, tstart)
             FLAG_device_status_changed = False
             devices_changed = []
             devices_removed = []
-            # Read data from the main thread
+            # Read all data from the main thread, the notifier was cleared already
             try:
                 tread = time.time()
-                redvyprdata = redvyprqueue.get(block=False) # Data from the main thread
-            except queue.Empty:
-                redvyprdata = None
-                #logger_dist.info("Error processing data",exc_info=True)
+                redvyprdata_all = data_queues.get_many(redvyprqueue) # Data from the main thread
             except:
                 logger_dist.info("Error processing data",exc_info=True)
-                redvyprdata = None
+                redvyprdata_all = []
 
 
             # Process data from the main thread
-            if redvyprdata is not None:
+            for redvyprdata in redvyprdata_all:
                 print("Got data from redvyprqueue",redvyprdata)
                 if "_metadata" in redvyprdata.keys() or "_metadata_remove" in redvyprdata.keys():
                     print("Adding/remove metadata from redvyrqueue")
@@ -224,19 +387,14 @@ def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue,
 
                     # Update metadata
                     if status_statistics['metadata_changed']:
-                        # Send a deviceinfo update with the changed metadata
-                        compacket = data_packets.commandpacket('info',
-                                                               host=hostinfo,
-                                                               devicename='distribute_data',
-                                                               packetid='metadata')
-                        compacket['deviceinfo_all'] = copy.deepcopy(deviceinfo_all)
-                        redvypr_packet_statistic.treat_datadict(compacket, '',
-                                                                hostinfo, 0, tread,
-                                                                'distribute_data')
+                        # Send a deviceinfo patch with the changed metadata
+                        for address_str in status_statistics['addresses_changed']:
+                            deviceinfo_revisions.mark_changed('metadata', address_str)
+                        compacket = create_deviceinfo_packet(hostinfo, tread, patch=deviceinfo_revisions.create_patch())
                         infoqueue.put_nowait(compacket)
                         print("send to devices new metadata ...")
                         send_packets_to_devices(devicedict_main, devices, data_packets_fan_out=[compacket],
-                                        logger_dist=logger_dist, hostinfo=hostinfo)
+                                        logger_dist=logger_dist, hostinfo=hostinfo, routing_table=routing_table)
                     # Send the packet back to notify function that it was processed
                     redvyprreplyqueue.put_nowait(redvyprdata)
 
@@ -246,17 +404,20 @@ def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue,
                         FLAG_device_status_changed = True
                         devices_removed.append(redvyprdata['device'])
                         devinfo_rem = deviceinfo_all['device_redvypr'].pop(redvyprdata['device'])
-                        devinfo_send = {'type':'deviceinfo_all', 'deviceinfo_all': copy.deepcopy(deviceinfo_all), 'devices_changed': list(set(devices_changed)),
+                        deviceinfo_revisions.mark_changed('device_redvypr', redvyprdata['device'])
+                        compacket_patch = create_deviceinfo_packet(hostinfo, tread, patch=deviceinfo_revisions.create_patch())
+                        devinfo_send = {'type':'deviceinfo_all', 'deviceinfo_patch': compacket_patch['deviceinfo_patch'],
+                                        'deviceinfo_revision': compacket_patch['deviceinfo_revision'], 'devices_changed': list(set(devices_changed)),
                         'devices_removed': devices_removed,'change':'devrem','device_changed':redvyprdata['device']}
                         infoqueue.put_nowait(devinfo_send)
-                        # Send a deviceinfo update with the changed metadata
+                        # Notify the devices about the removed device and send the deviceinfo patch
                         compacket = data_packets.commandpacket('info', host=hostinfo, devicename='distribute_data', packetid='device_removed',
                                                                publisher='')
-                        compacket['deviceinfo_all'] = copy.deepcopy(deviceinfo_all)
                         compacket['devices_removed'] = devices_removed
                         redvypr_packet_statistic.treat_datadict(compacket, 'distribute_data', hostinfo, 0, tread,
                                                                 'distribute_data')
-                        data_packets_fan_out.append(compacket)
+                        send_packets_to_devices(devicedict_main, devices, data_packets_fan_out=[compacket, compacket_patch],
+                                                logger_dist=logger_dist, hostinfo=hostinfo, routing_table=routing_table)
 
             # Loop over all devices and process data
             for devicedict in devices:
@@ -268,23 +429,21 @@ def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue,
                 data_all = []
                 tread = time.time()
                 # Read all packets in a bunch
-                while True:
-                    try:
-                        data = device.dataqueue.get(block=False)
-                        if not (isinstance(data, dict)): # If data is not a dictionary, convert it to one
-                            data = {'data':data}
+                try:
+                    data_read = data_queues.get_many(device.dataqueue)
+                except:
+                    logger_dist.info("Error processing data",exc_info=True)
+                    return
 
+                for data in data_read:
+                    if not (isinstance(data, dict)): # If data is not a dictionary, convert it to one
+                        data = {'data':data}
 
-                        devicedict['statistics']['packets_published'] += 1  # The total number of packets published by the device
-                        packets_processed += 1 # Counter for the statistics
-                        packet_counter += 1 # Global counter of packets received by the redvypr instance
-                        data_all.append([data,packet_counter])
-                    except queue.Empty:
-                        break
-                    except:
-                        logger_dist.info("Error processing data",exc_info=True)
-                        return
-                        break
+                    packet_counter += 1 # Global counter of packets received by the redvypr instance
+                    data_all.append([data,packet_counter])
+
+                devicedict['statistics']['packets_published'] += len(data_read)  # The total number of packets published by the device
+                packets_processed += len(data_read) # Counter for the statistics
                 # Process read packets
                 for data_list in data_all:
                     data_packets_fan_out = []
@@ -293,7 +452,7 @@ def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue,
                     # Add additional information, if not present yet
                     redvypr_packet_statistic.treat_datadict(data, device.name, hostinfo, numpacket, tread,devicedict['devicemodulename'])
                     # Get the devicename
-                    raddr = redvypr_address.RedvyprAddress(data)
+                    raddr = redvypr_address.packet_address(data)
                     devicename_stat = str(raddr)
                     numtag = data['_redvypr']['tag'][hostinfo['uuid']]
                     #print("Processing",data)
@@ -320,8 +479,11 @@ def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue,
                                 #print(funcname + 'Metadata done')
                             except:
                                 logger_dist.debug(funcname + ':Metadata:', exc_info=True)
-                        elif (command == 'info'):  # info command, typically a deviceinfo_all packet
-                            metadata_remote = data['deviceinfo_all']['metadata']
+                        elif (command == 'info'):  # info command, typically a deviceinfo_all packet or a deviceinfo patch
+                            if data.get('deviceinfo_all') is not None:
+                                metadata_remote = data['deviceinfo_all']['metadata']
+                            else:
+                                metadata_remote = data.get('deviceinfo_patch', {}).get('set', {}).get('metadata', {})
                             # Updating the metadata
                             for remote_device_name,remote_device_metadata in metadata_remote.items():
                                 # Change the publisher to the local device and the uuid if its not existing
@@ -331,8 +493,16 @@ def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue,
                                         raddr_metadata.add_filter(key="uuid",op="eq",value=raddr.uuid)
                                     rstr_tmp = raddr_metadata.to_address_string()
                                     deviceinfo_all['metadata'][rstr_tmp] = metadata_tmp
+                                    deviceinfo_revisions.mark_changed('metadata', rstr_tmp)
 
                             status_statistics['metadata_changed'] = True
+                        elif (command == 'deviceinfo_resync'):  # The device needs the full deviceinfo_all
+                            revision, deviceinfo_copy = deviceinfo_revisions.snapshot()
+                            compacket = create_deviceinfo_packet(hostinfo, tread, deviceinfo_all=deviceinfo_copy, revision=revision)
+                            try:
+                                device.datainqueue.put_nowait(compacket)
+                            except:
+                                logger_dist.warning(funcname + ':Could not send deviceinfo to ' + device.name, exc_info=True)
                         elif (command == 'reply'):  # status update
                             device.distribute_data_replyqueue.put_nowait(data)
                         elif (command == 'device'):  # A command for the device
@@ -354,10 +524,14 @@ def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue,
                                     logger_dist.warning('Could not update status ',exc_info=True)
 
                             # Send an information about the change, that will trigger a pyqt signal in the main thread
-                            devinfo_send = {'type': 'deviceinfo_all', 'deviceinfo_all': copy.deepcopy(deviceinfo_all),
+                            deviceinfo_revisions.mark_changed('device_redvypr', device.name)
+                            compacket_patch = create_deviceinfo_packet(hostinfo, tread, patch=deviceinfo_revisions.create_patch())
+                            devinfo_send = {'type': 'deviceinfo_all', 'deviceinfo_patch': compacket_patch['deviceinfo_patch'],
+                                            'deviceinfo_revision': compacket_patch['deviceinfo_revision'],
                                             'devices_changed': list(set(devices_changed)), 'device_changed':device.name,
                                             'devices_removed': devices_removed, 'change': 'device_status command','comdata':comdata}
                             infoqueue.put_nowait(devinfo_send)
+                            data_packets_fan_out.append(compacket_patch)
 
                     #
                     # Collect the individual dictionaries into one global deviceinfo
@@ -366,14 +540,14 @@ def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue,
                         deviceinfo_all['device_redvypr'][device.name].update(devicedict['statistics']['device_redvypr'])
                     except:
                         deviceinfo_all['device_redvypr'][device.name] = devicedict['statistics']['device_redvypr']
+                    deviceinfo_revisions.mark_changed('device_redvypr', device.name)
 
                     # Update metadata
                     if status_statistics['metadata_changed']:
-                        # Send a deviceinfo update with the changed metadata
-                        compacket = data_packets.commandpacket('info',host=hostinfo, devicename='distribute_data', packetid='metadata')
-                        compacket['deviceinfo_all'] = copy.deepcopy(deviceinfo_all)
-                        redvypr_packet_statistic.treat_datadict(compacket, '', hostinfo, 0, tread,
-                                                                'distribute_data')
+                        # Send a deviceinfo patch with the changed metadata
+                        for address_str in status_statistics.get('addresses_changed', []):
+                            deviceinfo_revisions.mark_changed('metadata', address_str)
+                        compacket = create_deviceinfo_packet(hostinfo, tread, patch=deviceinfo_revisions.create_patch())
                         infoqueue.put_nowait(compacket)
                         data_packets_fan_out.append(compacket)
 
@@ -384,7 +558,7 @@ def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue,
                     #
                     data_packets_fan_out.append(data)
                     # And now send it to all devices
-                    send_packets_to_devices(devicedict, devices, data_packets_fan_out, logger_dist, hostinfo=hostinfo)
+                    send_packets_to_devices(devicedict, devices, data_packets_fan_out, logger_dist, hostinfo=hostinfo, routing_table=routing_table)
                     # Send it into the local dataqueue
                     try:
                         device.dataqueue_local.put_nowait(data)
@@ -398,6 +572,12 @@ def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue,
                             pass
                             # logger.debug(funcname + ':guiqueue of :' + devicedict['device'].name + ' full')
 
+                    latency_statistic.add(time.time() - t_latency)
+
+            # Send the packets collected in batched datainqueues
+            for devicedict in devices:
+                data_queues.flush(devicedict['device'].datainqueue)
+
             # Calculate the sleeping time
             tstop = time.time()
             dt_dist = tstop - tstart  # The time for all the looping
@@ -406,9 +586,11 @@ def distribute_data(devices, hostinfo, deviceinfo_all, infoqueue, redvyprqueue,
             # Time to sleep, remove processing time
             dt_sleep = max([dt/4, dt - dt_dist])
             #print("dt_sleep",dt_sleep)
-            if ((tstop - tinfo) > dt_info):
+            if ((tstop - tinfo) >= dt_info):
                 tinfo = tstop
-                info_dict = {'type':'dt_avg','dt_avg': dt_avg / navg,'packets_processed': packets_processed,'packets_counter':packet_counter,'thread_start':thread_start}
+                [latency_p50, latency_p99] = latency_statistic.percentiles((50, 99))
+                info_dict = {'type':'dt_avg','dt_avg': dt_avg / navg,'packets_processed': packets_processed,'packets_counter':packet_counter,'thread_start':thread_start,
+                             'latency_p50': latency_p50, 'latency_p99': latency_p99}
                 #print("sending info",info_dict)
                 packets_processed = 0
                 # print(info_dict)
@@ -491,13 +673,18 @@ class Redvypr(QtCore.QObject):
         self.devices = []  # List containing dictionaries with information about all attached devices
         self.device_paths = []  # A list of pathes to be searched for devices
         self.datastreams_dict = {} # Information about all datastreams, this is updated by distribute data
-        self.deviceinfo_all = {'device_redvypr':{},'metadata':{}} # Information about all devices, this is updated by distribute data
+        self.deviceinfo_all = {'device_redvypr':{},'metadata':redvypr_packet_statistic.MetadataStore()} # Information about all devices, this is updated by distribute data
 
         self.packets_counter = 0 # Counter for the total number of packets processed
-        self.dt_datadist = 0.01  # The time interval of datadistribution
+        self.dt_datadist = 0.01  # The time interval of datadistribution (only used if no notifier is available)
         self.dt_avg_datadist = 0.00  # The time interval of datadistribution
+        self.latency_p50_datadist = None  # Median latency between data arrival and distribution
+        self.latency_p99_datadist = None  # 99th percentile of the latency between data arrival and distribution
+        self.datadist_notifier = data_queues.DataNotifier()  # Wakes up the datadistthread if new data arrived
+        self.subscription_routing_table = SubscriptionRoutingTable()  # Caches the subscribers of datapackets
+        self.deviceinfo_revisions = redvypr_packet_statistic.DeviceinfoRevisions(self.deviceinfo_all)  # Revisions of deviceinfo_all, sent as patches
         self.datadistinfoqueue = queue.Queue(maxsize=1000)  # A queue to get informations from the datadistthread
-        self.redvyprqueue = queue.Queue()  # A queue to send informations to the datadistthread
+        self.redvyprqueue = data_queues.NotifyQueue(notifier=self.datadist_notifier)  # A queue to send informations to the datadistthread
         self.redvyprreplyqueue = queue.Queue()  # A queue to send informations to the datadistthread
         # Adding metadata from config, if present
         if config.metadata and len(config.metadata.keys()) > 0:
@@ -513,7 +700,7 @@ class Redvypr(QtCore.QObject):
 
         # Lets start the distribution!
         self.datadistthread = threading.Thread(target=distribute_data, args=(
-        self.devices, self.hostinfo, self.deviceinfo_all, self.datadistinfoqueue, self.redvyprqueue, self.redvyprreplyqueue, self.dt_datadist), daemon=True)
+        self.devices, self.hostinfo, self.deviceinfo_all, self.datadistinfoqueue, self.redvyprqueue, self.redvyprreplyqueue, self.dt_datadist, self.datadist_notifier, self.subscription_routing_table, self.deviceinfo_revisions), daemon=True)
         self.t_thread_start = time.time()
         self.datadistthread.start()
 
@@ -764,6 +951,8 @@ class Redvypr(QtCore.QObject):
                     if "type" in data.keys():
                         if('dt_avg' in data['type']):
                             self.dt_avg_datadist   = data['dt_avg']
+                            self.latency_p50_datadist = data.get('latency_p50')
+                            self.latency_p99_datadist = data.get('latency_p99')
                             self.packets_processed = data['packets_processed']
                             self.packets_counter = data['packets_counter']
                             self.t_thread_start = data['thread_start']
@@ -778,7 +967,6 @@ class Redvypr(QtCore.QObject):
                             self.device_status_changed_signal.emit()
                     elif raddress.packetid == 'metadata':
                         logger.debug(funcname + "Got metadata, emitting signal")
-                        metadata_new = data["deviceinfo_all"]["metadata"]
                         self.metadata_changed_signal.emit()
 
 
@@ -959,11 +1147,23 @@ class Redvypr(QtCore.QObject):
 
                 # Check for multiprocess options in configuration
                 if 'thread' in device_parameter.multiprocess:  # Thread or QThread
-                    dataqueue = queue.Queue(maxsize=queuesize)
+                    dataqueue = data_queues.NotifyQueue(maxsize=queuesize, notifier=self.datadist_notifier)
                     datainqueue = queue.Queue(maxsize=queuesize)
                     comqueue = queue.Queue(maxsize=queuesize)
                     statusqueue = queue.Queue(maxsize=queuesize)
                     guiqueue = queue.Queue(maxsize=queuesize)
+                elif device_parameter.queue_transport == 'batch':  # multiprocess with batched data transport
+                    dataqueue = data_queues.BatchQueue(maxsize=queuesize)
+                    datainqueue = data_queues.BatchQueue(maxsize=queuesize)
+                    comqueue = multiprocessing.Queue(maxsize=queuesize)
+                    statusqueue = multiprocessing.Queue(maxsize=queuesize)
+                    guiqueue = multiprocessing.Queue(maxsize=queuesize)
+                elif device_parameter.queue_transport == 'shared_memory':  # multiprocess with shared memory ring buffers
+                    dataqueue = data_queues.SharedMemoryQueue(maxsize=queuesize)
+                    datainqueue = data_queues.SharedMemoryQueue(maxsize=queuesize)
+                    comqueue = multiprocessing.Queue(maxsize=queuesize)
+                    statusqueue = multiprocessing.Queue(maxsize=queuesize)
+                    guiqueue = multiprocessing.Queue(maxsize=queuesize)
                 else: # multiprocess
                     dataqueue = multiprocessing.Queue(maxsize=queuesize)
                     datainqueue = multiprocessing.Queue(maxsize=queuesize)
@@ -1065,7 +1265,9 @@ class Redvypr(QtCore.QObject):
 
                 # Add the device to the device list
                 self.devices.append(devicedict)  # Add the device to the devicelist
+                self.subscription_routing_table.invalidate()
                 ind_device = len(self.devices) - 1
+                self.datadist_notifier.notify()  # The datadistthread needs to wait on the queues of the new device
 
                 # Update the statistics of the device itself
                 deviceinfo_packet = {'_redvypr':{},'_deviceinfo': {'subscribes': device_parameter.subscribes, 'publishes': device_parameter.publishes, 'devicemodulename': device_parameter.devicemodulename}}
@@ -1176,6 +1378,7 @@ class Redvypr(QtCore.QObject):
         """
         devsender = self.sender()
         logger.debug('Subscribtion changed {}'.format(devsender.name))
+        self.subscription_routing_table.invalidate()
         for d in self.devices:
             dev = d['device']
             if dev == devsender:
@@ -1369,10 +1572,8 @@ class Redvypr(QtCore.QObject):
                     mode: typing.Literal["merge", "expanded"] = "expanded"):
         funcname = __name__ + 'get_metadata():'
         logger.debug(funcname)
-        deviceinfo_all = self.get_deviceinfo()
-        #print("Deviceonfi all new",deviceinfo_all)
-        #print("Mode redvypr",mode)
-        metadata = redvypr_packet_statistic.get_metadata(deviceinfo_all, address=address, mode=mode)
+        # The metadata store returns copies, deviceinfo_all does not need to be copied
+        metadata = redvypr_packet_statistic.get_metadata(self.deviceinfo_all, address=address, mode=mode)
         return metadata
 
     def get_metadata_in_range(
@@ -1386,58 +1587,15 @@ class Redvypr(QtCore.QObject):
         Returns all metadata and constraints that were active at any point
         between t1 and t2.
         """
-        # 1. Get raw hierarchical metadata
-        raw_data = self.get_metadata(address, mode=mode)
-
-        results = {}
-
-        for addr, content in raw_data.items():
-            # Keep static metadata
-            addr_result = {k: v for k, v in content.items() if k != '_constraints'}
-            addr_result['_constraints'] = []
-
-            constraints = content.get('_constraints', [])
-
-            for rule in constraints:
-                # Extract time boundaries from the rule
-                r_start = None
-                r_end = None
-                for cond in rule['conditions']:
-                    if cond['field'] == 't':
-                        val = cond['value']
-                        dt_val = datetime.datetime.fromisoformat(val) if isinstance(val,
-                                                                                    str) else val
-
-                        if cond['op'] in ['>', '>=']: r_start = dt_val
-                        if cond['op'] in ['<', '<=']: r_end = dt_val
-
-                #print(f"Comparing Rule {r_start} > Query {t2}:{r_start and t2 and r_start > t2}")
-                #print(f"Comparing Rule {r_end} < Query {t1}:{r_end and t1 and r_end < t1}")
-                # Logic for overlap:
-                # A rule is relevant if its start is before our end AND its end is after our start
-                is_relevant = True
-                if r_start and t2 and r_start > t2:
-                    is_relevant = False
-                if r_end and t1 and r_end < t1:
-                    is_relevant = False
-
-                #print("Is relevant",is_relevant)
-                if is_relevant:
-                    addr_result['_constraints'].append(rule)
-
-            results[addr] = addr_result
-
-        return results
+        return redvypr_packet_statistic.get_metadata_in_range(self.deviceinfo_all, address, t1, t2, mode=mode,
+                                                              constraint_mode="expanded")
 
     def get_metadata_commandpacket(self, device=''):
         funcname = __name__ + 'get_metadata_commandpacket():'
         logger.debug(funcname)
-        deviceinfo_all = self.get_deviceinfo()
-        compacket = data_packets.commandpacket('info', host=self.hostinfo, devicename=device, packetid='metadata')
-        compacket['deviceinfo_all'] = copy.deepcopy(deviceinfo_all)
-        tread = time.time()
-        redvypr_packet_statistic.treat_datadict(compacket, '', self.hostinfo, 0, tread,
-                                                'distribute_data')
+        revision, deviceinfo_all = self.deviceinfo_revisions.snapshot()
+        compacket = create_deviceinfo_packet(self.hostinfo, time.time(), deviceinfo_all=deviceinfo_all,
+                                             revision=revision, devicename=device)
         return compacket
 
     def set_metadata(self, address: str | RedvyprAddress, metadata: dict):
@@ -1615,6 +1773,7 @@ class Redvypr(QtCore.QObject):
 
                 device.stop_and_cleanup()
                 self.devices.remove(sendict)
+                self.subscription_routing_table.invalidate()
                 FLAG_REMOVED = True
                 self.device_removed.emit()
                 device_changed_dict = {'type':'device_removed','device':device.name,'uuid':device.uuid}
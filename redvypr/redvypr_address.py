@@ -5,6 +5,7 @@ see also the documentation here: :ref:`design_addressing`.
 
 import re
 import copy
+import functools
 import time
 import logging
 import sys
@@ -74,6 +75,9 @@ class RedvyprAddress:
     # Für deinen Parser (Regex-Ersetzung) extrahieren wir einfach:
     PREFIX_MAP = {k: v["internal"] for k, v in META_CONFIG.items()}
 
+    # Pfade der _redvypr Felder, e.g. (("host", "uuid"), "__host_uuid__")
+    _META_PATHS = tuple((tuple(v["path"].split(".")), v["internal"]) for v in META_CONFIG.values())
+
     # 1. PREFIX_MAP (Kurzformen -> __dunder__)
     # Ergebnis: {"i": "__packetid__", "d": "__device__", ...}
     PREFIX_MAP = {k: v["internal"] for k, v in META_CONFIG.items()}
@@ -130,64 +134,58 @@ class RedvyprAddress:
                  addr: Optional[Any] = None,
                  host_local: Optional[Any] = None,
                  uuid_local: Optional[Any] = None,
-                 addr_local: Optional[Any] = None):
+                 addr_local: Optional[Any] = None,
+                 _cache: bool = True):
         self.left_expr: Optional[str] = None
         self._rhs_ast: Optional[ast.Expression] = None
+        self._rhs_ast_shared = False  # True if the AST is shared with other addresses (copy on write)
         self.filter_keys: typing.Dict[str, list] = {}
         self.strict_no_datakey = False
+        FLAG_COMPILED = False
 
         if expr == "":
             expr = None
 
         # Kopieren von einem RedvyprAddress
         if isinstance(expr, RedvyprAddress):
-            self.left_expr = expr.left_expr
-            self._rhs_ast = copy.deepcopy(expr._rhs_ast)
-            self.filter_keys = {k: list(v) for k, v in expr.filter_keys.items()}
+            self._copy_state(expr)
+            FLAG_COMPILED = True
 
         # Dict input (_redvypr mapping)
         elif isinstance(expr, dict):
-            _redvypr = expr.get("_redvypr", {})
-            constraints = []
-
-            # Wir iterieren über die zentrale META_CONFIG
-            for cfg in self.META_CONFIG.values():
-                path = cfg["path"]
-                internal = cfg["internal"]
-
-                # Pfad im Paket auflösen (z.B. "host.uuid")
-                parts = path.split(".")
-                val = _redvypr
-                try:
-                    for part in parts:
-                        val = val[part]
-
-                    # Wenn ein Wert gefunden wurde, Constraint hinzufügen
-                    if val not in (None, ''):
-                        # Wir speichern es direkt als Python-Vergleichs-String
-                        # e.g. "__packetid__ == 'test'"
-                        constraints.append(f"{internal} == {repr(val)}")
-                except (KeyError, TypeError):
-                    continue
-
-            # Zu einem einzigen RHS-String zusammenfügen
+            constraints = self._packet_constraints(expr)
             if constraints:
-                self._rhs_str = " and ".join(constraints)
-                self._rhs_ast = ast.parse(self._rhs_str, mode="eval")
+                if _cache:
+                    try:
+                        self._copy_state(_packet_address_template(constraints))
+                        FLAG_COMPILED = True
+                    except TypeError:  # Unhashable values
+                        _cache = False
+
+                if not _cache:
+                    # Zu einem einzigen RHS-String zusammenfügen
+                    # e.g. "__packetid__ == 'test'"
+                    self._rhs_str = " and ".join(f"{internal} == {repr(val)}" for internal, val in constraints)
+                    self._rhs_ast = ast.parse(self._rhs_str, mode="eval")
 
         # String input
         elif isinstance(expr, str):
-            left, right = self._split_left_right_tokens(expr)
-            #print("left",left)
-            #print("right", right)
-            self.left_expr = left
-            if right:
-                self._rhs_ast = self._parse_rhs(right)
+            if _cache:
+                self._copy_state(_address_template(expr))
+                FLAG_COMPILED = True
+            else:
+                left, right = self._split_left_right_tokens(expr)
+                #print("left",left)
+                #print("right", right)
+                self.left_expr = left
+                if right:
+                    self._rhs_ast = self._parse_rhs(right)
 
 
         # LHS via datakey
         if datakey is not None:
             self.left_expr = datakey
+            FLAG_COMPILED = False
 
         # Keyword args
         kw_map = [
@@ -206,19 +204,80 @@ class RedvyprAddress:
                 # delete_filter nutzt jetzt auch die LONGFORM_MAP Auflösung
                 self.delete_filter(red_key)
                 self.add_filter(red_key, "eq", val)
+                FLAG_COMPILED = True
 
+        if not FLAG_COMPILED:
+            self._compiled_left = None
+            self._compiled_rhs = None
+            self._compile_expressions()
 
-        self._compiled_left = None
-        self._compiled_rhs = None
-        self._compile_expressions()
+    @classmethod
+    def _packet_constraints(cls, packet: dict) -> tuple:
+        """
+        Returns the identity of a datapacket as a tuple of (internal_name, value) pairs of the _redvypr fields.
+        """
+        _redvypr = packet.get("_redvypr", {})
+        constraints = []
+
+        # Wir iterieren über die zentrale META_CONFIG
+        for path_parts, internal in cls._META_PATHS:
+            # Pfad im Paket auflösen (z.B. "host.uuid")
+            val = _redvypr
+            try:
+                for part in path_parts:
+                    val = val[part]
+
+                # Wenn ein Wert gefunden wurde, Constraint hinzufügen
+                if val not in (None, ''):
+                    constraints.append((internal, val))
+            except (KeyError, TypeError):
+                continue
+
+        return tuple(constraints)
+
+    def _copy_state(self, other: "RedvyprAddress"):
+        """
+        Copies the parsed and compiled state of another address. The RHS AST is shared
+        and copied only if one of the addresses modifies its filter (copy on write).
+        """
+        self.left_expr = other.left_expr
+        self.filter_keys = {k: list(v) for k, v in other.filter_keys.items()}
+        self._rhs_ast = other._rhs_ast
+        if self._rhs_ast is not None:
+            other.__dict__['_rhs_ast_shared'] = True
+            self._rhs_ast_shared = True
+        self._lhs_ast = other._lhs_ast
+        self._compiled_left = other._compiled_left
+        self._compiled_rhs = other._compiled_rhs
+        self._rhs_names = other._rhs_names
+        self._equality_filter = other._equality_filter
+        self._fast_filter = other._fast_filter
+        self._str_cache = dict(other.__dict__.get('_str_cache', {}))
+        self._field_cache = dict(other.__dict__.get('_field_cache', {}))
+
+    def _unshare_rhs_ast(self):
+        """
+        Creates an own copy of the RHS AST before it is modified.
+        """
+        if self._rhs_ast_shared:
+            self._rhs_ast = copy.deepcopy(self._rhs_ast)
+            self._rhs_ast_shared = False
 
     def _compile_expressions(self):
         self._compiled_left = None
         self._compiled_rhs = None
         self._lhs_ast = None  # Neu: Speicher für den AST der linken Seite
+        self._str_cache = {}  # Cached results of to_address_string()
+        self._field_cache = {}  # Cached results of __getattr__ (packetid, device ...)
+        self._equality_filter = None
+        self._fast_filter = None
+        self._rhs_names = ()
 
         if self._rhs_ast:
             self._compiled_rhs = compile(self._rhs_ast, '<string>', 'eval')
+            self._rhs_names = tuple(set(node.id for node in ast.walk(self._rhs_ast) if isinstance(node, ast.Name)))
+            self._equality_filter = self._extract_equality_filter(self._rhs_ast)
+            self._fast_filter = self._compile_fast_filter(self._equality_filter)
 
         if self.left_expr and self.left_expr != "!":
             try:
@@ -241,6 +300,86 @@ class RedvyprAddress:
             self._compiled_left = compile(self._lhs_ast, '<string>', 'eval')
 
 
+    def _extract_equality_filter(self, tree: ast.Expression) -> Optional[dict]:
+        """
+        Returns the filter as a dictionary {internal_name: value} if it is a pure conjunction of
+        equality comparisons with literals (i.e. "@i:test and d:cam"), otherwise None.
+        """
+        eq_filter = {}
+
+        def _walk(node):
+            if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+                return all(_walk(v) for v in node.values)
+            if isinstance(node, ast.Constant) and node.value is True:
+                return True  # Empty prefix values are replaced by 'True'
+            if (isinstance(node, ast.Compare) and isinstance(node.left, ast.Name)
+                    and len(node.ops) == 1 and isinstance(node.ops[0], ast.Eq)):
+                try:
+                    val = ast.literal_eval(node.comparators[0])
+                except (ValueError, SyntaxError, TypeError):
+                    return False
+                # Only hashable literals, the same key twice is not supported
+                if isinstance(val, (list, dict, set)) or node.left.id in eq_filter:
+                    return False
+                eq_filter[node.left.id] = val
+                return True
+            return False
+
+        if _walk(tree.body):
+            return eq_filter
+        return None
+
+    def _compile_fast_filter(self, eq_filter: Optional[dict]) -> Optional[tuple]:
+        """
+        Compiles a pure equality filter on the _redvypr fields (i:, p:, d:, u:, a:, h: ...) into a tuple of
+        (path, value) pairs that can be compared directly with the packet, without eval().
+        Returns None if the filter cannot be compiled.
+        """
+        if eq_filter is None:
+            return None
+
+        INTERNAL_TO_PATH = {v["internal"]: tuple(v["path"].split(".")) for v in self.META_CONFIG.values()}
+        fast_filter = []
+        for internal_name, value in eq_filter.items():
+            if internal_name not in INTERNAL_TO_PATH:
+                return None
+            fast_filter.append((INTERNAL_TO_PATH[internal_name], value))
+
+        return tuple(fast_filter)
+
+    def _matches_fast_filter(self, p_data):
+        """
+        Evaluates the compiled fast filter with direct key lookups.
+
+        Returns:
+            True/False or None if a field is missing and the filter needs to be evaluated with eval()
+        """
+        try:
+            meta = p_data['_redvypr']
+            for path, value in self._fast_filter:
+                val = meta
+                for part in path:
+                    val = val[part]
+                if not (val == value):
+                    return False
+        except (KeyError, TypeError):
+            return None
+
+        return True
+
+    def get_equality_filter(self) -> Optional[dict]:
+        """
+        Returns the filter (RHS) of the address as a dictionary {internal_name: value}, if the filter
+        consists only of equality comparisons combined with "and", i.e. "@i:test and d:cam" returns
+        {'__packetid__': 'test', '__device__': 'cam'}. An empty filter returns an empty dictionary.
+        If the filter contains other expressions (regex, lists, datetimes, "or"), None is returned.
+        """
+        if self._rhs_ast is None:
+            return {}
+        if self._equality_filter is None:
+            return None
+        return dict(self._equality_filter)
+
     def _split_left_right_tokens(self, expr: str):
         """
         Split a Redvypr address string into (left, right) at the first @ outside quotes.
@@ -418,14 +557,19 @@ class RedvyprAddress:
         p_data = packet.to_redvypr_dict() if hasattr(packet,
                                                      "to_redvypr_dict") else packet
 
+        # Fast path: pure equality filters on the _redvypr fields are compared directly
+        if self._fast_filter is not None:
+            match = self._matches_fast_filter(p_data)
+            if match is not None:
+                return match
+
         # 2. Daten flachklopfen (Metadata -> __dunder__)
         flat_data = self._to_redvypr_dict_flat(p_data)
 
         # 3. Locals vorbereiten
         placeholder = SoftPlaceholder(soft_missing)
         # Erst alle Namen aus dem AST mit Placeholdern füllen
-        locals_map = {node.id: placeholder for node in ast.walk(self._rhs_ast)
-                      if isinstance(node, ast.Name)}
+        locals_map = {name: placeholder for name in self._rhs_names}
 
         # 4. WICHTIG: Die echten Daten müssen die Placeholder ÜBERSCHREIBEN
         locals_map.update(flat_data)
@@ -822,6 +966,7 @@ class RedvyprAddress:
         new_ast = ast.parse(expr_str, mode="eval")
 
         # 3. In den bestehenden RHS-AST integrieren
+        self._unshare_rhs_ast()
         if self._rhs_ast is None:
             self._rhs_ast = new_ast
         else:
@@ -848,6 +993,7 @@ class RedvyprAddress:
 
         # Internen Namen ermitteln
         internal_target = self.PREFIX_MAP.get(key, self.LONGFORM_MAP.get(key, key))
+        self._unshare_rhs_ast()
 
         def _should_remove(node):
             # Fall A: Vergleich (__device__ == 'val')
@@ -1258,6 +1404,24 @@ class RedvyprAddress:
         3. Rückwandlung von Dunder-Namen zu Präfixen (i:, d: etc.)
         4. @-Symbol Symmetrie
         """
+        # Ergebnis wird bis zur nächsten Änderung der Adresse gecached
+        str_cache = self.__dict__.get('_str_cache')
+        cache_key = keys if (keys is None or isinstance(keys, str)) else tuple(keys)
+        if str_cache is not None:
+            try:
+                return str_cache[cache_key]
+            except KeyError:
+                pass
+            except TypeError:  # Unhashable keys
+                str_cache = None
+
+        address_str = self._to_address_string(keys)
+        if str_cache is not None:
+            str_cache[cache_key] = address_str
+
+        return address_str
+
+    def _to_address_string(self, keys: Union[str, List[str]] = None) -> str:
         # --- 1. Vorbereitung der Key-Filterung ---
         allowed_keys_set = None
         show_left = True
@@ -1567,6 +1731,21 @@ class RedvyprAddress:
         if not self._rhs_ast:
             return None
 
+        # Lists are cached as tuples (the cache is shared by copies), the caller gets its own list
+        field_cache = self.__dict__.get('_field_cache')
+        try:
+            is_list, retval = field_cache[internal_key]
+        except (KeyError, TypeError):
+            retval = self._get_field_values(internal_key)
+            is_list = isinstance(retval, list)
+            if is_list:
+                retval = tuple(retval)
+            if field_cache is not None:
+                field_cache[internal_key] = (is_list, retval)
+
+        return list(retval) if is_list else retval
+
+    def _get_field_values(self, internal_key):
         values = []
         #print(f"{name=},{internal_key=}")
         # 4. AST nach Werten für diesen internen Key durchsuchen
@@ -1671,3 +1850,105 @@ class RedvyprAddress:
 
 
 
+
+
+class FrozenRedvyprAddress(RedvyprAddress):
+    """
+    An immutable and hashable RedvyprAddress. Frozen addresses are shared between all users,
+    see packet_address() and interned_address(), and can therefore not be modified.
+    Use RedvyprAddress(frozen_address) to get a modifiable copy.
+    """
+    def _frozen(self, *args, **kwargs):
+        raise TypeError(f"{type(self).__name__!r} cannot be modified, create a RedvyprAddress copy first")
+
+    add_filter = _frozen
+    delete_filter = _frozen
+    add_datakey = _frozen
+    delete_datakey = _frozen
+
+    def __setattr__(self, name, value):
+        if self.__dict__.get('_initialized', False):
+            self._frozen()
+        super().__setattr__(name, value)
+
+    def __eq__(self, other):
+        if isinstance(other, RedvyprAddress):
+            return self.to_address_string() == other.to_address_string()
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.to_address_string())
+
+
+def _frozen_copy(address: RedvyprAddress) -> FrozenRedvyprAddress:
+    frozen = FrozenRedvyprAddress.__new__(FrozenRedvyprAddress)
+    frozen._copy_state(address)
+    frozen._rhs_ast_shared = False
+    frozen.strict_no_datakey = address.strict_no_datakey
+    frozen._initialized = True
+    frozen.to_address_string()  # The string is cached and handed over to all copies
+    return frozen
+
+
+@functools.lru_cache(maxsize=4096)
+def _address_template(expr: str) -> RedvyprAddress:
+    """
+    Parsed and compiled address of an expression string, used as template by RedvyprAddress(str).
+    """
+    return _frozen_copy(RedvyprAddress(expr, _cache=False))
+
+
+@functools.lru_cache(maxsize=4096)
+def _packet_address_template(constraints: tuple) -> RedvyprAddress:
+    """
+    Parsed and compiled address of a datapacket identity, see RedvyprAddress._packet_constraints().
+    """
+    address = RedvyprAddress(_cache=False)
+    if constraints:  # A packet without identity has no filter
+        address._rhs_str = " and ".join(f"{internal} == {repr(val)}" for internal, val in constraints)
+        address._rhs_ast = ast.parse(address._rhs_str, mode="eval")
+        address._compile_expressions()
+    return _frozen_copy(address)
+
+
+def packet_address(packet: dict) -> FrozenRedvyprAddress:
+    """
+    Returns the interned address of a datapacket. Packets with the same _redvypr identity
+    (host, device, publisher, packetid) share the same FrozenRedvyprAddress object, which makes
+    this function cheap enough to be called for every packet.
+
+    Parameters
+    ----------
+    packet : dict
+        A redvypr datapacket
+
+    Returns
+    -------
+    FrozenRedvyprAddress
+    """
+    constraints = RedvyprAddress._packet_constraints(packet)
+    try:
+        return _packet_address_template(constraints)
+    except TypeError:  # Unhashable values
+        return _frozen_copy(RedvyprAddress(packet, _cache=False))
+
+
+def interned_address(expr: Union[str, RedvyprAddress]) -> FrozenRedvyprAddress:
+    """
+    Returns the interned, immutable address of an expression string.
+
+    Parameters
+    ----------
+    expr : str or RedvyprAddress
+        The address expression
+
+    Returns
+    -------
+    FrozenRedvyprAddress
+    """
+    if isinstance(expr, FrozenRedvyprAddress):
+        return expr
+    elif isinstance(expr, RedvyprAddress):
+        return _address_template(expr.to_address_string())
+
+    return _address_template(expr)
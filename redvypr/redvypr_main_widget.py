@@ -936,6 +936,9 @@ class redvyprWidget(QtWidgets.QWidget):
             trun = time.time() - self.redvypr.t_thread_start
             npackets_total = self.redvypr.packets_counter
             statusstr = 'Running: {:.0f}s, dt: {:0.5f}s (needed {:0.5f}s, {:6.1f} packets/s), Packets processed {:d}'.format(trun, self.redvypr.dt_datadist, self.redvypr.dt_avg_datadist, packets_pstr, npackets_total)
+            if self.redvypr.latency_p50_datadist is not None:
+                statusstr += ', latency p50/p99: {:0.2f}/{:0.2f}ms'.format(self.redvypr.latency_p50_datadist * 1000,
+                                                                          self.redvypr.latency_p99_datadist * 1000)
             self.__status_thread.setText(statusstr)
 
     def create_statuswidget_compact(self):
@@ -0,0 +1,58 @@
+import time
+import queue
+import multiprocessing
+from redvypr.data_queues import BatchQueue, get_many
+
+print('This script compares the packet throughput of a BatchQueue with a multiprocessing.Queue between two processes')
+
+npackets = 50000
+
+
+def producer(dataqueue, npackets, use_put_many):
+    packets = [{'_redvypr': {'packetid': 'test'}, 'data': i} for i in range(npackets)]
+    if use_put_many:
+        for i in range(0, npackets, 100):
+            dataqueue.put_many(packets[i:i + 100])
+    else:
+        for packet in packets:
+            dataqueue.put(packet)
+
+    dataqueue.put(None)
+
+
+def consume(dataqueue):
+    received = []
+    while True:
+        packets = get_many(dataqueue)
+        if len(packets) == 0:
+            time.sleep(0.001)
+        elif packets[-1] is None:
+            received.extend(packets[:-1])
+            return received
+        else:
+            received.extend(packets)
+
+
+for name, dataqueue, use_put_many in [('multiprocessing.Queue', multiprocessing.Queue(), False),
+                                      ('BatchQueue.put', BatchQueue(), False),
+                                      ('BatchQueue.put_many', BatchQueue(), True)]:
+    t0 = time.time()
+    process = multiprocessing.Process(target=producer, args=(dataqueue, npackets, use_put_many))
+    process.start()
+    received = consume(dataqueue)
+    dt = time.time() - t0
+    process.join()
+    assert [p['data'] for p in received] == list(range(npackets)), 'Packets are missing or in the wrong order'
+    print('{:<25}: {:>10.0f} packets/s'.format(name, npackets / dt))
+
+# A single packet is sent after the deadline
+dataqueue = BatchQueue(deadline=0.01)
+dataqueue.put({'data': 1})
+assert dataqueue.get(timeout=1.0) == {'data': 1}
+try:
+    dataqueue.get(block=False)
+    raise AssertionError('Queue should be empty')
+except queue.Empty:
+    pass
+
+print('Done')
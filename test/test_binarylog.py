@@ -0,0 +1,53 @@
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+from redvypr.devices.fileio.rawdatawriter.binarylog import BinaryLogWriter, BinaryLogReader, is_binary_log
+
+print('This script writes and reads a binary redvypr log file')
+
+npackets = 20000
+tmpdir = tempfile.mkdtemp()
+filename = os.path.join(tmpdir, 'test.redvypr_bin')
+
+t0 = time.time()
+writer = BinaryLogWriter(open(filename, 'wb'), chunksize=100000)
+for i in range(npackets):
+    device = 'a' if i % 2 else 'b'
+    packet = {'_redvypr': {'t': 1000.0 + i, 'device': device, 'packetid': device, 'publisher': 'pub',
+                           'host': {'hostname': 'host', 'uuid': 'uuid', 'addr': '127.0.0.1', 'tstart': 0},
+                           'numpacket': i},
+              'data': float(i), 'array': np.arange(3)}
+    writer.write(packet)
+writer.close()
+print('Write: {:.0f} packets/s, {:d} bytes'.format(npackets / (time.time() - t0), os.path.getsize(filename)))
+
+assert is_binary_log(filename)
+reader = BinaryLogReader(filename)
+assert len(reader) == npackets
+t0 = time.time()
+packets = list(reader.iter_packets())
+print('Read: {:.0f} packets/s'.format(npackets / (time.time() - t0)))
+assert [p['data'] for p in packets] == [float(i) for i in range(npackets)]
+assert (packets[-1]['array'] == np.arange(3)).all()
+
+# Time range and address
+assert len(reader.select(t_start=1100, t_end=1199)) == 100
+packets_a = list(reader.iter_packets(address='@d:a'))
+assert len(packets_a) == npackets // 2
+assert all(p['_redvypr']['device'] == 'a' for p in packets_a)
+reader.close()
+
+# A file without footer (i.e. the writer was not closed) is indexed with the chunk headers
+filename_trunc = os.path.join(tmpdir, 'test_trunc.redvypr_bin')
+shutil.copy(filename, filename_trunc)
+with open(filename_trunc, 'r+b') as f:
+    f.truncate(os.path.getsize(filename) - 10)
+reader = BinaryLogReader(filename_trunc)
+assert len(reader) == npackets
+assert reader.get_packet(12345)['data'] == 12345.0
+reader.close()
+
+shutil.rmtree(tmpdir)
+print('Done')
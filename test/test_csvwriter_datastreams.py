@@ -0,0 +1,21 @@
+import redvypr
+from redvypr.devices.fileio.csvwriter.csvwriter import DatastreamExtractor
+
+print('This script tests the extraction of the csv columns from datapackets')
+
+extractor = DatastreamExtractor(["temp@mode == 'A'", "temp@d:dev1", "temp@d:dev2"])
+# Only the filter on the device depends on the _redvypr fields
+assert [column[3] for column in extractor.columns] == [False, True, True]
+
+values = {}
+for mode in ['A', 'B']:
+    packet = redvypr.data_packets.create_datadict(data=1.0, datakey='temp', device='dev1')
+    packet['mode'] = mode
+    values[mode] = extractor.extract(packet)
+
+assert values['A'] == [1.0, 1.0, None], values
+assert values['B'] == [None, 1.0, None], 'The data filter needs to be evaluated for every packet'
+packet = redvypr.data_packets.create_datadict(data=2.0, datakey='temp', device='dev3')
+packet['mode'] = 'B'
+assert extractor.extract(packet) is None
+print('Done')
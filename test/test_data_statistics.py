@@ -0,0 +1,31 @@
+import time
+from redvypr.packet_statistic import create_data_statistic_dict, do_data_statistics, get_schema_fingerprint
+
+print('This script tests the datakey update of do_data_statistics for packets with a changing schema')
+
+host = {'host': 'host1', 'uuid': 'uuid1', 'addr': '127.0.0.1', 'tstart': 0}
+npackets = 20000
+packets = []
+for i in range(npackets):
+    packets.append({'_redvypr': {'device': 'dev1', 'packetid': 'test', 'publisher': 'pub1', 'host': host, 't': i,
+                                 'numpacket': i, 'tag': {}}, 't': float(i), 'data': 1.0, 'x': [1, 2, 3]})
+
+# A new key and a changed type in a list
+packets[npackets // 2]['new'] = 'new'
+packets[-1]['x'] = [1, 2, 'a']
+assert get_schema_fingerprint(packets[0]) == get_schema_fingerprint(packets[1])
+assert get_schema_fingerprint(packets[0]) != get_schema_fingerprint(packets[-1])
+
+statistics = create_data_statistic_dict()
+t0 = time.time()
+for packet in packets:
+    do_data_statistics(packet, statistics)
+
+dt = time.time() - t0
+print('Statistics of {} packets: {:.1f} us/packet'.format(npackets, dt / npackets * 1e6))
+assert len(statistics['device_redvypr']) == 1
+device_stat = list(statistics['device_redvypr'].values())[0]
+assert sorted(device_stat['datakeys']) == ['data', 'new', 't', 'x']
+assert device_stat['datakeys_expanded']['x'][2] == ('x[2]', str)
+assert device_stat['_redvypr']['numpacket'] == npackets - 1
+print('Done')
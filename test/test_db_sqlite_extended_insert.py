@@ -0,0 +1,42 @@
+import os
+import tempfile
+import redvypr
+from redvypr.devices.db.db_engines_extended import RedvyprSqliteDbExtended
+
+print('This script tests that a single insert_packet writes exactly one row into every table of the extended SQLite database')
+
+tmpdir = tempfile.mkdtemp()
+db_file = os.path.join(tmpdir, 'test_extended.db')
+db = RedvyprSqliteDbExtended(base_name=db_file, tables={'sensor_data': ['temp@d:thermo']}, columnar=True)
+db.connect()  # Creates the schema
+
+data = redvypr.data_packets.create_datadict(data=12.5, datakey='temp', device='thermo', publisher='thermo', tu=1000.0,
+                                             hostinfo=redvypr.redvypr.create_hostinfo())
+data['_redvypr']['numpacket'] = 0
+data['t'] = data['_redvypr']['t']  # Set by distribute_data
+# Flat tables are upserted by timestamp, a second write would not add a row, count the writes instead
+flat_writes = []
+insert_packet_flat = db.insert_packet_flat
+def insert_packet_flat_counted(**kwargs):
+    flat_writes.append(kwargs['address'])
+    return insert_packet_flat(**kwargs)
+
+db.insert_packet_flat = insert_packet_flat_counted
+db.insert_packet(data)
+assert flat_writes == ['temp@d:thermo'], flat_writes
+
+conn = db.connect()
+cur = conn.cursor()
+cur.execute('SELECT COUNT(*) FROM redvypr_packets')
+assert cur.fetchone()[0] == 1, 'expected one row in redvypr_packets'
+cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'rc_%'")
+columnar_tables = [row[0] for row in cur.fetchall()]
+assert len(columnar_tables) == 1, columnar_tables
+cur.execute(f'SELECT COUNT(*) FROM {columnar_tables[0]}')
+assert cur.fetchone()[0] == 1, 'expected one row in the columnar table'
+flat_table = db.sanitize_table_name('sensor_data')
+cur.execute(f'SELECT COUNT(*) FROM {flat_table}')
+assert cur.fetchone()[0] == 1, 'expected one row in the flat table'
+cur.close()
+db.disconnect()
+print('Done')
@@ -0,0 +1,46 @@
+import yaml
+from redvypr.packet_statistic import DeviceinfoRevisions, DeviceinfoMirror, MetadataStore
+
+print('This script tests the incremental update of a deviceinfo_all copy with revisioned patches')
+
+deviceinfo_all = {'device_redvypr': {'dev1': {'packets_published': 1}}, 'metadata': {}}
+revisions = DeviceinfoRevisions(deviceinfo_all)
+mirror = DeviceinfoMirror()
+
+# Full snapshot
+revision, deviceinfo_copy = revisions.snapshot()
+mirror.update({'deviceinfo_all': deviceinfo_copy, 'deviceinfo_revision': revision})
+assert mirror.deviceinfo_all == deviceinfo_all
+
+# Patches
+deviceinfo_all['device_redvypr']['dev1']['packets_published'] = 2
+revisions.mark_changed('device_redvypr', 'dev1')
+deviceinfo_all['metadata']['@i:test'] = {'unit': 'm'}
+revisions.mark_changed('metadata', '@i:test')
+patch = revisions.create_patch()
+metadata = mirror.update({'deviceinfo_patch': patch, 'deviceinfo_revision': patch['revision']})
+assert metadata == {'@i:test': {'unit': 'm'}}
+assert mirror.deviceinfo_all == deviceinfo_all
+assert revisions.create_patch() is None, 'Nothing changed, no patch expected'
+
+# A missed patch requires a resync
+deviceinfo_all['metadata'].pop('@i:test')
+revisions.mark_changed('metadata', '@i:test')
+patch_missed = revisions.create_patch()
+deviceinfo_all['metadata']['@i:test2'] = {'unit': 's'}
+revisions.mark_changed('metadata', '@i:test2')
+patch = revisions.create_patch()
+assert mirror.update({'deviceinfo_patch': patch, 'deviceinfo_revision': patch['revision']}) is None
+assert mirror.resync_needed
+assert mirror.resync_packet()['_redvypr_command']['command'] == 'deviceinfo_resync'
+revision, deviceinfo_copy = revisions.snapshot()
+mirror.update({'deviceinfo_all': deviceinfo_copy, 'deviceinfo_revision': revision})
+assert mirror.deviceinfo_all == deviceinfo_all
+assert not mirror.resync_needed
+
+# Snapshots of a MetadataStore are plain dictionaries and can be logged with a safe yaml dump (e.g. rawdatawriter)
+revisions = DeviceinfoRevisions({'device_redvypr': {}, 'metadata': MetadataStore({'@i:test': {'unit': 'm'}})})
+revision, deviceinfo_copy = revisions.snapshot()
+assert type(deviceinfo_copy['metadata']) is dict
+assert yaml.safe_load(yaml.dump(deviceinfo_copy)) == deviceinfo_copy
+print('Done')
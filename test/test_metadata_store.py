@@ -0,0 +1,61 @@
+import time
+import itertools
+from datetime import datetime
+from redvypr.packet_statistic import MetadataStore, get_metadata, get_metadata_in_range, do_metadata
+from redvypr.redvypr_address import RedvyprAddress
+
+print('This script compares the indexed lookup of the MetadataStore with a direct test of all metadata entries')
+
+
+def get_metadata_direct(metadata, address):
+    raddress = RedvyprAddress(address)
+    keys_sorted = sorted((len(RedvyprAddress(a).get_datakeyentries()), a) for a in metadata.keys())
+    result = {}
+    for nentries, address_str in keys_sorted:
+        if raddress.matches(RedvyprAddress(address_str)):
+            result.update(metadata[address_str])
+
+    return result
+
+
+metadata = {}
+for i, (device, packetid) in enumerate(itertools.product(['dev{}'.format(k) for k in range(20)], ['p1', 'p2', 'p3'])):
+    metadata[str(RedvyprAddress('@d:{} and i:{}'.format(device, packetid)))] = {'unit': 'm', 'i': i}
+    constraints = [{'conditions': [{'field': 't', 'op': '>=', 'value': '2024-01-0{}T00:00:00'.format(1 + i % 5)},
+                                   {'field': 't', 'op': '<', 'value': '2024-01-0{}T00:00:00'.format(3 + i % 5)}],
+                    'values': {'sn': i}}]
+    metadata[str(RedvyprAddress('temp@d:{} and i:{}'.format(device, packetid)))] = {'unit': 'C', '_constraints': constraints}
+    metadata[str(RedvyprAddress('temp[0]@d:{}'.format(device)))] = {'unit': 'K'}
+
+metadata[str(RedvyprAddress('@d:~/dev1/'))] = {'regex': 1}
+metadata[str(RedvyprAddress('temp'))] = {'generic': 1}
+statistics = {'metadata': MetadataStore(metadata)}
+
+queries = ['@', 'temp', 'temp[0]', '@d:dev1', 'temp@d:dev3 and i:p2', '@i:p2', 'x@d:dev2', '@d:~/dev/']
+for query in queries:
+    assert get_metadata(statistics, query, mode='merge') == get_metadata_direct(metadata, query), query
+
+t0 = time.time()
+for i in range(100):
+    get_metadata_direct(metadata, 'temp@d:dev3 and i:p2')
+t1 = time.time()
+for i in range(100):
+    get_metadata(statistics, 'temp@d:dev3 and i:p2', mode='merge')
+t2 = time.time()
+print('Direct lookup: {:.3f} ms, MetadataStore: {:.3f} ms'.format((t1 - t0) * 10, (t2 - t1) * 10))
+
+# Constraints in a time range
+result = get_metadata_in_range(statistics, 'temp@d:dev0 and i:p1', datetime(2024, 1, 5), datetime(2024, 1, 6))
+assert result["temp @ d:'dev0' and i:'p1'"]['_constraints'] == []
+result = get_metadata_in_range(statistics, 'temp@d:dev0 and i:p1', datetime(2024, 1, 2), None, constraint_mode='merge')
+assert result["temp @ d:'dev0' and i:'p1'"]['sn'] == 0
+
+# Changes invalidate the memoized results
+address_str = str(RedvyprAddress('temp@d:dev3 and i:p2'))
+do_metadata({'_redvypr': {}, '_metadata': {address_str: {'description': 'new'}}}, statistics, auto_add_packetfilter=False)
+assert get_metadata(statistics, 'temp@d:dev3 and i:p2', mode='merge')['description'] == 'new'
+statistics['metadata'][str(RedvyprAddress('@d:dev3'))] = {'location': 'lab'}
+assert get_metadata(statistics, 'temp@d:dev3 and i:p2', mode='merge')['location'] == 'lab'
+statistics['metadata'].pop(str(RedvyprAddress('@d:dev3')))
+assert 'location' not in get_metadata(statistics, 'temp@d:dev3 and i:p2', mode='merge')
+print('Done')
@@ -0,0 +1,72 @@
+import time
+import datetime
+import yaml
+import numpy as np
+from redvypr import packet_codec
+
+print('This script compares the binary serialization of redvypr.packet_codec with YAML')
+
+packet = {'_redvypr': {'device': 'sensor1', 'packetid': 'sensor1', 'publisher': 'sensor1',
+                       'host': {'hostname': 'host1', 'uuid': '1234-5678', 'addr': '192.168.1.1'},
+                       't': 1.7e9, 'numpacket': 123456},
+          't': 1.7e9, 'data': 0.123, 'temp': [1.0, 2.0, -3]}
+
+# All supported types
+packet_types = dict(packet, raw=b'\x00\x01abc', arr=np.arange(12, dtype='<i2').reshape(3, 4), none=None, flag=True,
+                    neg=-5, big=2 ** 63 + 5, dt=datetime.datetime(2024, 1, 2, 3, 4, 5), f32=np.float32(1.5),
+                    tup=(1, 2), nested={1: {'a': [{}]}}, text='x' * 40)
+packet_decoded = packet_codec.decode(packet_codec.encode(packet_types))
+arr = packet_decoded.pop('arr')
+assert arr.dtype == np.dtype('<i2') and (arr == packet_types['arr']).all()
+packet_expected = dict(packet_types, tup=[1, 2])
+packet_expected.pop('arr')
+assert packet_decoded == packet_expected, packet_decoded
+
+# Incremental decoding of a stream of frames received in pieces of random size
+frames = b''.join(packet_codec.encode_frame(dict(packet, n=i)) for i in range(100))
+decoder = packet_codec.PacketStreamDecoder()
+received = []
+rng = np.random.default_rng(1)
+i = 0
+while i < len(frames):
+    n = int(rng.integers(1, 500))
+    received += decoder.feed(frames[i:i + n])
+    i += n
+
+assert [p['n'] for p in received] == list(range(100))
+assert len(decoder.buffer) == 0
+
+# Corrupted data between frames is skipped
+frame = packet_codec.encode_frame({'a': 1})
+decoder = packet_codec.PacketStreamDecoder()
+received = decoder.feed(b'garbageRV' + frame + b'xx' + frame[:5])
+received += decoder.feed(frame[5:] + frame)
+assert received == [{'a': 1}] * 3, received
+packets, rest = packet_codec.decode_frames(frame + frame[:3])
+assert packets == [{'a': 1}] and rest == frame[:3]
+
+# Speed
+N = 5000
+t0 = time.time()
+for i in range(N):
+    datab = packet_codec.encode_frame(packet)
+dt_encode = (time.time() - t0) / N
+decoder = packet_codec.PacketStreamDecoder()
+t0 = time.time()
+for i in range(N // 100):
+    packets = decoder.feed(datab * 100)
+dt_decode = (time.time() - t0) / N
+assert packets[-1] == packet
+print('binary: encode {:.1f} us, decode {:.1f} us, {:d} bytes'.format(dt_encode * 1e6, dt_decode * 1e6, len(datab)))
+
+N = 500
+t0 = time.time()
+for i in range(N):
+    datab = yaml.dump(packet, explicit_end=True, explicit_start=True).encode('utf-8')
+dt_encode = (time.time() - t0) / N
+t0 = time.time()
+for i in range(N):
+    yaml.load(datab, Loader=yaml.CUnsafeLoader)
+dt_decode = (time.time() - t0) / N
+print('yaml  : encode {:.1f} us, decode {:.1f} us, {:d} bytes'.format(dt_encode * 1e6, dt_decode * 1e6, len(datab)))
+print('Done')
@@ -0,0 +1,63 @@
+import os
+import gzip
+import time
+import shutil
+import tempfile
+import yaml
+import numpy as np
+from redvypr.devices.fileio.rawdatawriter import rawdatareplay
+
+print('This script indexes raw data files and compares the index with the packets')
+
+nfiles = 4
+npackets = 2000
+tmpdir = tempfile.mkdtemp()
+filenames = []
+for k in range(nfiles):
+    filename = os.path.join(tmpdir, 'test_{:d}.redvypr_yaml'.format(k))
+    if k % 2:
+        filename += '.gz'
+        f = gzip.open(filename, 'wb')
+    else:
+        f = open(filename, 'wb')
+    for i in range(npackets):
+        packet = {'_redvypr': {'t': 1000.0 + i, 'device': 'dev{:d}'.format(i % 3), 'packetid': 'test',
+                               'publisher': 'pub', 'numpacket': i,
+                               'host': {'hostname': 'host', 'uuid': 'uuid', 'addr': '127.0.0.1', 'tstart': 0}},
+                  'data': float(i), 'array': list(range(20))}
+        f.write(yaml.dump(packet, explicit_end=True, explicit_start=True).encode('utf-8'))
+        f.write(b'\0')
+    f.close()
+    filenames.append(filename)
+
+t0 = time.time()
+stats = rawdatareplay.build_indices(filenames)
+print('Indexing of {:d} files: {:.3f}s'.format(nfiles, time.time() - t0))
+for filename in filenames:
+    stat = stats[filename]
+    assert stat['npackets'] == npackets
+    assert (stat['packets_t'] == 1000.0 + np.arange(npackets)).all()
+    assert (stat['packets_num'] == np.arange(npackets)).all()
+    assert len(stat['addresses']) == 3
+    assert os.path.exists(rawdatareplay.get_index_filename(filename))
+
+# The index sidecars are used
+t0 = time.time()
+stats = rawdatareplay.build_indices(filenames)
+print('Loading of {:d} indices: {:.3f}s'.format(nfiles, time.time() - t0))
+assert all(stats[filename]['npackets'] == npackets for filename in filenames)
+
+reader = rawdatareplay.packetreader(filenames[1])
+packets = reader.get_packets('10,13,1')
+assert [p['data'] for p in packets] == [10.0, 11.0, 12.0]
+reader.close_file()
+
+# A changed file is indexed again
+with open(filenames[0], 'ab') as f:
+    f.write(yaml.dump(packet, explicit_end=True, explicit_start=True).encode('utf-8'))
+    f.write(b'\0')
+assert rawdatareplay.load_index(filenames[0]) is None
+assert rawdatareplay.build_indices(filenames[:1])[filenames[0]]['npackets'] == npackets + 1
+
+shutil.rmtree(tmpdir)
+print('Done')
@@ -279,3 +279,13 @@ print("Testing regex")
 print("Testing a1:{} with\n a2:{} = {}".format(addr_regex,addr_regex_t1,addr_regex(addr_regex_t1,strict=False)))
 print("Testing a1:{} with\n a2:{} = {}".format(addr_regex,addr_regex_t2,addr_regex(addr_regex_t2,strict=False)))
 
+
+# The field values are cached, changing a returned list must not change the address or its copies
+addr_list = RedvyprAddress('@i:[a,b]')
+addr_list_copy = RedvyprAddress(addr_list)
+packetids = addr_list.packetid
+packetids.append('c')
+assert addr_list.packetid == ['a', 'b'], addr_list.packetid
+assert addr_list_copy.packetid == ['a', 'b'], addr_list_copy.packetid
+addr_list.packetid.append('d')
+assert addr_list.packetid == ['a', 'b'], addr_list.packetid
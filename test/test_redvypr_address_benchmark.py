@@ -4,7 +4,7 @@ import sys
 import os
 import psutil
 from datetime import datetime
-from redvypr.redvypr_address import RedvyprAddress
+from redvypr.redvypr_address import RedvyprAddress, packet_address
 import redvypr  # Um die Version zu lesen
 
 # --- Testdaten ---
@@ -17,6 +17,26 @@ test_pkt = {
 
 addr_obj = RedvyprAddress(test_addr_str)
 
+# Filter shapes for the matching benchmark, the first ones are compiled into the fast path
+test_pkt_full = {
+    "_redvypr": {"packetid": "test", "publisher": "mainhub", "device": "cam",
+                 "host": {"host": "node01", "addr": "10.0.0.1", "uuid": "uuid-node01"}},
+    "data": {"temp": [23.5, 24.0]},
+    "data2": 5,
+    "td": datetime(2000, 1, 1)
+}
+
+filter_shapes = [
+    ("Equality (i:)", "@i:test"),
+    ("Equality (i: and p:)", "@i:test and p:mainhub"),
+    ("Equality (i:,p:,d:,u:)", "@i:test and p:mainhub and d:cam and u:uuid-node01"),
+    ("Equality, no match", "@i:test and d:gps"),
+    ("Regex", "@i:~/^te/"),
+    ("List", "@i:[test,foo,bar]"),
+    ("Or / root key", "@(i:test and p:mainhub) or data2==10"),
+    ("Datetime", "@td==dt(2000-01-01)"),
+]
+
 
 def get_cpu_info():
     """Versucht den CPU-Namen herauszufinden."""
@@ -82,6 +102,42 @@ def benchmark():
     print(
         f"{'Matching (Filter only)':<30} | {int(n_exec / t_match):>15,d} | {t_match / n_exec * 1e6:>8.2f} µs")
     print("-" * 70)
+    print()
+
+    # 4. Matching per filter shape, compiled fast path vs. eval
+    print(f"{'Filter shape':<30} | {'Fast path':<10} | {'Compiled':<12} | {'eval()':<12} | {'Speedup':<8}")
+    print("-" * 70)
+    n_match = 50_000
+    for name, filter_str in filter_shapes:
+        addr_fast = RedvyprAddress(filter_str)
+        addr_eval = RedvyprAddress(filter_str)
+        addr_eval._fast_filter = None  # Force the eval() path
+        assert addr_fast.matches_filter(test_pkt_full) == addr_eval.matches_filter(test_pkt_full)
+        t_fast = timeit.timeit(lambda: addr_fast.matches_filter(test_pkt_full), number=n_match)
+        t_eval = timeit.timeit(lambda: addr_eval.matches_filter(test_pkt_full), number=n_match)
+        fast = 'yes' if addr_fast._fast_filter is not None else 'no'
+        print(
+            f"{name:<30} | {fast:<10} | {t_fast / n_match * 1e6:>9.2f} µs | {t_eval / n_match * 1e6:>9.2f} µs | {t_eval / t_fast:>6.1f}x")
+    print("-" * 70)
+    print()
+
+    # 5. Construction, interned templates vs. parsing every time
+    print(f"{'Construction':<30} | {'Interned':<12} | {'Uncached':<12} | {'Speedup':<8}")
+    print("-" * 70)
+    n_constr = 10_000
+    constructions = [("String", lambda: RedvyprAddress(test_addr_str),
+                      lambda: RedvyprAddress(test_addr_str, _cache=False)),
+                     ("Packet + str()", lambda: str(RedvyprAddress(test_pkt_full)),
+                      lambda: str(RedvyprAddress(test_pkt_full, _cache=False))),
+                     ("packet_address() + str()", lambda: str(packet_address(test_pkt_full)),
+                      lambda: str(RedvyprAddress(test_pkt_full, _cache=False)))]
+    for name, f_cached, f_uncached in constructions:
+        assert str(f_cached()) == str(f_uncached())
+        t_cached = timeit.timeit(f_cached, number=n_constr)
+        t_uncached = timeit.timeit(f_uncached, number=n_constr)
+        print(
+            f"{name:<30} | {t_cached / n_constr * 1e6:>9.2f} µs | {t_uncached / n_constr * 1e6:>9.2f} µs | {t_uncached / t_cached:>6.1f}x")
+    print("-" * 70)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,72 @@
+import time
+import queue
+import multiprocessing
+import numpy as np
+from redvypr.data_queues import SharedMemoryQueue, get_many
+
+print('This script compares the transport of numpy arrays with a SharedMemoryQueue and a multiprocessing.Queue between two processes')
+
+npackets = 500
+arraysize = 100000
+
+
+def producer(dataqueue, npackets):
+    for i in range(npackets):
+        dataqueue.put({'_redvypr': {'packetid': 'array'}, 'data': np.full(arraysize, i, dtype=float)})
+
+    dataqueue.put(None)
+
+
+def consume(dataqueue):
+    received = []
+    while True:
+        packets = get_many(dataqueue)
+        if len(packets) == 0:
+            time.sleep(0.001)
+        elif packets[-1] is None:
+            received.extend(packets[:-1])
+            return received
+        else:
+            received.extend(packets)
+
+
+for name, dataqueue in [('multiprocessing.Queue', multiprocessing.Queue()),
+                        ('SharedMemoryQueue', SharedMemoryQueue())]:
+    t0 = time.time()
+    process = multiprocessing.Process(target=producer, args=(dataqueue, npackets))
+    process.start()
+    received = consume(dataqueue)
+    dt = time.time() - t0
+    process.join()
+    assert len(received) == npackets, 'Packets are missing'
+    for i, packet in enumerate(received):
+        assert packet['data'][0] == i and packet['data'][-1] == i, 'Wrong packet content'
+    print('{:<25}: {:>10.0f} packets/s ({:.0f} MB/s)'.format(name, npackets / dt, npackets * arraysize * 8 / dt / 1e6))
+
+# Wrap around of a small ring buffer, the queue is full before wrapping
+dataqueue = SharedMemoryQueue(size=1024)
+for i in range(100):
+    dataqueue.put_nowait({'data': i})
+    assert dataqueue.get(timeout=1.0) == {'data': i}
+
+try:
+    for i in range(100):
+        dataqueue.put_nowait({'data': i})
+    raise AssertionError('Queue should be full')
+except queue.Full:
+    pass
+
+assert [p['data'] for p in dataqueue.get_many()] == list(range(i))
+assert dataqueue.empty()
+
+# Maximum number of packets
+dataqueue = SharedMemoryQueue(maxsize=2)
+dataqueue.put({'data': 1})
+dataqueue.put({'data': 2})
+try:
+    dataqueue.put({'data': 3}, timeout=0.01)
+    raise AssertionError('Queue should be full')
+except queue.Full:
+    pass
+
+print('Done')
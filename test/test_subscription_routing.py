@@ -0,0 +1,86 @@
+import copy
+import queue
+import logging
+import itertools
+from redvypr.redvypr import SubscriptionRoutingTable, send_packets_to_devices
+from redvypr.redvypr_address import RedvyprAddress
+
+print('This script compares the routing of send_packets_to_devices with a direct test of all subscriptions')
+
+
+class Subscriber():
+    def __init__(self, name, subscriptions):
+        self.name = name
+        self.subscribed_addresses = [RedvyprAddress(a) for a in subscriptions]
+        self.datainqueue = queue.Queue()
+
+    def get_thread_status(self):
+        return {'thread_running': True}
+
+
+subscriptions = [["@i:a", "@d:dev1"],
+                 ["@d:dev2 and i:b"],
+                 ["@i:~/^a/", "@p:pub1"],
+                 ["data@d:dev1", "@i:[a,b]"],
+                 ["@u:U1 and d:dev3"],
+                 ["@h:host1"],
+                 ["x@i:c or d:dev2"],
+                 ["@"],
+                 ["_redvypr_command@i:metadata"]]
+
+devices = []
+for i, subs in enumerate(subscriptions):
+    devices.append({'device': Subscriber('sub{:d}'.format(i), subs), 'statistics': {'packets_received': 0, 'packets': {}}})
+
+packets = []
+for packetid, device, publisher, uuid, host in itertools.product('abcd', ['dev1', 'dev2', 'dev3'], ['pub1', 'pub2'],
+                                                              ['U1', 'U2'], ['host1', 'host2']):
+    packets.append({'_redvypr': {'packetid': packetid, 'device': device, 'publisher': publisher,
+                                 'host': {'uuid': uuid, 'host': host, 'addr': '127.0.0.1'}, 'tag': {}}, 'data': 1})
+
+# A packet without routing fields
+packets.append({'_redvypr': {'device': 'dev1'}, 'data': 1})
+
+routing_table = SubscriptionRoutingTable()
+sender = {'device': None, 'statistics': {}}
+logger = logging.getLogger('test_subscription_routing')
+for packet in packets:
+    expected = []
+    for d in devices:
+        for addr in d['device'].subscribed_addresses:
+            if addr.matches_filter(packet):
+                expected.append(d['device'].name)
+                break
+
+    send_packets_to_devices(sender, devices, [packet], logger, {'uuid': 'localuuid'}, routing_table=routing_table)
+    received = []
+    for d in devices:
+        while not d['device'].datainqueue.empty():
+            d['device'].datainqueue.get()
+            received.append(d['device'].name)
+
+    assert received == expected, 'Routing of {} to {}, expected {}'.format(packet['_redvypr'], received, expected)
+
+print('Number of cached routes', len(routing_table.routes))
+
+# Change a subscription, the table needs to be rebuilt
+devices[0]['device'].subscribed_addresses.append(RedvyprAddress('@d:dev3'))
+routing_table.invalidate()
+send_packets_to_devices(sender, devices, [packets[-2]], logger, {'uuid': 'localuuid'}, routing_table=routing_table)
+assert not devices[0]['device'].datainqueue.empty(), 'Changed subscription was not used'
+
+# A deviceinfo patch caused by a packet of a device is sent to the device itself as well
+devices[8]['device'].datainqueue = queue.Queue()  # Empty queue
+patch = {'_redvypr': {'packetid': 'metadata', 'device': 'distribute_data', 'publisher': 'distribute_data',
+                      'host': {'uuid': 'localuuid', 'host': 'host1', 'addr': '127.0.0.1'}, 'tag': {}},
+         '_redvypr_command': {'command': 'info'}, 'deviceinfo_patch': {'revision': 1}}
+send_packets_to_devices(devices[8], devices, [patch], logger, {'uuid': 'localuuid'}, routing_table=routing_table)
+assert not devices[8]['device'].datainqueue.empty(), 'The originating device did not receive the deviceinfo patch'
+
+# A patch forwarded from another host is not sent back to the forwarding device
+devices[8]['device'].datainqueue = queue.Queue()  # Empty queue
+patch_remote = copy.deepcopy(patch)
+patch_remote['_redvypr']['host']['uuid'] = 'remoteuuid'
+send_packets_to_devices(devices[8], devices, [patch_remote], logger, {'uuid': 'localuuid'}, routing_table=routing_table)
+assert devices[8]['device'].datainqueue.empty(), 'A forwarded deviceinfo patch was sent back'
+print('Done')